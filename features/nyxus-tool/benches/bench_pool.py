@@ -0,0 +1,136 @@
+"""Benchmark images/sec of the nyxus tool on a collection of small images.
+
+Compares the previous scheme, which opened a process pool per segmentation
+image and built a new Nyxus instance per intensity image, to the current
+long-lived pool with persistent Nyxus instances.
+
+Run from the tool root:
+
+    python -m benches.bench_pool --images 2000 --size 128
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import filepattern as fp
+import numpy as np
+from polus.images.features.nyxus_tool.__main__ import app
+from polus.images.features.nyxus_tool.nyxus_func import get_nyxus
+from polus.images.features.nyxus_tool.nyxus_func import nyxus_func
+from polus.images.features.nyxus_tool.utils import Extension
+from skimage import filters
+from skimage import io
+from skimage import measure
+from typer.testing import CliRunner
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger("bench_pool")
+logger.setLevel(logging.INFO)
+
+INT_PATTERN = "y04_r{r:d}_c1.ome.tif"
+SEG_PATTERN = "y04_r{r:d}_c0.ome.tif"
+FEATURES = ["*ALL_INTENSITY*"]
+
+
+def make_images(inp_dir: Path, seg_dir: Path, num_images: int, size: int) -> None:
+    """Write pairs of synthetic intensity and label images."""
+    rng = np.random.default_rng(0)
+    for i in range(num_images):
+        im = np.zeros((size, size))
+        points = (size * rng.random((2, 20))).astype(int)
+        im[points[0], points[1]] = 1
+        im = filters.gaussian(im, sigma=size / 50.0)
+        labels = measure.label(im > im.mean(), background=0)
+        io.imsave(inp_dir.joinpath(f"y04_r{i}_c1.ome.tif"), im, check_contrast=False)
+        io.imsave(seg_dir.joinpath(f"y04_r{i}_c0.ome.tif"), labels, check_contrast=False)
+
+
+def legacy_nyxus_func(*args, **kwargs) -> None:  # noqa: ANN002, ANN003
+    """Run nyxus_func with a fresh Nyxus instance, as before."""
+    get_nyxus.cache_clear()
+    nyxus_func(*args, **kwargs)
+
+
+def run_legacy(inp_dir: Path, seg_dir: Path, out_dir: Path, num_workers: int) -> None:
+    """Open a pool per segmentation image, as before."""
+    int_images = fp.FilePattern(inp_dir, INT_PATTERN)
+    seg_images = fp.FilePattern(seg_dir, SEG_PATTERN)
+    for s_image in seg_images():
+        i_image = int_images.get_matching(**dict(s_image[0].items()))
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [
+                executor.submit(
+                    legacy_nyxus_func,
+                    fl[1],
+                    s_image[1],
+                    out_dir,
+                    FEATURES,
+                    Extension.PARQUET,
+                )
+                for fl in i_image
+            ]
+            for f in futures:
+                f.result()
+
+
+def run_pool(inp_dir: Path, seg_dir: Path, out_dir: Path) -> None:
+    """Run the tool."""
+    result = CliRunner().invoke(
+        app,
+        [
+            "--inpDir",
+            str(inp_dir),
+            "--segDir",
+            str(seg_dir),
+            "--intPattern",
+            INT_PATTERN,
+            "--segPattern",
+            SEG_PATTERN,
+            "--features",
+            "ALL_INTENSITY",
+            "--fileExtension",
+            "parquet",
+            "--outDir",
+            str(out_dir),
+        ],
+    )
+    if result.exit_code != 0:
+        raise RuntimeError(result.output) from result.exception
+
+
+def main() -> None:
+    """Time both schemes on the same collection."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=128)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inp_dir, seg_dir = Path(tmp, "inp"), Path(tmp, "seg")
+        inp_dir.mkdir()
+        seg_dir.mkdir()
+        make_images(inp_dir, seg_dir, args.images, args.size)
+
+        runs = [
+            ("per-image", lambda out: run_legacy(inp_dir, seg_dir, out, max(os.cpu_count(), 2))),
+            ("pool", lambda out: run_pool(inp_dir, seg_dir, out)),
+        ]
+        logger.info(f"{'scheme':>10} {'seconds':>10} {'images/s':>10}")
+        for name, run in runs:
+            out_dir = Path(tmp, name)
+            out_dir.mkdir()
+            start = time.perf_counter()
+            run(out_dir)
+            elapsed = time.perf_counter() - start
+            logger.info(f"{name:>10} {elapsed:>10.2f} {args.images / elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
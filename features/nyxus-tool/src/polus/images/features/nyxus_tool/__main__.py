@@ -4,19 +4,23 @@ import json
 import logging
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from concurrent.futures import as_completed
-from multiprocessing import cpu_count
 from pathlib import Path
 from typing import Any
 from typing import Optional
 
 import filepattern as fp
-import preadator
 import typer
+from polus.images.features.nyxus_tool.dataset import MANIFEST
+from polus.images.features.nyxus_tool.dataset import DatasetWriter
 from polus.images.features.nyxus_tool.nyxus_func import nyxus_func
+from polus.images.features.nyxus_tool.nyxus_func import nyxus_table
 from polus.images.features.nyxus_tool.utils import FEATURE_GROUP
 from polus.images.features.nyxus_tool.utils import FEATURE_LIST
 from polus.images.features.nyxus_tool.utils import Extension
+from polus.images.features.nyxus_tool.utils import available_cpus
+from polus.images.features.nyxus_tool.utils import worker_layout
 from tqdm import tqdm
 
 # #Import environment variables
@@ -32,6 +36,55 @@ logging.basicConfig(
 logger = logging.getLogger("polus.images.features.nyxus_tool")
 
 
+def write_dataset(  # noqa: PLR0913
+    int_images: fp.FilePattern,
+    seg_images: fp.FilePattern,
+    out_dir: Path,
+    features: list[str],
+    partition_by: list[str],
+    pixel_per_micron: Optional[float],
+    neighbor_dist: Optional[int],
+    num_workers: int,
+    num_threads: int,
+) -> None:
+    """Extract features of all images into one partitioned Parquet dataset.
+
+    Workers return the features of each image as an Arrow table, which is
+    appended to the dataset by the main process as soon as it is ready.
+    """
+    with ProcessPoolExecutor(max_workers=num_workers) as executor, DatasetWriter(
+        out_dir,
+        partition_by,
+    ) as writer:
+        futures = {}
+        for s_image in seg_images():
+            i_image = int_images.get_matching(**dict(s_image[0].items()))
+            for variables, files in i_image:
+                for file in files:
+                    future = executor.submit(
+                        nyxus_table,
+                        file,
+                        s_image[1],
+                        features,
+                        pixel_per_micron,
+                        neighbor_dist,
+                        n_feature_calc_threads=num_threads,
+                    )
+                    futures[future] = variables
+
+        for f in tqdm(
+            as_completed(futures),
+            total=len(futures),
+            mininterval=5,
+            desc="writing features dataset",
+            initial=0,
+            unit_scale=True,
+            colour="cyan",
+        ):
+            # Release each table as soon as it is written
+            writer.write(f.result(), futures.pop(f))
+
+
 @app.command()
 def main(  # noqa: PLR0913
     inp_dir: Path = typer.Option(
@@ -64,6 +117,11 @@ def main(  # noqa: PLR0913
         "--fileExtension",
         help="File format of an output file.",
     ),
+    partition_by: Optional[str] = typer.Option(
+        "",
+        "--partitionBy",
+        help="Filepattern variables partitioning the dataset output, e.g. r,c",
+    ),
     neighbor_dist: Optional[int] = typer.Option(
         5,
         "--neighborDist",
@@ -98,6 +156,7 @@ def main(  # noqa: PLR0913
     logger.info(f"segPattern = {seg_pattern}")
     logger.info(f"features = {features}")
     logger.info(f"fileExtension = {file_extension}")
+    logger.info(f"partitionBy = {partition_by}")
     logger.info(f"neighborDist = {neighbor_dist}")
     logger.info(f"pixelPerMicron = {pixel_per_micron}")
     logger.info(f"singleRoi = {single_roi}")
@@ -120,38 +179,58 @@ def main(  # noqa: PLR0913
     # Adding * to the start and end of nyxus group features
     features = [(f"*{f}*") if f in FEATURE_GROUP else f for f in features]
 
-    num_workers = max([cpu_count(), 2])
+    num_workers, num_threads = worker_layout(available_cpus())
+    logger.info(f"Using {num_workers} workers with {num_threads} feature threads")
 
     int_images = fp.FilePattern(inp_dir, int_pattern)
     seg_images = fp.FilePattern(seg_dir, seg_pattern)
 
+    partition_vars = [v for v in re.split(",", partition_by or "") if v]  # type: ignore
+    assert all(
+        v in int_images.get_variables() for v in partition_vars
+    ), f"Partition variables must be variables of intPattern: {partition_vars}"
+
     if preview:
         with Path.open(Path(out_dir, "preview.json"), "w") as jfile:
             out_json: dict[str, Any] = {
                 "filepattern": int_pattern,
                 "outDir": [],
             }
-            for file in int_images():
-                out_name = file[1][0].name.replace(
-                    "".join(file[1][0].suffixes),
-                    f"{file_extension}",
-                )
-                out_json["outDir"].append(out_name)
+            if file_extension == Extension.DATASET:
+                out_json["outDir"].append(MANIFEST)
+            else:
+                for file in int_images():
+                    out_name = file[1][0].name.replace(
+                        "".join(file[1][0].suffixes),
+                        f"{file_extension}",
+                    )
+                    out_json["outDir"].append(out_name)
             json.dump(out_json, jfile, indent=2)
 
-    for s_image in seg_images():
-        i_image = int_images.get_matching(**dict(s_image[0].items()))
+    if file_extension == Extension.DATASET:
+        write_dataset(
+            int_images,
+            seg_images,
+            out_dir,
+            features,
+            partition_vars,
+            pixel_per_micron,
+            neighbor_dist,
+            num_workers,
+            num_threads,
+        )
+        return
 
-        with preadator.ProcessManager(
-            name="compute nyxus feature",
-            num_processes=num_workers,
-            threads_per_process=2,
-        ) as pm:
-            threads = []
+    # A single pool serves the whole run, and each worker keeps its Nyxus
+    # instance between images
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        threads = []
+        for s_image in seg_images():
+            i_image = int_images.get_matching(**dict(s_image[0].items()))
             for fl in i_image:
                 file = fl[1]
                 logger.debug(f"Compute nyxus feature {file}")
-                thread = pm.submit_process(
+                thread = executor.submit(
                     nyxus_func,
                     file,
                     s_image[1],
@@ -160,19 +239,20 @@ def main(  # noqa: PLR0913
                     file_extension,
                     pixel_per_micron,
                     neighbor_dist,
+                    n_feature_calc_threads=num_threads,
                 )
                 threads.append(thread)
-            pm.join_processes()
-            for f in tqdm(
-                as_completed(threads),
-                total=len(threads),
-                mininterval=5,
-                desc=f"converting images to {file_extension}",
-                initial=0,
-                unit_scale=True,
-                colour="cyan",
-            ):
-                f.result()
+
+        for f in tqdm(
+            as_completed(threads),
+            total=len(threads),
+            mininterval=5,
+            desc=f"converting images to {file_extension}",
+            initial=0,
+            unit_scale=True,
+            colour="cyan",
+        ):
+            f.result()
 
 
 if __name__ == "__main__":
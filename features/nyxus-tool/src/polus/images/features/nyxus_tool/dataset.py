@@ -0,0 +1,180 @@
+"""Nyxus Plugin."""
+import json
+import logging
+import pathlib
+from typing import Any
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# Rows per Parquet row group and per part file of a partition
+ROW_GROUP_SIZE = 64 * 1024
+ROWS_PER_FILE = 1024 * 1024
+
+MANIFEST = "_manifest.json"
+
+
+class DatasetWriter:
+    """Append feature tables to one hive-partitioned Parquet dataset.
+
+    Every partition directory (e.g. `r=1/c=2`) holds numbered part files.
+    Rows are buffered per partition and written in row groups of
+    `row_group_size` rows, and a new part file is started once a file holds
+    `rows_per_file` rows. On close, the Parquet `_metadata` and
+    `_common_metadata` files and a json manifest listing every part file are
+    written, so the whole dataset can be opened in one call, e.g. with
+    `pyarrow.dataset.dataset(out_dir, partitioning="hive")`.
+
+    Partition columns are encoded in the directory names only. Every table
+    is cast to the schema of the first table written.
+
+    Args:
+        out_dir: Root directory of the dataset.
+        partition_by: Filepattern variables used to partition the dataset.
+        row_group_size: Number of rows per row group.
+        rows_per_file: Maximum number of rows per part file.
+    """
+
+    def __init__(
+        self,
+        out_dir: pathlib.Path,
+        partition_by: list[str],
+        row_group_size: int = ROW_GROUP_SIZE,
+        rows_per_file: int = ROWS_PER_FILE,
+    ) -> None:
+        """Initialize the writer."""
+        self.out_dir = pathlib.Path(out_dir)
+        self.partition_by = partition_by
+        self.row_group_size = row_group_size
+        self.rows_per_file = rows_per_file
+        self.schema: Optional[pa.Schema] = None
+
+        self._buffers: dict[tuple, list[pa.Table]] = {}
+        self._buffered_rows: dict[tuple, int] = {}
+        self._writers: dict[tuple, pq.ParquetWriter] = {}
+        self._open_parts: dict[tuple, dict[str, Any]] = {}
+        self._file_rows: dict[tuple, int] = {}
+        self._num_parts: dict[tuple, int] = {}
+        self._parts: list[dict[str, Any]] = []
+        self._metadata: list[pq.FileMetaData] = []
+
+    def write(self, table: pa.Table, variables: dict[str, Any]) -> None:
+        """Append a table to the partition given by filepattern variables."""
+        if table.num_rows == 0:
+            return
+        if self.schema is None:
+            self.schema = table.schema
+        elif table.schema != self.schema:
+            missing = set(self.schema.names) - set(table.schema.names)
+            if missing:
+                msg = f"Feature table is missing columns {sorted(missing)}"
+                raise ValueError(msg)
+            table = table.select(self.schema.names).cast(self.schema)
+
+        key = tuple(variables[v] for v in self.partition_by)
+        self._buffers.setdefault(key, []).append(table)
+        self._buffered_rows[key] = self._buffered_rows.get(key, 0) + table.num_rows
+        if self._buffered_rows[key] >= self.row_group_size:
+            self._flush(key, final=False)
+
+    def close(self) -> None:
+        """Write all buffered rows, the Parquet metadata and the manifest."""
+        for key in list(self._buffers):
+            self._flush(key, final=True)
+        for key in list(self._writers):
+            self._close_file(key)
+
+        if self.schema is not None:
+            pq.write_metadata(self.schema, self.out_dir.joinpath("_common_metadata"))
+            pq.write_metadata(
+                self.schema,
+                self.out_dir.joinpath("_metadata"),
+                metadata_collector=self._metadata,
+            )
+
+        manifest = {
+            "format": "parquet",
+            "partitioning": "hive",
+            "partition_by": self.partition_by,
+            "num_rows": sum(p["num_rows"] for p in self._parts),
+            "columns": [] if self.schema is None else self.schema.names,
+            "files": self._parts,
+        }
+        with self.out_dir.joinpath(MANIFEST).open("w") as fw:
+            json.dump(manifest, fw, indent=2)
+
+    def _flush(self, key: tuple, final: bool) -> None:
+        """Write the buffered rows of a partition in whole row groups."""
+        table = pa.concat_tables(self._buffers.pop(key))
+        self._buffered_rows.pop(key)
+
+        if not final:
+            # Keep the remainder buffered so row groups stay full sized
+            full = table.num_rows - table.num_rows % self.row_group_size
+            if full < table.num_rows:
+                self._buffers[key] = [table.slice(full)]
+                self._buffered_rows[key] = table.num_rows - full
+            table = table.slice(0, full)
+
+        offset = 0
+        while offset < table.num_rows:
+            if self._file_rows.get(key, 0) >= self.rows_per_file:
+                self._close_file(key)
+            writer = self._open_file(key)
+            length = min(
+                table.num_rows - offset,
+                self.rows_per_file - self._file_rows[key],
+            )
+            writer.write_table(
+                table.slice(offset, length),
+                row_group_size=self.row_group_size,
+            )
+            self._file_rows[key] += length
+            offset += length
+
+    def _partition_dir(self, key: tuple) -> pathlib.Path:
+        """Return the directory of a partition relative to the dataset root."""
+        return pathlib.Path(
+            *[f"{v}={value}" for v, value in zip(self.partition_by, key)],
+        )
+
+    def _open_file(self, key: tuple) -> pq.ParquetWriter:
+        """Return the open part file of a partition, starting one if needed."""
+        if key not in self._writers:
+            part = self._num_parts.get(key, 0)
+            self._num_parts[key] = part + 1
+            path = self._partition_dir(key).joinpath(f"part-{part:05d}.parquet")
+            self.out_dir.joinpath(path).parent.mkdir(parents=True, exist_ok=True)
+            self._writers[key] = pq.ParquetWriter(
+                self.out_dir.joinpath(path),
+                self.schema,
+            )
+            self._file_rows[key] = 0
+            self._open_parts[key] = {
+                "path": path.as_posix(),
+                "partition": dict(zip(self.partition_by, key)),
+                "num_rows": 0,
+            }
+            self._parts.append(self._open_parts[key])
+        return self._writers[key]
+
+    def _close_file(self, key: tuple) -> None:
+        """Close the open part file of a partition and record its metadata."""
+        self._writers.pop(key).close()
+        part = self._open_parts.pop(key)
+        metadata = pq.read_metadata(self.out_dir.joinpath(part["path"]))
+        metadata.set_file_path(part["path"])
+        self._metadata.append(metadata)
+        part["num_rows"] = metadata.num_rows
+        logger.debug(f"Wrote {metadata.num_rows} rows to {part['path']}")
+
+    def __enter__(self) -> "DatasetWriter":
+        """Enter context."""
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        """Close the writer on exit."""
+        self.close()
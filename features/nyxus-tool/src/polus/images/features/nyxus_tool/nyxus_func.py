@@ -1,10 +1,13 @@
 """Nyxus Plugin."""
+import functools
 import logging
 import pathlib
+import tempfile
 from typing import Any
 from typing import Optional
 from typing import Union
 
+import pyarrow as pa
 import vaex
 from nyxus import Nyxus
 
@@ -15,6 +18,30 @@ logger = logging.getLogger(__name__)
 chunk_size = 100_000
 
 
+@functools.lru_cache(maxsize=1)
+def get_nyxus(
+    features: tuple[str, ...],
+    pixels_per_micron: Optional[float],
+    neighbor_dist: Optional[int],
+    n_feature_calc_threads: int,
+) -> Nyxus:
+    """Return a Nyxus instance, reusing it while the parameters are unchanged.
+
+    Every worker process keeps its instance for the whole run, so the engine
+    is set up once per process instead of once per image.
+    """
+    nyx = Nyxus(list(features))
+
+    nyx_params = {
+        "neighbor_distance": neighbor_dist,
+        "pixels_per_micron": pixels_per_micron,
+        "n_feature_calc_threads": n_feature_calc_threads,
+    }
+
+    nyx.set_params(**nyx_params)
+    return nyx
+
+
 def nyxus_func(  # noqa: PLR0913
     int_file: Union[list[pathlib.Path], Any],
     seg_file: Union[list[pathlib.Path], Any],
@@ -24,6 +51,7 @@ def nyxus_func(  # noqa: PLR0913
     pixels_per_micron: Optional[float] = 1.0,
     neighbor_dist: Optional[int] = 5,
     single_roi: Optional[bool] = False,
+    n_feature_calc_threads: int = 4,
 ) -> None:
     """Scalable Extraction of Nyxus Features.
 
@@ -36,19 +64,17 @@ def nyxus_func(  # noqa: PLR0913
         pixels_per_micron : Number of pixels for every micrometer.
         neighbor_dist : Pixel distance between neighbor objects. Defaults to 5.
         single_roi : 'True' to treat intensity image as single roi and vice versa.
+        n_feature_calc_threads : Number of Nyxus feature calculation threads.
     """
     if isinstance(int_file, pathlib.Path):
         int_file = [int_file]
 
-    nyx = Nyxus(features)
-
-    nyx_params = {
-        "neighbor_distance": neighbor_dist,
-        "pixels_per_micron": pixels_per_micron,
-        "n_feature_calc_threads": 4,
-    }
-
-    nyx.set_params(**nyx_params)
+    nyx = get_nyxus(
+        tuple(features),
+        pixels_per_micron,
+        neighbor_dist,
+        n_feature_calc_threads,
+    )
 
     if f"{file_extension}" == "arrowipc":
         ext = ".arrow"
@@ -72,3 +98,52 @@ def nyxus_func(  # noqa: PLR0913
     if f"{file_extension}" == "pandas":
         vf = vaex.from_pandas(feats)
         vf.export_csv(path=output_path, chunk_size=chunk_size)
+
+
+def nyxus_table(  # noqa: PLR0913
+    int_file: pathlib.Path,
+    seg_file: Union[list[pathlib.Path], Any],
+    features: list[str],
+    pixels_per_micron: Optional[float] = 1.0,
+    neighbor_dist: Optional[int] = 5,
+    single_roi: Optional[bool] = False,
+    n_feature_calc_threads: int = 4,
+) -> pa.Table:
+    """Extract Nyxus features of one intensity image as an Arrow table.
+
+    Nyxus writes the features to a temporary Arrow IPC file, which is read
+    back without conversion to pandas.
+
+    Args:
+        int_file : Path to intensity image.
+        seg_file : Path to label image.
+        features : List of features to compute.
+        pixels_per_micron : Number of pixels for every micrometer.
+        neighbor_dist : Pixel distance between neighbor objects. Defaults to 5.
+        single_roi : 'True' to treat intensity image as single roi and vice versa.
+        n_feature_calc_threads : Number of Nyxus feature calculation threads.
+
+    Returns:
+        Features of every object in the image.
+    """
+    nyx = get_nyxus(
+        tuple(features),
+        pixels_per_micron,
+        neighbor_dist,
+        n_feature_calc_threads,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = str(pathlib.Path(tmp, "features.arrow"))
+        out = nyx.featurize_files(
+            intensity_files=[str(int_file)],
+            mask_files=[str(seg_file[0])],
+            single_roi=single_roi,
+            output_type="arrowipc",
+            output_path=output_path,
+        )
+        if isinstance(out, str):
+            output_path = out
+        # Read into memory rather than memory map, the file is removed on exit
+        with pa.OSFile(output_path) as source:
+            return pa.ipc.open_file(source).read_all()
@@ -1,9 +1,15 @@
 """Nyxus Plugin."""
 import enum
+import math
 import os
+from pathlib import Path
+from typing import Optional
 
 POLUS_TAB_EXT = os.environ.get("POLUS_TAB_EXT", "pandas")
 
+# Upper bound on the feature calculation threads of a single Nyxus instance
+MAX_FEATURE_THREADS = 4
+
 
 class Extension(str, enum.Enum):
     """Enum of File Extension."""
@@ -11,9 +17,62 @@ class Extension(str, enum.Enum):
     PANDAS = "pandas"
     ARROW = "arrowipc"
     PARQUET = "parquet"
+    DATASET = "dataset"
     DEFAULT = POLUS_TAB_EXT
 
 
+def _cgroup_quota() -> Optional[float]:
+    """Read the CPU quota of the container from cgroup v2 or v1, if any."""
+    cpu_max = Path("/sys/fs/cgroup/cpu.max")
+    try:
+        if cpu_max.exists():
+            quota, period = cpu_max.read_text().split()[:2]
+            if quota != "max":
+                return int(quota) / int(period)
+        else:
+            cgroup = Path("/sys/fs/cgroup/cpu")
+            quota = int(cgroup.joinpath("cpu.cfs_quota_us").read_text())
+            period = int(cgroup.joinpath("cpu.cfs_period_us").read_text())
+            if quota > 0:
+                return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """Return the number of CPUs this process may use.
+
+    The CPU affinity of the process is limited further by the cgroup CPU
+    quota, so containers with a fractional share of a large host are not
+    oversubscribed.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return max(1, cpus)
+
+
+def worker_layout(num_cpus: int) -> tuple[int, int]:
+    """Split CPUs into worker processes and Nyxus feature threads per process.
+
+    Small images parallelize best over processes, so each process gets one
+    feature thread per four available CPUs, up to `MAX_FEATURE_THREADS`.
+
+    Args:
+        num_cpus: Number of available CPUs.
+
+    Returns:
+        Number of processes and feature threads per process.
+    """
+    threads = max(1, min(MAX_FEATURE_THREADS, num_cpus // 4))
+    return max(1, num_cpus // threads), threads
+
+
 FEATURE_GROUP = {
     "ALL_INTENSITY",
     "ALL_MORPHOLOGY",
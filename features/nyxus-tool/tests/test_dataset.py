@@ -0,0 +1,58 @@
+"""Nyxus Plugin."""
+import json
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+from polus.images.features.nyxus_tool.dataset import MANIFEST
+from polus.images.features.nyxus_tool.dataset import DatasetWriter
+
+
+def feature_table(num_rows: int, name: str) -> pa.Table:
+    """Create a table resembling nyxus features."""
+    return pa.table(
+        {
+            "intensity_image": [name] * num_rows,
+            "label": np.arange(num_rows, dtype=np.int64),
+            "MEAN": np.random.random(num_rows),
+        },
+    )
+
+
+@pytest.mark.parametrize("partition_by", [[], ["r"], ["r", "c"]])
+def test_dataset_writer(tmp_path: Path, partition_by: list[str]) -> None:
+    """Test that all rows are written to one partitioned dataset."""
+    num_rows = 0
+    with DatasetWriter(tmp_path, partition_by, row_group_size=50, rows_per_file=120) as w:
+        for i in range(30):
+            table = feature_table(i * 3, f"y04_r{i % 3}_c{i % 2}.ome.tif")
+            if i % 2 == 0:
+                # Column order and types may differ between images
+                table = table.select(["MEAN", "label", "intensity_image"])
+                table = table.cast(
+                    pa.schema(
+                        [
+                            ("MEAN", pa.float64()),
+                            ("label", pa.int32()),
+                            ("intensity_image", pa.string()),
+                        ],
+                    ),
+                )
+            w.write(table, {"r": i % 3, "c": i % 2})
+            num_rows += table.num_rows
+
+    manifest = json.loads(tmp_path.joinpath(MANIFEST).read_text())
+    assert manifest["num_rows"] == num_rows
+    assert sum(f["num_rows"] for f in manifest["files"]) == num_rows
+    assert all(0 < f["num_rows"] <= 120 for f in manifest["files"])
+
+    dataset = ds.parquet_dataset(tmp_path.joinpath("_metadata"), partitioning="hive")
+    table = dataset.to_table()
+    assert table.num_rows == num_rows
+    assert table.schema.names[:3] == ["intensity_image", "label", "MEAN"]
+    assert table.schema.names[3:] == partition_by
+    if partition_by:
+        for row in table.to_pylist():
+            assert f"_r{row['r']}_" in row["intensity_image"]
@@ -1,5 +1,6 @@
 """Nyxus Plugin."""
 
+import os
 from pathlib import Path
 import shutil
 import tempfile
@@ -14,6 +15,8 @@ from typer.testing import CliRunner
 
 from polus.images.features.nyxus_tool.__main__ import app as app
 from polus.images.features.nyxus_tool.nyxus_func import nyxus_func
+from polus.images.features.nyxus_tool.utils import available_cpus
+from polus.images.features.nyxus_tool.utils import worker_layout
 
 runner = CliRunner()
 
@@ -148,3 +151,13 @@ def test_cli(synthetic_images, output_directory, get_params) -> None:
     )
     assert output_directory.joinpath(f"y04_r1_c1{fileext}")
     clean_directories()
+
+
+@pytest.mark.parametrize("num_cpus", [1, 2, 4, 7, 16, 64])
+def test_worker_layout(num_cpus: int) -> None:
+    """Test that workers never oversubscribe the available CPUs."""
+    num_workers, num_threads = worker_layout(num_cpus)
+    assert num_workers >= 1
+    assert num_threads >= 1
+    assert num_workers * num_threads <= num_cpus
+    assert 1 <= available_cpus() <= os.cpu_count()
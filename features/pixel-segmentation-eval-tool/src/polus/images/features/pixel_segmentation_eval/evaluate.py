@@ -3,14 +3,17 @@ import logging
 import math
 import os
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
 from multiprocessing import cpu_count
 from typing import List, Optional, Sequence, Union
 
 import filepattern
 import numpy as np
-import pandas as pd
-import vaex
+import pyarrow as pa
 from bfio import BioReader
+from polus.images.features.pixel_segmentation_eval.sink import TableSink
+from polus.images.features.pixel_segmentation_eval.sink import table_schema
 from scipy import special
 
 logger = logging.getLogger(__name__)
@@ -18,6 +21,10 @@ logger.setLevel(logging.INFO)
 
 POLUS_TAB_EXT = os.environ.get("POLUS_TAB_EXT", ".csv")
 
+TILE_SIZE = 2048
+NUM_WORKERS = max(cpu_count(), 2)
+NUM_FILE_WORKERS = 4
+
 
 header = [
     "Image_Name",
@@ -206,23 +213,148 @@ def metrics(
 
 
 def write_outfile(
-    x,
+    x: List[List],
     header: List[str],
     out_name: pathlib.Path,
     chunk_size: int,
 ) -> None:
-    """Write an output in vaex supported tabular format."""
-    if all(isinstance(i, list) for i in x):
-        xdf = pd.DataFrame(x, columns=header)
-    else:
-        xdf = pd.DataFrame(x).T
-        xdf.columns = header
+    """Write a small table in one go."""
+    with TableSink(out_name, schema(header), chunk_size) as sink:
+        sink.append(x)
+
+
+def schema(columns: List[str]) -> pa.Schema:
+    """Schema of a result table: image name, integer counts, then metrics."""
+    types = [
+        pa.string()
+        if c == "Image_Name"
+        else pa.int64()
+        if c in ["Class", "TP", "TN", "FP", "FN"]
+        else pa.float64()
+        for c in columns
+    ]
+    return table_schema(columns, types)
+
+
+def confusion_matrix(
+    y_true: np.ndarray, y_pred: np.ndarray, input_classes: int
+) -> np.ndarray:
+    """Compute a multi-class confusion matrix with a single bincount.
+
+    Rows are ground truth classes and columns are predicted classes. Class 0
+    is background and any value outside `[0, input_classes]` is counted in an
+    extra last bin so that it is never mistaken for one of the evaluated
+    classes. If `input_classes` is 1, labeled images are converted to binary.
+
+    Args:
+        y_true: Ground truth image or tile
+        y_pred: Predicted image or tile
+        input_classes: Number of classes in predicted images
+
+    Returns:
+        A `(input_classes + 2, input_classes + 2)` int64 confusion matrix
+    """
+    num_bins = input_classes + 2
+
+    def _bin(y: np.ndarray) -> np.ndarray:
+        y = y.ravel()
+        if input_classes == 1:
+            return (y > 0).astype(np.int64)
+        y = y.astype(np.int64)
+        y[(y < 0) | (y > input_classes)] = input_classes + 1
+        return y
+
+    counts = np.bincount(
+        _bin(y_true) * num_bins + _bin(y_pred), minlength=num_bins**2
+    )
+    return counts.reshape(num_bins, num_bins)
+
+
+def class_counts(cm: np.ndarray, cl: int) -> tuple[int, int, int, int]:
+    """Reduce a confusion matrix to one-vs-rest counts for a single class.
+
+    Args:
+        cm: Confusion matrix computed by `confusion_matrix`
+        cl: Class to evaluate
+
+    Returns:
+        tp, tn, fp, fn
+    """
+    tp = int(cm[cl, cl])
+    fn = int(cm[cl, :].sum()) - tp
+    fp = int(cm[:, cl].sum()) - tp
+    tn = int(cm.sum()) - tp - fn - fp
+    return tp, tn, fp, fn
+
 
-    vf = vaex.from_pandas(xdf)
-    if f"{POLUS_TAB_EXT}" in [".feather", ".arrow"]:
-        vf.export_feather(out_name)
-    else:
-        vf.export_csv(path=out_name, chunk_size=chunk_size)
+def _tile_confusion(
+    br_gt: BioReader,
+    br_pred: BioReader,
+    x: int,
+    y: int,
+    z: int,
+    tile_size: int,
+    input_classes: int,
+) -> np.ndarray:
+    """Read one tile pair and compute its confusion matrix."""
+    x_max = min([br_gt.X, x + tile_size])
+    y_max = min([br_gt.Y, y + tile_size])
+    y_true = br_gt[y:y_max, x:x_max, z : z + 1, 0, 0]  # noqa
+    y_pred = br_pred[y:y_max, x:x_max, z : z + 1, 0, 0]  # noqa
+    return confusion_matrix(y_true, y_pred, input_classes)
+
+
+def image_confusion(
+    gt_path: pathlib.Path,
+    pred_path: pathlib.Path,
+    input_classes: int,
+    executor: ThreadPoolExecutor,
+    tile_size: int = TILE_SIZE,
+) -> np.ndarray:
+    """Accumulate the confusion matrix of an image pair tile by tile.
+
+    Each tile of both images is read exactly once, and tiles are evaluated
+    concurrently on the provided executor.
+
+    Args:
+        gt_path: Ground truth image
+        pred_path: Predicted image
+        input_classes: Number of classes in predicted images
+        executor: Thread pool used to evaluate tiles
+        tile_size: Size of tiles read from the images
+
+    Returns:
+        The confusion matrix of the whole image
+    """
+    logger.info(f"Evaluating image {pred_path}")
+    with BioReader(pred_path, max_workers=1) as br_pred, BioReader(
+        gt_path, max_workers=1
+    ) as br_gt:
+        futures = [
+            executor.submit(
+                _tile_confusion,
+                br_gt,
+                br_pred,
+                x,
+                y,
+                z,
+                tile_size,
+                input_classes,
+            )
+            for z, y, x in product(
+                range(br_gt.Z),
+                range(0, br_gt.Y, tile_size),
+                range(0, br_gt.X, tile_size),
+            )
+        ]
+        return sum(f.result() for f in futures)
+
+
+def _stats(tp: int, tn: int, fp: int, fn: int) -> list:
+    """Counts followed by every metric, guarding empty tp and tn."""
+    tp_ = 1e-20 if tp == 0 else tp
+    tn_ = 1e-20 if tn == 0 else tn
+    return [tp, tn, fp, fn, *metrics(tp_, fp, fn, tn_)]
 
 
 def evaluation(
@@ -236,9 +368,12 @@ def evaluation(
 ) -> None:
     """Evalulate segmentations by pixel-by-pixel comparison.
 
-    If only 1 input class (foreground and background) is provided, this plugin convert labeled images to binary, else iterate over each class and calculate pixel level confusion matrix.
+    If only 1 input class (foreground and background) is provided, this plugin convert labeled images to binary, else a single confusion matrix over all classes is accumulated for each image.
     Use the confusion matrix to generate metrics and save the values.
 
+    Images are evaluated concurrently, and the tiles of each image are spread
+    over a shared pool of threads.
+
     Args:
         gt_dir: Ground truth images
         pred_dir: Predicted images
@@ -253,227 +388,50 @@ def evaluation(
     fp = filepattern.FilePattern(pred_dir, file_pattern)
     chunk_size = 100_000
 
-    result = []
-
-    if total_stats:
-        TN = [0] * (input_classes + 1)
-        TP = [0] * (input_classes + 1)
-        FP = [0] * (input_classes + 1)
-        FN = [0] * (input_classes + 1)
+    total_cm = 0
 
     try:
-        for file in fp():
-            file_name = file[1][0]
-            tile_grid_size = 1
-            tile_size = tile_grid_size * 2048
-            # Set up the BioReader
-            with BioReader(file_name, max_workers=cpu_count()) as br_pred:
-                with BioReader(
-                    pathlib.Path(gt_dir, file_name.name), max_workers=cpu_count()
-                ) as br_gt:
-                    # Loop through z-slices
-                    logger.info(f"Evaluating image {file_name}")
-                    for cl in range(1, input_classes + 1):
-                        tn = 0
-                        tp = 0
-                        fp = 0
-                        fn = 0
-                        for z in range(br_gt.Z):
-                            # Loop across the length of the image
-                            for y in range(0, br_gt.Y, tile_size):
-                                y_max = min([br_gt.Y, y + tile_size])
-                                # Loop across the depth of the image
-                                for x in range(0, br_gt.X, tile_size):
-                                    x_max = min([br_gt.X, x + tile_size])
-                                    y_true = np.squeeze(
-                                        br_gt[y:y_max, x:x_max, z : z + 1, 0, 0]  # noqa
-                                    )
-                                    y_pred = np.squeeze(
-                                        br_pred[
-                                            y:y_max, x:x_max, z : z + 1, 0, 0  # noqa
-                                        ]  # noqa
-                                    )
-                                    if input_classes == 1:
-                                        y_true = (
-                                            (y_true > 0).astype("uint8") * 1
-                                        ).flatten()
-                                        y_pred = (
-                                            (y_pred > 0).astype("uint8") * 1
-                                        ).flatten()
-                                    else:
-                                        y_true = y_true.flatten()
-                                        y_pred = y_pred.flatten()
-
-                                    for i in range(len(y_true)):
-                                        if y_true[i] == cl:
-                                            if y_true[i] == y_pred[i]:
-                                                tp += 1
-                                            else:
-                                                fn += 1
-                                        else:
-                                            if y_pred[i] == cl:
-                                                fp += 1
-                                            else:
-                                                tn += 1
-
-                        if tp == 0:
-                            tp_ = 1e-20
-                        else:
-                            tp_ = tp
-                        if tn == 0:
-                            tn_ = 1e-20
-                        else:
-                            tn_ = tn
-                        (
-                            iou,
-                            tpr,
-                            precision,
-                            tnr,
-                            npv,
-                            fnr,
-                            fpr,
-                            fdr,
-                            fr,
-                            prev,
-                            accuracy,
-                            ba,
-                            fscore,
-                            f1_score,
-                            pt,
-                            mcc,
-                            fmi,
-                            bi,
-                            mkn,
-                            ck,
-                            mm,
-                            amm,
-                            ari,
-                        ) = metrics(tp_, fp, fn, tn_)
-                        data = [
-                            file_name.name,
-                            cl,
-                            tp,
-                            tn,
-                            fp,
-                            fn,
-                            iou,
-                            tpr,
-                            precision,
-                            tnr,
-                            npv,
-                            fnr,
-                            fpr,
-                            fdr,
-                            fr,
-                            prev,
-                            accuracy,
-                            ba,
-                            fscore,
-                            f1_score,
-                            pt,
-                            mcc,
-                            fmi,
-                            bi,
-                            mkn,
-                            ck,
-                            mm,
-                            amm,
-                            ari,
-                        ]
-
-                        if individual_stats:
-                            individual_file = pathlib.Path(
-                                out_dir, f"{file_name.name}{POLUS_TAB_EXT}"
-                            )
-                            write_outfile(
-                                data,
-                                header,
-                                individual_file,
-                                chunk_size
-                            )
-
-                        result.append(data)
-                        filename = pathlib.Path(out_dir, f"result{POLUS_TAB_EXT}")
-                        write_outfile(
-                            result, header, filename, chunk_size
-                        )
-
-                        if total_stats:
-                            TP[cl] += tp
-                            TN[cl] += tn
-                            FP[cl] += fp
-                            FN[cl] += fn
-
-        if total_stats:
-            for cl in range(1, input_classes + 1):
-                if TP[cl] == 0:
-                    TP_ = 1e-20
-                else:
-                    TP_ = TP[cl]
-                if TN[cl] == 0:
-                    TN_ = 1e-20
-                else:
-                    TN_ = TN[cl]
-                (
-                    iou,
-                    tpr,
-                    precision,
-                    tnr,
-                    npv,
-                    fnr,
-                    fpr,
-                    fdr,
-                    fr,
-                    prev,
-                    accuracy,
-                    ba,
-                    fscore,
-                    f1_score,
-                    pt,
-                    mcc,
-                    fmi,
-                    bi,
-                    mkn,
-                    ck,
-                    mm,
-                    amm,
-                    ari,
-                ) = metrics(TP_, FP[cl], FN[cl], TN_)
+        files = [file[1][0] for file in fp()]
+        filename = pathlib.Path(out_dir, f"result{POLUS_TAB_EXT}")
+        with ThreadPoolExecutor(NUM_WORKERS) as tile_executor, ThreadPoolExecutor(
+            NUM_FILE_WORKERS
+        ) as file_executor, TableSink(filename, schema(header), chunk_size) as result:
+            futures = [
+                file_executor.submit(
+                    image_confusion,
+                    pathlib.Path(gt_dir, file_name.name),
+                    file_name,
+                    input_classes,
+                    tile_executor,
+                )
+                for file_name in files
+            ]
+
+            for file_name, future in zip(files, futures):
+                cm = future.result()
+                total_cm = total_cm + cm
+
                 data = [
-                    cl,
-                    TP[cl],
-                    TN[cl],
-                    FP[cl],
-                    FN[cl],
-                    iou,
-                    tpr,
-                    precision,
-                    tnr,
-                    npv,
-                    fnr,
-                    fpr,
-                    fdr,
-                    fr,
-                    prev,
-                    accuracy,
-                    ba,
-                    fscore,
-                    f1_score,
-                    pt,
-                    mcc,
-                    fmi,
-                    bi,
-                    mkn,
-                    ck,
-                    mm,
-                    amm,
-                    ari,
+                    [file_name.name, cl, *_stats(*class_counts(cm, cl))]
+                    for cl in range(1, input_classes + 1)
                 ]
 
+                if individual_stats:
+                    individual_file = pathlib.Path(
+                        out_dir, f"{file_name.name}{POLUS_TAB_EXT}"
+                    )
+                    write_outfile(data, header, individual_file, chunk_size)
+
+                result.append(data)
+
+        if total_stats and len(files) > 0:
+            data = [
+                [cl, *_stats(*class_counts(total_cm, cl))]
+                for cl in range(1, input_classes + 1)
+            ]
+
             overall_file = pathlib.Path(out_dir, f"total_stats_result{POLUS_TAB_EXT}")
-            write_outfile(
-                data, totalStats_header, overall_file, chunk_size
-            )
+            write_outfile(data, totalStats_header, overall_file, chunk_size)
             logger.info(f"total_stats_result{POLUS_TAB_EXT}")
 
     finally:
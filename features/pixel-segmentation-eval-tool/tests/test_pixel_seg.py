@@ -6,10 +6,13 @@ import shutil
 import tempfile
 from collections.abc import Generator
 
+import numpy as np
 import pytest
 import skimage
 import vaex
 from polus.images.features.pixel_segmentation_eval.__main__ import app
+from polus.images.features.pixel_segmentation_eval.evaluate import class_counts
+from polus.images.features.pixel_segmentation_eval.evaluate import confusion_matrix
 from polus.images.features.pixel_segmentation_eval.evaluate import evaluation
 from skimage import io
 from typer.testing import CliRunner
@@ -140,3 +143,25 @@ def test_cli(
     )
 
     assert result.exit_code == 0
+
+
+@pytest.mark.parametrize("classes", [1, 2, 3])
+def test_confusion_matrix(classes: int) -> None:
+    """Test one-vs-rest counts derived from the confusion matrix."""
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 6, 1000).astype(np.uint16)
+    y_pred = rng.integers(0, 6, 1000).astype(np.uint16)
+
+    cm = confusion_matrix(y_true, y_pred, classes)
+    assert cm.sum() == y_true.size
+
+    if classes == 1:
+        y_true = (y_true > 0).astype(np.uint8)
+        y_pred = (y_pred > 0).astype(np.uint8)
+
+    for cl in range(1, classes + 1):
+        tp = np.sum((y_true == cl) & (y_pred == cl))
+        fn = np.sum((y_true == cl) & (y_pred != cl))
+        fp = np.sum((y_true != cl) & (y_pred == cl))
+        tn = np.sum((y_true != cl) & (y_pred != cl))
+        assert class_counts(cm, cl) == (tp, tn, fp, fn)
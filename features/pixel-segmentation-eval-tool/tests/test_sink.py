@@ -0,0 +1,50 @@
+"""Tests for the columnar table sink.
+
+The pixel and region segmentation eval tools share these tests, as they share
+sink.py. Keep both copies in sync.
+"""
+import pathlib
+import tempfile
+from collections.abc import Generator
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+from polus.images.features.pixel_segmentation_eval.sink import TableSink
+from polus.images.features.pixel_segmentation_eval.sink import table_schema
+
+
+@pytest.fixture()
+def output_directory() -> Generator[pathlib.Path, None, None]:
+    """Create output directory."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield pathlib.Path(tmpdir)
+
+
+@pytest.mark.parametrize("ext", [".csv", ".arrow", ".feather", ".parquet"])
+def test_sink(output_directory: pathlib.Path, ext: str) -> None:
+    """Test that buffered rows are streamed in order."""
+    schema = table_schema(
+        ["name", "count", "score", "labels"],
+        [pa.string(), pa.int64(), pa.float64(), pa.list_(pa.int64())],
+    )
+    path = output_directory.joinpath(f"table{ext}")
+    with TableSink(path, schema, buffer_rows=3) as sink:
+        for i in range(10):
+            sink.append([[f"image_{i}", i, i / 2, [i, i + 1]]])
+        sink.append([["short_row", 10]])
+
+    assert sink.num_rows == 11
+
+    if ext == ".csv":
+        table = pacsv.read_csv(path)
+    elif ext == ".parquet":
+        table = pq.read_table(path)
+    else:
+        table = feather.read_table(path)
+
+    assert table.num_rows == 11
+    assert table.column("count").to_pylist() == list(range(11))
+    assert table.column("score").to_pylist()[-1] is None
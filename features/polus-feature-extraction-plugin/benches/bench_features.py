@@ -0,0 +1,84 @@
+"""Benchmark feature extraction of `all` features against individual feature lists.
+
+Synthetic label and intensity images of increasing size are generated, and
+`feature_extraction` is timed for every feature list. Feature lists that share
+intermediates (feret diameters, neighbor counts) compute them
+once per image.
+
+Run from the plugin root:
+
+    python benches/bench_features.py --sizes 512 1024 --objects 100 400
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from skimage import filters
+from skimage import measure
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+import main
+
+logging.basicConfig(format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s',
+                    datefmt='%d-%b-%y %H:%M:%S')
+logger = logging.getLogger('bench_features')
+logger.setLevel(logging.INFO)
+logging.getLogger('main').setLevel(logging.WARNING)
+
+FEATURE_LISTS = {
+    'all': ['all'],
+    'shape': ['area', 'perimeter', 'solidity', 'eccentricity', 'orientation'],
+    'intensity': ['mean_intensity', 'median', 'standard_deviation', 'skewness', 'kurtosis'],
+    'feret': ['maxferet', 'minferet'],
+    'neighbors': ['neighbors'],
+    'polygonality': ['polygonality_score', 'hexagonality_score', 'hexagonality_sd'],
+}
+
+
+def make_images(size, num_objects, seed=0):
+    """Create a label image of blobs and a matching intensity image."""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((size, size))
+    points = (size * rng.random((2, num_objects))).astype(int)
+    image[points[0], points[1]] = 1
+    image = filters.gaussian(image, sigma=size / (8 * np.sqrt(num_objects)))
+    label_image = measure.label(image > image.mean()).astype(np.uint32)
+    intensity_image = (image / image.max() * 1000 + rng.normal(100, 10, image.shape)).astype(np.uint16)
+    return label_image, intensity_image
+
+
+def main_bench():
+    """Time every feature list on every image size."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--objects', type=int, nargs='+', default=[100, 400, 1600])
+    parser.add_argument('--lists', type=str, nargs='+', default=list(FEATURE_LISTS))
+    args = parser.parse_args()
+
+    logger.info(f"{'size':>6} {'objects':>8} {'features':>14} {'seconds':>10}")
+    for size, num_objects in zip(args.sizes, args.objects):
+        label_image, intensity_image = make_images(size, num_objects)
+        for name in args.lists:
+            start = time.perf_counter()
+            main.feature_extraction(list(FEATURE_LISTS[name]),
+                                    embeddedpixelsize=None,
+                                    unitLength=None,
+                                    pixelsPerunit=None,
+                                    pixelDistance=5,
+                                    channel=None,
+                                    intensity_image=intensity_image,
+                                    img_emb_unit=None,
+                                    label_image=label_image,
+                                    seg_file_names1=Path('synthetic_seg.ome.tif'),
+                                    int_file_name='synthetic_int.ome.tif')
+            elapsed = time.perf_counter() - start
+            logger.info(f'{size:>6} {label_image.max():>8} {name:>14} {elapsed:>10.3f}')
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -6,19 +6,19 @@ from scipy.stats import kurtosis as kurto
 from scipy.stats import mode as modevalue
 from scipy.sparse import csr_matrix
 from scipy import stats
-from operator import itemgetter
 from bfio import BioReader
-from itertools import repeat
 from functools import partial
+from functools import wraps
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from writer import TableWriter
 import argparse
 import logging
 import os
 import math
 import itertools
 import filepattern
-import concurrent
-import cv2
-import multiprocessing
 import numpy as np
 import pandas as pd
 
@@ -28,284 +28,304 @@ logging.basicConfig(format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(messa
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
 
+#Maximum number of images processed at the same time. Each worker holds the images of one
+#label image and its intensity images in memory.
+NUM_WORKERS = max(1, os.cpu_count() // 2)
+
+#Fraction of the physical memory that may be used by the images processed at the same time
+MEMORY_FRACTION = 0.5
+
+#Approximate memory, in bytes per pixel, of the intermediate arrays used to extract the
+#features of an image (int64 copies of the labels, float intensities and boolean masks)
+INTERMEDIATE_BYTES = 48
+
+#Methods to measure feret diameters, see feret_diameter
+FERET_METHODS = ['sampled', 'calipers']
+
+#Maximum number of hull vertex projections evaluated at once by the sampled feret method
+FERET_CHUNK = 2 ** 22
+
 def read(img_file):
-    """Read the .ome.tif image using BioReader.
-    
+    """Read the first channel of the .ome.tif image using BioReader.
+
+    The whole plane is read at once, because the shape features (neighbors, ferets,
+    regionprops) need every object whole.
+
     Args:
-        img_directory (str): Path to the directory containing the input images.
+        img_file (Path): Path to the image.
         
     Returns:
         Array of the image and the embedded unit in the metadata if present else it will be none.
         
     """
-    br = BioReader(img_file)
-    #Load only the first channel
-    image_bfio = br[:,:,0:1,0,0].squeeze()
-    #Get embedded units from metadata (physical size)
-    img_unit = br.ps_y[1]
+    with BioReader(img_file) as br:
+        #Load only the first channel
+        image_bfio = br[:, :, 0:1, 0, 0].reshape(br.Y, br.X)
+        #Get embedded units from metadata (physical size)
+        img_unit = br.ps_y[1]
     logger.info('Reading file\t{}/ {}'.format(img_file.parent, img_file.name))
     return image_bfio, img_unit
     
-def box_border_search(label_image, boxsize=3):
-    """Get perimeter pixels of object for calculating neighbors and feret diameter memory efficiently.
+def object_boundary(label_image):
+    """Get the boundary pixels of all objects.
+
+    A pixel is on the boundary of its object if a pixel in its 8-neighborhood has a
+    different label or if it lies on the border of the image.
 
     Args:
         label_image (ndarray): Labeled image array.
-        boxsize (int): Box size value.
 
     Returns:
-        An array containing the perimeter pixels of the object n.
+        A boolean array marking the boundary pixels of the objects.
 
     """
-    #Get image shape values
     height, width = label_image.shape
-
-    #Get boxsize values
-    floor_offset = math.floor(boxsize / 2)
-    ceil_offset = math.ceil(boxsize / 2)
-
-    #Create the integral image
-    int_image = np.zeros((height + 1, width + 1))
-    int_image[1:, 1:] = np.cumsum(np.cumsum(np.double(label_image), 0), 1)
-    int_image_transpose = int_image.T
-    int_image_int = int_image_transpose.astype(int)
-    del int_image, int_image_transpose
-
-    #Create indices for the original image
-    height_sequence = height - (boxsize - 1)
-    width_sequence = width - (boxsize - 1)
-    width_boxsize = np.linspace(0, width - boxsize, height_sequence)
-    height_boxsize = np.linspace(0, height - boxsize, width_sequence)
-    columns, rows = np.meshgrid(width_boxsize, height_boxsize)
-    columns_flat = columns.flatten(order = 'F')
-    columns_reshape = columns_flat.reshape(-1, 1)
-    rows_flat = rows.flatten(order = 'F')
-    rows_reshape = rows_flat.reshape(-1, 1)
-    #Upper left value
-    upper_left = (height + 1) * columns_reshape + rows_reshape
-    upper_left_int = upper_left.astype(int)
-    #Upper right value
-    upper_right = upper_left_int + (boxsize) * (height + 1)
-    upper_right_int = upper_right.astype(int)
-    #Lower left value
-    lower_left = upper_left + boxsize
-    lower_left_int = lower_left.astype(int)
-    #Lower right value
-    lower_right = upper_right_int + boxsize
-    lower_right_int = lower_right.astype(int)
-    del height_sequence, width_sequence, width_boxsize, height_boxsize, columns, columns_flat, rows, rows_flat, columns_reshape, rows_reshape, upper_right, lower_left, upper_left, lower_right
-
-    #Get the sum of local neighborhood defined by boxSize
-    int_image_flat = int_image_int.flatten(order = 'F')
-    int_image_flat_transpose = int_image_flat.T
-    neighborvals = (int_image_flat_transpose[upper_left_int]
-                    + int_image_flat_transpose[lower_right_int] 
-                    - int_image_flat_transpose[upper_right_int] 
-                    - int_image_flat_transpose[lower_left_int])
-    del lower_left_int, lower_right_int, upper_right_int, upper_left_int, int_image_flat_transpose, int_image_flat, int_image_int
-
-    #Divide the pixel averages by the pixel value
-    reshape_vals = np.reshape(neighborvals, (height - 2 * floor_offset, width - 2 * floor_offset))
-    double_image = label_image[ceil_offset - 1: -floor_offset, ceil_offset - 1: -floor_offset]
-    pix_mask = reshape_vals / double_image
-    pad = np.pad(pix_mask, ((floor_offset, floor_offset), (floor_offset, floor_offset)), mode='constant')
-    thresh = boxsize * boxsize
-    del neighborvals, reshape_vals, ceil_offset, double_image, pix_mask, floor_offset
-
-    #Get perimeter of the object     
-    pad_array = np.array(pad)
-    pad_flat = pad_array.flatten(order = 'F')
-    #Get perimeter indices
-    perimeter_indices = np.where(pad_flat != thresh)
-    perimeter_indices_array = np.asarray(perimeter_indices)
-    perimeter_indices_reshape = perimeter_indices_array.reshape(-1, 1)
-    perimeter_zeros = np.zeros(label_image.shape)
-    perimeter_int = perimeter_zeros.astype(int)
-    perimeter_flat = perimeter_int.flatten(order = 'F')
-    image_flat = label_image.flatten(order = 'F')
-    #Calculate perimeter
-    perimeter_flat[perimeter_indices_reshape] = image_flat[perimeter_indices_reshape]
-    perimeter_reshape = perimeter_flat.reshape(height, width)
-    perimeter_transpose = perimeter_reshape.T
-    del pad_array, pad_flat, thresh, perimeter_indices, perimeter_indices_array, perimeter_zeros, perimeter_int, image_flat, perimeter_indices_reshape, perimeter_flat, perimeter_reshape
-    return perimeter_transpose
-
-def neighbors_find(lbl_img, im_label,pixeldistance):
-    """Calculate the number of objects within d pixels of object n.
+    boundary = np.zeros(label_image.shape, dtype=bool)
+    boundary[[0, -1], :] = True
+    boundary[:, [0, -1]] = True
+    for dy, dx in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        src = (slice(0, height - dy), slice(max(0, -dx), width - max(0, dx)))
+        dst = (slice(dy, height), slice(max(0, dx), width - max(0, -dx)))
+        differs = label_image[src] != label_image[dst]
+        boundary[src] |= differs
+        boundary[dst] |= differs
+    boundary &= label_image > 0
+    return boundary
+
+def neighbors_find(lbl_img, labels, pixeldistance):
+    """Calculate the number of objects within d pixels of every object.
+
+    Two objects are neighbors if a pixel of one lies within the (2d+1)x(2d+1) window
+    centered on a pixel of the other. The closest pixels of two objects are always
+    on their boundaries, so only boundary pixels are inspected. The window is visited
+    one offset at a time for all boundary pixels at once, and the labels found are
+    reduced to unique pairs of neighboring objects.
 
     Args:
         lbl_image (ndarray): Labeled image array.
-        im_label (int): list of all labels in the image.
+        labels (list): Labels of the objects to count neighbors for.
         pixeldistance (int): Pixel distance value.
 
     Returns:
-        An array showing the number of neighbors touching the object for each object in labeled image. 
+        A list with the number of neighbors of each object in labels.
 
-    Note:
-        Number_of_Neighbors = neighbors_find(label_image, im_label, pixeldistance=None)
-        Computes the number of objects within 5 pixels of each object.
+    """
+    height, width = lbl_img.shape
+
+    #Get the boundary pixels of the objects
+    boundary = object_boundary(lbl_img)
+    rows, cols = np.nonzero(boundary)
+    source = lbl_img[rows, cols].astype(np.uint64)
+    del boundary
+
+    #Collect the labels within the window of every boundary pixel as unique pairs
+    pairs = [np.zeros(0, dtype=np.uint64)]
+    for dy in range(-pixeldistance, pixeldistance + 1):
+        for dx in range(-pixeldistance, pixeldistance + 1):
+            if dy == 0 and dx == 0:
+                continue
+            target_rows = rows + dy
+            target_cols = cols + dx
+            inside = (target_rows >= 0) & (target_rows < height) & (target_cols >= 0) & (target_cols < width)
+            target = lbl_img[target_rows[inside], target_cols[inside]].astype(np.uint64)
+            found = (target != 0) & (target != source[inside])
+            keys = (source[inside][found] << np.uint64(32)) | target[found]
+            pairs.append(np.unique(keys))
+        pairs = [np.unique(np.concatenate(pairs))]
+    pairs = pairs[0]
+
+    #Count the pairs of every object
+    objects, counts = np.unique(pairs >> np.uint64(32), return_counts=True)
+    labels = np.asarray(labels, dtype=np.uint64)
+    if len(objects) == 0:
+        return [0] * len(labels)
+    index = np.minimum(np.searchsorted(objects, labels), len(objects) - 1)
+    return np.where(objects[index] == labels, counts[index], 0).tolist()
+
+def convex_hulls(lbl_img):
+    """Get the convex hull of the pixels of every object.
+
+    The hull is taken over the pixel corners, so that it covers the whole area of each
+    pixel. Only the leftmost and rightmost boundary pixel of every row of an object can
+    be on its hull. These form a polygon, from which vertices that do not make a convex
+    turn are removed for all objects at once until only the hull vertices are left.
+
+    Args:
+        lbl_image (ndarray): Labeled image array.
+
+    Returns:
+        The labels of the objects, the number of hull vertices of each object and the
+        x and y positions of the hull vertices of all objects in order around each hull.
 
     """
-    nei=[]
-    num_nei=[]
-    shape_img = lbl_img.shape
-    #Find contours
-    contours = cv2.findContours((lbl_img==im_label).astype('uint8'),cv2.RETR_CCOMP, cv2.CHAIN_APPROX_TC89_KCOS)[0]
-    for contour in contours:
-        ck= [(contour[i][j]) for i in range(0,len(contour)) for j in  range(0,len(contour[i]))]
-        #Get borderpoints
-        pxx = [x[0] for x in ck]
-        pyy = [x[1] for x in ck]
-        pypdd = [int(py-pixeldistance) for py in pyy]
-        pxpdd = [int(px-pixeldistance) for px in pxx]
-        pypd_rnn=[int(py+pixeldistance) for py in pyy]
-        pxpd_rnn=[int(px+pixeldistance) for px in pxx]
-        cand = [(l,k) for pypd,pypd_rn,pxpd,pxpd_rn in zip(pypdd,pypd_rnn,pxpdd,pxpd_rnn) for l in range(pypd,pypd_rn+1) for k in range(pxpd,pxpd_rn+1)]
-        values=[lbl_img[l][k] for l,k in cand if(l<shape_img[0] and k<shape_img[1] and l>=0 and k>=0)]
-        nei.append(values)
-        #Get list of number of neighbors
-        uniq_nei=np.unique(nei)
-        num_nei.append(len(uniq_nei)-2)
-        nei=[]
-    num_nei = num_nei[0]
-    return num_nei
-
-def feret_diameter(lbl_img, boxsize, thetastart, thetastop):
-    """Calculate the maximum caliper diamter and minimum caliper diameter of an object at angle(1-180degrees).
+    #Get the leftmost and rightmost boundary pixel of each row of each object
+    rows, cols = np.nonzero(object_boundary(lbl_img))
+    objnum = lbl_img[rows, cols]
+    order = np.argsort(objnum, kind='stable')
+    rows, cols, objnum = rows[order], cols[order], objnum[order]
+    del order
+    row_start = np.flatnonzero(np.r_[True, (objnum[1:] != objnum[:-1]) | (rows[1:] != rows[:-1])])
+    row_stop = np.r_[row_start[1:], len(rows)] - 1
+    row = rows[row_start].astype(np.int64)
+    left = cols[row_start].astype(np.int64)
+    right = cols[row_stop].astype(np.int64) + 1
+    objects, obj_start, obj_rows = np.unique(objnum[row_start], return_index=True, return_counts=True)
+    del rows, cols, objnum, row_start, row_stop
+
+    #Walk down the left corners of each object and up its right corners
+    num_points = 4 * obj_rows
+    point_obj = np.repeat(np.arange(len(objects)), num_points)
+    position = np.arange(num_points.sum()) - np.repeat(np.cumsum(num_points) - num_points, num_points)
+    half = 2 * obj_rows[point_obj]
+    on_left = position < half
+    step = np.where(on_left, position, position - half)
+    group = np.where(on_left,
+                     obj_start[point_obj] + step // 2,
+                     obj_start[point_obj] + obj_rows[point_obj] - 1 - step // 2)
+    x = np.where(on_left, left[group], right[group])
+    y = row[group] + np.where(on_left, step % 2, 1 - step % 2)
+    del position, half, on_left, step, group
+
+    #Remove repeated corners of consecutive rows
+    keep = np.r_[True, (x[1:] != x[:-1]) | (y[1:] != y[:-1]) | (point_obj[1:] != point_obj[:-1])]
+    x, y, point_obj = x[keep], y[keep], point_obj[keep]
+
+    #Remove vertices without a convex turn. The first vertex of an object is its top
+    #left corner, which is always on the hull, so runs of removable vertices never
+    #wrap around. Only every other vertex of a run is removed at a time, so the
+    #neighbors of a removed vertex are still in place.
+    while True:
+        index = np.arange(len(x))
+        start = np.flatnonzero(np.r_[True, point_obj[1:] != point_obj[:-1]])
+        sizes = np.diff(np.r_[start, len(x)])
+        first = np.repeat(start, sizes)
+        last = first + np.repeat(sizes, sizes) - 1
+        prev = np.where(index == first, last, index - 1)
+        nxt = np.where(index == last, first, index + 1)
+        turn = (x - x[prev]) * (y[nxt] - y) - (y - y[prev]) * (x[nxt] - x)
+        concave = turn >= 0
+        if not concave.any():
+            break
+        run_start = np.flatnonzero(concave & ~np.r_[False, concave[:-1]])
+        run_position = index - run_start[np.cumsum(np.isin(index, run_start)) - 1]
+        keep = ~(concave & (run_position % 2 == 0))
+        x, y, point_obj = x[keep], y[keep], point_obj[keep]
+
+    return objects, sizes, x, y
+
+def feret_diameter(lbl_img, labels, feretMethod='sampled', thetastart=1, thetastop=180):
+    """Calculate the maximum caliper diameter and minimum caliper diameter of every object.
+
+    The diameters are measured on the convex hull of each object. With the 'sampled'
+    method the caliper diameters are measured at the angles from thetastart to thetastop
+    in steps of 1 degree, on chunks of hulls with at most FERET_CHUNK projected vertices.
+    The 'calipers' method is exact and uses rotating calipers on all hulls at once. The
+    vertex that is farthest from each hull edge (its antipodal vertex) is found by
+    merging the sorted directions of the edges with the directions opposite to them.
+    The minimum diameter is the smallest distance between an edge and its antipodal
+    vertex. Each vertex is antipodal to the vertices between the antipodal vertices of
+    its two edges, and the maximum diameter is the largest distance between these
+    antipodal pairs. There are O(h) antipodal pairs for a hull with h vertices.
 
     Args:
         lbl_image (ndarray): Labeled image array.
-        boxsize (int): Box size value.
+        labels (list): Labels of the objects.
+        feretMethod (string): Either 'sampled' or 'calipers'.
         thetastart (int): Angle start value by default it is 1.
         thetastop (int): Angle stop value by default it is 180.
 
     Returns:
-        An array with feret diameters of the corresponding objects at each of the angles in theta.
+        Lists with the maximum and minimum feret diameters of the objects in labels.
 
     """
-    counts_scalar_copy=None
-
-    #Convert to radians
-    theta = np.arange(thetastart, thetastop + 1)
-    theta = np.asarray(theta)
-    theta = np.radians(theta)
-
-    #Get perimeter of objects
-    obj_edges = box_border_search(lbl_img, boxsize=3)
-
-    #Get indices and label of all pixels
-    obj_edges_flat = obj_edges.flatten(order = 'F')
-    obj_edges_reshape = obj_edges_flat.reshape(-1, 1)
-    objnum = obj_edges_reshape[obj_edges_reshape != 0]
-    obj_edges_transpose = obj_edges.T
-    positionx = np.where(obj_edges_transpose)[0]
-    positionx_reshape = positionx.reshape(-1, 1)
-    positiony = np.where(obj_edges_transpose)[1]
-    positiony_reshape = positiony.reshape(-1, 1)
-    index = list(range(len(objnum)))
-    index = np.asarray(index).reshape(objnum.shape)
-    stack_index_objnum = np.column_stack((index, objnum))
-    del obj_edges_flat, obj_edges_reshape, objnum, index, obj_edges, positionx, obj_edges_transpose, positiony
-
-    #Sort pixels by label
-    sort_index_objnum = sorted(stack_index_objnum, key=itemgetter(1))
-    index_objnum_array = np.asarray(sort_index_objnum)
-    index_split = index_objnum_array[:, 0]
-    objnum_split = index_objnum_array[:, 1]
-    positionx_index = positionx_reshape[index_split]
-    positiony_index = positiony_reshape[index_split]
-    del positiony_reshape, index_split, stack_index_objnum, sort_index_objnum, index_objnum_array, positionx_reshape
-
-    #Get number of pixels for each object     
-    objnum_reshape = np.asarray(objnum_split).reshape(-1, 1)
-    difference_objnum = np.diff(objnum_reshape, axis=0)
-    stack_objnum = np.vstack((1, difference_objnum, 1))
-    objbounds = np.where(stack_objnum)
-    objbounds_array = np.asarray(objbounds)
-    objbounds_split = objbounds_array[0, :]
-    objbounds_reshape = objbounds_split.reshape(-1, 1)
-    objbounds_counts = objbounds_reshape[1:]-objbounds_reshape[:-1]
-    del objnum_split, difference_objnum, stack_objnum, objbounds, objbounds_array, objbounds_split, objnum_reshape, objbounds_reshape
-
-    uniqueindices_list = []
-    #Create cell with x, y positions of each objects border
-    for counts in objbounds_counts:
-        counts_scalar = np.asscalar(counts)
-        if counts_scalar == objbounds_counts[0]:
-            uniqueindices_x = positionx_index[:counts_scalar]
-            uniqueindices_y = positiony_index[:counts_scalar]
-            counts_scalar_copy = counts_scalar
-        if counts_scalar != objbounds_counts[0]:
-            index_range = counts_scalar_copy + counts_scalar
-            uniqueindices_x = positionx_index[counts_scalar_copy: index_range]
-            uniqueindices_y = positiony_index[counts_scalar_copy: index_range]
-            counts_scalar_copy = index_range
-        uniqueindices_x_reshape = uniqueindices_x.reshape(-1, 1)
-        uniqueindices_y_reshape = uniqueindices_y.reshape(-1, 1)
-        uniqueindices_concate = np.concatenate((uniqueindices_x_reshape, uniqueindices_y_reshape), axis=1)
-        uniqueindices_list.append(uniqueindices_concate)
-        del uniqueindices_concate, uniqueindices_x, uniqueindices_y, uniqueindices_x_reshape, uniqueindices_y_reshape
-
-    #Center points based on object centroid     
-    uniqueindices_array = np.asarray(uniqueindices_list)
-    meanind_list = []
-    for indices in uniqueindices_array:
-        repitations= (len(indices), 2)
-        sum_indices0 = np.sum(indices[:, 0])
-        sum_indices1 = np.sum(indices[:, 1])
-        length_indices0 =(sum_indices0 / len(indices))
-        length_indices1 =(sum_indices1 / len(indices))
-        mean_tile0 = np.tile(length_indices0, repitations)
-        sub_mean0_indices = np.subtract(indices, mean_tile0)
-        sub_mean0_indices = sub_mean0_indices[:, 0]
-        mean_tile1 = np.tile(length_indices1, repitations)
-        sub_mean1_indices = np.subtract(indices, mean_tile1)
-        sub_mean1_indices = sub_mean1_indices[:, 1]
-        meanind0_reshape = sub_mean0_indices.reshape(-1, 1)
-        meanind1_reshape = sub_mean1_indices.reshape(-1, 1)
-        meanind_concate = np.concatenate((meanind0_reshape, meanind1_reshape), axis=1)
-        meanind_list.append(meanind_concate)
-        del meanind_concate, sum_indices0, sum_indices1, length_indices0, mean_tile0, repitations, length_indices1, indices, mean_tile1, sub_mean0_indices, sub_mean1_indices
-    del uniqueindices_array     
-    center_point = np.asarray(meanind_list)
-
-    #Create transformation matrix
-    rot_trans = np.array((np.cos(theta), -np.sin(theta)))
-    rot_trans = rot_trans.T
-    rot_list = []
-    rot_position=[]
-    sub_rot_list=[]
-
-    #Calculate rotation positions
-    for point in center_point:
-        rot_position.clear()
-        for rotation in rot_trans:
-            rot_mul = np.multiply(rotation, point)
-            rot_add = np.add(rot_mul[:, 0], rot_mul[:, 1])
-            rot_position.append(rot_add)
-        rot_array = np.asarray(rot_position)
-        rot_list.append(rot_array)
-        del rot_array, rotation, rot_mul, rot_add
-    rot_position.clear()
-    del point, center_point
-
-    feretdiam = []
-    #Get Ferets diameter  
-    for rot in rot_list:
-        sub_rot_list.clear()
-        for rt,trans in zip(rot, rot_trans):
-            sub_rot = np.subtract(np.max(rt), np.min(rt))
-            sub_rot_add = np.add(sub_rot, np.sum(abs(trans)))
-            sub_rot_list.append(sub_rot_add)
-            del sub_rot_add, sub_rot, trans, rt
-        convert_array = np.asarray(sub_rot_list)
-        convert_reshape = convert_array.reshape(-1, 1)
-        feretdiam.append(convert_reshape)
-        del convert_reshape, convert_array
-    sub_rot_list.clear()
-    feret_diameter = np.asarray(feretdiam)
-    del feretdiam, rot_list, theta, rot
-    return feret_diameter
+    if feretMethod not in FERET_METHODS:
+        raise ValueError('Unknown feret method {}, must be one of {}'.format(feretMethod, FERET_METHODS))
+
+    objects, sizes, x, y = convex_hulls(lbl_img)
+    if len(objects) == 0:
+        return [], []
+    start = np.cumsum(sizes) - sizes
+    index = np.searchsorted(objects, labels)
+
+    if feretMethod == 'sampled':
+        maxferet = np.zeros(len(objects))
+        minferet = np.zeros(len(objects))
+        theta = np.radians(np.arange(thetastart, thetastop + 1))
+        cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+
+        #Group the objects so that each group projects about FERET_CHUNK vertices
+        projected = np.cumsum(sizes) * len(theta)
+        bounds = np.unique(np.r_[0, np.searchsorted(projected, np.arange(FERET_CHUNK, projected[-1], FERET_CHUNK)), len(objects)])
+        for obj_first, obj_stop in zip(bounds[:-1], bounds[1:]):
+            chunk = slice(start[obj_first], start[obj_stop - 1] + sizes[obj_stop - 1])
+            chunk_start = start[obj_first:obj_stop] - start[obj_first]
+
+            #Project the hull vertices onto each angle
+            projection = np.outer(x[chunk], cos_theta) - np.outer(y[chunk], sin_theta)
+            diameters = np.maximum.reduceat(projection, chunk_start) - np.minimum.reduceat(projection, chunk_start)
+            maxferet[obj_first:obj_stop] = diameters.max(axis=1)
+            minferet[obj_first:obj_stop] = diameters.min(axis=1)
+        return maxferet[index].tolist(), minferet[index].tolist()
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    num_vertices = len(x)
+    obj = np.repeat(np.arange(len(objects)), sizes)
+    first = start[obj]
+    size = sizes[obj]
+    local = np.arange(num_vertices) - first
+
+    #Edge i runs from vertex i to vertex i + 1. Flipping y makes the hulls run
+    #counterclockwise, so the edge directions increase around each hull. They are
+    #unwrapped to increase by 2 pi over each hull.
+    nxt = first + (local + 1) % size
+    edge_x = x[nxt] - x
+    edge_y = y[nxt] - y
+    direction = np.arctan2(-edge_y, edge_x)
+    turn = np.mod(direction - direction[first + (local - 1) % size], 2 * np.pi)
+    turn[start] = 0
+    turn = np.cumsum(turn)
+    direction = direction[first] + turn - turn[first]
+
+    #The antipodal vertex of edge i is the first vertex k, counting twice around the
+    #hull, whose edge direction is at least the direction of edge i plus pi. All
+    #hulls are searched at once by sorting the edge directions and queries of each
+    #object together, with the queries sorted before equal directions.
+    values = np.r_[direction, direction + 2 * np.pi, direction + np.pi]
+    is_direction = np.r_[np.ones(2 * num_vertices, dtype=bool), np.zeros(num_vertices, dtype=bool)]
+    order = np.lexsort((is_direction, values, np.tile(obj, 3)))
+    sorted_is_direction = is_direction[order]
+    directions_before = np.cumsum(sorted_is_direction) - sorted_is_direction
+    antipodal = np.empty(num_vertices, dtype=np.int64)
+    antipodal[order[~sorted_is_direction] - 2 * num_vertices] = directions_before[~sorted_is_direction]
+    antipodal -= 2 * first
+    del values, is_direction, order, sorted_is_direction, directions_before, turn, direction
+
+    #Minimum diameter: the largest distance of a vertex from the line through each
+    #edge is reached at its antipodal vertex. The neighbors of the antipodal vertex
+    #are also checked, as edges parallel to the query tie with it.
+    edge_length = np.sqrt(edge_x * edge_x + edge_y * edge_y)
+    width = np.zeros(num_vertices)
+    for shift in (-1, 0, 1):
+        k = first + (antipodal + shift) % size
+        height = np.abs(edge_x * (y[k] - y) - edge_y * (x[k] - x))
+        np.maximum(width, height / edge_length, out=width)
+    minferet = np.minimum.reduceat(width, start)
+    del width, edge_length, edge_x, edge_y
+
+    #Maximum diameter: vertex i is antipodal to the vertices from the antipodal vertex
+    #of edge i - 1 to that of edge i, which are paired with it one range at a time
+    previous = antipodal[first + (local - 1) % size] - np.where(local == 0, size, 0)
+    range_first = previous - 1
+    range_size = antipodal - previous + 3
+    vertex = np.repeat(np.arange(num_vertices), range_size)
+    pair_start = np.cumsum(range_size) - range_size
+    other = first[vertex] + (range_first[vertex] + np.arange(len(vertex)) - pair_start[vertex]) % size[vertex]
+    dx = x[other] - x[vertex]
+    dy = y[other] - y[vertex]
+    maxferet = np.sqrt(np.maximum.reduceat(dx * dx + dy * dy, pair_start[start]))
+
+    return maxferet[index].tolist(), minferet[index].tolist()
 
 def polygonality_hexagonality(area, perimeter, neighbors, solidity, maxferet, minferet):
     """Calculate the polygonality score, hexagonality score and hexagonality standard deviation of object n.
@@ -454,7 +474,8 @@ def feature_extraction(features,
                         img_emb_unit=None,
                         label_image=None,
                         seg_file_names1=None,
-                        int_file_name=None):
+                        int_file_name=None,
+                        feretMethod='sampled'):
     """Calculate shape and intensity based features.
 
     Args:
@@ -468,17 +489,53 @@ def feature_extraction(features,
         intensity_image (ndarray): Intensity image array.
         pixelDistance (int): Distance between pixels to calculate the neighbors touching the object and default valus is 5.
         channel (int): Channel of the image.
+        feretMethod (string): Method to measure the feret diameters, either 'sampled' or 'calipers'.
         
     Returns:
         Dataframe containing the features extracted and the filename of the labeled image.
 
     """ 
     df_insert = pd.DataFrame([])
-    boxsize = 3
     thetastart = 1
     thetastop = 180
     if pixelDistance is None:
         pixelDistance = 5
+
+    #Intermediate results shared by several features. Each one is computed on
+    #first use and reused by every other feature of the same image.
+    intermediates = {}
+
+    def intermediate(func):
+        """Compute an intermediate result at most once per image."""
+        @wraps(func)
+        def cached():
+            if func.__name__ not in intermediates:
+                intermediates[func.__name__] = func()
+            return intermediates[func.__name__]
+        return cached
+
+    @intermediate
+    def feret_diameters():
+        """Calculate the maximum and minimum feret diameters of all the regions of interest in the image."""
+        label = [region.label for region in regions]
+        return feret_diameter(label_image, label, feretMethod, thetastart, thetastop)
+
+    @intermediate
+    def neighbor_counts():
+        """Count the neighbors of all the regions of interest in the image."""
+        label = [region.label for region in regions]
+        return neighbors_find(label_image, label, pixelDistance)
+
+    @intermediate
+    def poly_hex_score():
+        """Calculate polygonality and hexagonality score for all the regions of interest in the image."""
+        poly_area = area(label_image, unitLength)
+        poly_peri = perimeter(label_image, unitLength)
+        poly_neighbor = neighbor_counts()
+        poly_solidity = solidity(label_image)
+        poly_maxferet = maxferet(label_image, unitLength)
+        poly_minferet = minferet(label_image, unitLength)
+        return [polygonality_hexagonality(area_metric, perimeter_metric, int(neighbor_metric), solidity_metric, maxferet_metric, minferet_metric) for area_metric, perimeter_metric, neighbor_metric, solidity_metric, maxferet_metric, minferet_metric in zip(poly_area, poly_peri, poly_neighbor, poly_solidity, poly_maxferet, poly_minferet)]
         
     def area(seg_img, units, *args):
         """Calculate area for all the regions of interest in the image."""          
@@ -748,19 +805,13 @@ def feature_extraction(features,
 
     def neighbors(seg_img, *args):
         """Calculate neighbors for all the regions of interest in the image."""
-        data_dict=[]
-        label=[region.label for region in regions]
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers = multiprocessing.cpu_count())
-        results = executor.map(neighbors_find, repeat(seg_img), label,repeat(pixelDistance))
-        data_dict = list(results)
+        data_dict = neighbor_counts()
         logger.debug('Completed extraction neighbors for ' + seg_file_names1.name)
         return data_dict
 
     def maxferet(seg_img, *args):
         """Calculate maxferet for all the regions of interest in the image."""
-        edges= box_border_search(seg_img, boxsize)
-        feretdiam = feret_diameter(edges, boxsize, thetastart, thetastop)
-        maxferet1 = [np.max(feret) for feret in feretdiam]
+        maxferet1 = feret_diameters()[0]
         if unitLength and not embeddedpixelsize:
             maxferet = [dt_pixel / pixelsPerunit for dt_pixel in maxferet1]
         else:
@@ -770,9 +821,7 @@ def feature_extraction(features,
 
     def minferet(seg_img, *args):
         """Calculate minferet for all the regions of interest in the image."""
-        edges= box_border_search(seg_img, boxsize)
-        feretdiam = feret_diameter(edges, boxsize, thetastart, thetastop)
-        minferet1 = [np.min(feret) for feret in feretdiam]
+        minferet1 = feret_diameters()[1]
         if unitLength and not embeddedpixelsize:
             minferet = [dt_pixel / pixelsPerunit for dt_pixel in minferet1]
         else:
@@ -780,37 +829,21 @@ def feature_extraction(features,
         logger.debug('Completed extracting minferet for ' + seg_file_names1.name)
         return minferet
 
-    def poly_hex_score(seg_img, units):
-        """Calculate polygonality and hexagonality score for all the regions of interest in the image"""
-        poly_area = area(seg_img, units)
-        poly_peri = perimeter(seg_img, units)
-        poly_neighbor = neighbors(seg_img)
-        poly_solidity = solidity(seg_img)
-        poly_maxferet = maxferet(seg_img, units)
-        poly_minferet = minferet(seg_img, units)
-        poly_hex= [polygonality_hexagonality(area_metric, perimeter_metric, int(neighbor_metric), solidity_metric, maxferet_metric, minferet_metric) for area_metric, perimeter_metric, neighbor_metric, solidity_metric, maxferet_metric, minferet_metric in zip(poly_area, poly_peri, poly_neighbor, poly_solidity, poly_maxferet, poly_minferet)]
-        return poly_hex
-
     def polygonality_score(seg_img, units, *args):
         """Get polygonality score for all the regions of interest in the image."""
-        if features == 'all':
-            poly_hex = poly_hex_score(seg_img, units)
-        poly_hex = poly_hex_score(seg_img, units)
-        polygonality_score = [poly[0] for poly in poly_hex]
+        polygonality_score = [poly[0] for poly in poly_hex_score()]
         logger.debug('Completed extracting polygonality score for ' + seg_file_names1.name)
         return polygonality_score
 
     def hexagonality_score(seg_img, units, *args):
         """Get hexagonality score for all the regions of interest in the image."""
-        poly_hex = poly_hex_score(seg_img, units)
-        hexagonality_score = [poly[1] for poly in poly_hex]
+        hexagonality_score = [poly[1] for poly in poly_hex_score()]
         logger.debug('Completed extracting hexagonality score for ' + seg_file_names1.name)
         return hexagonality_score
 
     def hexagonality_sd(seg_img, units, *args):
         """Get hexagonality standard deviation for all the regions of interest in the image."""
-        poly_hex = poly_hex_score(seg_img, units)
-        hexagonality_sd = [poly[2] for poly in poly_hex]
+        hexagonality_sd = [poly[2] for poly in poly_hex_score()]
         logger.debug('Completed extracting hexagonality standard deviation for ' + seg_file_names1.name)
         return hexagonality_sd
     
@@ -823,21 +856,13 @@ def feature_extraction(features,
         #calculate neighbors
         all_neighbor = neighbors(seg_img)
         #calculate maxferet
-        edges= box_border_search(seg_img, boxsize)
-        feretdiam = feret_diameter(edges, boxsize, thetastart, thetastop)
-        all_maxferet = [np.max(feret) for feret in feretdiam]
+        all_maxferet = maxferet(seg_img, units)
         #calculate minferet
-        all_minferet = [np.min(feret) for feret in feretdiam]  
-        if unitLength and not embeddedpixelsize:
-            maxferet = [dt_pixel / pixelsPerunit for dt_pixel in all_maxferet]
-            minferet = [dt_pixel / pixelsPerunit for dt_pixel in all_minferet]
-        else:
-            minferet = all_minferet
-            maxferet = all_maxferet
+        all_minferet = minferet(seg_img, units)
         #calculate convex area
         all_convex = convex_area(seg_img, units)
         #calculate solidity
-        all_solidity = np.array(all_area)/np.array(all_convex)
+        all_solidity = solidity(seg_img)
         #calculate orientation
         all_orientation = orientation(seg_img)
         #calculate centroid row value
@@ -863,7 +888,7 @@ def feature_extraction(features,
         #calculate minor axis length
         all_minor_axis_length = minor_axis_length(seg_img, units)
         #calculate polygonality_score
-        all_polygon_score = [polygonality_hexagonality(area_metric, perimeter_metric, int(neighbor_metric), solidity_metric, maxferet_metric, minferet_metric) for area_metric, perimeter_metric, neighbor_metric, solidity_metric, maxferet_metric, minferet_metric in zip(all_area, all_peri, all_neighbor, all_solidity, all_maxferet, all_minferet)]#seg_img, units)
+        all_polygon_score = poly_hex_score()
         all_polygonality_score = [poly[0] for poly in all_polygon_score]
         #calculate hexagonality_score
         all_hexagonality_score = [poly[1] for poly in all_polygon_score]
@@ -1116,6 +1141,134 @@ def labeling_is_blank(label_image):
     """
     return (label_image.min()==0 and label_image.max()==0)
 
+def extract_image(label_file, intensity_files, features, options):
+    """Read one labeled image and its intensity images and extract their features.
+
+    Args:
+        label_file (Path): Path to the labeled image, None if only intensity features are extracted.
+        intensity_files (list): Paths of the intensity images, each with its channel or None.
+        features (list): List of features to be extracted.
+        options (dict): Keyword arguments of feature_extraction.
+
+    Returns:
+        Dataframe containing the features extracted and the title of the output csv file, both
+        None if the labeled image is blank.
+
+    """
+    label_image = None
+    img_emb_unit = None
+    if label_file is not None:
+        label_image,img_emb_unit = read(label_file)
+        #Skip feature calculation and saving results for an image having trivial/blank/missing segmentation
+        if labeling_is_blank(label_image):
+            return None, None
+
+    if len(intensity_files) == 0:
+        return feature_extraction(features,
+                                  channel=None,
+                                  intensity_image=None,
+                                  img_emb_unit=img_emb_unit,
+                                  label_image=label_image,
+                                  seg_file_names1=label_file,
+                                  int_file_name=None,
+                                  **options)
+
+    df = None
+    for int_file, channel in intensity_files:
+        intensity_image,img_emb_unit = read(int_file)
+        dfc,title = feature_extraction(features,
+                                       channel=channel,
+                                       intensity_image=intensity_image,
+                                       img_emb_unit=img_emb_unit,
+                                       label_image=label_image,
+                                       seg_file_names1=label_file,
+                                       int_file_name=int_file.name,
+                                       **options)
+        del intensity_image
+        if df is None:
+            df = dfc
+        else:
+            df = pd.concat([df, dfc.iloc[:,2:]], axis=1,sort=False)
+    return df, title
+
+def estimate_memory(label_file, intensity_files):
+    """Estimate the peak memory used to extract the features of one labeled image.
+
+    The sizes are read from the metadata of the images. The intensity images are read one
+    at a time, so only the largest one counts.
+
+    Args:
+        label_file (Path): Path to the labeled image, None if only intensity features are extracted.
+        intensity_files (list): Paths of the intensity images, each with its channel or None.
+
+    Returns:
+        The estimated memory in bytes.
+
+    """
+    label_bytes, intensity_bytes, pixels = 0, 0, 0
+    for file, is_label in [(label_file, True)] + [(int_file, False) for int_file, _ in intensity_files]:
+        if file is None:
+            continue
+        with BioReader(file) as br:
+            image_pixels = br.Y * br.X
+            image_bytes = image_pixels * np.dtype(br.dtype).itemsize
+        if is_label:
+            label_bytes = image_bytes
+        else:
+            intensity_bytes = max(intensity_bytes, image_bytes)
+        pixels = max(pixels, image_pixels)
+    return label_bytes + intensity_bytes + pixels * INTERMEDIATE_BYTES
+
+def get_memory_budget():
+    """Return the memory, in bytes, that may be used by the images processed at the same time."""
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+    return int(MEMORY_FRACTION * memory)
+
+def extract_images(jobs, features, options, num_workers=NUM_WORKERS, memory_budget=None):
+    """Extract features from images in parallel, one labeled image per task.
+
+    Images are started in order while at most num_workers are processed and the sum of
+    their estimated memory (see estimate_memory) fits in the memory budget. An image is
+    always started when no other image is processed, even if it does not fit. Results
+    are yielded in the order of the jobs.
+
+    Args:
+        jobs (list): Pairs of a labeled image path and intensity images as in extract_image.
+        features (list): List of features to be extracted.
+        options (dict): Keyword arguments of feature_extraction.
+        num_workers (int): Maximum number of worker processes.
+        memory_budget (int): Memory in bytes that may be used at once, defaults to
+            MEMORY_FRACTION of the physical memory.
+
+    Returns:
+        A generator of the dataframes and titles returned by extract_image.
+
+    """
+    if num_workers <= 1:
+        for label_file, intensity_files in jobs:
+            yield extract_image(label_file, intensity_files, features, options)
+        return
+
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        used = 0
+        for label_file, intensity_files in jobs:
+            estimate = estimate_memory(label_file, intensity_files)
+            while pending and (len(pending) >= num_workers or used + estimate > memory_budget):
+                future, future_estimate = pending.popleft()
+                used -= future_estimate
+                yield future.result()
+            pending.append((executor.submit(extract_image, label_file, intensity_files, features, options), estimate))
+            used += estimate
+        while pending:
+            yield pending.popleft()[0].result()
+
 # Setup the argument parsing
 def main():
     logger.info("Parsing arguments...")
@@ -1136,6 +1289,8 @@ def main():
                         help='Intensity image collection', required=False)
     parser.add_argument('--pixelDistance', dest='pixelDistance', type=int,
                         help='Pixel distance to calculate the neighbors touching cells', required=False)
+    parser.add_argument('--feretMethod', dest='feretMethod', type=str, choices=FERET_METHODS, default='sampled',
+                        help='Method to measure the feret diameters', required=False)
     parser.add_argument('--segDir', dest='segDir', type=str,
                         help='Segmented image collection', required=False)
     parser.add_argument('--outDir', dest='outDir', type=str,
@@ -1176,6 +1331,10 @@ def main():
     pixelDistance = args.pixelDistance
     logger.info('pixelDistance = {}'.format(pixelDistance))
 
+    #Method to measure the feret diameters
+    feretMethod = args.feretMethod
+    logger.info('feretMethod = {}'.format(feretMethod))
+
     #Path to labeled image directory
     segDir = args.segDir
     logger.info('segDir = {}'.format(segDir))
@@ -1186,8 +1345,6 @@ def main():
 
     logger.info("Started")
 
-    df_csv = pd.DataFrame([])
-    
     if not segDir and not intDir:
         raise ValueError('No input image specified.')
 
@@ -1215,16 +1372,12 @@ def main():
     if segDir:
         configfiles_seg = filepattern.FilePattern(segDir,pattern)
         files_seg = list(configfiles_seg())
-    else:
-        label_image = None
     
     files_int=[]
     #Get list of .ome.tif files in the directory including sub folders for intensity images
     if intDir:      
         configfiles_int = filepattern.FilePattern(intDir,pattern)
         files_int = list(configfiles_int())
-    else:
-        intensity_image = None
 
     #Check for matching filepattern
     if segDir and intDir:
@@ -1236,141 +1389,66 @@ def main():
     elif intDir and not segDir:
         if len(files_int) == 0:
             raise ValueError("Could not find intensity image files matching filepattern")
-    
+
+    #Pair every labeled image with its intensity images and their channels
+    jobs = []
     #Only intensity image as input    
     if not segDir:
         for intfile in files_int:
-            df=None
-            channel=None
-            intensity_image,img_emb_unit = read(intfile[0]['file'])
-            int_name = intfile[0]['file'].name
-            df,title = feature_extraction(features,
-                                          embeddedpixelsize,
-                                          unitLength,
-                                          pixelsPerunit,
-                                          pixelDistance,
-                                          channel,
-                                          intensity_image,
-                                          img_emb_unit,
-                                          label_image=None,
-                                          seg_file_names1=None,
-                                          int_file_name=int_name)
-            os.chdir(outDir)
-            if csvfile == 'separatecsv':
-                logger.info('Saving dataframe to csv for ' + intfile[0]['file'].name)
-                export_csv = df.to_csv(r'%s.csv'%title, index=None, header=True, encoding='utf-8-sig')
-            else:
-                df_csv = df_csv.append(df)
+            jobs.append((None, [(intfile[0]['file'], None)]))
 
-    elif segDir:   
-        #Run analysis for each labeled image in the list
+    else:
         for img_file in itertools.zip_longest(files_seg,files_int):
-            label_image,img_emb_unit = read(img_file[0][0]['file'])
-
-            #Skip feature calculation and saving results for an image having trivial/blank/missing segmentation
-            if labeling_is_blank(label_image):
-                continue;
-
-            df = None
-            files=''
-            channel=''
-            #Both intensity and labeled image passed as input
-            if intDir:
-                #Get matching files
-                files = configfiles_int.get_matching(**{k.upper():v for k,v in img_file[0][0].items() if k not in ['file','c']})
-                if files is not None:  
-                    if len(files) == 0 and(all(fe not in intensity_features for fe in features)):
-                       intensity_image=None 
-
-                    elif len(files) == 0 and(any(fe in intensity_features for fe in features)):
-                       logger.warning(f"Could not find intensity files matching label image, {img_file[0][0]['file'].name}. Skipping...")
-                       if df==None:
-                           continue
-                    else:
-                        intensity_image,img_emb_unit = read(files[0]['file'])
-                        int_filename = files[0]['file'].name
-                        
-                    #Check length of files to mention channels in output only when there is more than one channel
-                    if len(files)==1:
-                        channel = None
-
-                    for file in files:
-                        if channel != None:
-                            channel=file['c']
-                        dfc,title = feature_extraction(features,
-                                          embeddedpixelsize,
-                                          unitLength,
-                                          pixelsPerunit,
-                                          pixelDistance,
-                                          channel,
-                                          intensity_image,
-                                          img_emb_unit,
-                                          label_image,
-                                          img_file[0][0]['file'],
-                                          int_filename)
-                        if df is None:
-                            df = dfc
-                        else:
-                            df = pd.concat([df, dfc.iloc[:,2:]], axis=1,sort=False)
-
-                    if csvfile == 'singlecsv':
-                        df_csv = df_csv.append(df)
-                    
+            #Intensity images without a labeled image are matched to labeled images below
+            if img_file[0] is None:
+                continue
+            if not intDir:
+                jobs.append((img_file[0][0]['file'], []))
+                continue
+
+            #Get matching files
+            files = configfiles_int.get_matching(**{k.upper():v for k,v in img_file[0][0].items() if k not in ['file','c']})
+            if files is None:
+                if len(files_seg) != len(files_int) :
+                    raise ValueError("Number of labeled/segmented images is not equal to number of intensity images")
+                jobs.append((img_file[0][0]['file'], [(img_file[1][0]['file'], None)]))
+            elif len(files) == 0 and(all(fe not in intensity_features for fe in features)):
+                jobs.append((img_file[0][0]['file'], []))
+            elif len(files) == 0 and(any(fe in intensity_features for fe in features)):
+                logger.warning(f"Could not find intensity files matching label image, {img_file[0][0]['file'].name}. Skipping...")
+            else:
+                #Mention channels in output only when there is more than one channel
+                if len(files)==1:
+                    jobs.append((img_file[0][0]['file'], [(files[0]['file'], None)]))
                 else:
-                    if len(files_seg) != len(files_int) :
-                        raise ValueError("Number of labeled/segmented images is not equal to number of intensity images")
-                    #Read intensity image
-                    intensity_image,img_emb_unit = read(img_file[1][0]['file'])
-                    int_file = img_file[1][0]['file'].name
-                    channel=None
-                
-            #Dataframe contains the features extracted from images 
-            if not intDir or files==[] or files==None:
-                channel=None
-                int_filename = None
-                if intDir and files==None:
-                    int_filename = int_file
-                df,title = feature_extraction(features,
-                                          embeddedpixelsize,
-                                          unitLength,
-                                          pixelsPerunit,
-                                          pixelDistance,
-                                          channel,
-                                          intensity_image,
-                                          img_emb_unit,
-                                          label_image,
-                                          seg_file_names1=img_file[0][0]['file'],
-                                          int_file_name=int_filename
-                                          )
+                    jobs.append((img_file[0][0]['file'], [(file['file'], file['c']) for file in files]))
+
+    options = {'embeddedpixelsize': embeddedpixelsize,
+               'unitLength': unitLength,
+               'pixelsPerunit': pixelsPerunit,
+               'pixelDistance': pixelDistance,
+               'feretMethod': feretMethod}
+
+    #Stream the features of every image to the output as soon as they are extracted
+    #Values for all images are saved in single csv when the writer is closed
+    with (TableWriter(outDir) if csvfile == 'singlecsv' else nullcontext()) as writer:
+        for (label_file, intensity_files), (df, title) in zip(jobs, extract_images(jobs, features, options, NUM_WORKERS)):
+            if df is None:
+                continue
+            if writer is not None:
+                writer.write(df)
+                continue
 
             #Save each csv file separately
-            os.chdir(outDir)
-            
-            if csvfile == 'singlecsv' and (files ==''or files==None or files==[]):
-                 df_csv = df_csv.append(df)
-            elif csvfile == 'separatecsv':
-                if df.empty:
-                    raise ValueError('No output to save as csv files')
-                else:
-                    logger.info('Saving dataframe to csv for ' + img_file[0][0]['file'].name)
-                    df = df.loc[:,~df.columns.duplicated()]
-                    if 'touching_border' in df.columns:
-                        last_column = df.pop('touching_border')
-                        df.insert(len(df.columns), 'touching_border', last_column)
-                    export_csv = df.to_csv(r'%s.csv'%title, index=None, header=True, encoding='utf-8-sig')
-
-    #Save values for all images in single csv
-    if csvfile == 'singlecsv':
-         if df_csv.empty:
-             raise ValueError('No output to save as csv files')
-         else:
-            logger.info('Saving dataframe to csv file for all images in {}'.format(outDir))
-            df_csv.dropna(inplace=True, axis=1, how='all')
-            df_csv = df_csv.loc[:,~df_csv.columns.duplicated()]
-            if 'touching_border' in df_csv.columns:
-                last_column = df_csv.pop('touching_border')
-                df_csv.insert(len(df_csv.columns), 'touching_border', last_column)
-            export_csv = df_csv.to_csv(r'Feature_Extraction.csv', index=None, header=True, encoding='utf-8-sig')
+            if df.empty:
+                raise ValueError('No output to save as csv files')
+            name = label_file.name if label_file is not None else intensity_files[0][0].name
+            logger.info('Saving dataframe to csv for ' + name)
+            df = df.loc[:,~df.columns.duplicated()]
+            if 'touching_border' in df.columns:
+                last_column = df.pop('touching_border')
+                df.insert(len(df.columns), 'touching_border', last_column)
+            df.to_csv(os.path.join(outDir, r'%s.csv'%title), index=None, header=True, encoding='utf-8-sig')
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+from pathlib import Path
+import logging
+import shutil
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger("writer")
+logger.setLevel(logging.INFO)
+
+class TableWriter:
+    """Collect the feature tables of all images into a single csv file.
+
+    Each table is written to a Parquet part file in a temporary directory as soon as
+    it is available, so only one table is held in memory at a time. Tables may have
+    different columns. When the writer is closed, the parts are streamed into one csv
+    file with the union of all columns in order of appearance. Columns without any
+    value are dropped and the touching_border column is moved to the end.
+
+    Args:
+        out_dir (Path): Output directory.
+        filename (string): Name of the csv file.
+
+    """
+
+    def __init__(self, out_dir, filename='Feature_Extraction.csv'):
+        self.path = Path(out_dir).joinpath(filename)
+        self.num_rows = 0
+        self._columns = {}
+        self._parts = []
+        self._tmp_dir = Path(tempfile.mkdtemp(dir=out_dir))
+
+    def write(self, df):
+        """Write the feature table of an image to a new part file.
+
+        Args:
+            df (DataFrame): Feature table, duplicate columns are dropped.
+
+        """
+        df = df.loc[:, ~df.columns.duplicated()].copy()
+        for column in df.columns:
+            if df[column].dtype == object:
+                df[column] = df[column].astype('string')
+            self._columns[column] = self._columns.get(column, False) or bool(df[column].notna().any())
+
+        part = self._tmp_dir.joinpath('part-{:05d}.parquet'.format(len(self._parts)))
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), part)
+        self._parts.append(part)
+        self.num_rows += len(df)
+
+    def close(self):
+        """Write the csv file and remove the part files."""
+        try:
+            if self.num_rows == 0:
+                raise ValueError('No output to save as csv files')
+
+            columns = [column for column, has_values in self._columns.items() if has_values]
+            if 'touching_border' in columns:
+                columns.remove('touching_border')
+                columns.append('touching_border')
+
+            logger.info('Saving {} rows to {}'.format(self.num_rows, self.path))
+            with open(self.path, 'w', encoding='utf-8-sig', newline='') as fw:
+                for index, part in enumerate(self._parts):
+                    df = pq.read_table(part).to_pandas().reindex(columns=columns)
+                    df.to_csv(fw, index=None, header=index == 0)
+        finally:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
@@ -0,0 +1,22 @@
+from unittest import TestSuite
+from .feret_test import FeretTest
+from .intermediate_test import IntermediateTest
+from .neighbors_test import NeighborsTest
+from .read_test import ReadTest
+from .writer_test import WriterTest
+
+test_cases = (
+    FeretTest,
+    IntermediateTest,
+    NeighborsTest,
+    ReadTest,
+    WriterTest,
+)
+
+
+def load_tests(loader, tests, pattern):
+    suite = TestSuite()
+    for test_class in test_cases:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    return suite
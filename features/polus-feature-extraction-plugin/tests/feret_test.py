@@ -0,0 +1,100 @@
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+from scipy.spatial import ConvexHull
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+import main
+
+
+def pixel_corners(mask):
+    """All corners of the pixels of a mask as x,y points."""
+    rows, cols = np.nonzero(mask)
+    corners = [np.c_[cols + dx, rows + dy] for dx in (0, 1) for dy in (0, 1)]
+    return np.unique(np.concatenate(corners), axis=0).astype(np.float64)
+
+
+def brute_force_feret(mask):
+    """Feret diameters from every pair of hull vertices and every hull edge."""
+    points = pixel_corners(mask)
+    hull = points[ConvexHull(points).vertices]
+    maxferet = np.sqrt(((hull[:, None] - hull[None]) ** 2).sum(axis=2)).max()
+    widths = []
+    for a, b in zip(hull, np.roll(hull, -1, axis=0)):
+        edge = b - a
+        distance = np.abs(edge[0] * (points[:, 1] - a[1]) - edge[1] * (points[:, 0] - a[0]))
+        widths.append(distance.max() / np.hypot(*edge))
+    return maxferet, min(widths)
+
+
+def make_shapes():
+    """Label image with a pixel, a rectangle, an ellipse, a polygon and a disc."""
+    image = np.zeros((120, 160), dtype=np.uint16)
+    image[3, 3] = 1
+    image[10:17, 5:30] = 2
+    cv2.ellipse(image, (60, 30), (25, 9), 33, 0, 360, 3, -1)
+    cv2.fillPoly(image, [np.array([[110, 5], [150, 20], [140, 55], [100, 40]], dtype=np.int32)], 4)
+    cv2.circle(image, (50, 85), 28, 5, -1)
+    image[70:110, 100:104] = 6
+    image[100:104, 100:150] = 6
+    return image
+
+
+class FeretTest(unittest.TestCase):
+
+    def test_convex_hulls(self):
+        image = make_shapes()
+        objects, sizes, x, y = main.convex_hulls(image)
+        np.testing.assert_array_equal(objects, np.arange(1, 7))
+
+        start = np.cumsum(sizes) - sizes
+        for label, first, size in zip(objects, start, sizes):
+            points = pixel_corners(image == label)
+            expected = points[ConvexHull(points).vertices]
+            hull = np.c_[x[first:first + size], y[first:first + size]]
+            self.assertEqual(
+                sorted(map(tuple, hull.tolist())),
+                sorted(map(tuple, expected.tolist())))
+
+    def test_feret_diameter(self):
+        image = make_shapes()
+        labels = [6, 1, 3, 5, 2, 4]
+        maxferet, minferet = main.feret_diameter(image, labels, 'calipers')
+        for label, max_diameter, min_diameter in zip(labels, maxferet, minferet):
+            expected_max, expected_min = brute_force_feret(image == label)
+            self.assertAlmostEqual(max_diameter, expected_max)
+            self.assertAlmostEqual(min_diameter, expected_min)
+
+        self.assertAlmostEqual(maxferet[1], np.sqrt(2))
+        self.assertAlmostEqual(minferet[1], 1)
+        self.assertAlmostEqual(minferet[4], 7)
+
+    def test_random_shapes(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            image = np.zeros((64, 64), dtype=np.uint16)
+            for label in range(1, 5):
+                points = rng.integers(0, 64, (rng.integers(3, 7), 2)).astype(np.int32)
+                cv2.fillPoly(image, [points], label)
+            labels = np.unique(image)[1:].tolist()
+            maxferet, minferet = main.feret_diameter(image, labels, 'calipers')
+            for label, max_diameter, min_diameter in zip(labels, maxferet, minferet):
+                expected_max, expected_min = brute_force_feret(image == label)
+                self.assertAlmostEqual(max_diameter, expected_max)
+                self.assertAlmostEqual(min_diameter, expected_min)
+
+    def test_sampled_bounds(self):
+        image = make_shapes()
+        labels = np.arange(1, 7).tolist()
+        maxferet, minferet = main.feret_diameter(image, labels, 'calipers')
+        sampled_max, sampled_min = main.feret_diameter(image, labels)
+        self.assertTrue(np.all(np.array(sampled_max) <= np.array(maxferet) + 1e-9))
+        self.assertTrue(np.all(np.array(sampled_min) >= np.array(minferet) - 1e-9))
+
+
+if __name__ == '__main__':
+    unittest.main()
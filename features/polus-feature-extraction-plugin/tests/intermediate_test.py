@@ -0,0 +1,113 @@
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from skimage import data
+from skimage import measure
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+import main
+
+#Features computed by 'all' and the names of their columns
+ALL_FEATURES = {
+    'area': 'area_pixels',
+    'centroid_x': 'centroid_x',
+    'centroid_y': 'centroid_y',
+    'bbox_xmin': 'bbox_xmin',
+    'bbox_ymin': 'bbox_ymin',
+    'bbox_width': 'bbox_width',
+    'bbox_height': 'bbox_height',
+    'major_axis_length': 'major_axis_length_pixels',
+    'minor_axis_length': 'minor_axis_length_pixels',
+    'eccentricity': 'eccentricity',
+    'orientation': 'orientation',
+    'convex_area': 'convex_area_pixels',
+    'euler_number': 'euler_number',
+    'equivalent_diameter': 'equivalent_diameter_pixels',
+    'solidity': 'solidity',
+    'perimeter': 'perimeter_pixels',
+    'maxferet': 'maxferet_pixels',
+    'minferet': 'minferet_pixels',
+    'neighbors': 'neighbors',
+    'polygonality_score': 'polygonality_score',
+    'hexagonality_score': 'hexagonality_score',
+    'hexagonality_sd': 'hexagonality_sd',
+    'kurtosis': 'kurtosis',
+    'max_intensity': 'maximum_intensity',
+    'mean_intensity': 'mean_intensity',
+    'median': 'median',
+    'min_intensity': 'minimum_intensity',
+    'mode': 'mode',
+    'standard_deviation': 'standard_deviation',
+    'skewness': 'skewness',
+}
+
+
+#Columns that are written for every feature list
+INFO_COLUMNS = ['mask_image', 'intensity_image', 'label', 'touching_border']
+
+
+def feature_column(df):
+    """The only feature column of a dataframe extracted for a single feature."""
+    columns = df.columns.drop(INFO_COLUMNS)
+    assert len(columns) == 1
+    return columns[0]
+
+
+class IntermediateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.label_image = measure.label(data.binary_blobs(256, 0.08, 2, 0.3, 0)).astype(np.uint16)
+        rng = np.random.default_rng(0)
+        self.intensity_image = rng.integers(0, 1000, self.label_image.shape).astype(np.uint16)
+
+    def extract(self, features):
+        df, title = main.feature_extraction(list(features),
+                                            embeddedpixelsize=None,
+                                            unitLength=None,
+                                            pixelsPerunit=None,
+                                            pixelDistance=None,
+                                            channel=None,
+                                            intensity_image=self.intensity_image,
+                                            img_emb_unit=None,
+                                            label_image=self.label_image,
+                                            seg_file_names1=Path('label.ome.tif'),
+                                            int_file_name='intensity.ome.tif')
+        return df
+
+    def test_all(self):
+        all_df = self.extract(['all'])
+        for feature, column in ALL_FEATURES.items():
+            with self.subTest(feature=feature):
+                df = self.extract([feature])
+                #The columns of all are objects
+                pd.testing.assert_series_equal(all_df[column], df[feature_column(df)],
+                                               check_names=False, check_dtype=False)
+
+    def test_shared_once(self):
+        #Every intermediate is computed once per image, however many features use it
+        features = ['maxferet', 'minferet', 'neighbors', 'polygonality_score', 'hexagonality_score', 'hexagonality_sd']
+        with mock.patch.object(main, 'feret_diameter', wraps=main.feret_diameter) as feret_diameter, \
+                mock.patch.object(main, 'neighbors_find', wraps=main.neighbors_find) as neighbors_find:
+            combined = self.extract(features)
+            self.assertEqual(feret_diameter.call_count, 1)
+            self.assertEqual(neighbors_find.call_count, 1)
+
+            self.extract(['all'])
+            self.assertEqual(feret_diameter.call_count, 2)
+            self.assertEqual(neighbors_find.call_count, 2)
+
+        for feature in features:
+            with self.subTest(feature=feature):
+                df = self.extract([feature])
+                column = feature_column(df)
+                pd.testing.assert_series_equal(combined[column], df[column])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+from scipy import ndimage
+from skimage import data
+from skimage import measure
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+import main
+
+
+def dilated_neighbors(lbl_img, labels, pixeldistance):
+    """Number of other objects under the dilation of each object by a square of 2d+1 pixels."""
+    window = np.ones((2 * pixeldistance + 1, 2 * pixeldistance + 1), dtype=bool)
+    counts = []
+    for label in labels:
+        dilated = ndimage.binary_dilation(lbl_img == label, structure=window)
+        found = np.unique(lbl_img[dilated])
+        counts.append(int(np.count_nonzero((found != 0) & (found != label))))
+    return counts
+
+
+class NeighborsTest(unittest.TestCase):
+
+    def setUp(self):
+        #Blobs, some of which touch the border of the image
+        blobs = data.binary_blobs(256, 0.08, 2, 0.3, 0)
+        self.blobs = measure.label(blobs).astype(np.uint32)
+
+        #Objects touching the border and each other, and an object inside a hole of another
+        image = np.zeros((40, 50), dtype=np.uint16)
+        image[0:10, 0:10] = 1
+        image[0:10, 11:20] = 2
+        image[12:30, 0:4] = 3
+        image[20:40, 30:50] = 4
+        image[25:35, 35:45] = 0
+        image[28:32, 38:42] = 5
+        image[38:40, 0:3] = 6
+        self.shapes = image
+
+    def test_neighbors(self):
+        for lbl_img in (self.blobs, self.shapes):
+            labels = np.unique(lbl_img)[1:].tolist()
+            self.assertTrue(lbl_img[[0, -1], :].any() and lbl_img[:, [0, -1]].any())
+            for pixeldistance in (1, 2, 3, 5, 8):
+                with self.subTest(shape=lbl_img.shape, pixeldistance=pixeldistance):
+                    self.assertEqual(main.neighbors_find(lbl_img, labels, pixeldistance),
+                                     dilated_neighbors(lbl_img, labels, pixeldistance))
+
+    def test_shapes(self):
+        #Objects 1 and 2 are 2 pixels apart (columns 9 and 11), 1 and 3 are 3 pixels apart,
+        #5 is 4 pixels from the hole in 4, and 3 and 6 are 9 pixels apart
+        labels = [1, 2, 3, 4, 5, 6]
+        self.assertEqual(main.neighbors_find(self.shapes, labels, 1), [0, 0, 0, 0, 0, 0])
+        self.assertEqual(main.neighbors_find(self.shapes, labels, 2), [1, 1, 0, 0, 0, 0])
+        self.assertEqual(main.neighbors_find(self.shapes, labels, 3), [2, 1, 1, 0, 0, 0])
+        self.assertEqual(main.neighbors_find(self.shapes, labels, 10), [2, 2, 3, 1, 1, 1])
+
+    def test_missing_labels(self):
+        self.assertEqual(main.neighbors_find(self.shapes, [7, 1], 2), [0, 1])
+        self.assertEqual(main.neighbors_find(np.zeros((5, 5), dtype=np.uint8), [1], 2), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
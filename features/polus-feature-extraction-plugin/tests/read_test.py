@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from bfio import BioWriter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+import main
+
+
+def write_image(path, image):
+    """Write a y,x or y,x,c array to an .ome.tif file."""
+    image = image.reshape(image.shape[0], image.shape[1], 1, -1, 1)
+    with BioWriter(path, X=image.shape[1], Y=image.shape[0], C=image.shape[3], dtype=image.dtype) as bw:
+        bw[:] = image
+
+
+class ReadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name)
+        rng = np.random.default_rng(0)
+
+        self.label_images = []
+        for i in range(3):
+            label_image = np.zeros((300, 200), dtype=np.uint16)
+            label_image[20:90, 30:60 + 20 * i] = 1
+            label_image[150:280, 100:190] = 2
+            label_image[100:105, 10:15 + i] = 3
+            write_image(self.path.joinpath('label_{}.ome.tif'.format(i)), label_image)
+            self.label_images.append(label_image)
+
+        self.intensity_image = rng.integers(0, 1000, (300, 200, 3)).astype(np.uint16)
+        write_image(self.path.joinpath('intensity.ome.tif'), self.intensity_image)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_read_first_channel(self):
+        image, unit = main.read(self.path.joinpath('intensity.ome.tif'))
+        self.assertEqual(image.shape, (300, 200))
+        np.testing.assert_array_equal(image, self.intensity_image[:, :, 0])
+
+        image, unit = main.read(self.path.joinpath('label_1.ome.tif'))
+        np.testing.assert_array_equal(image, self.label_images[1])
+
+    def test_extract_images(self):
+        jobs = [(self.path.joinpath('label_{}.ome.tif'.format(i)),
+                 [(self.path.joinpath('intensity.ome.tif'), None)])
+                for i in range(3)]
+        features = ['area', 'maxferet', 'neighbors', 'mean_intensity']
+        options = {'embeddedpixelsize': None,
+                   'unitLength': None,
+                   'pixelsPerunit': None,
+                   'pixelDistance': None,
+                   'feretMethod': 'sampled'}
+
+        serial = list(main.extract_images(jobs, features, options, num_workers=1))
+        self.assertEqual(len(serial), 3)
+        for i, (df, title) in enumerate(serial):
+            np.testing.assert_array_equal(df['area_pixels'], [70 * (30 + 20 * i), 90 * 130, 5 * (5 + i)])
+
+        #A budget that fits a single image processes the images one at a time
+        for memory_budget in (1, 2 ** 40):
+            pooled = list(main.extract_images(jobs, features, options, num_workers=2, memory_budget=memory_budget))
+            self.assertEqual(len(pooled), 3)
+            for (df, title), (pooled_df, pooled_title) in zip(serial, pooled):
+                self.assertEqual(title, pooled_title)
+                pd.testing.assert_frame_equal(df, pooled_df)
+
+    def test_estimate_memory(self):
+        label_file = self.path.joinpath('label_0.ome.tif')
+        intensity_file = self.path.joinpath('intensity.ome.tif')
+        pixels = 300 * 200
+
+        self.assertEqual(main.estimate_memory(label_file, []), pixels * (2 + main.INTERMEDIATE_BYTES))
+        self.assertEqual(main.estimate_memory(None, [(intensity_file, None)]), pixels * (2 + main.INTERMEDIATE_BYTES))
+        #Intensity images are read one at a time
+        self.assertEqual(main.estimate_memory(label_file, [(intensity_file, 1), (intensity_file, 2)]),
+                         pixels * (2 + 2 + main.INTERMEDIATE_BYTES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+from writer import TableWriter
+
+
+class WriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.out_dir = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_union_of_columns(self):
+        first = pd.DataFrame({'Image': ['a', 'a'], 'label': [1, 2],
+                              'touching_border': [True, False], 'area': [10, 20],
+                              'empty': [None, None]})
+        second = pd.DataFrame({'Image': ['b'], 'label': [1], 'area': [30],
+                               'perimeter': [4.5], 'touching_border': [False]})
+        duplicated = pd.concat([second, second[['area']]], axis=1)
+
+        with TableWriter(self.out_dir) as writer:
+            writer.write(first)
+            writer.write(duplicated)
+            self.assertEqual(writer.num_rows, 3)
+
+        df = pd.read_csv(self.out_dir.joinpath('Feature_Extraction.csv'), encoding='utf-8-sig')
+        self.assertEqual(list(df.columns), ['Image', 'label', 'area', 'perimeter', 'touching_border'])
+        self.assertEqual(df['Image'].tolist(), ['a', 'a', 'b'])
+        self.assertEqual(df['area'].tolist(), [10, 20, 30])
+        self.assertTrue(df['perimeter'].isna()[:2].all())
+        self.assertEqual(df['perimeter'][2], 4.5)
+        self.assertEqual(os.listdir(self.out_dir), ['Feature_Extraction.csv'])
+
+    def test_no_rows(self):
+        writer = TableWriter(self.out_dir)
+        with self.assertRaises(ValueError):
+            writer.close()
+        self.assertEqual(os.listdir(self.out_dir), [])
+
+    def test_error_removes_parts(self):
+        with self.assertRaises(KeyError):
+            with TableWriter(self.out_dir) as writer:
+                writer.write(pd.DataFrame({'label': [1]}))
+                raise KeyError()
+        self.assertEqual(os.listdir(self.out_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
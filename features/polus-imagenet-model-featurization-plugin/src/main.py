@@ -1,9 +1,15 @@
 import re, sys, os
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from tqdm import tqdm
 import tensorflow as tf
 import argparse, logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from multiprocessing import cpu_count
 from skimage import transform
 from bfio import BioReader
 
@@ -24,6 +30,10 @@ valid_models =  [
     'DenseNet201'
 ]
 
+valid_formats = ['csv', 'parquet']
+
+logger = logging.getLogger('main')
+
 
 def get_imagenet_model(model):
     model_method = getattr(tf.keras.applications, model)
@@ -52,11 +62,187 @@ def load_img(image_path, target_size=None):
     return img
 
 
+def prefetch_images(image_files, target_size=None, num_workers=cpu_count(), depth=None):
+    """ Load and resize images in worker threads, yielding them in order.
+
+    At most `depth` images are decoded ahead of the consumer, which bounds
+    the memory used by the pipeline.
+
+    Args:
+        image_files (list): Paths of the images to load
+        target_size (tuple): Resolution to which the images are scaled
+        num_workers (int): Number of decoding threads
+        depth (int): Maximum number of images decoded ahead of the consumer
+
+    Yields:
+        (str, numpy.ndarray): Path of the image and its data, or None if the
+            image could not be loaded
+    """
+    if depth is None:
+        depth = 2 * num_workers
+    files = iter(image_files)
+    with ThreadPoolExecutor(num_workers) as executor:
+        pending = deque((f, executor.submit(load_img, f, target_size))
+                        for f in islice(files, depth))
+        while pending:
+            image, future = pending.popleft()
+            for f in islice(files, 1):
+                pending.append((f, executor.submit(load_img, f, target_size)))
+            yield image, future.result()
+
+
+def batch_images(images, batch_size):
+    """ Group decoded images into batches of images with the same shape.
+
+    Batches hold `batch_size` images, except when an image with a different
+    shape arrives, in which case the current batch is emitted early.
+
+    Args:
+        images (iterable): (path, image data) pairs
+        batch_size (int): Number of images in a full batch
+
+    Yields:
+        (list, numpy.ndarray): Paths and stacked image data of a batch
+    """
+    names, batch = [], []
+    for image, image_data in images:
+        if image_data is None:
+            raise ValueError(f'Unable to load image: {image}!')
+        if batch and (len(batch) == batch_size or image_data.shape != batch[0].shape):
+            yield names, np.stack(batch)
+            names, batch = [], []
+        names.append(image)
+        batch.append(image_data.astype(np.float32))
+    if batch:
+        yield names, np.stack(batch)
+
+
+class FeatureWriter:
+    """ Stream features to the output directory as they are computed.
+
+    Features are appended to ``features.csv``, or written as one Parquet part
+    file per flushed batch group (``features-00000.parquet``, ...), which
+    together form a single Parquet dataset. Files that already have features
+    in the output are reported by :meth:`completed` so that an interrupted
+    run can be resumed. A row left incomplete by an interrupted run is
+    removed from ``features.csv`` before any new rows are appended, and
+    Parquet parts are written under a temporary name and renamed once
+    complete.
+
+    Args:
+        output_dir (str): Output directory
+        out_format (str): One of ``valid_formats``
+        rows_per_file (int): Number of rows written to each Parquet file
+    """
+
+    def __init__(self, output_dir, out_format='csv', rows_per_file=10000):
+        self.output_dir = output_dir
+        self.out_format = out_format
+        self.rows_per_file = rows_per_file
+        self._names = []
+        self._features = []
+        self._part = max((int(part[9:-8]) for part in self._parts()), default=-1) + 1
+        if out_format == 'csv':
+            self._truncate_partial_row()
+
+    def _parts(self):
+        return sorted(f for f in os.listdir(self.output_dir)
+                      if re.fullmatch(r'features-\d+\.parquet', f))
+
+    def _truncate_partial_row(self):
+        """ Remove anything written after the last newline of ``features.csv``. """
+        if not os.path.exists(self._csv_path):
+            return
+        with open(self._csv_path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                block = min(position, 65536)
+                f.seek(position - block)
+                newline = f.read(block).rfind(b'\n')
+                if newline >= 0:
+                    position -= block - newline - 1
+                    break
+                position -= block
+            if position < end:
+                logger.info('Removing an incomplete row from {}'.format(self._csv_path))
+                f.truncate(position)
+
+    @property
+    def _csv_path(self):
+        return os.path.join(self.output_dir, 'features.csv')
+
+    def completed(self):
+        """ Names of the files that were already featurized. """
+        if self.out_format == 'parquet':
+            return set(f for part in self._parts()
+                       for f in pq.read_table(os.path.join(self.output_dir, part),
+                                              columns=['file']).column('file').to_pylist())
+        if os.path.exists(self._csv_path) and os.path.getsize(self._csv_path) > 0:
+            return set(pd.read_csv(self._csv_path, usecols=['file'])['file'])
+        return set()
+
+    def write(self, names, features):
+        """ Buffer the features of a batch, flushing full Parquet files. """
+        self._names.extend(os.path.basename(n) for n in names)
+        self._features.append(features)
+        if self.out_format == 'csv' or len(self._names) >= self.rows_per_file:
+            self.flush()
+
+    def flush(self):
+        """ Write all buffered features. """
+        if not self._names:
+            return
+        features = np.concatenate(self._features)
+        columns = [str(c) for c in range(features.shape[1])]
+
+        if self.out_format == 'parquet':
+            table = pa.Table.from_arrays(
+                [pa.array(self._names)] + [pa.array(features[:, c]) for c in range(features.shape[1])],
+                names=['file'] + columns)
+            path = os.path.join(self.output_dir, f'features-{self._part:05d}.parquet')
+            pq.write_table(table, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            self._part += 1
+        else:
+            df = pd.DataFrame(data=features, columns=columns)
+            df.insert(0, 'file', self._names)
+            header = not os.path.exists(self._csv_path) or os.path.getsize(self._csv_path) == 0
+            df.to_csv(self._csv_path, mode='a', header=header, index=False)
+
+        self._names = []
+        self._features = []
+
+
+def featurize(imagenet_model, image_files, writer, target_size=None,
+              batch_size=32, num_workers=cpu_count()):
+    """ Featurize images with a decode, batch, predict and write pipeline.
+
+    Images are loaded and resized by a pool of worker threads while the model
+    runs on fixed-size batches, and features are streamed to the writer after
+    every batch.
+
+    Args:
+        imagenet_model (tf.keras.Model): Featurization model
+        image_files (list): Paths of the images to featurize
+        writer (FeatureWriter): Output writer
+        target_size (tuple): Resolution to which the images are scaled
+        batch_size (int): Number of images per model call
+        num_workers (int): Number of decoding threads
+    """
+    images = prefetch_images(image_files, target_size, num_workers,
+                             depth=batch_size + num_workers)
+    with tqdm(total=len(image_files)) as progress:
+        for names, batch in batch_images(images, batch_size):
+            writer.write(names, imagenet_model.predict_on_batch(batch))
+            progress.update(len(names))
+    writer.flush()
+
+
 if __name__=='__main__':
     # Initialize the logger
     logging.basicConfig(format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s',
                         datefmt='%d-%b-%y %H:%M:%S')
-    logger = logging.getLogger('main')
     logger.setLevel(logging.INFO)
 
     ''' Argument parsing '''
@@ -70,6 +256,10 @@ if __name__=='__main__':
                         help='Pre-trained ImageNet model to use for featurization', required=True)
     parser.add_argument('--resolution', dest='resolution', type=str,
                         help='Resolution to which the input images are scaled', required=False)
+    parser.add_argument('--batchSize', dest='batchSize', type=int, default=32,
+                        help='Number of images featurized in each model call', required=False)
+    parser.add_argument('--outFormat', dest='outFormat', type=str, default='csv',
+                        help='Output format of the features: csv or parquet', required=False)
     # Output arguments
     parser.add_argument('--outDir', dest='outDir', type=str,
                         help='Output collection', required=True)
@@ -90,6 +280,12 @@ if __name__=='__main__':
     resolution = args.resolution
     logger.info('resolution = {}'.format(resolution))
 
+    batch_size = args.batchSize
+    logger.info('batchSize = {}'.format(batch_size))
+
+    out_format = args.outFormat
+    logger.info('outFormat = {}'.format(out_format))
+
     output_dir = args.outDir
     logger.info('outDir = {}'.format(output_dir))
 
@@ -108,6 +304,11 @@ if __name__=='__main__':
         target_size = (int(match.group(1)), int(match.group(2)))
         logger.info(f'Parsed resolution: {target_size[0]}x{target_size[1]}.')
 
+    # Validate output format.
+    if out_format not in valid_formats:
+        logger.error(f'Output format must be one of the following: {", ".join(valid_formats)}. You entered: {out_format}.')
+        sys.exit()
+
     # Validate model. 
     if model not in valid_models:
         logger.error(f'You requested model {model}. Model must be one of the following: {", ".join(valid_models)}.')
@@ -125,25 +326,18 @@ if __name__=='__main__':
                    for file in files 
                    if os.path.isfile(os.path.join(dirpath, file)) and file.endswith('.ome.tif')]
 
-    # Pre-allocate numpy array. 
-    feat_dim = imagenet_model.layers[-1].output_shape[-1]
-    feat_arr = np.zeros(shape=(len(image_files), feat_dim))
-
-    # Loop through images and process.
-    for i, image in enumerate(tqdm(image_files)):
-        image_data = load_img(image, target_size=target_size)
-        if image_data is None:
-            logger.error(f'Unable to load image: {image}!')
-            sys.exit()
-
-        image_data = np.expand_dims(image_data, axis=0)
-        
-        # Featurize.
-        image_feats = imagenet_model.predict(image_data)[0]
-        feat_arr[i, :] = image_feats
+    # Skip images featurized by a previous run.
+    writer = FeatureWriter(output_dir, out_format)
+    completed = writer.completed()
+    if completed:
+        logger.info(f'Skipping {len(completed)} images that were already featurized.')
+        image_files = [image for image in image_files
+                       if os.path.basename(image) not in completed]
 
-    # Create dataframe.
-    df = pd.DataFrame(data=feat_arr, columns=np.arange(feat_dim))
-    df.insert(0, 'file', [os.path.basename(image) for image in image_files])
-
-    df.to_csv(os.path.join(output_dir, 'features.csv'), index=False)
\ No newline at end of file
+    # Featurize.
+    try:
+        featurize(imagenet_model, image_files, writer, target_size=target_size,
+                  batch_size=batch_size)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit()
@@ -0,0 +1,14 @@
+from unittest import TestSuite
+from .writer_test import WriterTest
+
+test_cases = (
+    WriterTest,
+)
+
+
+def load_tests(loader, tests, pattern):
+    suite = TestSuite()
+    for test_class in test_cases:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    return suite
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from bfio import BioWriter
+
+from src.main import FeatureWriter
+from src.main import featurize
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeModel:
+    """ Stands in for the Keras model, stopping after a number of batches. """
+
+    def __init__(self, max_batches=None):
+        self.max_batches = max_batches
+        self.batches = 0
+
+    def predict_on_batch(self, batch):
+        if self.max_batches is not None and self.batches == self.max_batches:
+            raise Interrupted()
+        self.batches += 1
+        return batch.reshape(batch.shape[0], -1, 3).mean(axis=1)
+
+
+class WriterTest(unittest.TestCase):
+    num_images = 10
+    batch_size = 2
+
+    def setUp(self):
+        self.input_dir = tempfile.TemporaryDirectory()
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.image_files = []
+        for i in range(self.num_images):
+            path = os.path.join(self.input_dir.name, f'image_{i}.ome.tif')
+            with BioWriter(path, X=16, Y=16, dtype=np.uint8) as bw:
+                bw[:] = np.full((16, 16), i, dtype=np.uint8)
+            self.image_files.append(path)
+
+    def tearDown(self):
+        self.input_dir.cleanup()
+        self.output_dir.cleanup()
+
+    def run_features(self, out_format, max_batches=None, rows_per_file=10000):
+        writer = FeatureWriter(self.output_dir.name, out_format, rows_per_file)
+        completed = writer.completed()
+        image_files = [f for f in self.image_files
+                       if os.path.basename(f) not in completed]
+        featurize(FakeModel(max_batches), image_files, writer,
+                  batch_size=self.batch_size, num_workers=2)
+
+    def check_features(self, df):
+        expected = [os.path.basename(f) for f in self.image_files]
+        self.assertEqual(sorted(df['file']), sorted(expected))
+        for _, row in df.iterrows():
+            value = int(row['file'][6:-8])
+            np.testing.assert_allclose(row[['0', '1', '2']].astype(float), value)
+
+    def test_resume_csv(self):
+        with self.assertRaises(Interrupted):
+            self.run_features('csv', max_batches=2)
+
+        # A kill during a write leaves a row without its newline
+        csv_path = os.path.join(self.output_dir.name, 'features.csv')
+        with open(csv_path, 'a') as f:
+            f.write('image_9.ome.tif,9.0,9.')
+
+        writer = FeatureWriter(self.output_dir.name, 'csv')
+        self.assertEqual(len(writer.completed()), 2 * self.batch_size)
+
+        self.run_features('csv')
+        self.check_features(pd.read_csv(csv_path))
+
+    def test_resume_parquet(self):
+        with self.assertRaises(Interrupted):
+            self.run_features('parquet', max_batches=3, rows_per_file=2)
+
+        # Leave a gap in the numbering of the parts, and an unfinished part
+        os.remove(os.path.join(self.output_dir.name, 'features-00001.parquet'))
+        with open(os.path.join(self.output_dir.name, 'features-00003.parquet.tmp'), 'wb') as f:
+            f.write(b'PAR1')
+
+        writer = FeatureWriter(self.output_dir.name, 'parquet')
+        self.assertEqual(len(writer.completed()), 2 * self.batch_size)
+        self.assertEqual(writer._part, 3)
+
+        self.run_features('parquet', rows_per_file=2)
+        parts = sorted(f for f in os.listdir(self.output_dir.name) if f.endswith('.parquet'))
+        self.assertEqual(len(parts), 5)
+        df = pd.concat(pq.read_table(os.path.join(self.output_dir.name, part)).to_pandas()
+                       for part in parts)
+        self.check_features(df)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Benchmark the spectral eigensolvers on meshes of increasing size.
+
+Meshes are generated from ellipsoids with a bumpy surface. For every mesh and
+solver the time per ROI and the largest relative deviation of the eigenvalues
+from the shift-invert solver are reported.
+
+Run from the plugin root:
+
+    python benches/bench_solvers.py --radii 10 20 40 --solvers shift-invert lobpcg-ilu
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from skimage import measure
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+import mesh
+import solvers
+
+logging.basicConfig(format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s',
+                    datefmt='%d-%b-%y %H:%M:%S')
+logger = logging.getLogger('bench_solvers')
+logger.setLevel(logging.INFO)
+
+
+def make_mesh(radius: int):
+    """ Mesh a bumpy ellipsoid with the given major radius. """
+    size = 2 * radius + 4
+    z, y, x = (np.mgrid[0:size, 0:size, 0:size] - size / 2) / radius
+    r = np.sqrt(x**2 + (y / 0.8)**2 + (z / 0.6)**2)
+    bumps = 0.05 * np.sin(6 * np.arctan2(y, x)) * np.cos(4 * z)
+    verts, faces, _, _ = measure.marching_cubes((r < 1 + bumps).astype(np.uint8), 0, allow_degenerate=False)
+    return verts, faces
+
+
+def main() -> None:
+    """ Time every solver on every mesh size. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--radii', type=int, nargs='+', default=[10, 20, 40, 80])
+    parser.add_argument('--solvers', type=str, nargs='+', default=list(solvers.SOLVERS))
+    parser.add_argument('--features', type=int, default=50)
+    args = parser.parse_args()
+
+    logger.info(f"{'vertices':>10} {'solver':>14} {'seconds':>10} {'max rel err':>12}")
+    for radius in args.radii:
+        verts, faces = make_mesh(radius)
+        reference = None
+        for solver in ['shift-invert'] + [s for s in args.solvers if s != 'shift-invert']:
+            if solver == 'dense' and verts.shape[0] > 5000:
+                continue
+            start = time.perf_counter()
+            try:
+                eigvals = mesh.mesh_spectral_features(verts, faces, k=args.features, solver=solver)
+            except ImportError as e:
+                logger.info(f'{verts.shape[0]:>10} {solver:>14} skipped: {e}')
+                continue
+            elapsed = time.perf_counter() - start
+            if reference is None:
+                reference = eigvals
+            error = np.max(np.abs(eigvals - reference) / reference)
+            logger.info(f'{verts.shape[0]:>10} {solver:>14} {elapsed:>10.3f} {error:>12.2e}')
+
+
+if __name__ == '__main__':
+    main()
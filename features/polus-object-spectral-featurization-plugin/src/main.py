@@ -1,7 +1,7 @@
 import os
+import csv
 import mesh
 import numpy as np
-import pandas as pd
 import argparse, logging
 from pathlib import Path
 from bfio import BioReader
@@ -27,6 +27,8 @@ if __name__=='__main__':
                         help='Calculate scale invariant features.', default='False', required=False)
     parser.add_argument('--limitMeshSize', dest='limitMeshSize', type=int,
                         help='Maximum number of mesh faces', default=None, required=False)
+    parser.add_argument('--solver', dest='solver', type=str,
+                        help='Eigensolver used for large meshes.', default='shift-invert', required=False)
     # Output arguments
     parser.add_argument('--outDir', dest='outDir', type=str,
                         help='Output collection', required=True)
@@ -47,6 +49,9 @@ if __name__=='__main__':
 
     limitMeshSize = args.limitMeshSize
     logger.info(f'limitMeshSize = {limitMeshSize}')
+
+    solver = args.solver
+    logger.info(f'solver = {solver}')
     
     outDir = args.outDir
     logger.info('outDir = {}'.format(outDir))
@@ -61,11 +66,9 @@ if __name__=='__main__':
         
         logger.info(f'Processing image ({i + 1}/{len(inpDir_files)}): {f}') 
 
-        labels, features = mesh.mesh_and_featurize_image(br, num_features=numFeatures, scale_invariant=scaleInvariant, limit_mesh_size=limitMeshSize)
-
-        df = pd.DataFrame(data=labels, columns=['Label'])
-        df_data = pd.DataFrame(data=features, columns=np.arange(numFeatures).tolist())
-
-        df = pd.concat([df, df_data], axis=1)
-
-        df.to_csv(os.path.join(outDir, f'{os.path.splitext(f)[0]}.csv'), index=False)
\ No newline at end of file
+        # Features are written as each ROI finishes, in label order
+        with open(os.path.join(outDir, f'{os.path.splitext(f)[0]}.csv'), 'w', newline='') as fw:
+            writer = csv.writer(fw)
+            writer.writerow(['Label'] + np.arange(numFeatures).tolist())
+            for label, features in mesh.featurize_image(br, num_features=numFeatures, scale_invariant=scaleInvariant, limit_mesh_size=limitMeshSize, solver=solver):
+                writer.writerow([label] + features.tolist())
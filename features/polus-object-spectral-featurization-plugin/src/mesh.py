@@ -1,9 +1,14 @@
+import os
 import scipy 
 import logging
 import trimesh
+import solvers
 import numpy as np
-from typing import Tuple, List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, Tuple, List
 from bfio import BioReader
+from scipy import ndimage
 from skimage import measure
 
 
@@ -12,26 +17,31 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 logger = logging.getLogger('mesh')
 logger.setLevel(logging.INFO)
 
+# Number of processes used to mesh and featurize ROIs
+NUM_WORKERS = max(1, os.cpu_count() // 2)
+
 
 def mesh_spectral_features(
     vertices: np.ndarray, 
     faces: np.ndarray, 
     k: int = 50, 
-    scale_invariant: bool = False) -> np.ndarray:
+    scale_invariant: bool = False,
+    solver: str = 'shift-invert') -> np.ndarray:
     """ Generate spectral features for a mesh, given mesh vertices and faces. 
 
     A triangular mesh, described by vertices and faces, is featurized using the 
     Laplace-Beltrami eigenvalues of the graph Laplacian of the geometry. The featurization 
     can be scale invariant if desired. The user can request a specific number of 
-    features. The algorithm attempts to iteratively identify the top `k` non-zero 
-    eigenvalues. If the graph is singular, it will be perturbed, and this may 
-    introduce artifacts in the final result. 
+    features. The `k` smallest non-zero eigenvalues are found for each connected 
+    component of the mesh and merged, so disconnected meshes need no retries or 
+    perturbation. See `solvers` for the available eigensolvers.
 
     Inputs:
         vertices - Nx3 Numpy array of mesh vertex coordinates.
         faces - Mx3 Numpy array of vertex indices making up mesh faces. 
         k - Number of requested features.
         scale_invariant - Specify if features should be scale invariant.
+        solver - Eigensolver used for large mesh components.
     Outputs:
         eigvals - k eigenvalues representing the featurized mesh.
     """
@@ -52,79 +62,36 @@ def mesh_spectral_features(
     D = scipy.sparse.diags(np.asarray(W.sum(axis=1)).flatten(), 0)
     L = D - W
         
-    # Make sure we calculate enough eigenvalues. First we calculate some extra 
-    # eigenvalues in case there are many separate components. 
-    max_iter = 10
-    enough_eigvals = False
-    k_orig = k
-    n_singular = 0
-    etol = 1e-3
-    while enough_eigvals is not True and max_iter > 0:
-        
-        try:
-            # Even though we're after the smallest eigenvalues (which='SM'), we use 
-            # shift-invert mode (sigma=0) and solve for the largest. This is more efficient. 
-            # See https://docs.scipy.org/doc/scipy/reference/generated/scipy.sparse.linalg.eigsh.html
-            eigvals = scipy.sparse.linalg.eigsh(L, sigma=0, which='LM', k=k + 10, return_eigenvectors=False)
-        except RuntimeError:
-            # Runtime error is most likely due to singularity. Add small delta to matrix and try again. 
-            # This will burn through an iteration since we don't want to do this forever.
-            eps = scipy.sparse.diags(np.zeros((W.shape[0],)) + etol, 0)
-            L += eps
-            n_singular += 1
-            logger.warning('Graph laplacian likely singular. Perturbing matrix, but this may introduce inaccuracies.')
-            max_iter -= 1
-            continue
-
-        # Remove zero eigenvalues.
-        eigvals = eigvals[~np.isclose(eigvals, 0, atol=1e-5 + etol*n_singular)]
-        eigvals.sort()
-    
-        if len(eigvals) >= k_orig:
-            eigvals = eigvals[:k_orig]
-            enough_eigvals = True
-        else:
-            max_iter -= 1
-            k += k - len(eigvals) + 1 # Add one for good measure.
-
-    if max_iter <= 0:
-        logger.error('Could not solve for the desired number of eigenvalues. Please check the number of connected components in your graph.')
+    eigvals = solvers.smallest_eigenvalues(L, k, solver=solver)
+
+    if len(eigvals) < k:
+        logger.error('Could not solve for the desired number of eigenvalues. The mesh has too few vertices.')
     
     if scale_invariant:
         eigvals /= eigvals[0]
 
-    return eigvals[:k_orig]
+    return eigvals
 
 
-def mesh_and_featurize_image(
+def bounding_boxes(
     image: BioReader,
-    chunk_size: Tuple[int, int, int] = (256, 256, 256),
-    num_features: int = 50, 
-    scale_invariant: bool = False,
-    limit_mesh_size: int = None) -> Tuple[List[int], np.ndarray]:
-    """ Mesh and generate spectral features for all ROIs in a 3D image.
+    chunk_size: Tuple[int, int, int] = (256, 256, 256)) -> Dict[int, np.ndarray]:
+    """ Find the bounding box of every ROI in a 3D image in a single pass.
 
-    Image is initially scanned for all ROIs and corresponding bounding boxes. 
-    Each ROI is then loaded in its entirety and meshed. The mesh is then used 
-    to generate spectral features using the graph Laplacian. 
+    The image is traversed in chunks. The extents of all ROIs in a chunk are 
+    found at once with `scipy.ndimage.find_objects` on the chunk relabeled to 
+    consecutive indices, and merged into the bounding boxes found so far.
 
     Inputs:
         image - BioReader handle to the image
         chunk_size - Size of chunks used for image traversal 
-        num_features - Number of spectral features to calculate
-        scale_invariant - Specify if the calculated features should be scale invariant
-        limit_mesh_size - If specified, the number of faces in generated meshes are limited
-                          to the supplied value
     Outputs:
-        labels - The label IDs of each ROI
-        features - An N x num_features matrix containing the spectral features for each ROI
+        bounds - Maps each label to a 2x3 array of the (y, x, z) start and stop 
+                 of its bounding box, padded by one voxel at the start.
     """
+    bounds = {}
+    shape = np.array([image.Y, image.X, image.Z])
     
-    # Store minimum and maximum bounds of every object.
-    min_bounds = {}
-    max_bounds = {}
-    
-    # Go through the image in chunks and determine extents of each ROI. 
     for y in range(0, image.Y, chunk_size[1]):
         for x in range(0, image.X, chunk_size[0]):
             for z in range(0, image.Z, chunk_size[2]):
@@ -133,54 +100,152 @@ def mesh_and_featurize_image(
                 y_step = np.min([y + chunk_size[1], image.Y])
                 z_step = np.min([z + chunk_size[2], image.Z])
 
-                chunk = np.squeeze(image[y:y_step, x:x_step, z:z_step]) 
+                chunk = np.asarray(image[y:y_step, x:x_step, z:z_step]).reshape(
+                    y_step - y, x_step - x, z_step - z)
                 
-                labels = np.unique(chunk[chunk > 0]) 
+                # Relabel to consecutive indices so find_objects does not 
+                # allocate a slot for every possible label value.
+                labels, inverse = np.unique(chunk, return_inverse=True)
+                inverse = inverse.reshape(chunk.shape) + 1
+                offset = np.array([y, x, z])
                 
-                for label in labels:
-                    coords = np.argwhere(chunk == label)
-                    # Add a one pixel padding so long as we're not on a boundary. 
-                    curr_min = np.min(coords, axis=0) + np.array([y, x, z]) - 1
-                    curr_min = np.maximum([0, 0, 0], curr_min)
-                    
-                    curr_max = np.max(coords, axis=0) + np.array([y, x, z]) + 1
-                    curr_max = np.minimum([image.Y, image.X, image.Z], curr_max)
+                for label, slices in zip(labels, ndimage.find_objects(inverse)):
+                    if label == 0 or slices is None:
+                        continue
+                    curr = np.array([[s.start for s in slices], [s.stop for s in slices]]) + offset
                     
-                    if label not in min_bounds: 
-                        min_bounds[label] = curr_min
-                    else:
-                        min_bounds[label] = np.min(np.stack([min_bounds[label], curr_min]), axis=0)
+                    # Add a one pixel padding so long as we're not on a boundary. 
+                    curr[0] = np.maximum(0, curr[0] - 1)
+                    curr[1] = np.minimum(shape, curr[1])
                     
-                    if label not in max_bounds:
-                        max_bounds[label] = curr_max
+                    label = int(label)
+                    if label not in bounds:
+                        bounds[label] = curr
                     else:
-                        max_bounds[label] = np.max(np.stack([max_bounds[label], curr_max]), axis=0)
+                        prev = bounds[label]
+                        prev[0] = np.minimum(prev[0], curr[0])
+                        prev[1] = np.maximum(prev[1], curr[1])
     
+    return bounds
+
+
+def featurize_roi(
+    mask: np.ndarray,
+    num_features: int = 50, 
+    scale_invariant: bool = False,
+    limit_mesh_size: int = None,
+    solver: str = 'shift-invert') -> np.ndarray:
+    """ Mesh a binary ROI and generate its spectral features.
+
+    Inputs:
+        mask - 3D binary mask of the ROI
+        num_features - Number of spectral features to calculate
+        scale_invariant - Specify if the calculated features should be scale invariant
+        limit_mesh_size - If specified, the number of faces in generated meshes are limited
+                          to the supplied value
+        solver - Eigensolver used for large mesh components
+    Outputs:
+        features - The num_features spectral features of the ROI
+    """
+    verts, faces, _, _ = measure.marching_cubes(mask.astype(np.uint8), 0, allow_degenerate=False)
 
-    # Get subvolume for each ROI and generate mesh. 
-    # Note: we assume labels in min and max dicts are the same.
-    labels = list(min_bounds.keys())
-    features = np.zeros((len(labels), num_features))
-    for i, (label, min_bounds, max_bounds) in enumerate(zip(labels, min_bounds.values(), max_bounds.values())): 
-        subvol = image[min_bounds[0]:max_bounds[0], min_bounds[1]:max_bounds[1], min_bounds[2]:max_bounds[2]]
-        subvol = np.squeeze(subvol)
+    if limit_mesh_size is not None and faces.shape[0] > limit_mesh_size: 
+        mesh_obj = trimesh.Trimesh(verts, faces).simplify_quadratic_decimation(limit_mesh_size)
+        mesh_obj.remove_degenerate_faces()
+        mesh_obj.remove_duplicate_faces()
+        mesh_obj.remove_unreferenced_vertices()
+        mesh_obj.remove_infinite_values()
+        mesh_obj.fill_holes()
 
-        verts, faces, _, _ = measure.marching_cubes((subvol == label).astype(np.uint8), 0, allow_degenerate=False)
+        verts = np.asarray(mesh_obj.vertices)
+        faces = np.asarray(mesh_obj.faces)
 
-        if limit_mesh_size is not None and faces.shape[0] > limit_mesh_size: 
-            mesh_obj = trimesh.Trimesh(verts, faces).simplify_quadratic_decimation(limit_mesh_size)
-            mesh_obj.remove_degenerate_faces()
-            mesh_obj.remove_duplicate_faces()
-            mesh_obj.remove_unreferenced_vertices()
-            mesh_obj.remove_infinite_values()
-            mesh_obj.fill_holes()
+    return mesh_spectral_features(verts, faces, k=num_features, scale_invariant=scale_invariant, solver=solver)
 
-            verts = np.asarray(mesh_obj.vertices)
-            faces = np.asarray(mesh_obj.faces)
 
-        logger.info(f'Featurizing ROI {label} ({i + 1}/{len(labels)}) with {verts.shape[0]} vertices.')
+def featurize_image(
+    image: BioReader,
+    chunk_size: Tuple[int, int, int] = (256, 256, 256),
+    num_features: int = 50, 
+    scale_invariant: bool = False,
+    limit_mesh_size: int = None,
+    num_workers: int = NUM_WORKERS,
+    solver: str = 'shift-invert') -> Iterator[Tuple[int, np.ndarray]]:
+    """ Mesh and generate spectral features for all ROIs in a 3D image.
+
+    Bounding boxes of all ROIs are found in one pass over the image. Each ROI is 
+    then read once and its mask is meshed and featurized in a process pool, with 
+    a bounded number of ROIs in flight. Results are yielded in label order as 
+    soon as they are available, so features can be written out incrementally.
+
+    Inputs:
+        image - BioReader handle to the image
+        chunk_size - Size of chunks used for image traversal 
+        num_features - Number of spectral features to calculate
+        scale_invariant - Specify if the calculated features should be scale invariant
+        limit_mesh_size - If specified, the number of faces in generated meshes are limited
+                          to the supplied value
+        num_workers - Number of processes, ROIs are processed serially if 1
+        solver - Eigensolver used for large mesh components
+    Outputs:
+        Tuples of the label ID and spectral features of each ROI
+    """
+    bounds = bounding_boxes(image, chunk_size)
+    labels = sorted(bounds)
+    
+    def masks() -> Iterator[np.ndarray]:
+        for label in labels:
+            start, stop = bounds[label]
+            subvol = image[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+            yield np.squeeze(subvol) == label
+    
+    kwargs = dict(num_features=num_features, scale_invariant=scale_invariant, limit_mesh_size=limit_mesh_size, 
+                  solver=solver)
+    
+    if num_workers <= 1:
+        for i, (label, mask) in enumerate(zip(labels, masks())):
+            logger.info(f'Featurizing ROI {label} ({i + 1}/{len(labels)}).')
+            yield label, featurize_roi(mask, **kwargs)
+        return
+    
+    with ProcessPoolExecutor(num_workers) as executor:
+        pending = deque()
+        for i, (label, mask) in enumerate(zip(labels, masks())):
+            logger.info(f'Featurizing ROI {label} ({i + 1}/{len(labels)}).')
+            pending.append((label, executor.submit(featurize_roi, mask, **kwargs)))
+            
+            # Keep enough ROIs queued to occupy the pool without holding every mask in memory
+            while len(pending) > 2 * num_workers or (pending and pending[0][1].done()):
+                label, future = pending.popleft()
+                yield label, future.result()
+        
+        while pending:
+            label, future = pending.popleft()
+            yield label, future.result()
+
+
+def mesh_and_featurize_image(
+    image: BioReader,
+    chunk_size: Tuple[int, int, int] = (256, 256, 256),
+    num_features: int = 50, 
+    scale_invariant: bool = False,
+    limit_mesh_size: int = None,
+    num_workers: int = NUM_WORKERS,
+    solver: str = 'shift-invert') -> Tuple[List[int], np.ndarray]:
+    """ Mesh and generate spectral features for all ROIs in a 3D image.
 
-        feats = mesh_spectral_features(verts, faces, k=num_features, scale_invariant=scale_invariant)
-        features[i] = feats
+    Collects the output of `featurize_image` in memory. See `featurize_image` 
+    for a description of the inputs.
 
-    return labels, features
+    Outputs:
+        labels - The label IDs of each ROI, in ascending order
+        features - An N x num_features matrix containing the spectral features for each ROI
+    """
+    labels = []
+    features = []
+    for label, feats in featurize_image(image, chunk_size, num_features, scale_invariant, 
+                                        limit_mesh_size, num_workers, solver):
+        labels.append(label)
+        features.append(feats)
+
+    return labels, np.asarray(features).reshape(len(labels), num_features)
@@ -0,0 +1,181 @@
+import logging
+import warnings
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+from scipy.sparse import csgraph
+from typing import Callable, Dict
+
+try:
+    import pyamg
+except ImportError:
+    pyamg = None
+
+
+logger = logging.getLogger('solvers')
+logger.setLevel(logging.INFO)
+
+# Components with at most this many vertices are solved with a dense eigensolver
+DENSE_SIZE = 256
+
+# Relative diagonal shift that makes the Laplacian of a component non-singular
+SHIFT = 1e-8
+
+# Convergence tolerance and iteration limits of LOBPCG
+LOBPCG_TOL = 1e-6
+LOBPCG_MAXITER = 200
+LOBPCG_RESTARTS = 5
+
+# Extra LOBPCG block vectors, which speed up convergence of the wanted ones
+LOBPCG_GUARD = 5
+
+# Registered eigensolvers, see `register_solver`
+SOLVERS: Dict[str, Callable[[scipy.sparse.spmatrix, int], np.ndarray]] = {}
+
+
+def register_solver(name: str) -> Callable:
+    """ Register an eigensolver under a name.
+
+    A solver takes the graph Laplacian of a single connected component and the
+    number `k` of requested eigenvalues, and returns the `k` smallest non-zero
+    eigenvalues in ascending order. Since the component is connected, its only
+    zero eigenvalue belongs to the constant eigenvector.
+    """
+    def decorator(func: Callable) -> Callable:
+        SOLVERS[name] = func
+        return func
+    return decorator
+
+
+def shifted(L: scipy.sparse.spmatrix, shift: float) -> scipy.sparse.csc_matrix:
+    """ Return the Laplacian with a diagonal shift that makes it positive definite. """
+    return (L + scipy.sparse.identity(L.shape[0]) * shift).tocsc()
+
+
+def default_shift(L: scipy.sparse.spmatrix) -> float:
+    """ Return a shift that is small compared to the eigenvalues of interest. """
+    return SHIFT * max(L.diagonal().mean(), 1)
+
+
+@register_solver('dense')
+def dense_solver(L: scipy.sparse.spmatrix, k: int) -> np.ndarray:
+    """ Solve the full eigenproblem. Only suitable for small components. """
+    eigvals = scipy.linalg.eigh(L.toarray(), eigvals_only=True, subset_by_index=[0, k])
+    return eigvals[1:]
+
+
+@register_solver('shift-invert')
+def shift_invert_solver(L: scipy.sparse.spmatrix, k: int) -> np.ndarray:
+    """ Solve with ARPACK in shift-invert mode around zero.
+
+    The shifted Laplacian is factorized once and the factorization is reused if
+    ARPACK has to be restarted with a larger Krylov subspace.
+    """
+    sigma = -default_shift(L)
+    A = shifted(L, -sigma)
+    lu = scipy.sparse.linalg.splu(A)
+    OPinv = scipy.sparse.linalg.LinearOperator(A.shape, matvec=lu.solve, dtype=A.dtype)
+
+    n = L.shape[0]
+    ncv = min(n - 1, max(2 * (k + 1) + 1, 20))
+    while True:
+        try:
+            eigvals = scipy.sparse.linalg.eigsh(L, k=k + 1, sigma=sigma, which='LM', OPinv=OPinv,
+                                                ncv=ncv, return_eigenvectors=False)
+            break
+        except scipy.sparse.linalg.ArpackNoConvergence:
+            if ncv >= n - 1:
+                raise
+            ncv = min(n - 1, 2 * ncv)
+            logger.warning(f'ARPACK did not converge, restarting with {ncv} Lanczos vectors.')
+
+    return np.sort(eigvals)[1:]
+
+
+def lobpcg_solver(L: scipy.sparse.spmatrix, k: int, M: scipy.sparse.linalg.LinearOperator) -> np.ndarray:
+    """ Solve with preconditioned LOBPCG, deflating the constant eigenvector.
+
+    The block holds `LOBPCG_GUARD` more vectors than requested. If the wanted
+    eigenpairs have not converged after `LOBPCG_MAXITER` iterations, LOBPCG is
+    warm started from the current eigenvector estimates.
+    """
+    n = L.shape[0]
+    Y = np.full((n, 1), 1 / np.sqrt(n))
+    X = np.random.default_rng(0).standard_normal((n, min(k + LOBPCG_GUARD, n // 5)))
+    tol = LOBPCG_TOL * max(L.diagonal().max(), 1)
+
+    for _ in range(LOBPCG_RESTARTS):
+        with warnings.catch_warnings():
+            # Convergence is checked below on the wanted eigenpairs only
+            warnings.simplefilter('ignore', UserWarning)
+            eigvals, X = scipy.sparse.linalg.lobpcg(L, X, M=M, Y=Y, tol=tol, maxiter=LOBPCG_MAXITER, largest=False)
+        order = np.argsort(eigvals)
+        eigvals, X = eigvals[order], X[:, order]
+        residuals = np.linalg.norm(L @ X[:, :k] - X[:, :k] * eigvals[:k], axis=0)
+        if np.all(residuals <= tol):
+            break
+    else:
+        logger.warning(f'LOBPCG did not converge, largest residual is {residuals.max():.2e}.')
+
+    return eigvals[:k]
+
+
+@register_solver('lobpcg-amg')
+def lobpcg_amg_solver(L: scipy.sparse.spmatrix, k: int) -> np.ndarray:
+    """ Solve with LOBPCG preconditioned by smoothed aggregation algebraic multigrid. """
+    if pyamg is None:
+        raise ImportError('The lobpcg-amg solver requires pyamg to be installed.')
+    M = pyamg.smoothed_aggregation_solver(shifted(L, default_shift(L)).tocsr()).aspreconditioner()
+    return lobpcg_solver(L, k, M)
+
+
+@register_solver('lobpcg-ilu')
+def lobpcg_ilu_solver(L: scipy.sparse.spmatrix, k: int) -> np.ndarray:
+    """ Solve with LOBPCG preconditioned by an incomplete factorization. """
+    ilu = scipy.sparse.linalg.spilu(shifted(L, default_shift(L)), drop_tol=1e-4, fill_factor=10)
+    M = scipy.sparse.linalg.LinearOperator(L.shape, matvec=ilu.solve, dtype=L.dtype)
+    return lobpcg_solver(L, k, M)
+
+
+def smallest_eigenvalues(
+    L: scipy.sparse.spmatrix,
+    k: int,
+    solver: str = 'shift-invert') -> np.ndarray:
+    """ Find the smallest non-zero eigenvalues of a graph Laplacian.
+
+    Each connected component of the graph contributes exactly one zero
+    eigenvalue, so the Laplacian is decomposed into its components, which are
+    solved independently for their non-zero eigenvalues and merged. Small
+    components are solved densely regardless of the selected solver.
+
+    Inputs:
+        L - Sparse graph Laplacian.
+        k - Number of requested eigenvalues.
+        solver - Name of a registered solver used for large components.
+    Outputs:
+        eigvals - Up to k smallest non-zero eigenvalues in ascending order.
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f'Unknown eigensolver {solver}, must be one of {list(SOLVERS)}.')
+
+    L = scipy.sparse.csr_matrix(L, dtype=np.float64)
+    num_components, component = csgraph.connected_components(L, directed=False)
+    order = np.argsort(component, kind='stable')
+    bounds = np.searchsorted(component[order], np.arange(num_components + 1))
+
+    eigvals = []
+    for c in range(num_components):
+        index = order[bounds[c]:bounds[c + 1]]
+        m = min(k, len(index) - 1)
+        if m == 0:
+            continue
+        Lc = L[index][:, index]
+        if len(index) <= max(DENSE_SIZE, 5 * (m + 1)):
+            eigvals.append(dense_solver(Lc, m))
+        else:
+            eigvals.append(SOLVERS[solver](Lc, m))
+
+    if len(eigvals) == 0:
+        return np.zeros(0)
+    return np.sort(np.concatenate(eigvals))[:k]
@@ -30,7 +30,54 @@ class TestScalableFeaturization(unittest.TestCase):
         self.assertTrue(
             np.allclose(ref_features, features.flatten(), atol=1.e-3)
         )
+
+    def test_bounding_boxes(self):
+        bunny_file = os.path.join(dir_path, 'test_data/bunny.ome.tif')
+        with BioReader(bunny_file) as br:
+            ref_img = np.squeeze(br[:])
+            bounds = mesh.bounding_boxes(br, chunk_size=(20, 20, 20))
+
+        coords = np.argwhere(ref_img == 255)
+        self.assertEqual(list(bounds.keys()), [255])
+        self.assertTrue(np.array_equal(bounds[255][0], np.maximum(coords.min(axis=0) - 1, 0)))
+        self.assertTrue(np.array_equal(bounds[255][1], coords.max(axis=0) + 1))
+
+    def test_parallel_features(self):
+        bunny_file = os.path.join(dir_path, 'test_data/bunny.ome.tif')
+        with BioReader(bunny_file) as br:
+            _, serial = mesh.mesh_and_featurize_image(br, chunk_size=(20, 20, 20), num_features=20, num_workers=1)
+            labels, parallel = mesh.mesh_and_featurize_image(br, chunk_size=(20, 20, 20), num_features=20, num_workers=2)
+
+        self.assertEqual(labels, [255])
+        self.assertTrue(np.allclose(serial, parallel))
         
+    def test_solvers(self):
+        bunny_file = os.path.join(dir_path, 'test_data/bunny.ome.tif')
+        with BioReader(bunny_file) as br:
+            ref_img = np.squeeze(br[:])
+
+        # Downsample so the dense reference fits in memory
+        verts, faces, _, _ = measure.marching_cubes((ref_img[::3, ::3, ::3] == 255).astype(np.uint8), 0, allow_degenerate=False)
+        ref_features = mesh.mesh_spectral_features(verts, faces, k=20, solver='dense')
+
+        for solver in ['shift-invert', 'lobpcg-ilu']:
+            features = mesh.mesh_spectral_features(verts, faces, k=20, solver=solver)
+            self.assertTrue(np.allclose(ref_features, features, rtol=1.e-6))
+
+    def test_disconnected_mesh(self):
+        bunny_file = os.path.join(dir_path, 'test_data/bunny.ome.tif')
+        with BioReader(bunny_file) as br:
+            ref_img = np.squeeze(br[:])
+
+        verts, faces, _, _ = measure.marching_cubes((ref_img == 255).astype(np.uint8), 0, allow_degenerate=False)
+        ref_features = mesh.mesh_spectral_features(verts, faces, k=20)
+
+        # Two copies of the same mesh have every eigenvalue twice
+        two_verts = np.concatenate([verts, verts + 1000])
+        two_faces = np.concatenate([faces, faces + len(verts)])
+        features = mesh.mesh_spectral_features(two_verts, two_faces, k=40)
+        self.assertTrue(np.allclose(np.repeat(ref_features, 2), features))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1 @@
+"""Benchmarks for the region segmentation eval plugin."""
@@ -0,0 +1,201 @@
+"""Benchmark overlap-table matching against per-object mask matching.
+
+The reference implementation below is the matching loop previously used by
+`evaluate.evaluation`, which builds full tile masks for every object.
+
+Run from the plugin root:
+
+    python -m benches.bench_overlap --size 2048 --objects 500 2000 5000
+"""
+import argparse
+import logging
+import time
+from typing import Any
+
+import numpy as np
+import skimage
+from polus.images.features.region_segmentation_eval import overlap
+from sklearn.neighbors import NearestNeighbors
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger("bench_overlap")
+logger.setLevel(logging.INFO)
+
+
+def synthetic_labels(
+    size: int,
+    num_objects: int,
+    seed: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Generate ground truth nuclei and a jittered, partly split prediction."""
+    rng = np.random.default_rng(seed)
+    radius = max(2, int(0.35 * size / np.sqrt(num_objects)))
+    centers = rng.integers(radius, size - radius, (num_objects, 2))
+
+    def draw(centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        im = np.zeros((size, size), dtype=np.int64)
+        for label, ((y, x), r) in enumerate(zip(centers, radii), start=1):
+            rr, cc = skimage.draw.disk((y, x), r, shape=im.shape)
+            im[rr, cc] = label
+        return im
+
+    gt = draw(centers, np.full(num_objects, radius))
+    jitter = rng.integers(-2, 3, centers.shape)
+    pred = draw(centers + jitter, rng.integers(radius - 1, radius + 2, num_objects))
+
+    # Split some predicted objects to create over segmentation
+    split = rng.random(num_objects) < 0.05  # noqa: PLR2004
+    for label in np.flatnonzero(split) + 1:
+        rows, cols = np.nonzero(pred == label)
+        if len(cols):
+            pred[rows[cols > cols.mean()], cols[cols > cols.mean()]] = (
+                num_objects + label
+            )
+
+    # Drop some predictions to create false negatives
+    dropped = np.flatnonzero(rng.random(num_objects) < 0.05) + 1  # noqa: PLR2004
+    pred[np.isin(pred, dropped)] = 0
+
+    return gt, pred
+
+
+def mask_matching(  # noqa: C901, PLR0912, PLR0915
+    im_gt: np.ndarray,
+    im_pred: np.ndarray,
+    radius_factor: float,
+    iou_score: float,
+) -> dict[str, Any]:
+    """Reference per-object matching with full tile masks."""
+    props = skimage.measure.regionprops(im_pred)
+    num_labels_pred = np.unique(im_pred)
+    if num_labels_pred[0] != 0:
+        num_labels_pred = np.insert(num_labels_pred, 0, 0)
+    centroids_pred = np.zeros((len(num_labels_pred), 2))
+    for i, prop in enumerate(props, start=1):
+        centroids_pred[i] = prop.centroid[::-1]
+
+    props = skimage.measure.regionprops(im_gt)
+    num_labels_gt = np.unique(im_gt)
+    if num_labels_gt[0] != 0:
+        num_labels_gt = np.insert(num_labels_gt, 0, 0)
+    centroids_gt = np.zeros((len(num_labels_gt), 2))
+    diameters = np.zeros(len(num_labels_gt))
+    for i, prop in enumerate(props, start=1):
+        centroids_gt[i] = prop.centroid[::-1]
+        diameters[i] = prop.minor_axis_length
+
+    neighbors = 5 if len(centroids_pred) > 4 else len(centroids_pred)  # noqa: PLR2004
+    nbrs = NearestNeighbors(n_neighbors=neighbors, algorithm="ball_tree").fit(
+        centroids_pred,
+    )
+    associations: dict[int, list] = {}
+    for i in range(1, len(centroids_gt)):
+        _, index = nbrs.kneighbors(np.array([centroids_gt[i]]))
+        mask_gt = im_gt == num_labels_gt[i]
+        associations[i] = []
+        for idx in index.flatten():
+            mask_pred = im_pred == num_labels_pred[idx]
+            if mask_pred.sum() > 2 and idx != 0:  # noqa: PLR2004
+                if (
+                    mask_gt[int(centroids_pred[idx][1]), int(centroids_pred[idx][0])]
+                    or mask_pred[int(centroids_gt[i][1]), int(centroids_gt[i][0])]
+                ):
+                    associations[i].append(num_labels_pred[idx])
+
+    tp = fn = fp = 0
+    matches = []
+    for i in range(1, len(centroids_gt)):
+        distance, index = nbrs.kneighbors(np.array([centroids_gt[i]]))
+        match = index.flatten()[0]
+        dis = distance.flatten()[0]
+        mask_gt = im_gt == num_labels_gt[i]
+        mask_pred = im_pred == num_labels_pred[match]
+        iou = np.logical_and(mask_pred, mask_gt).sum() / np.logical_or(
+            mask_pred,
+            mask_gt,
+        ).sum()
+        if (
+            dis < (diameters[i] / 2) * radius_factor
+            and match not in matches
+            and iou > iou_score
+        ):
+            tp += 1
+            matches.append(match)
+            centroids_pred[match] = [0.0, 0.0]
+        else:
+            fn += 1
+
+    for i in range(1, len(centroids_pred)):
+        if centroids_pred[i][0] != 0.0 and centroids_pred[i][1] != 0.0:
+            if (im_pred == num_labels_pred[i]).sum() > 2:  # noqa: PLR2004
+                fp += 1
+
+    over = sum(len(v) > 1 for v in associations.values())
+    claims: dict[int, int] = {}
+    for v in associations.values():
+        if len(v) == 1:
+            claims[v[0]] = claims.get(v[0], 0) + 1
+    under = sum(c for c in claims.values() if c > 1)
+
+    return {"tp": tp, "fp": fp, "fn": fn, "over": over, "under": under}
+
+
+def main() -> None:
+    """Time both matching engines on synthetic label images."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--objects", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--radius-factor", type=float, default=0.5)
+    parser.add_argument("--iou-score", type=float, default=0.0)
+    parser.add_argument(
+        "--skip-reference",
+        action="store_true",
+        help="Only time the overlap-table engine.",
+    )
+    args = parser.parse_args()
+
+    logger.info(
+        f"{'objects':>8} {'overlap (s)':>12} {'masks (s)':>10} "
+        f"{'tp':>12} {'fp':>10} {'fn':>10} {'over':>10} {'under':>10}",
+    )
+    for num_objects in args.objects:
+        im_gt, im_pred = synthetic_labels(args.size, num_objects)
+
+        start = time.perf_counter()
+        result = overlap.match_objects(
+            im_gt,
+            im_pred,
+            1,
+            args.radius_factor,
+            args.iou_score,
+        )
+        overlap_time = time.perf_counter() - start
+        new = {
+            "tp": result.tp,
+            "fp": result.fp,
+            "fn": result.fn,
+            "over": result.over_segmented,
+            "under": result.under_segmented,
+        }
+
+        ref: dict[str, Any] = {key: "-" for key in new}
+        mask_time = float("nan")
+        if not args.skip_reference:
+            start = time.perf_counter()
+            ref = mask_matching(im_gt, im_pred, args.radius_factor, args.iou_score)
+            mask_time = time.perf_counter() - start
+
+        counts = " ".join(
+            f"{str(new[key]) + '/' + str(ref[key]):>{12 if key == 'tp' else 10}}"
+            for key in new
+        )
+        logger.info(
+            f"{num_objects:>8} {overlap_time:>12.3f} {mask_time:>10.2f} {counts}",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,18 @@ import logging
 import math
 import os
 import pathlib
+from contextlib import ExitStack
 from multiprocessing import cpu_count
-from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 import cv2
 import filepattern
 import numpy as np
-import pandas as pd
-import skimage
-import vaex
+import pyarrow as pa
 from bfio import BioReader
-from sklearn.neighbors import NearestNeighbors
+from polus.images.features.region_segmentation_eval import overlap
+from polus.images.features.region_segmentation_eval.sink import TableSink
+from polus.images.features.region_segmentation_eval.sink import table_schema
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -126,22 +127,14 @@ def get_image(
     b3 = np.unique(im[0:tile_size, im.shape[1] - 2])
     if x_max < X and y_max < Y:
         val = np.concatenate([b1, b3])
-        border_values = np.unique(val[val > 0])
-        for i in border_values:
-            im = np.where(im == i, 0, im)
     elif x_max == X and y_max < Y:
         val = np.concatenate([b1])
-        border_values = np.unique(val[val > 0])
-        for i in border_values:
-            im = np.where(im == i, 0, im)
     elif x_max < X and y_max == Y:
         val = np.concatenate([b3])
-        border_values = np.unique(val[val > 0])
-        for i in border_values:
-            im = np.where(im == i, 0, im)
-    elif x_max == X and y_max == Y:
-        im = im
-    return im
+    else:
+        return im
+    border_values = np.unique(val[val > 0])
+    return np.where(np.isin(im, border_values), 0, im)
 
 
 def metrics(tp: Union[float, int], fp: int, fn: int) -> Sequence[float]:
@@ -175,41 +168,110 @@ def metrics(tp: Union[float, int], fp: int, fn: int) -> Sequence[float]:
     return iou, tpr, precision, fnr, fdr, fscore, f1_score, fmi
 
 
-def find_over_under(
-    dict_result: Dict, data: List[List[Union[str, int, float]]]
-) -> Tuple[List[List[Union[str, int, float]]], int, int]:
-    """Find number of over and under segmented cells.
+def evaluate_image(
+    gt_path: pathlib.Path,
+    pred_path: pathlib.Path,
+    input_classes: int,
+    radius_factor: float,
+    iou_score: float,
+    individual_file: Optional[pathlib.Path],
+    chunk_size: int,
+) -> np.ndarray:
+    """Match the objects of an image tile by tile.
 
     Args:
-            dict_result: dictionary containing predicted labels for each ground truth cell.
-            data: data to be saved to csv file.
+            gt_path: Ground truth image.
+            pred_path: Predicted image.
+            input_classes: Number of Classes.
+            radius_factor: Importance of radius/diameter to find centroid distance.
+            iou_score: Intersection over union threshold.
+            individual_file: If set, per object statistics are streamed to it.
+            chunk_size: Number of rows buffered before writing.
 
     Returns:
-            data: updated csv data with "over" or "under" label assigned to over and under segmented cells.
-            over_segmented: number of over segmented cells.
-            under_segmented: number of under segmented cells.
+            Array with a row per class (including background) of TP, FP, FN,
+            over segmented and under segmented counts followed by the summed
+            centroid distance and IoU of the true positives.
     """
-    over_segmented_ = 0
-    under_segmented_ = 0
-    labels = {}
-    for key in dict_result:
-        value = dict_result[key]
-        if len(value) == 1:
-            labels[key] = value[0]
-        if len(value) > 1:
-            over_segmented_ += 1
-            data[key].append("over")
-
-    dict_new: dict[str, Any] = {}
-    for key, value in labels.items():
-        dict_new.setdefault(value, set()).add(key)
-    res = filter(lambda x: len(x) > 1, dict_new.values())
-    for i in list(res):
-        for ind in i:
-            data[ind].append("under")
-            under_segmented_ += 1
-
-    return data, over_segmented_, under_segmented_
+    tile_size = 2048
+    counts = np.zeros((input_classes + 1, 7))
+    with ExitStack() as stack:
+        br_pred = stack.enter_context(BioReader(pred_path, max_workers=cpu_count()))
+        br_gt = stack.enter_context(BioReader(gt_path, max_workers=cpu_count()))
+        cells = None
+        if individual_file is not None:
+            cells = stack.enter_context(
+                TableSink(individual_file, schema(header_individual_data), chunk_size)
+            )
+
+        for z in range(br_gt.Z):
+            # Loop across the length of the image
+            for y in range(0, br_gt.Y, tile_size):
+                y_max = min([br_gt.Y, y + tile_size])
+                for x in range(0, br_gt.X, tile_size):
+                    x_max = min([br_gt.X, x + tile_size])
+                    im_gt = np.squeeze(br_gt[y:y_max, x:x_max, z : z + 1, 0, 0])
+                    im_pred = np.squeeze(br_pred[y:y_max, x:x_max, z : z + 1, 0, 0])
+
+                    classes = range(1, input_classes + 1) if input_classes > 1 else [1]
+                    for cl in classes:
+                        im_gt_cl, im_pred_cl = im_gt, im_pred
+                        if input_classes > 1:
+                            im_pred_cl, _, _, _ = ccl(np.uint8(im_pred == cl))
+                            im_gt_cl, _, _, _ = ccl(np.uint8(im_gt == cl))
+
+                        im_gt_cl = get_image(
+                            im_gt_cl, tile_size, br_gt.X, br_gt.Y, x_max, y_max
+                        ).astype(int)
+                        im_pred_cl = get_image(
+                            im_pred_cl, tile_size, br_pred.X, br_pred.Y, x_max, y_max
+                        ).astype(int)
+
+                        matches = overlap.match_objects(
+                            im_gt_cl, im_pred_cl, cl, radius_factor, iou_score
+                        )
+                        counts[cl] += [
+                            matches.tp,
+                            matches.fp,
+                            matches.fn,
+                            matches.over_segmented,
+                            matches.under_segmented,
+                            matches.tp_distance,
+                            matches.tp_iou,
+                        ]
+                        if cells is not None:
+                            cells.append(matches.data)
+
+        if cells is not None:
+            logger.info(f"{individual_file.name}")
+
+    return counts
+
+
+def schema(columns: List[str]) -> pa.Schema:
+    """Schema of an output table, inferred from its column names."""
+    strings = ["Image_Name", "Image", "TP or FN", "over/under"]
+    integers = [
+        "Class",
+        "class",
+        "TP",
+        "FP",
+        "FN",
+        "over_segmented",
+        "under_segmented",
+        "Actual Label",
+    ]
+    types = [
+        pa.string()
+        if c in strings
+        else pa.int64()
+        if c in integers
+        else pa.list_(pa.int64())
+        if c == "Predicted Labels"
+        else pa.float64()
+        for c in columns
+    ]
+    return table_schema(columns, types)
 
 
 def evaluation(
@@ -253,456 +315,111 @@ def evaluation(
         raise ValueError("radius_factor not provided")
 
     total_files = 0
-    result = []
-
-    if total_stats:
-        TP = [0] * (input_classes + 1)
-        FP = [0] * (input_classes + 1)
-        FN = [0] * (input_classes + 1)
-        total_over_segmented = [0] * (input_classes + 1)
-        total_under_segmented = [0] * (input_classes + 1)
-
-    if individual_summary:
-        ind_sum = []
-
-    if total_summary:
-        total_iou = [0] * (input_classes + 1)
-        total_tpr = [0] * (input_classes + 1)
-        total_precision = [0] * (input_classes + 1)
-        total_fnr = [0] * (input_classes + 1)
-        total_fdr = [0] * (input_classes + 1)
-        total_fscore = [0] * (input_classes + 1)
-        total_f1_score = [0] * (input_classes + 1)
-        total_fmi = [0] * (input_classes + 1)
+
+    # Accumulators for the tables summarizing all images
+    TP = [0] * (input_classes + 1)
+    FP = [0] * (input_classes + 1)
+    FN = [0] * (input_classes + 1)
+    total_over_segmented = [0] * (input_classes + 1)
+    total_under_segmented = [0] * (input_classes + 1)
+    total_metrics = np.zeros((input_classes + 1, len(header_total_summary) - 1))
 
     try:
-        for file in fp():
-            file_name = file[1][0]
-            tile_grid_size = 1
-            tile_size = tile_grid_size * 2048
-            with BioReader(file_name, max_workers=cpu_count()) as br_pred:
-                with BioReader(
+        with ExitStack() as stack:
+            result = stack.enter_context(
+                TableSink(
+                    pathlib.Path(out_dir, f"result{POLUS_TAB_EXT}"),
+                    schema(header),
+                    chunk_size,
+                )
+            )
+            if individual_summary:
+                ind_sum = stack.enter_context(
+                    TableSink(
+                        pathlib.Path(
+                            out_dir, f"individual_image_summary{POLUS_TAB_EXT}"
+                        ),
+                        schema(header_individual_summary),
+                        chunk_size,
+                    )
+                )
+
+            for file in fp():
+                file_name = file[1][0]
+                logger.info(f"Evaluating image {file_name}")
+                total_files += 1
+
+                counts = evaluate_image(
                     pathlib.Path(gt_dir / file_name.name),
-                    max_workers=cpu_count(),
-                ) as br_gt:
-                    logger.info(f"Evaluating image {file_name}")
-                    total_files += 1
+                    file_name,
+                    input_classes,
+                    radius_factor,
+                    iou_score,
+                    pathlib.Path(out_dir, f"cells_{file_name.name}{POLUS_TAB_EXT}")
+                    if individual_data
+                    else None,
+                    chunk_size,
+                )
 
-                    if individual_summary:
-                        mean_centroid = [0] * (input_classes + 1)
-                        mean_iou = [0] * (input_classes + 1)
-
-                    totalCells = [0] * (input_classes + 1)
-                    tp = [0] * (input_classes + 1)
-                    fp = [0] * (input_classes + 1)
-                    fn = [0] * (input_classes + 1)
-                    over_segmented = [0] * (input_classes + 1)
-                    under_segmented = [0] * (input_classes + 1)
-                    for z in range(br_gt.Z):
-                        # Loop across the length of the image
-                        for y in range(0, br_gt.Y, tile_size):
-                            y_max = min([br_gt.Y, y + tile_size])
-                            for x in range(0, br_gt.X, tile_size):  # noqa
-                                x_max = min([br_gt.X, x + tile_size])
-                                im_gt = np.squeeze(
-                                    br_gt[y:y_max, x:x_max, z : z + 1, 0, 0]  # noqa
-                                )
-                                im_pred = np.squeeze(
-                                    br_pred[y:y_max, x:x_max, z : z + 1, 0, 0]  # noqa
-                                )
-
-                                if input_classes > 1:
-                                    classes = np.unique(im_gt)
-                                else:
-                                    classes = [1]
-                                for cl in classes:
-                                    if len(classes) > 1:
-                                        im_pred = np.where(im_pred == cl, cl, 0)
-                                        im_gt = np.where(im_gt == cl, cl, 0)
-                                        im_pred, _, _, _ = ccl(np.uint8(im_pred))
-                                        im_gt, _, _, _ = ccl(np.uint8(im_gt))
-
-                                    im_gt = get_image(
-                                        im_gt,
-                                        tile_size,
-                                        br_gt.X,
-                                        br_gt.Y,
-                                        x_max,
-                                        y_max,
-                                    ).astype(int)
-                                    im_pred = get_image(
-                                        im_pred,
-                                        tile_size,
-                                        br_pred.X,
-                                        br_pred.Y,
-                                        x_max,
-                                        y_max,
-                                    ).astype(int)
-                                    props = skimage.measure.regionprops(im_pred)
-                                    numLabels_pred = np.unique(im_pred)
-
-                                    if numLabels_pred[0] != 0:
-                                        numLabels_pred = np.insert(numLabels_pred, 0, 0)
-                                    centroids_pred = np.zeros((len(numLabels_pred), 2))
-                                    i = 1
-                                    for prop in props:
-                                        centroids_pred[i] = prop.centroid[::-1]
-                                        i += 1
-
-                                    list_matches = []
-                                    props = skimage.measure.regionprops(im_gt)
-                                    numLabels_gt = np.unique(im_gt)
-
-                                    if numLabels_gt[0] != 0:
-                                        numLabels_gt = np.insert(numLabels_gt, 0, 0)
-                                    centroids_gt = np.zeros((len(numLabels_gt), 2))
-                                    diameters = np.zeros(len(numLabels_gt))
-                                    i = 1
-                                    for prop in props:
-                                        centroids_gt[i] = prop.centroid[::-1]
-                                        diameters[i] = prop.minor_axis_length
-                                        i += 1
-
-                                    dict_result: dict[str, Any] = {}
-                                    data = [None] * (numLabels_gt.max() + 1)
-
-                                    if len(centroids_pred) > 4:
-                                        numberofNeighbors = 5
-                                    else:
-                                        numberofNeighbors = len(centroids_pred)
-                                    nbrs = NearestNeighbors(
-                                        n_neighbors=numberofNeighbors,
-                                        algorithm="ball_tree",
-                                    ).fit(centroids_pred)
-                                    for i in range(1, len(centroids_gt)):
-                                        distance, index = nbrs.kneighbors(
-                                            np.array([centroids_gt[i]])
-                                        )
-                                        index = index.flatten()
-                                        componentMask_gt = (
-                                            im_gt == numLabels_gt[i]
-                                        ).astype("uint8") * 1
-                                        dict_result.setdefault(numLabels_gt[i], [])
-                                        for idx in index:
-                                            componentMask_pred_ = (
-                                                im_pred == numLabels_pred[idx]
-                                            ).astype("uint8") * 1
-                                            if (
-                                                componentMask_pred_ > 0
-                                            ).sum() > 2 and idx != 0:
-                                                if (
-                                                    componentMask_gt[
-                                                        int(centroids_pred[idx][1]),
-                                                        int(centroids_pred[idx][0]),
-                                                    ]
-                                                    == 1
-                                                    or componentMask_pred_[
-                                                        int(centroids_gt[i][1]),
-                                                        int(centroids_gt[i][0]),
-                                                    ]
-                                                    == 1
-                                                ):
-                                                    dict_result[numLabels_gt[i]].append(
-                                                        numLabels_pred[idx]
-                                                    )
-
-                                    for i in range(1, len(centroids_gt)):
-                                        distance, index = nbrs.kneighbors(
-                                            np.array([centroids_gt[i]])
-                                        )
-                                        index = index.flatten()
-                                        componentMask_gt = (
-                                            im_gt == numLabels_gt[i]
-                                        ).astype("uint8") * 1
-                                        match = index[0]
-                                        dis = distance.flatten()[0]
-                                        componentMask_pred = (
-                                            im_pred == numLabels_pred[match]
-                                        ).astype("uint8") * 1
-
-                                        intersection = np.logical_and(
-                                            componentMask_pred, componentMask_gt
-                                        )
-                                        union = np.logical_or(
-                                            componentMask_pred, componentMask_gt
-                                        )
-                                        iou_score_cell = np.sum(intersection) / np.sum(
-                                            union
-                                        )
-                                        if (
-                                            dis < (diameters[i] / 2) * radius_factor
-                                            and match not in list_matches
-                                            and iou_score_cell > iou_score
-                                        ):
-                                            tp[cl] += 1
-                                            list_matches.append(match)
-                                            condition = "TP"
-                                            centroids_pred[match] = [0.0, 0.0]
-                                            totalCells[cl] += 1
-                                        else:
-                                            fn[cl] += 1
-                                            condition = "FN"
-
-                                        if condition == "TP" and individual_summary:
-                                            mean_centroid[cl] += dis
-                                            mean_iou[cl] += iou_score_cell
-
-                                        data[numLabels_gt[i]] = [
-                                            dis,
-                                            cl,
-                                            iou_score_cell,
-                                            numLabels_gt[i],
-                                            dict_result.get(numLabels_gt[i]),
-                                            condition,  # type: ignore
-                                        ]
-
-                                    (
-                                        data,
-                                        over_segmented_,
-                                        under_segmented_,
-                                    ) = find_over_under(  # type: ignore
-                                        dict_result, data  # type: ignore
-                                    )
-
-                                    over_segmented[cl] += over_segmented_
-                                    under_segmented[cl] += under_segmented_
-
-                                    if individual_data:
-                                        ind_data: List[Any] = []
-                                        for i in range(0, numLabels_gt.max() + 1):
-                                            if data[i] is not None:
-                                                ind_data.append(data[i])
-                                        df_ind_data = pd.DataFrame(ind_data)
-                                        if df_ind_data.shape[1] == 6:
-                                            df_ind_data = pd.DataFrame(
-                                                ind_data,
-                                                columns=header_individual_data[:-1],
-                                            )
-                                        else:
-                                            df_ind_data = pd.DataFrame(
-                                                ind_data,
-                                                columns=header_individual_data,
-                                            )
-
-                                        vf_ind_data = vaex.from_pandas(df_ind_data)
-                                        outname_ind_data = pathlib.Path(
-                                            out_dir,
-                                            f"cells_{file_name.name}{POLUS_TAB_EXT}",
-                                        )
-                                        if f"{POLUS_TAB_EXT}" in [
-                                            ".feather",
-                                            ".arrow",
-                                        ]:
-                                            vf_ind_data.export_feather(outname_ind_data)
-                                        else:
-                                            vf_ind_data.export_csv(
-                                                path=outname_ind_data,
-                                                chunk_size=chunk_size,
-                                            )
-                                        logger.info(
-                                            f"cells_{file_name.name}{POLUS_TAB_EXT}"
-                                        )
-
-                                    for i in range(1, len(centroids_pred)):
-                                        if (
-                                            centroids_pred[i][0] != 0.0
-                                            and centroids_pred[i][1] != 0.0
-                                        ):
-                                            componentMask_pred = (
-                                                im_pred == numLabels_pred[i]
-                                            ).astype("uint8") * 1
-                                            if (componentMask_pred > 0).sum() > 2:
-                                                fp[cl] += 1
-
-                    for cl in range(1, input_classes + 1):
-                        if tp[cl] == 0:
-                            (
-                                iou,
-                                tpr,
-                                precision,
-                                fnr,
-                                fdr,
-                                fscore,
-                                f1_score,
-                                fmi,
-                            ) = metrics(1e-20, fp[cl], fn[cl])
-                        else:
-                            (
-                                iou,
-                                tpr,
-                                precision,
-                                fnr,
-                                fdr,
-                                fscore,
-                                f1_score,
-                                fmi,
-                            ) = metrics(tp[cl], fp[cl], fn[cl])
-                        data_result = [
-                            file_name.name,
-                            cl,
-                            tp[cl],
-                            fp[cl],
-                            fn[cl],
-                            over_segmented[cl],
-                            under_segmented[cl],
-                            iou,
-                            tpr,
-                            precision,
-                            fnr,
-                            fdr,
-                            fscore,
-                            f1_score,
-                            fmi,
-                        ]
+                for cl in range(1, input_classes + 1):
+                    tp, fp_, fn, over, under = (int(v) for v in counts[cl][:5])
+                    scores = metrics(1e-20 if tp == 0 else tp, fp_, fn)
+                    result.append(
+                        [[file_name.name, cl, tp, fp_, fn, over, under, *scores]]
+                    )
 
-                        result.append(data_result)
-                        df_result = pd.DataFrame(result, columns=header)
-                        vf_result = vaex.from_pandas(df_result)
-                        filename = pathlib.Path(out_dir, f"result{POLUS_TAB_EXT}")
-                        if f"{POLUS_TAB_EXT}" in [".feather", ".arrow"]:
-                            vf_result.export_feather(filename)
-                        else:
-                            vf_result.export_csv(path=filename, chunk_size=chunk_size)
-                        logger.info(f"Saving result{POLUS_TAB_EXT}")
-
-                        if total_summary:
-                            total_iou[cl] += iou
-                            total_tpr[cl] += tpr
-                            total_precision[cl] += precision
-                            total_fnr[cl] += fnr
-                            total_fdr[cl] += fdr
-                            total_fscore[cl] += fscore
-                            total_f1_score[cl] += f1_score
-                            total_fmi[cl] += fmi
-
-                        if total_stats:
-                            TP[cl] += tp[cl]
-                            FP[cl] += fp[cl]
-                            FN[cl] += fn[cl]
-                            total_over_segmented[cl] += over_segmented[cl]
-                            total_under_segmented[cl] += under_segmented[cl]
+                    total_metrics[cl] += scores
+                    TP[cl] += tp
+                    FP[cl] += fp_
+                    FN[cl] += fn
+                    total_over_segmented[cl] += over
+                    total_under_segmented[cl] += under
 
                     if individual_summary:
-                        for cl in range(1, input_classes + 1):
-                            if totalCells[cl] == 0:
-                                data_individualSummary = [
-                                    file_name.name,
-                                    cl,
-                                    0,
-                                    0,
-                                ]
-                                ind_sum.append(data_individualSummary)
-                            else:
-                                mean_centroid[cl] = mean_centroid[cl] / totalCells[cl]
-                                mean_iou[cl] = mean_iou[cl] / totalCells[cl]
-                                data_individualSummary = [
+                        tp_distance, tp_iou = counts[cl][5:]
+                        ind_sum.append(
+                            [
+                                [
                                     file_name.name,
                                     cl,
-                                    mean_centroid[cl],
-                                    mean_iou[cl],
+                                    tp_distance / tp if tp > 0 else 0,
+                                    tp_iou / tp if tp > 0 else 0,
                                 ]
-                                ind_sum.append(data_individualSummary)
-                        df_ind_sum = pd.DataFrame(
-                            ind_sum, columns=header_individual_summary
+                            ]
                         )
-                        vf_ind_sum = vaex.from_pandas(df_ind_sum)
-                        outname_individualSummary = pathlib.Path(
-                            out_dir, f"individual_image_summary{POLUS_TAB_EXT}"
-                        )
-                        if f"{POLUS_TAB_EXT}" in [".feather", ".arrow"]:
-                            vf_ind_sum.export_feather(outname_individualSummary)
-                            logger.info(
-                                f"Saving individual_image_summary{POLUS_TAB_EXT}"
-                            )
-                        else:
-                            vf_ind_sum.export_csv(
-                                path=outname_individualSummary,
-                                chunk_size=chunk_size,
-                            )
+
+            logger.info(f"Saving result{POLUS_TAB_EXT}")
 
         if total_summary and total_files != 0:
-            for cl in range(1, input_classes + 1):
-                total_iou[cl] = total_iou[cl] / total_files
-                total_tpr[cl] = total_tpr[cl] / total_files
-                total_precision[cl] = total_precision[cl] / total_files
-                total_fnr[cl] = total_fnr[cl] / total_files
-                total_fdr[cl] = total_fdr[cl] / total_files
-                total_fscore[cl] = total_fscore[cl] / total_files
-                total_f1_score[cl] = total_f1_score[cl] / total_files
-                total_fmi[cl] = total_fmi[cl] / total_files
-                data_totalSummary = [
-                    cl,
-                    total_iou[cl],
-                    total_tpr[cl],
-                    total_precision[cl],
-                    total_fnr[cl],
-                    total_fdr[cl],
-                    total_fscore[cl],
-                    total_f1_score[cl],
-                    total_fmi[cl],
-                ]
-                df_totalSummary = pd.DataFrame(data_totalSummary).T
-                df_totalSummary.columns = header_total_summary
-                vf_totalSummary = vaex.from_pandas(df_totalSummary)
-                summary_file = pathlib.Path(out_dir, f"average_summary{POLUS_TAB_EXT}")
-                if f"{POLUS_TAB_EXT}" in [".feather", ".arrow"]:
-                    vf_totalSummary.export_feather(summary_file)
-                else:
-                    vf_totalSummary.export_csv(path=summary_file, chunk_size=chunk_size)
-                logger.info(f"Saving average_summary{POLUS_TAB_EXT}")
+            summary_file = pathlib.Path(out_dir, f"average_summary{POLUS_TAB_EXT}")
+            with TableSink(
+                summary_file, schema(header_total_summary), chunk_size
+            ) as sink:
+                for cl in range(1, input_classes + 1):
+                    sink.append([[cl, *(total_metrics[cl] / total_files)]])
+            logger.info(f"Saving average_summary{POLUS_TAB_EXT}")
 
         if total_stats:
-            for cl in range(1, input_classes + 1):
-                if TP[cl] == 0:
-                    (
-                        iou,
-                        tpr,
-                        precision,
-                        fnr,
-                        fdr,
-                        fscore,
-                        f1_score,
-                        fmi,
-                    ) = metrics(1e-20, FP[cl], FN[cl])
-                else:
-                    (
-                        iou,
-                        tpr,
-                        precision,
-                        fnr,
-                        fdr,
-                        fscore,
-                        f1_score,
-                        fmi,
-                    ) = metrics(TP[cl], FP[cl], FN[cl])
-                data_total_stats = [
-                    cl,
-                    TP[cl],
-                    FP[cl],
-                    FN[cl],
-                    total_over_segmented[cl],
-                    total_under_segmented[cl],
-                    iou,
-                    tpr,
-                    precision,
-                    fnr,
-                    fdr,
-                    fscore,
-                    f1_score,
-                    fmi,
-                ]
-
-                df_total_stats = pd.DataFrame(data_total_stats).T
-                df_total_stats.columns = header_total_stats
-                vf_total_stats = vaex.from_pandas(df_total_stats)
-                overall_file = pathlib.Path(
-                    out_dir, f"total_stats_result{POLUS_TAB_EXT}"
-                )
-                if f"{POLUS_TAB_EXT}" in [".feather", ".arrow"]:
-                    vf_total_stats.export_feather(overall_file)
-                else:
-                    vf_total_stats.export_csv(path=overall_file, chunk_size=chunk_size)
-                logger.info(f"Saving total_stats_result{POLUS_TAB_EXT}")
+            overall_file = pathlib.Path(out_dir, f"total_stats_result{POLUS_TAB_EXT}")
+            with TableSink(
+                overall_file, schema(header_total_stats), chunk_size
+            ) as sink:
+                for cl in range(1, input_classes + 1):
+                    scores = metrics(1e-20 if TP[cl] == 0 else TP[cl], FP[cl], FN[cl])
+                    sink.append(
+                        [
+                            [
+                                cl,
+                                TP[cl],
+                                FP[cl],
+                                FN[cl],
+                                total_over_segmented[cl],
+                                total_under_segmented[cl],
+                                *scores,
+                            ]
+                        ]
+                    )
+            logger.info(f"Saving total_stats_result{POLUS_TAB_EXT}")
 
     finally:
         logger.info("Evaluation complete.")
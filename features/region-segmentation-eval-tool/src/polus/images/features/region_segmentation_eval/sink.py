@@ -0,0 +1,122 @@
+"""Append-only columnar table writer.
+
+The pixel and region segmentation eval tools are packaged separately, so each
+has a copy of this module. Keep both copies of sink.py identical and update the
+tests/test_sink.py of both tools with them.
+"""
+import pathlib
+import threading
+from typing import Any, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+
+def table_schema(
+    columns: Sequence[str], types: Sequence[pa.DataType]
+) -> pa.Schema:
+    """Build a schema of nullable columns from names and types."""
+    return pa.schema([pa.field(c, t) for c, t in zip(columns, types)])
+
+
+class TableSink:
+    """Stream rows of a table to disk in record batches.
+
+    Rows are buffered until `buffer_rows` are pending and then written as a
+    single record batch, so memory use is bounded regardless of how many
+    rows are appended. The output format is selected from the file extension:
+    `.arrow`/`.feather` (Arrow IPC), `.parquet` or `.csv`. List columns are
+    written as their string representation in csv files.
+
+    Appending is thread safe, so a single sink can be shared by workers.
+
+    Args:
+        path: Output file.
+        schema: Schema of the table.
+        buffer_rows: Maximum number of rows held in memory.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        schema: pa.Schema,
+        buffer_rows: int = 100_000,
+    ) -> None:
+        """Open the output file."""
+        self.path = pathlib.Path(path)
+        self.schema = schema
+        self.buffer_rows = buffer_rows
+        self.num_rows = 0
+
+        self._buffer: List[Sequence[Any]] = []
+        self._lock = threading.Lock()
+        self._writer: Optional[Any] = None
+
+        suffix = self.path.suffix
+        if suffix in [".arrow", ".feather"]:
+            self._writer = ipc.new_file(str(self.path), schema)
+        elif suffix == ".parquet":
+            self._writer = pq.ParquetWriter(str(self.path), schema)
+        else:
+            self.schema = pa.schema(
+                [
+                    pa.field(f.name, pa.string())
+                    if pa.types.is_list(f.type)
+                    else f
+                    for f in schema
+                ]
+            )
+            self._writer = pacsv.CSVWriter(str(self.path), self.schema)
+
+    def append(self, rows: Sequence[Sequence[Any]]) -> None:
+        """Append rows, given as sequences of values in column order.
+
+        Rows shorter than the schema are padded with nulls.
+        """
+        with self._lock:
+            self._buffer.extend(rows)
+            if len(self._buffer) >= self.buffer_rows:
+                self._flush()
+
+    def flush(self) -> None:
+        """Write all buffered rows."""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """Write buffered rows and close the output file."""
+        with self._lock:
+            if self._writer is None:
+                return
+            self._flush()
+            self._writer.close()
+            self._writer = None
+
+    def _flush(self) -> None:
+        if len(self._buffer) == 0:
+            return
+        width = len(self.schema)
+        columns: List[List[Any]] = [[] for _ in range(width)]
+        for row in self._buffer:
+            for i in range(width):
+                columns[i].append(row[i] if i < len(row) else None)
+
+        arrays = []
+        for column, field in zip(columns, self.schema):
+            if pa.types.is_string(field.type):
+                column = [None if v is None else str(v) for v in column]
+            arrays.append(pa.array(column, type=field.type))
+
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        self.num_rows += len(self._buffer)
+        self._buffer = []
+
+    def __enter__(self) -> "TableSink":
+        """Enter context."""
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        """Close the sink on exit."""
+        self.close()
@@ -0,0 +1,96 @@
+"""Tests for overlap-table object matching."""
+import numpy as np
+import pytest
+import skimage
+from polus.images.features.region_segmentation_eval import overlap
+
+
+@pytest.fixture
+def labels() -> np.ndarray:
+    """Generate a labeled synthetic image.
+
+    The seed (passed by position, as its name differs between scikit-image
+    versions) gives blobs that are all wider than one pixel. A one pixel wide
+    object has a minor axis length of 0, so it can never be a true positive.
+    """
+    blobs = skimage.data.binary_blobs(512, 0.05, 2, 0.05, 1)
+    return skimage.measure.label(blobs)
+
+
+def test_object_stats(labels) -> None:
+    """Test areas, centroids and minor axis lengths against regionprops."""
+    stats = overlap.object_stats(labels, moments=True)
+    props = skimage.measure.regionprops(labels)
+
+    assert np.array_equal(stats.labels[1:], [p.label for p in props])
+    assert np.array_equal(stats.area[1:], [p.area for p in props])
+    assert np.allclose(stats.centroids[1:], [p.centroid[::-1] for p in props])
+    assert np.allclose(
+        stats.minor_axis_length[1:], [p.minor_axis_length for p in props]
+    )
+
+
+def test_overlap_table(labels) -> None:
+    """Test pairwise intersections against explicit masks."""
+    shifted = np.roll(labels, 3, axis=1)
+    gt = overlap.object_stats(labels)
+    pred = overlap.object_stats(shifted)
+    table = overlap.overlap_table(gt, pred)
+
+    for i, j in [(1, 1), (2, 2), (1, 2), (3, 0)]:
+        expected = np.sum((labels == gt.labels[i]) & (shifted == pred.labels[j]))
+        assert overlap.intersection(table, len(pred.labels), i, j) == expected
+
+
+def test_match_identical(labels) -> None:
+    """Test that identical images only produce true positives."""
+    matches = overlap.match_objects(labels, labels, 1, 0.5, 0.0)
+    num_objects = labels.max()
+
+    assert matches.tp == num_objects
+    assert matches.fp == 0
+    assert matches.fn == 0
+    assert len(matches.data) == num_objects
+    assert all(row[2] == 1.0 for row in matches.data)
+
+
+def test_match_split() -> None:
+    """Test that a split prediction is reported as over segmented."""
+    im_gt = np.zeros((64, 64), dtype=int)
+    im_gt[10:30, 10:30] = 1
+    im_gt[40:50, 40:50] = 2
+    im_pred = im_gt.copy()
+    im_pred[10:30, 20:30] = 3
+
+    matches = overlap.match_objects(im_gt, im_pred, 1, 2.0, 0.0)
+
+    assert matches.over_segmented == 1
+    assert matches.data[0][-1] == "over"
+    assert sorted(matches.data[0][4]) == [1, 3]
+    assert matches.tp == 2
+    assert matches.fp == 1
+
+
+def test_match_crowded() -> None:
+    """Test that an object whose nearest prediction is taken is paired with the next one."""
+    im_gt = np.zeros((80, 80), dtype=int)
+    im_gt[22:28, 17:23] = 1
+    im_gt[30:70, 0:40] = 2
+    im_pred = np.zeros((80, 80), dtype=int)
+    im_pred[22:28, 17:23] = 1
+    # The centroid of this prediction is farther from the second object than the first prediction
+    im_pred[30:70, 26:66] = 2
+
+    matches = overlap.match_objects(im_gt, im_pred, 1, 2.0, 0.1)
+
+    assert matches.tp == 2
+    assert matches.fp == 0
+    assert matches.fn == 0
+    assert matches.data[1][0] == pytest.approx(26.0)
+
+    # Without the second prediction the first one is already taken
+    im_pred[im_pred == 2] = 0
+    matches = overlap.match_objects(im_gt, im_pred, 1, 2.0, 0.1)
+
+    assert matches.tp == 1
+    assert matches.fn == 1
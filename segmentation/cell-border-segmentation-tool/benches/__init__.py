@@ -0,0 +1 @@
+"""Benchmarks for the cell border segmentation plugin."""
@@ -0,0 +1,82 @@
+"""Benchmark segmentation throughput against the number of reader threads.
+
+Run from the plugin root:
+
+    python -m benches.bench_segment --size 8192 --threads 1 2 4 8
+"""
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import polus.images.segmentation.cell_border_segmentation.segment as zs
+from bfio import BioWriter
+from tensorflow import keras
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger("bench_segment")
+logger.setLevel(logging.INFO)
+logging.getLogger("main").setLevel(logging.WARNING)
+
+MODEL_PATH = Path(zs.__file__).parent.joinpath("cnn")
+
+
+def make_image(path: Path, size: int) -> None:
+    """Write a synthetic honeycomb-like border image."""
+    yy, xx = np.mgrid[0:size, 0:size]
+    borders = (np.sin(xx / 12.0) * np.sin(yy / 12.0)) > 0.9  # noqa: PLR2004
+    rng = np.random.default_rng(0)
+    image = (borders * 2000 + rng.normal(500, 50, (size, size))).astype(np.uint16)
+    with BioWriter(path) as bw:
+        bw.X = size
+        bw.Y = size
+        bw.dtype = np.uint16
+        bw[:] = image
+
+
+def main() -> None:
+    """Time segment_image for each requested thread count."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--batch-tiles", type=int, default=zs.BATCH_TILES)
+    args = parser.parse_args()
+
+    model = keras.models.load_model(str(MODEL_PATH))
+    model.compile()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inp_dir = Path(tmp).joinpath("inp")
+        out_dir = Path(tmp).joinpath("out")
+        inp_dir.mkdir()
+        out_dir.mkdir()
+        im_path = inp_dir.joinpath("synthetic.ome.tif")
+        make_image(im_path, args.size)
+        num_tiles = int(np.ceil(args.size / zs.TILE_SIZE)) ** 2
+
+        # Warm up the model so graph tracing is not timed
+        zs.segment_image(model, im_path, out_dir, num_threads=1, batch_tiles=1)
+
+        logger.info(f"{'threads':>8} {'seconds':>10} {'tiles/s':>10}")
+        for num_threads in args.threads:
+            start = time.perf_counter()
+            zs.segment_image(
+                model,
+                im_path,
+                out_dir,
+                num_threads=num_threads,
+                batch_tiles=args.batch_tiles,
+            )
+            elapsed = time.perf_counter() - start
+            logger.info(
+                f"{num_threads:>8} {elapsed:>10.2f} {num_tiles / elapsed:>10.2f}",
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 """Cell border segmentation package."""
 import logging
 import os
+from collections import deque
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import Executor
+from concurrent.futures import Future
 from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from itertools import product
 from multiprocessing import cpu_count
 from pathlib import Path
 from sys import platform
 from typing import Any
+from typing import Callable
 
 import numpy as np
 import tensorflow as tf
@@ -36,6 +43,13 @@ WINDOW_SIZE = 127
 MAX_NORM = 6
 TILE_SIZE = 1024
 OUTPUT_TILE = 1200
+PATCH_SIZE = 256
+PATCH_STRIDE = 200
+PATCHES_PER_TILE = (OUTPUT_TILE // PATCH_STRIDE) ** 2
+
+# Number of image tiles sent to the network in a single inference call
+BATCH_TILES = 4
+INFERENCE_BATCH = 72
 
 
 class ReflectionPadding2D(tf.keras.layers.Layer):
@@ -110,7 +124,11 @@ def imboxfilt(image: np.ndarray, window_size: int) -> np.ndarray:
     )
 
 
-def local_response(image: np.ndarray, window_size: int) -> np.ndarray:
+def local_response(
+    image: np.ndarray,
+    window_size: int,
+    dtype: np.dtype = np.float64,
+) -> np.ndarray:
     """local_response Regional normalization.
 
     This method normalizes each pixel using the mean and standard
@@ -119,9 +137,14 @@ def local_response(image: np.ndarray, window_size: int) -> np.ndarray:
     to normalize by. The image should be padded by window_size//2
     on each side.
 
+    The integral images are always accumulated in float64 since the
+    variance is computed by subtraction, but the normalization itself is
+    carried out in the requested dtype.
+
     Args:
         image ([numpy.ndarray]): 4d array of image tiles
         window_size ([int]): Size of region to normalize
+        dtype ([numpy.dtype]): Data type of the returned array
 
     Returns:
         4d array of image tiles
@@ -129,7 +152,7 @@ def local_response(image: np.ndarray, window_size: int) -> np.ndarray:
     image = image.astype(np.float64)
     local_mean = imboxfilt(image, window_size) / (window_size**2)
     local_mean_square = imboxfilt(image**2, window_size) / (window_size**2)
-    local_std = np.sqrt(local_mean_square - (local_mean**2))
+    local_std = np.sqrt(local_mean_square - (local_mean**2)).astype(dtype)
     local_std[local_std < 10**-3] = 10**-3
     return (
         image[
@@ -137,21 +160,21 @@ def local_response(image: np.ndarray, window_size: int) -> np.ndarray:
             window_size // 2 : -window_size // 2,
             window_size // 2 : -window_size // 2,
             :,
-        ]
-        - local_mean
+        ].astype(dtype)
+        - local_mean.astype(dtype)
     ) / local_std
 
 
-def segment_patch(
-    model: tf.keras.Model,
-    xt: int,
-    yt: int,
-    br: BioReader,
-    bw: BioWriter,
-) -> None:
-    """Pretrained model prediction of cell border.
+def preprocess_patch(xt: int, yt: int, br: BioReader) -> np.ndarray:
+    """Load and normalize the padded region around an image tile.
 
-    This function predicts cell border of padded and normalized image tile.
+    Args:
+        xt: Starting x position of the tile
+        yt: Starting y position of the tile
+        br: BioReader of the input image
+
+    Returns:
+        A float32 array of 256x256 network inputs with shape (36, 256, 256, 1)
     """
     # Load the image
     x_min = max(0, xt - 91)
@@ -176,42 +199,161 @@ def segment_patch(
 
     # Preprocess the image before segmentation
     image = image[None, :, :, None]
-    norm = local_response(image, WINDOW_SIZE)
-    norm[norm > MAX_NORM] = MAX_NORM
-    norm[norm < -MAX_NORM] = -MAX_NORM
+    norm = local_response(image, WINDOW_SIZE, dtype=np.float32)
+    np.clip(norm, -MAX_NORM, MAX_NORM, out=norm)
+
+    norm_tile = np.zeros((PATCHES_PER_TILE, PATCH_SIZE, PATCH_SIZE, 1), np.float32)
+    for i, (x, y) in enumerate(
+        product(
+            range(0, OUTPUT_TILE, PATCH_STRIDE),
+            range(0, OUTPUT_TILE, PATCH_STRIDE),
+        ),
+    ):
+        norm_tile[i, :, :, 0] = norm[0, y : y + PATCH_SIZE, x : x + PATCH_SIZE, 0]
 
-    norm_tile = np.zeros((36, 256, 256, 1))
-    for i, (x, y) in enumerate(product(range(0, 1200, 200), range(0, 1200, 200))):
-        norm_tile[i, :, :, 0] = norm[0, y : y + 256, x : x + 256, 0]
+    return norm_tile
 
-    # Segment the images
-    seg = model.predict(norm_tile, verbose=0)
-    seg = (seg > 0).astype(np.uint8).squeeze()
+
+def stitch_patch(seg: np.ndarray) -> np.ndarray:
+    """Stitch the network outputs of a single tile back together.
+
+    Args:
+        seg: Network outputs for the 36 patches of a tile
+
+    Returns:
+        A binary uint8 array of shape (1200, 1200)
+    """
+    seg = (seg > 0).astype(np.uint8)
 
     output = np.zeros((OUTPUT_TILE, OUTPUT_TILE), dtype=np.uint8)
     for i, (x, y) in enumerate(
-        product(range(0, 1200, 200), range(0, OUTPUT_TILE, 200)),
+        product(
+            range(0, OUTPUT_TILE, PATCH_STRIDE),
+            range(0, OUTPUT_TILE, PATCH_STRIDE),
+        ),
     ):
-        output[y : y + 200, x : x + 200] = seg[i].squeeze()
+        output[y : y + PATCH_STRIDE, x : x + PATCH_STRIDE] = seg[i].squeeze()
+
+    return output
 
+
+def write_patch(
+    xt: int,
+    yt: int,
+    output: np.ndarray,
+    br: BioReader,
+    bw: BioWriter,
+) -> None:
+    """Write a stitched tile, cropping any padding past the image edge."""
     bw[
         yt : yt + min(TILE_SIZE, br.Y - yt),
         xt : xt + min(TILE_SIZE, br.X - xt),
     ] = output[: min(br.Y - yt, TILE_SIZE), : min(br.X - xt, TILE_SIZE)]
 
 
-def segment_image(model: tf.keras.Model, im_path: Path, out_dir: Path) -> None:
-    """Applying segment_patch function on input images."""
+def segment_patch(
+    model: tf.keras.Model,
+    xt: int,
+    yt: int,
+    br: BioReader,
+    bw: BioWriter,
+) -> None:
+    """Pretrained model prediction of cell border.
+
+    This function predicts cell border of padded and normalized image tile.
+    """
+    norm_tile = preprocess_patch(xt, yt, br)
+
+    # Segment the images
+    seg = model.predict(norm_tile, verbose=0)
+
+    write_patch(xt, yt, stitch_patch(seg), br, bw)
+
+
+def _prefetch(
+    executor: Executor,
+    func: Callable[..., Any],
+    args: Iterable[tuple],
+    depth: int,
+) -> Iterator[Any]:
+    """Map a function over an executor, yielding results in submission order.
+
+    At most `depth` calls are in flight at once, which bounds the memory held
+    by results that have not been consumed yet.
+    """
+    args = iter(args)
+    pending: deque[Future] = deque(
+        executor.submit(func, *a) for a in islice(args, depth)
+    )
+    while pending:
+        result = pending.popleft().result()
+        for a in islice(args, 1):
+            pending.append(executor.submit(func, *a))
+        yield result
+
+
+def _batched(iterable: Iterable[Any], n: int) -> Iterator[list[Any]]:
+    """Group an iterable into lists of at most n items."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
+
+
+def segment_image(
+    model: tf.keras.Model,
+    im_path: Path,
+    out_dir: Path,
+    num_threads: int = NUM_THREADS,
+    batch_tiles: int = BATCH_TILES,
+) -> None:
+    """Segment an image with a reader/inference/writer pipeline.
+
+    Tiles are read and normalized by a pool of `num_threads` CPU workers.
+    The calling thread is the only one to run the network, on batches of
+    `batch_tiles` tiles, and a single writer thread commits the stitched
+    outputs in tile order.
+
+    Args:
+        model: Pretrained cell border model
+        im_path: Path to the input image
+        out_dir: Output directory
+        num_threads: Number of threads used to read and normalize tiles
+        batch_tiles: Number of tiles segmented in a single inference call
+    """
     logger.info(f"Segmenting: {im_path.name}")
-    # Loop through files in inpDir image collection and process
     with BioReader(im_path) as br, BioWriter(
         out_dir.joinpath(im_path.name),
         metadata=br.metadata,
     ) as bw:
         bw.dtype = np.uint8
 
-        with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-            executor.map(
-                lambda x: segment_patch(model, x[0], x[1], br, bw),
-                product(range(0, br.X, TILE_SIZE), range(0, br.Y, TILE_SIZE)),
+        tiles = list(product(range(0, br.X, TILE_SIZE), range(0, br.Y, TILE_SIZE)))
+
+        with ThreadPoolExecutor(
+            max_workers=num_threads,
+        ) as readers, ThreadPoolExecutor(max_workers=1) as writer:
+            norm_tiles = _prefetch(
+                readers,
+                preprocess_patch,
+                ((xt, yt, br) for xt, yt in tiles),
+                depth=num_threads + batch_tiles,
             )
+            writes: deque[Future] = deque()
+            for batch in _batched(zip(tiles, norm_tiles), batch_tiles):
+                seg = model.predict(
+                    np.concatenate([norm for _, norm in batch]),
+                    batch_size=INFERENCE_BATCH,
+                    verbose=0,
+                )
+                for i, ((xt, yt), _) in enumerate(batch):
+                    output = stitch_patch(
+                        seg[i * PATCHES_PER_TILE : (i + 1) * PATCHES_PER_TILE],
+                    )
+                    writes.append(writer.submit(write_patch, xt, yt, output, br, bw))
+
+                # Bound the number of stitched tiles waiting to be written
+                while len(writes) > batch_tiles:
+                    writes.popleft().result()
+
+            for write in writes:
+                write.result()
@@ -46,6 +46,34 @@ def test_segment_patch(download_data: Path, output_directory: Path) -> None:
         assert len(np.unique(seg_image)) == 2
 
 
+def test_segment_image_threads(download_data: Path, output_directory: Path) -> None:
+    im = next(download_data.iterdir())
+    outputs = []
+    for num_threads, batch_tiles in [(1, 1), (4, 3)]:
+        out_dir = output_directory.joinpath(f"threads_{num_threads}")
+        out_dir.mkdir()
+        zs.segment_image(
+            model=model,
+            im_path=im,
+            out_dir=out_dir,
+            num_threads=num_threads,
+            batch_tiles=batch_tiles,
+        )
+        with BioReader(out_dir.joinpath(im.name)) as br:
+            outputs.append(br.read())
+
+    assert np.array_equal(outputs[0], outputs[1])
+
+
+def test_preprocess_patch(download_data: Path) -> None:
+    for im in download_data.iterdir():
+        with BioReader(im) as br:
+            norm_tile = zs.preprocess_patch(0, 0, br)
+        assert norm_tile.shape == (zs.PATCHES_PER_TILE, 256, 256, 1)
+        assert norm_tile.dtype == np.float32
+        assert np.abs(norm_tile).max() <= zs.MAX_NORM
+
+
 def test_imboxfilt(download_data: Path) -> None:
     for im in download_data.iterdir():
         br = BioReader(im)
@@ -6,7 +6,11 @@ from .binops import Operation
 from .binops import StructuringShape
 from .binops import batch_binary_ops
 from .binops import binary_op
+from .binops import operation_halo
+from .binops import pipeline_binary_op
 from .binops import scalable_binary_op
+from .components import COMPONENT_OPERATIONS
+from .components import component_op
 from .utils import blackhat
 from .utils import close_
 from .utils import dilate
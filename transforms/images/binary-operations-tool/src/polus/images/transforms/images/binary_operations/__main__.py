@@ -35,8 +35,11 @@ def _main(
     out_dir: pathlib.Path = typer.Option(
         ..., "--outDir", help="Path to place output files."
     ),
-    operation: Operation = typer.Option(
-        ..., "--operation", help="Binary operation to perform."
+    operation: typing.List[str] = typer.Option(
+        ...,
+        "--operation",
+        help="""Binary operation to perform. Repeat the option, or give a comma
+                separated list, to run several operations in order.""",
     ),
     shape: StructuringShape = typer.Option(
         StructuringShape.ELLIPSE,
@@ -64,10 +67,19 @@ def _main(
     """Advanced montaging tool."""
     logger.info(f"version: {__version__}")
 
+    if len(operation) == 1:
+        operation = operation[0].split(",")
+    try:
+        operations = [Operation(op.strip()) for op in operation]
+    except ValueError as e:
+        raise typer.BadParameter(
+            f"{e}. Operations must be among {[op.value for op in Operation]}."
+        ) from e
+
     logger.info(f"filePattern = {pattern}")
     logger.info(f"inpDir = {inp_dir}")
     logger.info(f"outDir = {out_dir}")
-    logger.info(f"operation = {operation}")
+    logger.info(f"operation = {[op.value for op in operations]}")
     logger.info(f"shape = {shape}")
     logger.info(f"kernel = {kernel}")
     logger.info(f"threshold = {threshold}")
@@ -87,7 +99,7 @@ def _main(
         batch_binary_ops(
             inp_dir=inp_dir,
             out_dir=out_dir,
-            operation=operation,
+            operation=operations,
             structuring_shape=shape,
             file_pattern=pattern,
             kernel=kernel,
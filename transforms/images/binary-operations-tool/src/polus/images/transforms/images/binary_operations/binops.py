@@ -1,9 +1,10 @@
 """Primary functions for performing binary operations."""
 
 import logging
+import tempfile
 from enum import Enum
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, List, Optional, Tuple, Union
 
 import cv2
 import numpy
@@ -11,6 +12,7 @@ from bfio import BioReader, BioWriter
 from filepattern import FilePattern
 from preadator import ProcessManager
 
+from .components import COMPONENT_OPERATIONS, TILE_SIZE, component_op
 from .utils import (
     TileTuple,
     blackhat,
@@ -137,34 +139,208 @@ def binary_op(
     return out_image
 
 
-def _tile_thread(
-    filepath: Path,
-    window_slice: TileTuple,
-    step_slice: TileTuple,
-    step_size: int,
+def operation_halo(
+    operation: Union[Operation, str], kernel: int = 3, iterations: int = 1
+) -> Optional[int]:
+    """The number of neighboring pixels an operation needs on each side of a tile.
+
+    Args:
+        operation: The operation to perform.
+        kernel: The kernel size for the structuring shape. Defaults to 3.
+        iterations: Number of iterations of erode and dilate. Defaults to 1.
+
+    Returns:
+        The width of the halo, or None for operations on whole objects.
+    """
+    operation = Operation(operation)
+    radius = kernel // 2
+
+    if operation in COMPONENT_OPERATIONS:
+        return None
+    if operation == Operation.INVERT:
+        return 0
+    if operation in [Operation.DILATE, Operation.ERODE]:
+        return radius * iterations
+    if operation == Operation.MORPHOLOGICAL_GRADIENT:
+        return radius
+    if operation == Operation.SKELETON:
+        # Skeletons depend on whole objects, this only pads like the other operations
+        return kernel
+    # Opening and closing are an erosion and a dilation
+    return 2 * radius
+
+
+class _ChainReader:
+    """Reads tiles of an image through a chain of local operations.
+
+    Each tile is read once with the halo needed by all operations, the
+    operations are applied in memory and the halo is cropped. Tiles are sliced
+    like a BioReader, `reader[y:y_max, x:x_max, 0:1, 0:1, 0:1]`.
+    """
+
+    def __init__(
+        self,
+        reader: Any,
+        shape: Tuple[int, int],
+        operations: List[Operation],
+        **kwargs,
+    ):
+        self.reader = reader
+        self.shape = shape
+        self.operations = operations
+        self.kwargs = kwargs
+        self.halo = sum(
+            operation_halo(op, kwargs["kernel"], kwargs["iterations"])
+            for op in operations
+        )
+
+    def __getitem__(self, index: TileTuple) -> numpy.ndarray:
+        y_slice, x_slice = index[:2]
+        y = max(0, y_slice.start - self.halo)
+        y_max = min(self.shape[0], y_slice.stop + self.halo)
+        x = max(0, x_slice.start - self.halo)
+        x_max = min(self.shape[1], x_slice.stop + self.halo)
+
+        tile = self.reader[y:y_max, x:x_max, 0:1, 0:1, 0:1]
+        tile = numpy.asarray(tile).reshape(y_max - y, x_max - x)
+        for operation in self.operations:
+            tile = binary_op(image=tile, operation=operation, **self.kwargs)
+
+        tile = tile[
+            y_slice.start - y : y_slice.stop - y,  # noqa
+            x_slice.start - x : x_slice.stop - x,  # noqa
+        ]
+        return tile[:, :, None, None, None]
+
+
+def _split_pipeline(
+    operations: List[Operation],
+) -> List[Tuple[List[Operation], Optional[Operation]]]:
+    """Split a pipeline into stages that each read and write the image once.
+
+    Each stage is a run of local operations, followed by at most one operation
+    on whole objects.
+    """
+    stages = []
+    local: List[Operation] = []
+    for operation in operations:
+        if operation in COMPONENT_OPERATIONS:
+            stages.append((local, operation))
+            local = []
+        else:
+            local.append(operation)
+    if local or not stages:
+        stages.append((local, None))
+    return stages
+
+
+def _local_tile(chain: _ChainReader, writer: BioWriter, tile: TileTuple) -> None:
+    with ProcessManager.thread():
+        writer[tile] = chain[tile]
+
+
+def _run_stage(
+    reader: BioReader,
     writer: BioWriter,
-    operation: Union[Operation, str],
+    operations: List[Operation],
+    component_operation: Optional[Operation],
+    **kwargs,
+) -> None:
+    """Run the operations of one stage, reading and writing every tile once."""
+    shape = (reader.Y, reader.X)
+    threshold = kwargs["threshold"]
+    chain = _ChainReader(reader, shape, operations, **kwargs)
+
+    if component_operation is not None:
+        # The operations before are applied when the tiles are read
+        component_op(
+            reader=chain,
+            writer=writer,
+            shape=shape,
+            operation=component_operation.value,
+            threshold=threshold,
+            num_threads=max(1, ProcessManager._active_threads),
+        )
+        return
+
+    for _, tile in iterate_tiles(
+        shape=shape, window_size=TILE_SIZE, step_size=TILE_SIZE
+    ):
+        ProcessManager.submit_thread(_local_tile, chain, writer, tile)
+    ProcessManager.join_threads()
+
+
+def pipeline_binary_op(
+    filepath: Path,
+    out_dir: Path,
+    operations: List[Union[Operation, str]],
     structuring_shape: Union[str, StructuringShape] = StructuringShape.ELLIPSE,
     kernel: int = 3,
     iterations: int = 1,
     threshold: Optional[int] = None,
 ):
-    with ProcessManager.thread():
-        with BioReader(filepath) as br:
-            # read a tile of BioReader
-            tile = br[window_slice]
-
-            out_tile = binary_op(
-                image=tile,
-                operation=operation,
-                structuring_shape=structuring_shape,
-                kernel=kernel,
-                iterations=iterations,
-                threshold=threshold,
-            )
+    """Run a chain of binary operations on an arbitrarily sized image.
 
-            # finalize the output
-            writer[step_slice] = out_tile[0:step_size, 0:step_size]
+    Consecutive local operations, such as open and close, are applied to each
+    tile in memory, after reading the tile with the halo needed by the whole
+    chain. Removing objects and filling holes need whole objects, so they
+    read their input twice (see `component_op`), with the local operations
+    before them applied as tiles are read. The image is written once for each
+    of these operations that is followed by more operations, and once at the
+    end.
+
+    Args:
+        filepath: Path to image file to process.
+        out_dir: Output path to put processed data.
+        operations: The operations to perform, in order.
+        structuring_shape: The shape of the structuring element used by the
+            operations. Defaults to StructuringShape.ELLIPSE.
+        kernel: Size of the kernel. Defaults to 3.
+        iterations: Number of iterations of erode and dilate. Defaults to 1.
+        threshold: Object size threshold of `remove_large` and `remove_small`.
+            Defaults to None.
+    """
+    if ProcessManager._thread_executor is None:
+        ProcessManager.init_threads()
+
+    operations = [Operation(op) for op in operations]
+    if len(operations) == 0:
+        raise ValueError("At least one operation must be given.")
+    if any(op in [Operation.REMOVE_LARGE, Operation.REMOVE_SMALL] for op in operations):
+        assert (
+            threshold is not None
+        ), "If removing large or small objects, the threshold value must be set."
+    assert kernel is not None, "The kernel size must be a positive number."
+
+    kwargs = {
+        "structuring_shape": structuring_shape,
+        "kernel": kernel,
+        "iterations": iterations,
+        "threshold": threshold,
+    }
+
+    # Create the output file path
+    out_path = out_dir.joinpath(filepath.name)
+    stages = _split_pipeline(operations)
+
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+        in_path = filepath
+        for i, (local_operations, component_operation) in enumerate(stages):
+            if i == len(stages) - 1:
+                stage_path = out_path
+            else:
+                stage_path = Path(tmp_dir).joinpath(f"stage_{i}_{filepath.name}")
+
+            logger.debug(
+                f"{filepath.name}: stage {i} runs {local_operations} "
+                f"and {component_operation}"
+            )
+            with BioReader(in_path) as br:
+                with BioWriter(stage_path, metadata=br.metadata) as bw:
+                    _run_stage(
+                        br, bw, local_operations, component_operation, **kwargs
+                    )
+            in_path = stage_path
 
 
 def scalable_binary_op(
@@ -195,69 +371,35 @@ def scalable_binary_op(
         threshold: Object size threshold. Only used for `remove_large` and
             `remove_small`. When `remove_large`, objects above the threshold are
             removed.Defaults to None.
-    """
-    if ProcessManager._thread_executor is None:
-        ProcessManager.init_threads()
-
-    if threshold is None:
-        assert kernel is not None, "The kernel size must be a positive number."
-        extra_padding = kernel
-    else:
-        extra_padding = 512
-
-    if operation in [Operation.REMOVE_LARGE, Operation.REMOVE_SMALL]:
-        assert (
-            threshold is not None
-        ), "If removing large or small objects, the threshold value must be set."
-
-    # Create the output file path
-    out_path = out_dir.joinpath(filepath.name)
 
-    with BioReader(filepath) as br:
-        metadata = br.metadata
-
-    with BioWriter(out_path, metadata=metadata) as bw:
-        assert br.shape == bw.shape
-        bfio_shape: tuple = br.shape
-
-        step_size: int = 8 * br._TILE_SIZE
-        window_size: int = step_size + (2 * extra_padding)
-
-        for window_slice, step_slice in iterate_tiles(
-            shape=bfio_shape, window_size=window_size, step_size=step_size
-        ):
-            # info on the Slices for debugging
-            ProcessManager.submit_thread(
-                _tile_thread,
-                filepath=filepath,
-                window_slice=window_slice,
-                step_slice=step_slice,
-                step_size=step_size,
-                writer=bw,
-                operation=operation,
-                structuring_shape=structuring_shape,
-                kernel=kernel,
-                iterations=iterations,
-                threshold=threshold,
-            )
-
-        ProcessManager.join_threads()
+    Removing objects and filling holes label objects across tile borders, so the
+    result does not depend on the tiles.
+    """
+    pipeline_binary_op(
+        filepath=filepath,
+        out_dir=out_dir,
+        operations=[operation],
+        structuring_shape=structuring_shape,
+        kernel=kernel,
+        iterations=iterations,
+        threshold=threshold,
+    )
 
 
 def _batch_process(
     filepath: Path,
     out_dir: Path,
-    operation: Union[Operation, str],
+    operations: List[Union[Operation, str]],
     structuring_shape: Union[str, StructuringShape] = StructuringShape.ELLIPSE,
     kernel: int = 3,
     iterations: int = 1,
     threshold: Optional[int] = None,
 ):
     with ProcessManager.process(filepath.name):
-        scalable_binary_op(
+        pipeline_binary_op(
             filepath=filepath,
             out_dir=out_dir,
-            operation=operation,
+            operations=operations,
             structuring_shape=structuring_shape,
             kernel=kernel,
             iterations=iterations,
@@ -268,7 +410,7 @@ def _batch_process(
 def batch_binary_ops(
     inp_dir: Path,
     out_dir: Path,
-    operation: str,
+    operation: Union[str, List[Union[Operation, str]]],
     file_pattern: str = ".+",
     kernel: int = 3,
     structuring_shape: Union[StructuringShape, int] = StructuringShape.ELLIPSE,
@@ -283,7 +425,8 @@ def batch_binary_ops(
     Args:
         inp_dir: Path to image files to process.
         out_dir: Output path to put processed data.
-        operation: The operation to perform.
+        operation: The operation to perform, or a list of operations to perform in
+            order (see `pipeline_binary_op`).
         file_pattern: The filepattern used to select a subset of the data.
         kernel: Size of the kernel. Defaults to 3.
         structuring_shape: The shape of the structuring element used to perform the
@@ -295,6 +438,11 @@ def batch_binary_ops(
             `remove_small`. When `remove_large`, objects above the threshold are
             removed.Defaults to None.
     """
+    if isinstance(operation, str):
+        operations = [operation]
+    else:
+        operations = list(operation)
+
     ProcessManager.init_processes()
 
     fp = FilePattern(inp_dir, pattern=file_pattern)
@@ -304,7 +452,7 @@ def batch_binary_ops(
                 _batch_process,
                 Path(file),
                 out_dir,
-                operation,
+                operations,
                 structuring_shape,
                 kernel,
                 iterations,
@@ -0,0 +1,376 @@
+"""Connected-component operations that are exact on tiled images.
+
+Objects are 8-connected groups of pixels with the same nonzero value. A binary
+image has one object per connected foreground region, and an instance-labelled
+image has one object per connected part of each label. Holes are 4-connected
+groups of background pixels that do not touch the border of the image.
+
+Images are processed in two passes over tiles, so memory does not depend on
+the size of the image:
+
+1. Each tile is labelled on its own. The pieces of objects that touch the
+   border of the tile are recorded with their area, and pieces that touch
+   across the border of two tiles are merged with a union-find. Only the last
+   row of labels of the previous row of tiles is kept for this.
+2. Each tile is labelled again, and every piece is kept or removed based on
+   the area, or border contact, of the whole object it belongs to.
+
+Tiles are labelled in threads. In the first pass, they are merged in raster
+order by the calling thread.
+"""
+
+import collections
+import concurrent.futures
+import logging
+from typing import Any, Dict, Generator, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("components")
+
+TILE_SIZE = 2048
+
+COMPONENT_OPERATIONS = ["removeSmall", "removeLarge", "fillHoles"]
+
+
+class _TileSummary(NamedTuple):
+    """Labels and values on the edges of a labelled tile."""
+
+    areas: np.ndarray
+    top: Tuple[np.ndarray, np.ndarray]
+    bottom: Tuple[np.ndarray, np.ndarray]
+    left: Tuple[np.ndarray, np.ndarray]
+    right: Tuple[np.ndarray, np.ndarray]
+
+
+class _UnionFind:
+    """Union-find over the pieces of objects that touch a tile border.
+
+    Each piece is identified by its label in the tile plus the offset of the
+    tile. The root of every set holds the total area of the object and whether
+    it touches the border of the image.
+    """
+
+    def __init__(self) -> None:
+        self.parent: Dict[int, int] = {}
+        self.area: Dict[int, int] = {}
+        self.on_border: Dict[int, bool] = {}
+
+    def add(self, key: int, area: int, on_border: bool) -> None:
+        self.parent[key] = key
+        self.area[key] = area
+        self.on_border[key] = on_border
+
+    def find(self, key: int) -> int:
+        root = key
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[key] != root:
+            self.parent[key], key = root, self.parent[key]
+        return root
+
+    def union(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.area[a] < self.area[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.area[a] += self.area.pop(b)
+        self.on_border[a] |= self.on_border.pop(b)
+
+    def resolve(self) -> Dict[int, Tuple[int, bool]]:
+        """Returns the area and border contact of the object of every piece."""
+        return {
+            key: (self.area[root], self.on_border[root])
+            for key, root in ((key, self.find(key)) for key in self.parent)
+        }
+
+
+def label_tile(
+    tile: np.ndarray, background: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Label the objects, or the background regions, of a 2d tile.
+
+    Args:
+        tile: The tile to label.
+        background: Label 4-connected background regions instead of objects.
+
+    Returns:
+        The labels of the tile, where 0 is not part of any region, and the area
+        of each label.
+    """
+    if background:
+        mask = (tile == 0).astype(np.uint8)
+        _, labels = cv2.connectedComponents(mask, connectivity=4, ltype=cv2.CV_32S)
+        return labels, np.bincount(labels.ravel())
+
+    mask = (tile != 0).astype(np.uint8)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+        mask, connectivity=8, ltype=cv2.CV_32S
+    )
+
+    # Split the regions where touching objects have different values
+    foreground = labels.ravel() != 0
+    values = tile.ravel()[foreground]
+    low = np.full(num_labels, values.max(initial=0), dtype=tile.dtype)
+    high = np.zeros(num_labels, dtype=tile.dtype)
+    np.minimum.at(low, labels.ravel()[foreground], values)
+    np.maximum.at(high, labels.ravel()[foreground], values)
+
+    for label in np.flatnonzero(low != high):
+        x, y, w, h = stats[label, :4]
+        crop_labels = labels[y : y + h, x : x + w]  # noqa
+        crop = tile[y : y + h, x : x + w]  # noqa
+        region = crop_labels == label
+
+        # Each part gets a new label, which leaves a gap at the old one
+        for value in np.unique(crop[region]):
+            num_parts, parts = cv2.connectedComponents(
+                (region & (crop == value)).astype(np.uint8),
+                connectivity=8,
+                ltype=cv2.CV_32S,
+            )
+            new_labels = np.arange(num_labels - 1, num_labels + num_parts - 1)
+            part = parts != 0
+            crop_labels[part] = new_labels[parts[part]]
+            num_labels += num_parts - 1
+
+    return labels, np.bincount(labels.ravel(), minlength=num_labels)
+
+
+def _read_tile(reader: Any, tile: Tuple[int, int, int, int]) -> np.ndarray:
+    y, y_max, x, x_max = tile
+    return np.asarray(reader[y:y_max, x:x_max, 0:1, 0:1, 0:1]).reshape(
+        y_max - y, x_max - x
+    )
+
+
+def _summarize_tile(
+    reader: Any, tile: Tuple[int, int, int, int], background: bool
+) -> _TileSummary:
+    image = _read_tile(reader, tile)
+    labels, areas = label_tile(image, background)
+    return _TileSummary(
+        areas=areas,
+        top=(labels[0], image[0]),
+        bottom=(labels[-1], image[-1]),
+        left=(labels[:, 0], image[:, 0]),
+        right=(labels[:, -1], image[:, -1]),
+    )
+
+
+def _iterate_tiles(
+    shape: Tuple[int, int], tile_size: int
+) -> Generator[Tuple[int, int, int, int], None, None]:
+    """Iterate through the tiles of an image in raster order."""
+    for y in range(0, shape[0], tile_size):
+        y_max = min(shape[0], y + tile_size)
+        for x in range(0, shape[1], tile_size):
+            x_max = min(shape[1], x + tile_size)
+            yield y, y_max, x, x_max
+
+
+def _touching_pairs(
+    edge: Tuple[np.ndarray, np.ndarray],
+    other_edge: Tuple[np.ndarray, np.ndarray],
+    start: int,
+    background: bool,
+) -> np.ndarray:
+    """Find the pieces that touch across a tile border.
+
+    The labels and values of `edge` are next to those of `other_edge`, from
+    index `start`. Objects also touch diagonally and must have the same value.
+
+    Returns:
+        Unique pairs of touching labels.
+    """
+    labels, values = edge
+    other_labels, other_values = other_edge
+    index = np.arange(len(labels))
+
+    pairs = []
+    for shift in [0] if background else [-1, 0, 1]:
+        other = index + start + shift
+        valid = (other >= 0) & (other < len(other_labels))
+        a, b = labels[index[valid]], other_labels[other[valid]]
+        touching = (a != 0) & (b != 0)
+        if not background:
+            touching &= values[index[valid]] == other_values[other[valid]]
+        pairs.append(np.stack([a[touching], b[touching]], axis=1))
+
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+class _PieceMerger:
+    """Merges the pieces of labelled tiles in raster order.
+
+    Only the labels and values of the last row of the previous row of tiles,
+    and of the last column of the previous tile, are kept.
+    """
+
+    def __init__(self, shape: Tuple[int, int], background: bool) -> None:
+        self.shape = shape
+        self.background = background
+        self.pieces = _UnionFind()
+        self.offsets: List[int] = []
+        self.num_labels = 0
+
+        self.above: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.below: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.left: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def merge(self, tile: Tuple[int, int, int, int], summary: _TileSummary) -> None:
+        """Add the pieces of a tile and merge them with the tiles above and left."""
+        height, width = self.shape
+        y, y_max, x, x_max = tile
+        offset = self.num_labels
+        self.offsets.append(offset)
+        self.num_labels += len(summary.areas)
+
+        # Record the pieces on the border of the tile
+        edges = [summary.top, summary.bottom, summary.left, summary.right]
+        image_border = [y == 0, y_max == height, x == 0, x_max == width]
+        on_border: Dict[int, bool] = {}
+        for (labels, _), is_image_border in zip(edges, image_border):
+            for label in np.unique(labels[labels != 0]).tolist():
+                on_border[label] = on_border.get(label, False) or is_image_border
+        for label, is_image_border in on_border.items():
+            self.pieces.add(offset + label, int(summary.areas[label]), is_image_border)
+
+        def keys(edge: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+            labels, values = edge
+            return np.where(labels != 0, labels.astype(np.int64) + offset, 0), values
+
+        if self.below is None:
+            dtype = summary.bottom[1].dtype
+            self.above = (np.zeros(width, np.int64), np.zeros(width, dtype))
+            self.below = (np.zeros(width, np.int64), np.zeros(width, dtype))
+
+        # Merge with the tiles above and to the left
+        pairs = []
+        if y > 0:
+            top = keys(summary.top)
+            pairs.append(_touching_pairs(top, self.above, x, self.background))
+        if x > 0:
+            left = keys(summary.left)
+            pairs.append(_touching_pairs(left, self.left, 0, self.background))
+        for a, b in np.concatenate(pairs).tolist() if pairs else []:
+            self.pieces.union(a, b)
+
+        bottom_labels, bottom_values = keys(summary.bottom)
+        self.below[0][x:x_max] = bottom_labels
+        self.below[1][x:x_max] = bottom_values
+        self.left = keys(summary.right)
+        if x_max == width:
+            self.above, self.below = self.below, self.above
+
+
+def _filter_tile(  # noqa: PLR0913
+    reader: Any,
+    writer: Any,
+    tile: Tuple[int, int, int, int],
+    offset: int,
+    objects: Dict[int, Tuple[int, bool]],
+    operation: str,
+    threshold: Optional[int],
+) -> None:
+    """The second pass on a tile: keep or remove every piece of the tile."""
+    y, y_max, x, x_max = tile
+    image = _read_tile(reader, tile)
+    labels, areas = label_tile(image, background=operation == "fillHoles")
+
+    # Pieces on the border of the tile are part of larger objects
+    on_border = np.zeros(len(areas), dtype=bool)
+    edges = np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]])
+    for label in np.unique(edges[edges != 0]).tolist():
+        areas[label], on_border[label] = objects[offset + label]
+
+    if operation == "fillHoles":
+        hole = ~on_border
+        hole[0] = False
+        out_tile = np.where(hole[labels], 1, image).astype(image.dtype)
+    elif operation == "removeSmall":
+        out_tile = np.where(areas[labels] >= threshold, image, 0).astype(image.dtype)
+    else:
+        out_tile = np.where(areas[labels] <= threshold, image, 0).astype(image.dtype)
+
+    writer[y:y_max, x:x_max, 0:1, 0:1, 0:1] = out_tile[:, :, None, None, None]
+
+
+def component_op(  # noqa: PLR0913
+    reader: Any,
+    writer: Any,
+    shape: Tuple[int, int],
+    operation: str,
+    threshold: Optional[int] = None,
+    tile_size: int = TILE_SIZE,
+    num_threads: int = 1,
+) -> None:
+    """Run a connected-component operation on an arbitrarily sized 2d image.
+
+    The result is the same as running the operation on the whole image, no
+    matter the tile size.
+
+    Args:
+        reader: The input image, a BioReader or a 5d numpy array. Only the
+            first z-slice, channel and timepoint are used.
+        writer: The output image, a BioWriter or a 5d numpy array.
+        shape: Height and width of the image.
+        operation: One of `COMPONENT_OPERATIONS`. `removeSmall` removes objects
+            with an area below the threshold, `removeLarge` removes objects
+            with an area above the threshold, and `fillHoles` sets the pixels
+            of holes to 1.
+        threshold: The area threshold of `removeSmall` and `removeLarge`.
+        tile_size: Height and width of the tiles.
+        num_threads: Number of threads used to label tiles.
+    """
+    if operation not in COMPONENT_OPERATIONS:
+        raise ValueError(
+            f"Operation must be one of {COMPONENT_OPERATIONS}, got {operation}."
+        )
+    if operation != "fillHoles" and threshold is None:
+        raise ValueError("The threshold must be set to remove objects.")
+
+    shape = (int(shape[0]), int(shape[1]))
+    tiles = list(_iterate_tiles(shape, tile_size))
+    merger = _PieceMerger(shape, background=operation == "fillHoles")
+
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+        # First pass, label tiles in threads and merge them in order
+        pending: collections.deque = collections.deque()
+        for tile in tiles:
+            future = executor.submit(_summarize_tile, reader, tile, merger.background)
+            pending.append((tile, future))
+
+            # Limit the number of labelled tiles held in memory
+            if len(pending) > 2 * num_threads:
+                merger.merge(*_result(pending.popleft()))
+        while pending:
+            merger.merge(*_result(pending.popleft()))
+
+        objects = merger.pieces.resolve()
+        logger.debug(f"Merged {len(objects)} pieces on {len(tiles)} tile borders")
+
+        # Second pass, keep or remove the pieces of each tile
+        futures = [
+            executor.submit(
+                _filter_tile,
+                reader,
+                writer,
+                tile,
+                offset,
+                objects,
+                operation,
+                threshold,
+            )
+            for tile, offset in zip(tiles, merger.offsets)
+        ]
+        for future in futures:
+            future.result()
+
+
+def _result(item: Tuple[Any, concurrent.futures.Future]) -> Tuple[Any, Any]:
+    tile, future = item
+    return tile, future.result()
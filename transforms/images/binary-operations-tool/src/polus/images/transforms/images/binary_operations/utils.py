@@ -1,11 +1,13 @@
 """Binary operations and processing utilities."""
 
 import logging
-from typing import Any, Generator, Tuple
+from typing import Any, Generator, Optional, Tuple
 
 import cv2
 import numpy as np
 
+from .components import component_op
+
 logger = logging.getLogger("utils")
 
 TileTuple = Tuple[slice, slice, slice, slice, slice]
@@ -102,32 +104,31 @@ def morphgradient(image: np.ndarray, kernel: Any, n: int = 1) -> np.ndarray:
     return mg
 
 
+def _component_op(
+    image: np.ndarray, operation: str, threshold: Optional[int] = None
+) -> np.ndarray:
+    """Run a connected-component operation on the first plane of an image."""
+    image_5d = image.reshape(image.shape[:2] + (1, 1, 1))
+    out_image = np.zeros_like(image_5d)
+    component_op(image_5d, out_image, image.shape[:2], operation, threshold)
+    return out_image.reshape(image.shape)
+
+
 def fill_holes(image: np.ndarray, kernel: Any = None, n: int = 0) -> np.ndarray:
     """Fill holes in objects.
 
-    This algorithm was modeled off this Stack Overflow answer.
-    https://stackoverflow.com/questions/10316057/filling-holes-inside-a-binary-object
+    Holes are regions of background pixels that do not touch the border of the
+    image. They are set to 1, and the objects keep their values.
 
     Args:
-        image: Image to perform morphological gradient on.
+        image: Image to fill holes in.
         kernel: Not used.
         n: Not used.
 
     Returns:
         An image with holes inside of objects filled in.
     """
-    image_dtype = image.dtype
-    image = cv2.convertScaleAbs(image)
-    contour, _ = cv2.findContours(
-        image, mode=cv2.RETR_CCOMP, method=cv2.CHAIN_APPROX_SIMPLE
-    )
-
-    for cnt in contour:
-        cv2.drawContours(image, [cnt], 0, 1, -1)
-
-    image = image.astype(image_dtype)
-
-    return image
+    return _component_op(image, "fillHoles")
 
 
 def skeletonize(image: np.ndarray, kernel: Any, n: int = 0) -> np.ndarray:
@@ -194,7 +195,8 @@ def blackhat(image: np.ndarray, kernel: Any = None, n: int = 0) -> np.ndarray:
 def remove_small(image: np.ndarray, kernel: Any = None, n: int = 2) -> np.ndarray:
     """Remove small objects from the image.
 
-    Removes all objects in the image that have an area larger than the threshold.
+    Removes all objects in the image that have an area smaller than the threshold.
+    Objects are connected pixels with the same nonzero value.
 
     Args:
         image: Image to remove small objects from.
@@ -204,36 +206,25 @@ def remove_small(image: np.ndarray, kernel: Any = None, n: int = 2) -> np.ndarra
     Returns:
         An image with small objects removed.
     """
-    uniques, inverse, counts = np.unique(image, return_inverse=True, return_counts=True)
-
-    uniques[counts < n] = 0
-
-    image_out = uniques[inverse].reshape(image.shape)
-
-    return image_out
+    return _component_op(image, "removeSmall", n)
 
 
 def remove_large(image: np.ndarray, kernel: Any = None, n: int = 0) -> np.ndarray:
-    """Remove small objects from the image.
+    """Remove large objects from the image.
 
     Removes all objects in the image that have an area larger than the threshold.
+    Objects are connected pixels with the same nonzero value.
 
     Args:
-        image: Image to remove small objects from.
+        image: Image to remove large objects from.
         kernel: Not used.
-        n: Threshold size under which objects will be removed. Defaults to 2.
+        n: Threshold size over which objects will be removed.
 
     Returns:
-        An image with small objects removed.
+        An image with large objects removed.
     """
     assert n > 0, "n must be a positive, non-zero value"
-    uniques, inverse, counts = np.unique(image, return_inverse=True, return_counts=True)
-
-    uniques[counts > n] = 0
-
-    image_out = uniques[inverse].reshape(image.shape)
-
-    return image_out
+    return _component_op(image, "removeLarge", n)
 
 
 def iterate_tiles(
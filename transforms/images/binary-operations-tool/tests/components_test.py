@@ -0,0 +1,124 @@
+# noqa
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+from bfio import BioReader
+from bfio import BioWriter
+from polus.images.transforms.images.binary_operations import component_op
+from polus.images.transforms.images.binary_operations import scalable_binary_op
+
+
+def _run(image, operation, threshold=None, tile_size=2048):  # noqa
+    out_image = np.zeros_like(image)
+    component_op(
+        image[:, :, None, None, None],
+        out_image[:, :, None, None, None],
+        image.shape,
+        operation,
+        threshold,
+        tile_size=tile_size,
+        num_threads=2,
+    )
+    return out_image
+
+
+def _random_image(seed, instances=False):  # noqa
+    rng = np.random.default_rng(seed)
+    noise = cv2.GaussianBlur(rng.random((97, 83)), (0, 0), 1.5)
+    image = (noise > np.median(noise)).astype(np.uint16)
+    if instances:
+        values = cv2.GaussianBlur(rng.random((97, 83)), (0, 0), 3)
+        image *= 1 + (values * 40).astype(np.uint16) % 4
+    return image
+
+
+class ComponentsTest(unittest.TestCase):
+    """Tests for connected-component operations across tile borders."""
+
+    def test_object_across_tiles(self):  # noqa
+        image = np.zeros((40, 40), dtype=np.uint8)
+        image[5:35, 18:22] = 1  # crosses a tile border
+        image[2:4, 2:4] = 1  # area 4
+        image[35:37, 22:24] = 1  # touches the first object diagonally
+
+        small_removed = _run(image, "removeSmall", 10, tile_size=16)
+        np.testing.assert_array_equal(small_removed[5:35, 18:22], 1)
+        assert small_removed[2:4, 2:4].sum() == 0
+        assert small_removed[35:37, 22:24].sum() == 4
+
+        large_removed = _run(image, "removeLarge", 10, tile_size=16)
+        assert large_removed[5:35, 18:22].sum() == 0
+        np.testing.assert_array_equal(large_removed[2:4, 2:4], 1)
+
+    def test_diagonal_across_tile_corner(self):  # noqa
+        image = np.zeros((8, 8), dtype=np.uint8)
+        image[3, 3] = image[4, 4] = image[3, 5] = image[2, 6] = 1
+
+        assert _run(image, "removeSmall", 4, tile_size=4).sum() == 4
+        assert _run(image, "removeLarge", 3, tile_size=4).sum() == 0
+
+    def test_touching_instances(self):  # noqa
+        image = np.zeros((20, 20), dtype=np.uint8)
+        image[2:18, 2:10] = 5
+        image[2:18, 10:12] = 7
+
+        out_image = _run(image, "removeSmall", 50, tile_size=8)
+        assert (out_image == 5).sum() == 128
+        assert (out_image == 7).sum() == 0
+
+    def test_fill_holes_across_tiles(self):  # noqa
+        image = np.zeros((30, 30), dtype=np.uint8)
+        image[5:25, 5:25] = 1
+        image[8:22, 8:22] = 0  # a hole across 4 tiles
+        image[0:10, 27] = 1  # a gap along the image border is not a hole
+
+        out_image = _run(image, "fillHoles", tile_size=10)
+        np.testing.assert_array_equal(out_image[5:25, 5:25], 1)
+        assert out_image[0:10, 28:30].sum() == 0
+        assert out_image.sum() == 400 + 10
+
+    def test_tile_size_does_not_change_result(self):  # noqa
+        for seed in range(4):
+            for instances in (False, True):
+                image = _random_image(seed, instances)
+                for operation, threshold in [
+                    ("removeSmall", 30),
+                    ("removeLarge", 30),
+                    ("fillHoles", None),
+                ]:
+                    expected = _run(image, operation, threshold)
+                    for tile_size in (7, 16, 40):
+                        np.testing.assert_array_equal(
+                            _run(image, operation, threshold, tile_size),
+                            expected,
+                        )
+
+    def test_scalable_binary_op(self):  # noqa
+        image = np.zeros((2500, 2300), dtype=np.uint8)
+        image[2000:2100, 10:2200] = 1  # crosses a tile border
+        image[1000:1010, 1000:1010] = 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            input_path = Path(os.path.join(tmpdirname, "input.ome.tif"))
+            out_dir = Path(os.path.join(tmpdirname, "out"))
+            out_dir.mkdir()
+
+            with BioWriter(input_path, X=2300, Y=2500, dtype=np.uint8) as bw:
+                bw[:] = image
+
+            scalable_binary_op(input_path, out_dir, "removeLarge", threshold=1000)
+
+            with BioReader(out_dir.joinpath("input.ome.tif")) as br:
+                out_image = br[:].squeeze()
+
+        assert out_image[2000:2100, 10:2200].sum() == 0
+        assert out_image[1000:1010, 1000:1010].sum() == 100
+
+
+if __name__ == "__main__":
+    unittest.main()
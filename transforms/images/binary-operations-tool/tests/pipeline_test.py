@@ -0,0 +1,64 @@
+# noqa
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+from bfio import BioReader
+from bfio import BioWriter
+from polus.images.transforms.images.binary_operations import binary_op
+from polus.images.transforms.images.binary_operations import operation_halo
+from polus.images.transforms.images.binary_operations import pipeline_binary_op
+
+
+class PipelineTest(unittest.TestCase):
+    """Tests for chained binary operations on tiled images."""
+
+    def test_operation_halo(self):  # noqa
+        assert operation_halo("invert", kernel=5) == 0
+        assert operation_halo("dilate", kernel=5, iterations=3) == 6
+        assert operation_halo("open", kernel=5) == 4
+        assert operation_halo("morphologicalGradient", kernel=7) == 3
+        assert operation_halo("removeSmall") is None
+
+    def test_pipeline_matches_whole_image(self):  # noqa
+        rng = np.random.default_rng(0)
+        noise = cv2.GaussianBlur(rng.random((2300, 2200)), (0, 0), 4)
+        image = (noise > np.median(noise)).astype(np.uint8)
+        kwargs = {"kernel": 7, "iterations": 2, "threshold": 300}
+
+        pipelines = [
+            ["erode", "dilate", "close", "morphologicalGradient"],
+            ["fillHoles", "open", "removeSmall"],
+            ["removeLarge", "dilate"],
+        ]
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            input_path = Path(os.path.join(tmpdirname, "input.ome.tif"))
+            out_dir = Path(os.path.join(tmpdirname, "out"))
+            out_dir.mkdir()
+
+            with BioWriter(input_path, X=2200, Y=2300, dtype=np.uint8) as bw:
+                bw[:] = image
+
+            for operations in pipelines:
+                expected = image
+                for operation in operations:
+                    expected = binary_op(expected, operation, **kwargs)
+
+                pipeline_binary_op(input_path, out_dir, operations, **kwargs)
+
+                with BioReader(out_dir.joinpath("input.ome.tif")) as br:
+                    out_image = br[:].squeeze()
+
+                np.testing.assert_array_equal(out_image, expected)
+
+                # Intermediate images are removed
+                assert [p.name for p in out_dir.iterdir()] == ["input.ome.tif"]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""Benchmark the fused expression mode against chained two-operand operations.
+
+A flat-field correction `(image - dark) / (flat - dark) * 1000` is computed
+on synthetic float32 images, once as a single expression and once by chaining
+`process_image` runs: two subtractions, a division and a multiplication by a
+constant image. The chained runs write every intermediate image to disk.
+
+Run from the plugin root:
+
+    python benches/bench_expression.py --sizes 2048 8192 --repeats 3
+"""
+
+import argparse
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+import bfio
+import numpy
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1].joinpath("src")))
+
+from polus.images.transforms.images import image_calculator  # noqa: E402
+
+EXPRESSION = "(image - dark) / (flat - dark) * 1000"
+
+
+def _write_image(path: pathlib.Path, data: numpy.ndarray) -> None:
+    with bfio.BioWriter(path) as writer:
+        writer.Y, writer.X = data.shape
+        writer.dtype = data.dtype
+        writer[:] = data
+
+
+def make_images(data_dir: pathlib.Path, size: int) -> dict[str, pathlib.Path]:
+    """Write the image, dark, flat and constant images, one per directory."""
+    rng = numpy.random.default_rng(0)
+    arrays = {
+        "image": rng.uniform(200, 4000, (size, size)),
+        "dark": rng.uniform(90, 110, (size, size)),
+        "flat": rng.uniform(3000, 4000, (size, size)),
+        "constant": numpy.full((size, size), 1000),
+    }
+
+    paths = {}
+    for name, data in arrays.items():
+        name_dir = data_dir.joinpath(name)
+        name_dir.mkdir()
+        paths[name] = name_dir.joinpath("img.ome.tif")
+        _write_image(paths[name], data.astype(numpy.float32))
+    return paths
+
+
+def run_chained(paths: dict[str, pathlib.Path], out_dir: pathlib.Path) -> pathlib.Path:
+    """Compute the expression with two-operand operations."""
+    steps = [
+        ("image", "dark", image_calculator.Operation.Subtract),
+        ("flat", "dark", image_calculator.Operation.Subtract),
+        ("step_0", "step_1", image_calculator.Operation.Divide),
+        ("step_2", "constant", image_calculator.Operation.Multiply),
+    ]
+    paths = dict(paths)
+    for i, (primary, secondary, operation) in enumerate(steps):
+        step_dir = out_dir.joinpath(f"step_{i}")
+        step_dir.mkdir()
+        image_calculator.process_image(
+            paths[primary],
+            paths[secondary],
+            step_dir,
+            operation,
+        )
+        paths[f"step_{i}"] = step_dir.joinpath(paths[primary].name)
+    return paths[f"step_{len(steps) - 1}"]
+
+
+def run_fused(paths: dict[str, pathlib.Path], out_dir: pathlib.Path) -> pathlib.Path:
+    """Compute the expression in a single pass."""
+    fused_dir = out_dir.joinpath("fused")
+    fused_dir.mkdir()
+    return image_calculator.process_expression(EXPRESSION, paths, fused_dir)
+
+
+def main_bench() -> None:
+    """Time both modes on every image size."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2048, 8192])
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    print(  # noqa: T201
+        "{:>6} {:>12} {:>12} {:>9} {:>12}".format(
+            "size",
+            "chained (s)",
+            "fused (s)",
+            "speedup",
+            "max diff",
+        ),
+    )
+    for size in args.sizes:
+        data_dir = pathlib.Path(tempfile.mkdtemp(suffix="_bench"))
+        try:
+            paths = make_images(data_dir, size)
+
+            times: dict[str, list[float]] = {"chained": [], "fused": []}
+            outputs = {}
+            for i in range(args.repeats):
+                for name, run in (("chained", run_chained), ("fused", run_fused)):
+                    out_dir = data_dir.joinpath(f"{name}_{i}")
+                    out_dir.mkdir()
+                    start = time.perf_counter()
+                    outputs[name] = run(paths, out_dir)
+                    times[name].append(time.perf_counter() - start)
+
+            with (
+                bfio.BioReader(outputs["chained"]) as chained,
+                bfio.BioReader(outputs["fused"]) as fused,
+            ):
+                diff = numpy.max(numpy.abs(chained[:] - fused[:]))
+
+            chained_time, fused_time = min(times["chained"]), min(times["fused"])
+            print(  # noqa: T201
+                "{:>6} {:>12.3f} {:>12.3f} {:>9.2f} {:>12.2e}".format(
+                    size,
+                    chained_time,
+                    fused_time,
+                    chained_time / fused_time,
+                    diff,
+                ),
+            )
+        finally:
+            shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    main_bench()
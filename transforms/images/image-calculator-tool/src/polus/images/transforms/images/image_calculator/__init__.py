@@ -3,7 +3,10 @@
 from .calculator import MAX_WORKERS
 from .calculator import POLUS_IMG_EXT
 from .calculator import POLUS_LOG
+from .calculator import THREADS_PER_PROCESS
 from .calculator import Operation
+from .calculator import process_expression
 from .calculator import process_image
+from .expression import Expression
 
 __version__ = "0.2.2"
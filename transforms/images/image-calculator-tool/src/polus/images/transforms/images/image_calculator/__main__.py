@@ -3,6 +3,7 @@
 import json
 import logging
 import pathlib
+import typing
 
 import filepattern
 import preadator
@@ -22,8 +23,8 @@ app = typer.Typer()
 
 @app.command()
 def main(  # noqa: PLR0913
-    primary_dir: pathlib.Path = typer.Option(
-        ...,
+    primary_dir: typing.Optional[pathlib.Path] = typer.Option(
+        None,
         "--primaryDir",
         help="The first set of images",
     ),
@@ -32,13 +33,13 @@ def main(  # noqa: PLR0913
         "--primaryPattern",
         help="Filename pattern used to select images.",
     ),
-    operation: image_calculator.Operation = typer.Option(
-        ...,
+    operation: typing.Optional[image_calculator.Operation] = typer.Option(
+        None,
         "--operator",
         help="The operation to perform",
     ),
-    secondary_dir: pathlib.Path = typer.Option(
-        ...,
+    secondary_dir: typing.Optional[pathlib.Path] = typer.Option(
+        None,
         "--secondaryDir",
         help="The second set of images",
     ),
@@ -47,6 +48,26 @@ def main(  # noqa: PLR0913
         "--secondaryPattern",
         help="Filename pattern used to select images.",
     ),
+    expression: typing.Optional[str] = typer.Option(
+        None,
+        "--expression",
+        help="An expression over the named inputs, used instead of --operator.",
+    ),
+    inputs: typing.List[str] = typer.Option(  # noqa: UP006
+        [],
+        "--input",
+        help="A named input collection for the expression, as NAME=DIR.",
+    ),
+    input_patterns: typing.List[str] = typer.Option(  # noqa: UP006
+        [],
+        "--inputPattern",
+        help="Filename pattern of a named input, as NAME=PATTERN.",
+    ),
+    output_dtype: typing.Optional[str] = typer.Option(
+        None,
+        "--outputDtype",
+        help="The dtype of the output images in expression mode.",
+    ),
     out_dir: pathlib.Path = typer.Option(..., "--outDir", help="Output collection"),
     preview: bool = typer.Option(
         False,
@@ -55,6 +76,26 @@ def main(  # noqa: PLR0913
     ),
 ) -> None:
     """Perform simple mathematical operations on images."""
+    if expression is not None:
+        _main_expression(
+            expression,
+            _parse_pairs(inputs, "--input"),
+            _parse_pairs(input_patterns, "--inputPattern"),
+            output_dtype,
+            out_dir,
+            preview,
+        )
+        return
+
+    if primary_dir is None or operation is None or secondary_dir is None:
+        msg = "".join(
+            [
+                "--primaryDir, --operator and --secondaryDir are required ",
+                "without --expression.",
+            ],
+        )
+        raise typer.BadParameter(msg)
+
     primary_dir = primary_dir.resolve()
     if primary_dir.joinpath("images").is_dir():
         # switch to images folder if present
@@ -80,7 +121,7 @@ def main(  # noqa: PLR0913
     with preadator.ProcessManager(
         name="Image Calculator",
         num_processes=image_calculator.MAX_WORKERS,
-        threads_per_process=2,
+        threads_per_process=image_calculator.THREADS_PER_PROCESS,
     ) as manager:
         preview_files = []
         group: dict[str, int]
@@ -133,5 +174,120 @@ def main(  # noqa: PLR0913
             manager.join_processes()
 
 
+def _parse_pairs(values: list[str], option: str) -> dict[str, str]:
+    """Parse NAME=VALUE options, which may also be given comma separated."""
+    if len(values) == 1:
+        values = values[0].split(",")
+
+    pairs = {}
+    for value in values:
+        name, sep, item = value.partition("=")
+        if not sep or not name.strip():
+            msg = f"Expected NAME=VALUE for {option}, got '{value}'."
+            raise typer.BadParameter(msg)
+        pairs[name.strip()] = item.strip()
+    return pairs
+
+
+def _main_expression(  # noqa: PLR0913, C901
+    text: str,
+    inputs: dict[str, str],
+    input_patterns: dict[str, str],
+    output_dtype: typing.Optional[str],
+    out_dir: pathlib.Path,
+    preview: bool,
+) -> None:
+    """Evaluate an expression over the matching images of the named inputs.
+
+    The images of the first input in the expression are iterated over. Each
+    of the other inputs is matched on the filepattern variables it has in
+    common with the first input, and an input with a single image is used
+    with every image of the first input.
+    """
+    try:
+        expression = image_calculator.Expression(text)
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+
+    missing = [name for name in expression.variables if name not in inputs]
+    if missing:
+        msg = f"No --input given for {missing} in expression '{text}'."
+        raise typer.BadParameter(msg)
+
+    out_dir = out_dir.resolve()
+
+    logger.info(f"expression = {text}")
+    patterns = {}
+    fps = {}
+    for name in expression.variables:
+        input_dir = pathlib.Path(inputs[name]).resolve()
+        if input_dir.joinpath("images").is_dir():
+            # switch to images folder if present
+            input_dir = input_dir.joinpath("images")
+        patterns[name] = input_patterns.get(name, ".*")
+        logger.info(f"input {name} = {input_dir}, pattern = {patterns[name]}")
+        fps[name] = filepattern.FilePattern(input_dir, patterns[name])
+    logger.info(f"outputDtype = {output_dtype}")
+    logger.info(f"outDir = {out_dir}")
+
+    primary, *others = expression.variables
+    variables = {name: set(fps[name].get_variables()) for name in others}
+
+    with preadator.ProcessManager(
+        name="Image Calculator",
+        num_processes=image_calculator.MAX_WORKERS,
+        threads_per_process=image_calculator.THREADS_PER_PROCESS,
+    ) as manager:
+        preview_files = []
+        group: dict[str, int]
+        files: list[pathlib.Path]
+        for group, files in fps[primary]():
+            for file in files:
+                logger.info(f"Processing {file.name} ...")
+
+                images = {primary: file}
+                for name in others:
+                    common = {k: v for k, v in group.items() if k in variables[name]}
+                    if common:
+                        matches = [
+                            f for _, m in fps[name].get_matching(**common) for f in m
+                        ]
+                    else:
+                        matches = [f for _, m in fps[name]() for f in m]
+
+                    if len(matches) == 0:
+                        msg = f"No {name} images match {file.name}. Skipping ..."
+                        logger.error(msg)
+                        break
+                    if len(matches) > 1:
+                        msg = "".join(
+                            [
+                                f"Found multiple {name} images to match {file.name}.\n",
+                                f"Matches: {matches}.\n",
+                                f"Using only the first match: {matches[0]}",
+                            ],
+                        )
+                        logger.warning(msg)
+                    images[name] = matches[0]
+                else:
+                    if preview:
+                        preview_files.append(file)
+                    else:
+                        manager.submit_process(
+                            image_calculator.process_expression,
+                            text,
+                            images,
+                            out_dir,
+                            output_dtype,
+                            image_calculator.THREADS_PER_PROCESS,
+                        )
+
+        if preview:
+            with out_dir.joinpath("preview.json").open("w") as writer:
+                json.dump({"files": preview_files}, writer)
+        else:
+            manager.join_processes()
+
+
 if __name__ == "__main__":
     app()
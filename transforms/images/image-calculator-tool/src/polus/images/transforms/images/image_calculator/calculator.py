@@ -1,5 +1,8 @@
 """Functions for performing image calculations."""
 
+import collections
+import concurrent.futures
+import contextlib
 import enum
 import logging
 import multiprocessing
@@ -10,10 +13,13 @@ import typing
 import bfio
 import numpy
 
+from .expression import Expression
+
 # Import environment variables
 POLUS_LOG = getattr(logging, os.environ.get("POLUS_LOG", "INFO"))
 POLUS_IMG_EXT = os.environ.get("POLUS_IMG_EXT", ".ome.tif")
 MAX_WORKERS = max(1, multiprocessing.cpu_count() // 2)
+THREADS_PER_PROCESS = 2
 
 CHUNK_SIZE = 4_096
 SUFFIX_LEN = 6
@@ -77,6 +83,14 @@ class Operation(str, enum.Enum):
         return f
 
 
+def _output_path(image: pathlib.Path, output_dir: pathlib.Path) -> pathlib.Path:
+    """Returns the path of the output image for an input image."""
+    input_extension = "".join(
+        [s for s in image.suffixes[-2:] if len(s) < SUFFIX_LEN],
+    )
+    return output_dir.joinpath(image.name.replace(input_extension, POLUS_IMG_EXT))
+
+
 def _process_chunk(  # noqa: PLR0913
     primary_reader: bfio.BioReader,
     secondary_reader: bfio.BioReader,
@@ -113,11 +127,7 @@ def process_image(
         bfio.BioReader(primary_image, max_workers=1) as primary_reader,
         bfio.BioReader(secondary_image, max_workers=1) as secondary_reader,
     ):
-        input_extension = "".join(
-            [s for s in primary_image.suffixes[-2:] if len(s) < SUFFIX_LEN],
-        )
-        out_name = primary_image.name.replace(input_extension, POLUS_IMG_EXT)
-        out_path = output_dir.joinpath(out_name)
+        out_path = _output_path(primary_image, output_dir)
 
         # Initialize the output image
         with bfio.BioWriter(out_path, metadata=primary_reader.metadata) as writer:
@@ -138,3 +148,118 @@ def process_image(
                             writer,
                             operation,
                         )
+
+
+def _evaluate_chunk(  # noqa: PLR0913
+    readers: dict[str, bfio.BioReader],
+    x: int,
+    x_max: int,
+    y: int,
+    y_max: int,
+    z: int,
+    expression: Expression,
+    dtype: numpy.dtype,
+) -> numpy.ndarray:
+    """Read a chunk of every input and evaluate the expression on it."""
+    tiles = {name: reader[y:y_max, x:x_max, z] for name, reader in readers.items()}
+    return expression.evaluate(tiles, dtype)
+
+
+def process_expression(
+    expression: typing.Union[str, Expression],
+    images: dict[str, pathlib.Path],
+    output_dir: pathlib.Path,
+    output_dtype: typing.Optional[str] = None,
+    num_threads: int = THREADS_PER_PROCESS,
+) -> pathlib.Path:
+    """Evaluates an expression over several images and saves the output image.
+
+    The expression is evaluated chunk by chunk, with all operations fused, so
+    no intermediate images are created. Chunks are read and evaluated by
+    several threads and written in order.
+
+    Args:
+        expression: The expression, see `Expression` for the syntax.
+        images: The image file for each name used in the expression. The
+            output is named after the first image.
+        output_dir: The output directory.
+        output_dtype: The dtype of the output image. Defaults to the dtype of
+            the inputs if the result is an integer and all inputs share a
+            dtype, and to float32 or float64 otherwise.
+        num_threads: The number of threads used to evaluate chunks.
+
+    Returns:
+        The path of the output image.
+    """
+    if isinstance(expression, str):
+        expression = Expression(expression)
+
+    missing = [name for name in expression.variables if name not in images]
+    if missing:
+        msg = f"No images given for {missing} in expression '{expression.text}'"
+        raise ValueError(msg)
+
+    images = {name: images[name] for name in expression.variables}
+    out_path = _output_path(next(iter(images.values())), output_dir)
+
+    with contextlib.ExitStack() as stack:
+        readers = {
+            name: stack.enter_context(
+                bfio.BioReader(path, max_workers=num_threads),
+            )
+            for name, path in images.items()
+        }
+        primary_reader = next(iter(readers.values()))
+
+        shapes = {name: (r.Y, r.X, r.Z) for name, r in readers.items()}
+        if len(set(shapes.values())) != 1:
+            msg = f"All images must have the same size. Got {shapes}"
+            raise ValueError(msg)
+
+        dtypes = {name: r.dtype for name, r in readers.items()}
+        if output_dtype is None:
+            dtype = expression.output_dtype(dtypes)
+        else:
+            dtype = numpy.dtype(output_dtype)
+
+        writer = stack.enter_context(
+            bfio.BioWriter(out_path, metadata=primary_reader.metadata),
+        )
+        writer.dtype = dtype
+
+        executor = stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(num_threads),
+        )
+        pending: collections.deque = collections.deque()
+
+        def write_chunk() -> None:
+            (x, x_max, y, y_max, z), future = pending.popleft()
+            writer[y:y_max, x:x_max, z] = future.result()
+
+        for z in range(primary_reader.Z):
+            for x in range(0, primary_reader.X, CHUNK_SIZE):
+                x_max = min(x + CHUNK_SIZE, primary_reader.X)
+                for y in range(0, primary_reader.Y, CHUNK_SIZE):
+                    y_max = min(y + CHUNK_SIZE, primary_reader.Y)
+
+                    future = executor.submit(
+                        _evaluate_chunk,
+                        readers,
+                        x,
+                        x_max,
+                        y,
+                        y_max,
+                        z,
+                        expression,
+                        dtype,
+                    )
+                    pending.append(((x, x_max, y, y_max, z), future))
+
+                    # Limit the number of evaluated chunks held in memory
+                    if len(pending) > 2 * num_threads:
+                        write_chunk()
+
+        while pending:
+            write_chunk()
+
+    return out_path
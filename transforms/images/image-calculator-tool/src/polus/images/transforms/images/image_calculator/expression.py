@@ -0,0 +1,405 @@
+"""A fused evaluator for arithmetic and logical expressions over images.
+
+An expression such as `(a - dark) / (flat - dark) * 1000` is parsed with the
+`ast` module, checked against a small set of allowed operations and compiled
+into a list of numpy ufunc calls. Each call writes into one of a few reusable
+buffers of `BLOCK_SIZE` elements. A tile is evaluated one block at a time, so
+the whole expression runs on data that stays in the cache. It never allocates
+an intermediate array of the size of the tile or the image.
+
+All arithmetic is done in a floating-point working dtype that can represent
+every input exactly, so subtracting unsigned images does not wrap around.
+The result is then converted to the output dtype. Values are rounded and
+clipped for integer outputs.
+"""
+
+import ast
+import typing
+
+import numpy
+
+BLOCK_SIZE = 2**16
+
+_BINARY_OPS: dict[type, numpy.ufunc] = {
+    ast.Add: numpy.add,
+    ast.Sub: numpy.subtract,
+    ast.Mult: numpy.multiply,
+    ast.Div: numpy.true_divide,
+    ast.FloorDiv: numpy.floor_divide,
+    ast.Mod: numpy.remainder,
+    ast.Pow: numpy.power,
+}
+
+_BITWISE_OPS: dict[type, numpy.ufunc] = {
+    ast.BitAnd: numpy.bitwise_and,
+    ast.BitOr: numpy.bitwise_or,
+    ast.BitXor: numpy.bitwise_xor,
+}
+
+_COMPARE_OPS: dict[type, numpy.ufunc] = {
+    ast.Lt: numpy.less,
+    ast.LtE: numpy.less_equal,
+    ast.Gt: numpy.greater,
+    ast.GtE: numpy.greater_equal,
+    ast.Eq: numpy.equal,
+    ast.NotEq: numpy.not_equal,
+}
+
+_FUNCTIONS: dict[str, numpy.ufunc] = {
+    "abs": numpy.absolute,
+    "sqrt": numpy.sqrt,
+    "exp": numpy.exp,
+    "log": numpy.log,
+    "min": numpy.minimum,
+    "max": numpy.maximum,
+}
+
+# Operations whose result may not be an integer for integer operands
+_FLOAT_OPS = (numpy.true_divide, numpy.power, numpy.sqrt, numpy.exp, numpy.log)
+
+FUNCTIONS = [*_FUNCTIONS, "clip", "where"]
+
+# An operand is an input name, a constant or the index of a buffer
+Operand = tuple[str, typing.Any]
+
+
+class Expression:
+    """An arithmetic or logical expression over named images.
+
+    Supported syntax:
+
+    - numbers and image names, e.g. `a`, `dark`, `1000`, `0.5`
+    - arithmetic: `+`, `-`, `*`, `/`, `//`, `%`, `**`
+    - bitwise operators on integer values: `&`, `|`, `^`, `~`
+    - comparisons, which give 1 or 0: `<`, `<=`, `>`, `>=`, `==`, `!=`
+    - logical operators: `and`, `or`, `not`
+    - functions: `abs(x)`, `sqrt(x)`, `exp(x)`, `log(x)`, `min(x, y, ...)`,
+      `max(x, y, ...)`, `clip(x, low, high)` and `where(condition, x, y)`
+
+    Args:
+        text: The expression.
+
+    Raises:
+        ValueError: If the expression is invalid or uses unsupported syntax.
+    """
+
+    def __init__(self, text: str) -> None:
+        """Parse and compile the expression."""
+        self.text = text
+        try:
+            tree = ast.parse(text.strip(), mode="eval")
+        except SyntaxError as e:
+            msg = f"Invalid expression '{text}': {e.msg}"
+            raise ValueError(msg) from e
+
+        self.variables: list[str] = []
+        self.instructions: list[tuple[typing.Callable, int, list[Operand]]] = []
+        self.num_buffers = 0
+        self._free: list[int] = []
+        self._is_integral = True
+
+        self.result = self._compile(tree.body)
+        del self._free
+
+        if not self.variables:
+            msg = f"Expression '{text}' does not use any image"
+            raise ValueError(msg)
+
+    def output_dtype(self, dtypes: dict[str, numpy.dtype]) -> numpy.dtype:
+        """The default dtype of the result.
+
+        If all inputs have the same dtype, and the expression gives integers
+        for integer inputs, the result has the dtype of the inputs. Otherwise,
+        the result has the working dtype.
+
+        Args:
+            dtypes: The dtype of each input.
+        """
+        unique = {numpy.dtype(d) for d in dtypes.values()}
+        if len(unique) == 1:
+            (dtype,) = unique
+            if numpy.issubdtype(dtype, numpy.floating) or self._is_integral:
+                return dtype
+        return self.working_dtype(dtypes)
+
+    @staticmethod
+    def working_dtype(dtypes: dict[str, numpy.dtype]) -> numpy.dtype:
+        """The floating-point dtype used for arithmetic.
+
+        This is float32 when every input fits exactly in a float32, i.e. inputs
+        of up to 16 bits and float32 inputs, and float64 otherwise.
+
+        Args:
+            dtypes: The dtype of each input.
+        """
+        for dtype in map(numpy.dtype, dtypes.values()):
+            max_bytes = 2 if dtype.kind in "iu" else 4
+            if dtype.itemsize > max_bytes:
+                return numpy.dtype(numpy.float64)
+        return numpy.dtype(numpy.float32)
+
+    def evaluate(
+        self,
+        inputs: dict[str, numpy.ndarray],
+        dtype: typing.Optional[numpy.dtype] = None,
+    ) -> numpy.ndarray:
+        """Evaluate the expression on a tile of each input.
+
+        Args:
+            inputs: A tile of each input, all with the same shape.
+            dtype: The dtype of the result. Defaults to `output_dtype`.
+
+        Returns:
+            The result, with the shape of the tiles.
+        """
+        missing = [v for v in self.variables if v not in inputs]
+        if missing:
+            msg = f"Missing inputs {missing} for expression '{self.text}'"
+            raise ValueError(msg)
+
+        tiles = {v: inputs[v] for v in self.variables}
+        shapes = {t.shape for t in tiles.values()}
+        if len(shapes) != 1:
+            msg = f"All inputs must have the same shape. Got {shapes}"
+            raise ValueError(msg)
+        (shape,) = shapes
+
+        dtypes = {v: t.dtype for v, t in tiles.items()}
+        working = self.working_dtype(dtypes)
+        dtype = self.output_dtype(dtypes) if dtype is None else numpy.dtype(dtype)
+
+        out = numpy.empty(shape, dtype=dtype)
+        flat_out = out.reshape(-1)
+        flat = {v: numpy.ascontiguousarray(t).reshape(-1) for v, t in tiles.items()}
+        buffers = [
+            numpy.empty(BLOCK_SIZE, dtype=working) for _ in range(self.num_buffers)
+        ]
+
+        with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            for start in range(0, flat_out.size, BLOCK_SIZE):
+                stop = min(start + BLOCK_SIZE, flat_out.size)
+                blocks = {v: a[start:stop] for v, a in flat.items()}
+                views = [b[: stop - start] for b in buffers]
+
+                for function, index, operands in self.instructions:
+                    args = [_resolve(o, blocks, views) for o in operands]
+                    function(*args, out=views[index], dtype=working)
+
+                result = _resolve(self.result, blocks, views)
+                _convert(result, flat_out[start:stop])
+
+        return out
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        self.num_buffers += 1
+        return self.num_buffers - 1
+
+    def _release(self, *operands: Operand) -> None:
+        for kind, value in operands:
+            if kind == "buffer":
+                self._free.append(value)
+
+    def _emit(self, function: typing.Callable, operands: list[Operand]) -> Operand:
+        """Add an elementwise instruction that may overwrite one of its operands."""
+        self._release(*operands)
+        index = self._allocate()
+        self.instructions.append((function, index, operands))
+        if function in _FLOAT_OPS:
+            self._is_integral = False
+        return ("buffer", index)
+
+    def _compile(self, node: ast.AST) -> Operand:  # noqa: C901, PLR0911, PLR0912
+        if isinstance(node, ast.Constant):
+            if not isinstance(node.value, (bool, int, float)):
+                msg = f"Unsupported constant {node.value!r} in '{self.text}'"
+                raise ValueError(msg)
+            if isinstance(node.value, float) and not node.value.is_integer():
+                self._is_integral = False
+            return ("constant", node.value)
+
+        if isinstance(node, ast.Name):
+            if node.id in FUNCTIONS:
+                msg = f"'{node.id}' is a function in '{self.text}'"
+                raise ValueError(msg)
+            if node.id not in self.variables:
+                self.variables.append(node.id)
+            return ("input", node.id)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            operands = [self._compile(node.left), self._compile(node.right)]
+            return self._emit(_BINARY_OPS[type(node.op)], operands)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BITWISE_OPS:
+            operands = [self._compile(node.left), self._compile(node.right)]
+            return self._emit(_bitwise(_BITWISE_OPS[type(node.op)]), operands)
+
+        if isinstance(node, ast.UnaryOp):
+            operand = self._compile(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            if isinstance(node.op, ast.USub):
+                return self._emit(numpy.negative, [operand])
+            if isinstance(node.op, ast.Invert):
+                return self._emit(_bitwise(numpy.invert), [operand])
+            return self._emit(_logical(numpy.logical_not), [operand])
+
+        if isinstance(node, ast.Compare):
+            # Chained comparisons, e.g. `0 < a < 10`, are combined with `and`
+            left = self._compile(node.left)
+            result = None
+            for op, comparator in zip(node.ops, node.comparators):
+                if type(op) not in _COMPARE_OPS:
+                    msg = f"Unsupported comparison {type(op).__name__} in '{self.text}'"
+                    raise ValueError(msg)
+                right = self._compile(comparator)
+                # Keep `right` for the next comparison
+                self._release(left)
+                index = self._allocate()
+                function = _logical(_COMPARE_OPS[type(op)])
+                self.instructions.append((function, index, [left, right]))
+                comparison = ("buffer", index)
+                if result is None:
+                    result = comparison
+                else:
+                    result = self._emit(
+                        _logical(numpy.logical_and),
+                        [result, comparison],
+                    )
+                left = right
+            self._release(left)
+            return result
+
+        if isinstance(node, ast.BoolOp):
+            is_and = isinstance(node.op, ast.And)
+            function = numpy.logical_and if is_and else numpy.logical_or
+            result = self._compile(node.values[0])
+            for value in node.values[1:]:
+                result = self._emit(_logical(function), [result, self._compile(value)])
+            return result
+
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and not node.keywords
+        ):
+            return self._compile_call(node.func.id, node.args)
+
+        msg = f"Unsupported syntax '{ast.unparse(node)}' in '{self.text}'"
+        raise ValueError(msg)
+
+    def _compile_call(self, name: str, args: list[ast.expr]) -> Operand:
+        num_args = {"min": None, "max": None, "clip": 3, "where": 3}.get(name, 1)
+        if name not in FUNCTIONS:
+            msg = "".join(
+                [
+                    f"Unknown function '{name}' in '{self.text}'. ",
+                    f"Must be one of {FUNCTIONS}",
+                ],
+            )
+            raise ValueError(msg)
+        if num_args is None:
+            num_args_ok = len(args) >= 2  # noqa: PLR2004
+        else:
+            num_args_ok = len(args) == num_args
+        if not num_args_ok:
+            msg = f"Wrong number of arguments for '{name}' in '{self.text}'"
+            raise ValueError(msg)
+
+        if name == "clip":
+            x, low, high = (self._compile(a) for a in args)
+            result = self._emit(numpy.maximum, [x, low])
+            return self._emit(numpy.minimum, [result, high])
+
+        if name == "where":
+            operands = [self._compile(a) for a in args]
+            # The result must not overwrite an operand before it is used
+            index = self._allocate()
+            self._release(*operands)
+            self.instructions.append((_where, index, operands))
+            return ("buffer", index)
+
+        result = self._compile(args[0])
+        for arg in args[1:]:
+            result = self._emit(_FUNCTIONS[name], [result, self._compile(arg)])
+        if len(args) == 1:
+            result = self._emit(_FUNCTIONS[name], [result])
+        return result
+
+
+def _resolve(
+    operand: Operand,
+    blocks: dict[str, numpy.ndarray],
+    buffers: list[numpy.ndarray],
+) -> typing.Any:
+    kind, value = operand
+    if kind == "input":
+        return blocks[value]
+    if kind == "buffer":
+        return buffers[value]
+    return value
+
+
+def _bitwise(function: numpy.ufunc) -> typing.Callable:
+    """Apply a bitwise ufunc to operands rounded to 64-bit integers."""
+
+    def f(
+        *args: typing.Any,
+        out: numpy.ndarray,
+        dtype: numpy.dtype,  # noqa: ARG001
+    ) -> None:
+        out[:] = function(*(_as_integer(a) for a in args))
+
+    return f
+
+
+def _as_integer(value: typing.Any) -> typing.Any:
+    if numpy.ndim(value) == 0:
+        return int(value)
+    if numpy.issubdtype(value.dtype, numpy.integer):
+        return value
+    return numpy.rint(value).astype(numpy.int64)
+
+
+def _logical(function: numpy.ufunc) -> typing.Callable:
+    """Apply a comparison or logical ufunc, storing the result as 1 or 0."""
+
+    def f(
+        *args: typing.Any,
+        out: numpy.ndarray,
+        dtype: numpy.dtype,  # noqa: ARG001
+    ) -> None:
+        function(*args, out=out)
+
+    return f
+
+
+def _where(
+    condition: typing.Any,
+    x: typing.Any,
+    y: typing.Any,
+    out: numpy.ndarray,
+    dtype: numpy.dtype,  # noqa: ARG001
+) -> None:
+    out[:] = y
+    numpy.copyto(out, x, where=numpy.asarray(condition) != 0)
+
+
+def _convert(result: typing.Any, out: numpy.ndarray) -> None:
+    """Store a block of results in the output dtype, rounding and clipping integers."""
+    if numpy.issubdtype(out.dtype, numpy.integer):
+        info = numpy.iinfo(out.dtype)
+        result = numpy.rint(numpy.asarray(result, dtype=numpy.float64))
+        result = numpy.nan_to_num(
+            result,
+            copy=False,
+            nan=0,
+            posinf=info.max,
+            neginf=info.min,
+        )
+        out[:] = numpy.clip(result, info.min, info.max)
+    elif out.dtype == bool:
+        out[:] = numpy.asarray(result) != 0
+    else:
+        out[:] = result
@@ -0,0 +1,169 @@
+"""Tests for the expression mode of the image calculator."""
+
+import pathlib
+import tempfile
+
+import bfio
+import numpy
+import pytest
+from polus.images.transforms.images import image_calculator
+from polus.images.transforms.images.image_calculator import expression
+
+EXPRESSIONS = [
+    ("a + b", lambda a, b, c: a + b),
+    ("a - b * c", lambda a, b, c: a - b * c),
+    ("(a - b) / (c - b)", lambda a, b, c: (a - b) / (c - b)),
+    ("-a ** 2 + 3", lambda a, b, c: -(a**2) + 3),
+    ("a // 7 % 5", lambda a, b, c: a // 7 % 5),
+    ("abs(a - b) + sqrt(c)", lambda a, b, c: numpy.abs(a - b) + numpy.sqrt(c)),
+    ("log(a + 1) * exp(-b / 100)", lambda a, b, c: numpy.log(a + 1) * numpy.exp(-b / 100)),  # noqa: E501
+    ("min(a, b, c) + max(a, b)", lambda a, b, c: numpy.minimum(numpy.minimum(a, b), c) + numpy.maximum(a, b)),  # noqa: E501
+    ("clip(a, 10, 50)", lambda a, b, c: numpy.clip(a, 10, 50)),
+    ("where(a > b, a, c)", lambda a, b, c: numpy.where(a > b, a, c)),
+    ("(a > 20) & (b <= 40) | (c == 3)", lambda a, b, c: (a > 20) & (b <= 40) | (c == 3)),  # noqa: E501
+    ("not a > 30 or 10 < b < 20", lambda a, b, c: ~(a > 30) | ((b > 10) & (b < 20))),
+    ("a & b ^ 3", lambda a, b, c: a.astype(numpy.int64) & b.astype(numpy.int64) ^ 3),
+]
+
+
+def _inputs(size: int = 1000) -> dict[str, numpy.ndarray]:
+    rng = numpy.random.default_rng(42)
+    return {
+        name: rng.integers(1, 64, size=(size, 3)).astype(numpy.float64)
+        for name in "abc"
+    }
+
+
+@pytest.mark.parametrize(("text", "reference"), EXPRESSIONS)
+def test_evaluate(text: str, reference: callable) -> None:
+    inputs = _inputs()
+    expected = reference(**inputs)
+
+    result = image_calculator.Expression(text).evaluate(inputs, numpy.float64)
+
+    numpy.testing.assert_allclose(result, expected)
+
+
+def test_evaluate_blocks() -> None:
+    """Inputs larger than a block give the same result as a single block."""
+    inputs = _inputs(expression.BLOCK_SIZE + 123)
+    result = image_calculator.Expression("a * b - c").evaluate(inputs, numpy.float64)
+
+    numpy.testing.assert_allclose(result, inputs["a"] * inputs["b"] - inputs["c"])
+
+
+def test_output_dtype() -> None:
+    uint8 = numpy.dtype(numpy.uint8)
+    uint16 = numpy.dtype(numpy.uint16)
+    float32 = numpy.dtype(numpy.float32)
+
+    def output_dtype(text: str, **dtypes: numpy.dtype) -> numpy.dtype:
+        return image_calculator.Expression(text).output_dtype(dtypes)
+
+    assert output_dtype("a - b", a=uint16, b=uint16) == uint16
+    assert output_dtype("a / b", a=uint16, b=uint16) == float32
+    assert output_dtype("a + b", a=uint8, b=uint16) == float32
+    assert output_dtype("a > b", a=uint8, b=uint8) == uint8
+    assert image_calculator.Expression("a + b").output_dtype(
+        {"a": numpy.dtype(numpy.uint32), "b": numpy.dtype(numpy.uint32)},
+    ) == numpy.dtype(numpy.uint32)
+    assert image_calculator.Expression.working_dtype(
+        {"a": numpy.dtype(numpy.int32)},
+    ) == numpy.dtype(numpy.float64)
+
+
+def test_integer_output_saturates() -> None:
+    """Integer outputs are rounded and clipped instead of wrapping around."""
+    inputs = {
+        "a": numpy.array([10, 200, 100], dtype=numpy.uint8),
+        "b": numpy.array([20, 100, 100], dtype=numpy.uint8),
+    }
+    expr = image_calculator.Expression("a - b")
+    numpy.testing.assert_array_equal(expr.evaluate(inputs), [0, 100, 0])
+
+    expr = image_calculator.Expression("a * b / 3")
+    numpy.testing.assert_array_equal(
+        expr.evaluate(inputs, numpy.uint8),
+        [67, 255, 255],
+    )
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "a +",
+        "a.b",
+        "a[0]",
+        "foo(a)",
+        "sqrt(a, b)",
+        "a if b else c",
+        "'a' + b",
+        "1 + 2",
+        "sqrt + a",
+        "lambda: a",
+    ],
+)
+def test_invalid(text: str) -> None:
+    with pytest.raises(ValueError):  # noqa: PT011
+        image_calculator.Expression(text)
+
+
+def test_missing_input() -> None:
+    with pytest.raises(ValueError):  # noqa: PT011
+        image_calculator.Expression("a + b").evaluate({"a": numpy.zeros(3)})
+
+
+def _write_image(path: pathlib.Path, data: numpy.ndarray) -> None:
+    with bfio.BioWriter(path) as writer:
+        writer.Y, writer.X = data.shape[:2]
+        writer.Z = data.shape[2] if data.ndim == 3 else 1  # noqa: PLR2004
+        writer.dtype = data.dtype
+        writer[:] = data
+
+
+def test_process_expression() -> None:
+    rng = numpy.random.default_rng(42)
+    data_dir = pathlib.Path(tempfile.mkdtemp(suffix="_data_dir"))
+    out_dir = data_dir.joinpath("outputs")
+    out_dir.mkdir()
+
+    shape = (1500, 1300, 2)
+    images = {}
+    arrays = {}
+    for name in ("image", "dark", "flat"):
+        arrays[name] = rng.integers(0, 2**12, size=shape, dtype=numpy.uint16)
+        images[name] = data_dir.joinpath(f"{name}.ome.tif")
+        _write_image(images[name], arrays[name])
+    arrays["flat"] += 2**12
+
+    _write_image(images["flat"], arrays["flat"])
+
+    out_path = image_calculator.process_expression(
+        "(image - dark) / (flat - dark) * 1000",
+        images,
+        out_dir,
+        output_dtype="uint16",
+    )
+
+    assert out_path == out_dir.joinpath("image.ome.tif")
+    a, d, f = (arrays[name].astype(numpy.float32) for name in ("image", "dark", "flat"))
+    expected = numpy.clip(numpy.rint((a - d) / (f - d) * 1000), 0, 2**16 - 1)
+
+    with bfio.BioReader(out_path) as reader:
+        assert reader.dtype == numpy.uint16
+        result = reader[:, :, :]
+
+    numpy.testing.assert_allclose(result, expected, atol=1)
+
+
+def test_process_expression_size_mismatch() -> None:
+    data_dir = pathlib.Path(tempfile.mkdtemp(suffix="_data_dir"))
+    _write_image(data_dir.joinpath("a.ome.tif"), numpy.zeros((64, 64), numpy.uint8))
+    _write_image(data_dir.joinpath("b.ome.tif"), numpy.zeros((64, 32), numpy.uint8))
+
+    with pytest.raises(ValueError):  # noqa: PT011
+        image_calculator.process_expression(
+            "a + b",
+            {"a": data_dir.joinpath("a.ome.tif"), "b": data_dir.joinpath("b.ome.tif")},
+            data_dir,
+        )
@@ -116,3 +116,45 @@ def test_cli_small(op: image_calculator.Operation) -> None:
 def test_cli_large(op: image_calculator.Operation) -> None:
     pattern, primary_dir, secondary_dir, out_dir = gen_images(1024 * 16)
     _test_cli(pattern, primary_dir, secondary_dir, out_dir, op)
+
+
+def test_cli_expression() -> None:
+    pattern, primary_dir, secondary_dir, out_dir = gen_images(1024)
+
+    # A single flat-field image is used with every primary image
+    flat_dir = primary_dir.parent.joinpath("flat")
+    flat_dir.mkdir()
+    rng = numpy.random.default_rng(0)
+    _make_random_image(flat_dir.joinpath("flat.ome.tif"), rng, 1024)
+
+    args = [
+        "--expression",
+        "(a - b) / flat",
+        "--input",
+        f"a={primary_dir},b={secondary_dir},flat={flat_dir}",
+        "--inputPattern",
+        f"a={pattern},b={pattern}",
+        "--outDir",
+        str(out_dir),
+    ]
+
+    runner = typer.testing.CliRunner()
+    result = runner.invoke(app, args)
+
+    assert result.exit_code == 0, f"CLI failed with {result.stdout}\n{args}"
+
+    for p in primary_dir.iterdir():
+        out_path = out_dir.joinpath(p.name)
+        assert out_path.exists(), f"Missing {p.name} in {out_dir}"
+
+        with (
+            bfio.BioReader(p) as a,
+            bfio.BioReader(secondary_dir.joinpath(p.name)) as b,
+            bfio.BioReader(flat_dir.joinpath("flat.ome.tif")) as flat,
+            bfio.BioReader(out_path) as out,
+        ):
+            expected = (a[:].astype(numpy.float64) - b[:]) / flat[:]
+            assert out.dtype == numpy.float64
+            numpy.testing.assert_allclose(out[:], expected)
+
+    shutil.rmtree(primary_dir.parent)
@@ -1,11 +1,13 @@
 """LUMoS bleedthrough correction algorithm."""
 
+import collections
+import concurrent.futures
 import logging
 import pathlib
+import typing
 
 import bfio
 import numpy
-from scipy.cluster.vq import kmeans as scipy_kmeans
 
 from . import utils
 
@@ -13,47 +15,64 @@ logger = logging.getLogger(__name__)
 logger.setLevel(utils.POLUS_LOG)
 
 
-def sample_row_indices(
-    shape: tuple[int, int],
-    fraction: float,
-) -> numpy.ndarray:
-    """Sample a fraction of the rows in the input image.
-
-    Args:
-        shape: shape of the input image.
-        fraction: fraction of rows to sample.
-
-    Returns:
-        1d array of indices of the sampled rows.
-    """
-    nun_rows = shape[0]
-    num_samples = int(fraction * nun_rows)
-    rng = numpy.random.default_rng()
-    return rng.choice(nun_rows, num_samples, replace=False)
-
-
 def sample_tile(
     tile: numpy.ndarray,
-    indices: numpy.ndarray,
-) -> numpy.ndarray:
-    """Sample a subset of the rows in the input tile.
+    sample_size: int,
+    rng: numpy.random.Generator,
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Draw a uniform random sample of the pixels in the input tile.
 
     We assume the tile to be a 3d array with the first dimension being the number
     of rows, the second dimension being the number of columns, and the third
     dimension being the number of channels.
 
-    This function will sample the input tile along the first dimension using the
-    provided indices. The samples will then be transformed into a 2d array with
-    as many rows as sampled pixels and as many columns as channels.
+    Every pixel is given a random key, and the pixels with the `sample_size`
+    smallest keys are kept. The pixels are returned as a 2d array with as many
+    rows as sampled pixels and as many columns as channels, along with their keys.
+    Keeping the smallest keys of several samples with `merge_samples` gives a
+    uniform sample of all of their pixels.
 
     Args:
         tile: input tile.
-        indices: indices of the rows to sample.
+        sample_size: maximum number of pixels to sample.
+        rng: random number generator for the keys.
+
+    Returns:
+        keys and sampled pixels.
+    """
+    pixels = tile.reshape(-1, tile.shape[2])
+    keys = rng.random(pixels.shape[0])
+    if pixels.shape[0] > sample_size:
+        indices = numpy.argpartition(keys, sample_size - 1)[:sample_size]
+        keys, pixels = keys[indices], pixels[indices]
+    return keys, pixels.astype(numpy.float32)
+
+
+def merge_samples(
+    sample: tuple[numpy.ndarray, numpy.ndarray],
+    other: tuple[numpy.ndarray, numpy.ndarray],
+    sample_size: int,
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Merge two samples from `sample_tile` into a single reservoir.
+
+    The pixels with the `sample_size` smallest keys are kept, so the reservoir
+    never grows beyond `sample_size` pixels and the result does not depend on
+    the order in which the tiles are merged.
+
+    Args:
+        sample: keys and pixels of the reservoir.
+        other: keys and pixels of the sample to add to the reservoir.
+        sample_size: maximum number of pixels in the reservoir.
 
     Returns:
-        sampled pixels.
+        keys and pixels of the merged reservoir.
     """
-    return tile[indices, :, :].reshape(-1, tile.shape[2])
+    keys = numpy.concatenate((sample[0], other[0]))
+    pixels = numpy.concatenate((sample[1], other[1]))
+    if keys.shape[0] > sample_size:
+        indices = numpy.argpartition(keys, sample_size - 1)[:sample_size]
+        keys, pixels = keys[indices], pixels[indices]
+    return keys, pixels
 
 
 def whiten_spectral_signatures(
@@ -81,20 +100,80 @@ def whiten_spectral_signatures(
     return spectral_signatures / std_dev, std_dev
 
 
-def kmeans(
+def squared_distances(
+    pixels: numpy.ndarray,
+    centers: numpy.ndarray,
+) -> numpy.ndarray:
+    """Compute the squared distances between pixels and cluster centers.
+
+    The distances are expanded as ||x||^2 - 2 x.c + ||c||^2 and computed in
+    float32, so the only large intermediate is the (pixels x clusters) matrix
+    product instead of a (pixels x clusters x channels) difference array.
+
+    Args:
+        pixels: 2d array with as many rows as pixels and as many columns as
+            channels.
+        centers: 2d array with as many rows as clusters and as many columns as
+            channels.
+
+    Returns:
+        2d array with as many rows as pixels and as many columns as clusters.
+    """
+    pixels = pixels.astype(numpy.float32, copy=False)
+    centers = centers.astype(numpy.float32, copy=False)
+    distances = pixels @ (-2 * centers.T)
+    distances += numpy.einsum("ij,ij->i", centers, centers)[None, :]
+    distances += numpy.einsum("ij,ij->i", pixels, pixels)[:, None]
+    return numpy.maximum(distances, 0, out=distances)
+
+
+def _init_centers(
+    pixels: numpy.ndarray,
+    num_clusters: int,
+    rng: numpy.random.Generator,
+) -> numpy.ndarray:
+    """Choose the initial cluster centers with k-means++.
+
+    Fewer centers are returned if the pixels have fewer distinct values than
+    the number of clusters.
+    """
+    centers = pixels[[rng.integers(pixels.shape[0])]]
+    closest = squared_distances(pixels, centers)[:, 0]
+    while centers.shape[0] < num_clusters:
+        total = float(closest.sum(dtype=numpy.float64))
+        if total <= 0:
+            break
+        index = rng.choice(pixels.shape[0], p=closest.astype(numpy.float64) / total)
+        centers = numpy.concatenate((centers, pixels[[index]]))
+        numpy.minimum(
+            closest,
+            squared_distances(pixels, pixels[[index]])[:, 0],
+            out=closest,
+        )
+    return centers
+
+
+def kmeans(  # noqa: PLR0913
     spectral_signatures: numpy.ndarray,
     num_clusters: int,
     max_iterations: int,
+    batch_size: int = utils.BATCH_SIZE,
+    tolerance: float = 1e-6,
+    seed: typing.Union[int, numpy.random.SeedSequence, None] = None,
 ) -> numpy.ndarray:
-    """Perform k-means clustering on the input spectral signatures.
+    """Perform mini-batch k-means clustering on the input spectral signatures.
 
     The spectral signatures are assumed to be a 2d array with as many rows as
     pixels and as many columns as channels. Each row is the spectral signature
     of a pixel.
 
     The spectral signatures will be whitened before clustering. See
-    `whiten_spectral_signatures` for more details. The whitened spectral
-    signatures will be used as the input to the k-means algorithm. The cluster
+    `whiten_spectral_signatures` for more details. The centers are initialized
+    with k-means++ and then updated with one random mini-batch of spectral
+    signatures per iteration (Sculley, 2010). Each center moves towards the mean
+    of its pixels in the batch with a learning rate of one over the number of
+    pixels it has been assigned so far. The iterations stop early once no center
+    moves by more than `tolerance` (squared, in whitened units). The cluster
     centers will be de-whitened and ordered in non-decreasing order of their
     norms before being returned.
 
@@ -102,13 +181,45 @@ def kmeans(
         spectral_signatures: spectral signatures.
         num_clusters: number of clusters.
         max_iterations: maximum number of iterations.
+        batch_size: number of spectral signatures in each mini-batch.
+        tolerance: squared center shift below which the iterations stop.
+        seed: seed for the random number generator.
 
     Returns:
         cluster centers.
     """
+    rng = numpy.random.default_rng(seed)
     spectral_signatures, std_dev = whiten_spectral_signatures(spectral_signatures)
-    cluster_centers, _ = scipy_kmeans(spectral_signatures, num_clusters, max_iterations)
-    cluster_centers = cluster_centers * std_dev
+    spectral_signatures = spectral_signatures.astype(numpy.float32)
+
+    cluster_centers = _init_centers(spectral_signatures, num_clusters, rng)
+    num_centers, num_channels = cluster_centers.shape
+    counts = numpy.zeros(num_centers, dtype=numpy.int64)
+    for _ in range(max_iterations):
+        batch = spectral_signatures[
+            rng.integers(spectral_signatures.shape[0], size=batch_size)
+        ]
+        labels = numpy.argmin(squared_distances(batch, cluster_centers), axis=1)
+        batch_counts = numpy.bincount(labels, minlength=num_centers)
+        batch_sums = numpy.stack(
+            [
+                numpy.bincount(labels, weights=batch[:, c], minlength=num_centers)
+                for c in range(num_channels)
+            ],
+            axis=1,
+        )
+
+        counts += batch_counts
+        updated = batch_counts > 0
+        shift = (
+            batch_sums[updated] - batch_counts[updated, None] * cluster_centers[updated]
+        ) / counts[updated, None]
+        cluster_centers[updated] += shift.astype(numpy.float32)
+        if numpy.max(numpy.sum(shift**2, axis=1)) <= tolerance:
+            break
+
+    # Centers that were never assigned a pixel do not represent a cluster
+    cluster_centers = cluster_centers[counts > 0] * std_dev
     norms = numpy.linalg.norm(cluster_centers, axis=1)
     cluster_centers = cluster_centers[numpy.argsort(norms)]
 
@@ -118,15 +229,6 @@ def kmeans(
             f"({num_clusters})."
         )
         logger.warning(msg)
-        return cluster_centers
-
-    if cluster_centers.shape[0] > num_clusters:
-        msg = (
-            f"Found more clusters ({cluster_centers.shape[0]}) than requested "
-            f"({num_clusters})."
-        )
-        logger.warning(msg)
-        return cluster_centers[:num_clusters]
 
     return cluster_centers
 
@@ -145,35 +247,53 @@ def correct_tile(
     of clusters and as many columns as input channels.
 
     This function will compute the distance between each pixel in the tile and
-    each cluster center. The pixel will be assigned to the cluster with the
-    smallest distance. The output tile will have as many channels as the number
-    of clusters. Each channel will contain the pixels assigned to the
-    corresponding cluster. The value in that channel will be the norm of the
-    pixel.
+    each cluster center. See `squared_distances` for more details. The pixel will
+    be assigned to the cluster with the smallest distance. The output tile will
+    have as many channels as the number of clusters. Each channel will contain
+    the pixels assigned to the corresponding cluster. The value in that channel
+    will be the norm of the pixel.
 
     Args:
         tile: input tile.
         centers: cluster centers.
 
     Returns:
-        output tile.
+        float32 output tile.
     """
-    reshaped_tile = tile.reshape(-1, tile.shape[2])
-    distances = numpy.linalg.norm(
-        reshaped_tile[:, None, :] - centers[None, :, :],
-        axis=2,
-    )
-    assigned_columns = numpy.argmin(distances, axis=1)
+    reshaped_tile = tile.reshape(-1, tile.shape[2]).astype(numpy.float32, copy=False)
+    assigned_columns = numpy.argmin(squared_distances(reshaped_tile, centers), axis=1)
     output_pixels = numpy.linalg.norm(reshaped_tile, axis=1)
-    output_tile = numpy.zeros((reshaped_tile.shape[0], centers.shape[0]))
+    output_tile = numpy.zeros(
+        (reshaped_tile.shape[0], centers.shape[0]),
+        dtype=numpy.float32,
+    )
     output_tile[numpy.arange(reshaped_tile.shape[0]), assigned_columns] = output_pixels
     return output_tile.reshape(tile.shape[0], tile.shape[1], centers.shape[0])
 
 
-def correct(
+def _ordered_results(
+    executor: concurrent.futures.Executor,
+    function: typing.Callable,
+    arguments: typing.Iterable[tuple],
+    limit: int,
+) -> typing.Generator[typing.Any, None, None]:
+    """Yield the results of `function` in order, with at most `limit` pending."""
+    pending: collections.deque = collections.deque()
+    for args in arguments:
+        pending.append(executor.submit(function, *args))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def correct(  # noqa: PLR0913
     image_paths: list[pathlib.Path],
     num_fluorophores: int,
     output_path: pathlib.Path,
+    sample_size: int = utils.SAMPLE_SIZE,
+    num_threads: int = utils.NUM_THREADS,
+    seed: typing.Optional[int] = None,
 ) -> None:
     """Apply LUMoS bleedthrough correction to the input images and save the outputs.
 
@@ -194,21 +314,29 @@ def correct(
     channels. If multiple images are provided, then we assume that each image contains
     a single channel.
 
+    The image is streamed twice, one tile at a time, with `num_threads` tiles in
+    flight. The first pass collects a uniform reservoir of at most `sample_size`
+    spectral signatures, on which the cluster centers are learned with mini-batch
+    k-means. The second pass assigns every pixel to its nearest center and writes
+    the output tiles. Memory use does not depend on the size of the image.
+
     The output images will be saved as multi-channel ".ome.zarr" files. The output
     image will have, at most, as many channels as the number of fluorophores plus one
     for the background. If, during the kmeans clustering, we find that there are fewer
     than num_fluorophores + 1 clusters, then we will reduce the number of channels in
-    the output image to the number of clusters. If there are more than num_fluorophores
-    + 1 clusters, then we will only use the first num_fluorophores + 1 clusters, and
-    will raise a warning. The channels will be ordered in non-decreasing order of their
-    norms, leading to a high chance that the first channel will be the dimmest, and
-    therefore the background channel. However, we cannot guarantee that the first
-    channel will always be the background channel.
+    the output image to the number of clusters, and will raise a warning. The channels
+    will be ordered in non-decreasing order of their norms, leading to a high chance
+    that the first channel will be the dimmest, and therefore the background channel.
+    However, we cannot guarantee that the first channel will always be the background
+    channel.
 
     Args:
         image_paths: paths to input image(s).
         num_fluorophores: number of fluorophores.
         output_path: path to output image.
+        sample_size: number of pixels sampled for k-means clustering.
+        num_threads: number of tiles processed in parallel.
+        seed: seed for the random number generators.
     """
     tile_reader = (
         utils.read_tile_multi_channel
@@ -221,38 +349,67 @@ def correct(
         for image_path in image_paths
     ]
     image_shape = bfio_readers[0].Y, bfio_readers[0].X
-    num_channels = bfio_readers[0].C if len(image_paths) == 1 else len(image_paths)
     metadata = bfio_readers[0].metadata
-
-    logger.info("Sampling pixels from across tiles ...")
-    sampled_pixels = numpy.zeros((0, num_channels), dtype=numpy.float32)
-    for y_min, y_max, x_min, x_max in utils.tile_index_generator(
-        image_shape,
-        utils.TILE_SIZE,
-    ):
-        tile = tile_reader(bfio_readers, (y_min, y_max, x_min, x_max))
-        sampled_pixels = numpy.concatenate(
-            (sampled_pixels, sample_tile(tile, sample_row_indices(tile.shape, 0.1))),
+    tile_indices = list(utils.tile_index_generator(image_shape, utils.TILE_SIZE))
+    seed_sequence = numpy.random.SeedSequence(seed)
+
+    def _sample(
+        indices: tuple[int, int, int, int],
+        tile_seed: numpy.random.SeedSequence,
+    ) -> tuple[numpy.ndarray, numpy.ndarray]:
+        tile = tile_reader(bfio_readers, indices)
+        return sample_tile(tile, sample_size, numpy.random.default_rng(tile_seed))
+
+    def _correct(
+        indices: tuple[int, int, int, int],
+        centers: numpy.ndarray,
+    ) -> numpy.ndarray:
+        return correct_tile(tile_reader(bfio_readers, indices), centers)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        logger.info("Sampling pixels from across tiles ...")
+        reservoir = None
+        for sample in _ordered_results(
+            executor,
+            _sample,
+            zip(tile_indices, seed_sequence.spawn(len(tile_indices))),
+            2 * num_threads,
+        ):
+            reservoir = (
+                sample
+                if reservoir is None
+                else merge_samples(reservoir, sample, sample_size)
+            )
+
+        logger.info("Performing k-means clustering ...")
+        centers = kmeans(
+            spectral_signatures=reservoir[1],
+            num_clusters=num_fluorophores + 1,  # +1 for background
+            max_iterations=100,
+            seed=seed_sequence.spawn(1)[0],
         )
 
-    logger.info("Performing k-means clustering ...")
-    centers = kmeans(
-        spectral_signatures=sampled_pixels,
-        num_clusters=num_fluorophores + 1,  # +1 for background
-        max_iterations=100,
-    )
-
-    logger.info("Correcting tiles ...")
-    with bfio.BioWriter(output_path, metadata=metadata) as writer:
-        writer.C = centers.shape[0]
-        logger.info(f"writer shape = {writer.shape}")
-        for y_min, y_max, x_min, x_max in utils.tile_index_generator(
-            image_shape,
-            utils.TILE_SIZE,
-        ):
-            tile = tile_reader(bfio_readers, (y_min, y_max, x_min, x_max))
-            output_tile = correct_tile(tile, centers)
-            writer[y_min:y_max, x_min:x_max, 0, :, 0] = output_tile[:, :, None, :, None]
+        logger.info("Correcting tiles ...")
+        with bfio.BioWriter(output_path, metadata=metadata) as writer:
+            writer.C = centers.shape[0]
+            writer.dtype = numpy.float32
+            logger.info(f"writer shape = {writer.shape}")
+            for (y_min, y_max, x_min, x_max), output_tile in zip(
+                tile_indices,
+                _ordered_results(
+                    executor,
+                    _correct,
+                    ((indices, centers) for indices in tile_indices),
+                    2 * num_threads,
+                ),
+            ):
+                writer[y_min:y_max, x_min:x_max, 0, :, 0] = output_tile[
+                    :,
+                    :,
+                    None,
+                    :,
+                    None,
+                ]
 
     for bfio_reader in bfio_readers:
         bfio_reader.close()
@@ -11,9 +11,12 @@ import filepattern
 import numpy
 
 MAX_WORKERS = max(1, multiprocessing.cpu_count() // 2)
+NUM_THREADS = max(1, multiprocessing.cpu_count() // MAX_WORKERS)
 POLUS_IMG_EXT = os.environ.get("POLUS_IMG_EXT", ".ome.tif")
 POLUS_LOG = getattr(logging, os.environ.get("POLUS_LOG", "INFO"))
 TILE_SIZE = 1_024
+SAMPLE_SIZE = 100_000
+BATCH_SIZE = 4_096
 
 
 def replace_extension(name: str, new_extension: typing.Optional[str] = None) -> str:
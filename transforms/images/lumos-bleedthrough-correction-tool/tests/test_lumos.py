@@ -152,3 +152,96 @@ def test_cli() -> None:
     finally:
         shutil.rmtree(inp_dir)
         shutil.rmtree(out_dir)
+
+
+def _make_clusters(
+    num_pixels: int,
+    seed: int = 0,
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Make spectral signatures around well-separated cluster centers."""
+    rng = numpy.random.default_rng(seed)
+    centers = numpy.array(
+        [[0, 0, 0], [100, 10, 5], [10, 120, 20], [5, 15, 90]],
+        dtype=numpy.float64,
+    )
+    labels = rng.integers(0, centers.shape[0], num_pixels)
+    return centers[labels] + rng.normal(0, 3, (num_pixels, 3)), centers
+
+
+def test_reservoir_sample() -> None:
+    """Test that merged tile samples are a bounded, order-independent sample."""
+    rng = numpy.random.default_rng(0)
+    tiles = [numpy.full((30, 40, 2), i, dtype=numpy.uint16) for i in range(1, 5)]
+    samples = [lumos.sample_tile(tile, 500, rng) for tile in tiles]
+    assert all(keys.shape[0] == 500 for keys, _ in samples)
+
+    forward = samples[0]
+    for sample in samples[1:]:
+        forward = lumos.merge_samples(forward, sample, 500)
+    backward = samples[-1]
+    for sample in samples[-2::-1]:
+        backward = lumos.merge_samples(backward, sample, 500)
+
+    assert forward[1].shape == (500, 2)
+    assert forward[1].dtype == numpy.float32
+    assert sorted(forward[0]) == sorted(backward[0])
+
+    # Every tile has the same number of pixels, so each is about a quarter
+    counts = numpy.bincount(forward[1][:, 0].astype(int), minlength=5)[1:]
+    assert numpy.all(numpy.abs(counts - 125) < 50), counts
+
+
+def test_squared_distances() -> None:
+    """Test the expanded float32 distances against the direct computation."""
+    pixels, centers = _make_clusters(1_000)
+    expected = numpy.sum((pixels[:, None, :] - centers[None, :, :]) ** 2, axis=2)
+
+    distances = lumos.squared_distances(pixels, centers)
+
+    assert distances.dtype == numpy.float32
+    numpy.testing.assert_allclose(distances, expected, rtol=1e-4, atol=1e-1)
+    numpy.testing.assert_array_equal(
+        numpy.argmin(distances, axis=1),
+        numpy.argmin(expected, axis=1),
+    )
+
+
+def test_kmeans() -> None:
+    """Test that mini-batch k-means recovers the cluster centers."""
+    pixels, centers = _make_clusters(50_000)
+
+    found = lumos.kmeans(pixels, centers.shape[0], max_iterations=100, seed=0)
+
+    assert found.shape == centers.shape
+    norms = numpy.linalg.norm(found, axis=1)
+    assert numpy.all(numpy.diff(norms) >= 0)
+    order = numpy.argsort(numpy.linalg.norm(centers, axis=1))
+    numpy.testing.assert_allclose(found, centers[order], atol=1.0)
+
+
+def test_kmeans_fewer_clusters() -> None:
+    """Test that k-means returns fewer centers for fewer distinct pixels."""
+    pixels = numpy.repeat([[1.0, 2.0], [5.0, 1.0]], 100, axis=0)
+
+    found = lumos.kmeans(pixels, 4, max_iterations=10, seed=0)
+
+    numpy.testing.assert_allclose(found, [[1.0, 2.0], [5.0, 1.0]], rtol=1e-5)
+
+
+def test_correct_tile() -> None:
+    """Test that each pixel's norm goes to the channel of its nearest center."""
+    pixels, centers = _make_clusters(64 * 48)
+    tile = pixels.reshape(64, 48, 3)
+
+    output_tile = lumos.correct_tile(tile, centers)
+
+    assert output_tile.shape == (64, 48, centers.shape[0])
+    assert output_tile.dtype == numpy.float32
+    distances = numpy.linalg.norm(tile[:, :, None, :] - centers, axis=3)
+    assigned = numpy.argmin(distances, axis=2)
+    numpy.testing.assert_allclose(
+        numpy.take_along_axis(output_tile, assigned[:, :, None], axis=2)[..., 0],
+        numpy.linalg.norm(tile, axis=2),
+        rtol=1e-6,
+    )
+    assert numpy.count_nonzero(output_tile) <= tile.shape[0] * tile.shape[1]
@@ -1,19 +1,17 @@
 import logging
 import random
-from concurrent.futures import as_completed
 from concurrent.futures import ProcessPoolExecutor
-from functools import reduce
 from pathlib import Path
+from typing import Optional
 
 import numpy
 import scipy.ndimage
-import scipy.stats
 from bfio import BioReader
 from bfio import BioWriter
 
 from utils import constants
 from utils import helpers
-from utils import local_distogram as distogram
+from utils import array_distogram
 
 logging.basicConfig(
     format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s',
@@ -23,140 +21,58 @@ logger = logging.getLogger("autocrop")
 logger.setLevel(constants.POLUS_LOG)
 
 
-def calculate_strip_entropy(
-        *,
-        file_path: Path,
-        z_index: int,
-        strip_index: int,
-        along_x: bool,
-        direction: bool,
-        smoothing: bool,
-) -> list[float]:
-    """ Get the entropy for each row/column in the indexed strip along the given
-     axis. A strip spans the entire length/width of the image.
+def scan_depth(end: int) -> int:
+    """ The number of rows/columns, counted from an edge of the image, in which
+     we search for a gradient spike.
+
+    We don't want to look too deep into the image. If no spike is found within
+     the first quarter of the strips, a high percentile gradient is used.
 
     Args:
-        file_path: Path to the image.
-        z_index: The index of the z-slice.
-        strip_index: index of the current strip.
-        along_x: Whether the strip runs along the x-axis.
-        direction: Whether we are looking in the forward or backward direction.
-        smoothing: Whether to use Gaussian smoothing for each tile.
+        end: The length of the image along the axis.
 
     Returns:
-        A list of scores for each row in the strip.
+        The depth of the search from either edge.
     """
-    histograms: list[list[distogram.Distogram]] = list()
-
-    with BioReader(file_path) as reader:
-        for x_min, x_max, y_min, y_max in helpers.iter_strip(file_path, strip_index, along_x):
-            tile = numpy.asarray(
-                reader[y_min:y_max, x_min:x_max, z_index:z_index + 1, 0, 0],
-                dtype=numpy.float32,
-            )
-            if smoothing:
-                tile = scipy.ndimage.gaussian_filter(tile, sigma=1, mode='constant', cval=numpy.mean(tile))
-
-            # It is simpler to work with tiles of shape (strip_width, :) so we can
-            # always iterate over the 0th axis to get the rows/columns of the image.
-            tile = tile if along_x else numpy.transpose(tile)
-
-            row_range = range(tile.shape[0]) if direction else reversed(range(tile.shape[0]))
+    num_strips = end // constants.TILE_STRIDE
+    if end % constants.TILE_STRIDE != 0:
+        num_strips += 1
 
-            # Create a distogram for each row in the tile. We use more binds for now
-            # and later merge into a distogram with fewer bins
-            row_histograms: list[distogram.Distogram] = [
-                helpers.distogram_from_batch(
-                    tile[i, :].flat,
-                    constants.MAX_BINS * 2,
-                    constants.WEIGHTED_BINS,
-                )
-                for i in row_range
-            ]
-            histograms.append(row_histograms)
+    deepest_strip = max(1, num_strips // 4)
+    return min(end, deepest_strip * constants.TILE_STRIDE)
 
-    # In case the last tile had fewer rows than other tiles,
-    # simply pad the list with empty Distograms.
-    histograms[-1].extend([
-        distogram.Distogram(bin_count=constants.MAX_BINS, weighted_diff=constants.WEIGHTED_BINS)
-        for _ in range(len(histograms[0]) - len(histograms[-1]))
-    ])
 
-    # Merge the Distograms for the same row from across the strip.
-    histograms: list[distogram.Distogram] = [
-        reduce(
-            lambda residual, value: distogram.merge(residual, value),
-            row_histograms,
-            distogram.Distogram(bin_count=constants.MAX_BINS, weighted_diff=constants.WEIGHTED_BINS),
-        )
-        for row_histograms in zip(*histograms)
-    ]
-
-    # Now that each row has its own Distogram, we can compute the entropy of
-    # each row.
-    strip_entropy: list[float] = [
-        scipy.stats.entropy([c for _, c in histogram.bins])
-        for histogram in histograms
-    ]
-    return strip_entropy
-
-
-def find_gradient_spike_xy(
-        file_path: Path,
-        z_index: int,
-        along_x: bool,
-        direction: bool,
-        smoothing: bool,
-) -> int:
+def find_gradient_spike(entropies: list[float], end: int, direction: bool) -> int:
     """ Find the index of the row/column, after padding, of the first large
       spike in the gradient of entropy of rows/columns.
 
+    The entropies are consumed one strip at a time, so that the spike closest
+     to the edge is found as soon as its strip is added.
+
     Args:
-        file_path: Path to the image.
-        z_index: index of the z-slice.
-        along_x: Whether to crop along the x-axis.
+        entropies: The entropy of each row/column, starting from the edge.
+        end: The length of the image along the axis.
         direction: Whether we are working forward/down from the left/top edge or
                     backward/up from the right/bottom edge.
-        smoothing: Whether to use gaussian smoothing on tiles.
 
     Returns:
         The index of the row/column where we found the high gradient value.
     """
-    with BioReader(file_path) as reader:
-        end = reader.Y if along_x else reader.X
-
-    num_strips = end // constants.TILE_STRIDE
-    if end % constants.TILE_STRIDE != 0:
-        num_strips += 1
-
-    # In case we are going backward, reverse the strip indices.
-    strip_indices = list(range(num_strips) if direction else reversed(range(num_strips)))
-
-    # We don't want to look too deep into the image. If we go through
-    # too many strips, we will just use a high percentile gradient value.
-    deepest_strip = max(1, len(strip_indices) // 4)
     raw_entropies = list()
     smoothed_gradients = list()
-    for i, index in enumerate(strip_indices[:deepest_strip]):
-        logger.info(
-            f'Checking strip {index + 1} of {len(strip_indices)} '
-            f'along {"x" if along_x else "y"}-axis in the {z_index}-slice...'
-        )
-
-        raw_entropies.extend(calculate_strip_entropy(
-            file_path=file_path,
-            z_index=z_index,
-            strip_index=index,
-            along_x=along_x,
-            direction=direction,
-            smoothing=smoothing,
-        ))
+    offset = 0  # The index of the first entry of raw_entropies
+    for start in range(0, len(entropies), constants.TILE_STRIDE):
+        if len(raw_entropies) > 0:
+            # Only keep enough entropies from the previous strip to continue
+            # the rolling means across the boundary between strips.
+            kept = raw_entropies[-(1 + 2 * constants.WINDOW_SIZE):]
+            offset += len(raw_entropies) - len(kept)
+            raw_entropies = kept
+        raw_entropies.extend(entropies[start:start + constants.TILE_STRIDE])
 
         smoothed_gradients = helpers.smoothed_gradients(raw_entropies)
         index_val = helpers.find_spike(smoothed_gradients, constants.GRADIENT_THRESHOLD)
-        if index_val is None:
-            raw_entropies = raw_entropies[-(1 + 2 * constants.WINDOW_SIZE):]
-        else:
+        if index_val is not None:
             break
     else:  # There was no break in the loop, i.e. no high gradient was found.
         logger.debug(f'Gradient threshold {constants.GRADIENT_THRESHOLD:.2e} was too high. '
@@ -164,121 +80,148 @@ def find_gradient_spike_xy(
         threshold = numpy.percentile(smoothed_gradients, q=constants.GRADIENT_PERCENTILE)
         index_val = helpers.find_spike(smoothed_gradients, float(threshold))
 
-    stop = index_val[0] if direction else end - index_val[0]
-    logger.debug(f'Found gradient spike at index {stop} along axis {"x" if along_x else "y"}')
-    return stop
+    index = offset + index_val[0]
+    return index if direction else end - index
 
 
-def estimate_slice_entropies_thread(
+def scan_slice(
         file_path: Path,
-        smoothing: bool,
         z_index: int,
-) -> distogram.Distogram:
-    tile_indices = list(helpers.iter_tiles_2d(file_path))
-    if len(tile_indices) > 25:
-        tile_indices = list(random.sample(tile_indices, 25))
+        crop_axes: tuple[bool, bool, bool],
+        smoothing: bool,
+) -> tuple[tuple[int, int, int, int], Optional[float]]:
+    """ Reads each tile of a z-slice once and computes everything that is needed
+     to crop the slice.
 
-    tile_histograms = list()
+    The rows near the top and bottom edges and the columns near the left and
+     right edges each get a distogram, which is fed from every tile that
+     overlaps them. A tile therefore contributes to the searches in all four
+     directions, and to the entropy of the whole slice if it is among the
+     randomly sampled tiles, from a single read. Tiles in the middle of large
+     images, which are not needed by any of these, are not read at all.
+
+    Args:
+        file_path: Path to the image.
+        z_index: The index of the z-slice.
+        crop_axes: A 3-tuple indicating whether to crop along the x-axis, y-axis, z-axis.
+        smoothing: Whether to use Gaussian smoothing for each tile.
+
+    Returns:
+        A 2-tuple of the bounding-box (y1, y2, x1, x2) of the slice and, when
+         cropping along the z-axis, the estimated entropy of the slice.
+    """
+    crop_x, crop_y, crop_z = crop_axes
 
     with BioReader(file_path) as reader:
+        x_end, y_end, z_end = reader.X, reader.Y, reader.Z
+        depth_y = scan_depth(y_end) if crop_y else 0
+        depth_x = scan_depth(x_end) if crop_x else 0
+
+        # Masks of the rows/columns that are close enough to an edge.
+        rows = numpy.zeros(y_end, dtype=bool)
+        rows[:depth_y] = rows[y_end - depth_y:] = depth_y > 0
+        columns = numpy.zeros(x_end, dtype=bool)
+        columns[:depth_x] = columns[x_end - depth_x:] = depth_x > 0
+
+        tile_indices = list(helpers.iter_tiles_2d(file_path))
+        sampled = set()
+        if crop_z and z_end > 1:
+            sampled = set(random.sample(tile_indices, min(25, len(tile_indices))))
+
+        # Distograms for the rows in each band of tiles along the y-axis, and
+        # for the columns in each band of tiles along the x-axis. Tiles are
+        # visited row-major, so both are fed with tiles in the order of a strip.
+        row_histograms: dict[int, array_distogram.ArrayDistogram] = dict()
+        column_histograms: dict[int, array_distogram.ArrayDistogram] = dict()
+        slice_histogram = array_distogram.ArrayDistogram(1, constants.MAX_BINS, constants.WEIGHTED_BINS)
+
         for x_min, x_max, y_min, y_max in tile_indices:
+            tile_rows = numpy.flatnonzero(rows[y_min:y_max])
+            tile_columns = numpy.flatnonzero(columns[x_min:x_max])
+            is_sampled = (x_min, x_max, y_min, y_max) in sampled
+            if len(tile_rows) == 0 and len(tile_columns) == 0 and not is_sampled:
+                continue
+
             tile = numpy.asarray(
-                reader[y_min:y_max, x_min:x_max, z_index, 0, 0],
+                reader[y_min:y_max, x_min:x_max, z_index:z_index + 1, 0, 0],
                 dtype=numpy.float32,
-            )
+            ).reshape(y_max - y_min, x_max - x_min)
             if smoothing:
                 tile = scipy.ndimage.gaussian_filter(tile, sigma=1, mode='constant', cval=numpy.mean(tile))
 
-            tile_histograms.append(helpers.distogram_from_batch(
-                tile.flat,
-                constants.MAX_BINS * 2,
-                constants.WEIGHTED_BINS,
-            ))
-
-    return reduce(
-        lambda residual, value: distogram.merge(residual, value),
-        tile_histograms,
-        distogram.Distogram(bin_count=constants.MAX_BINS, weighted_diff=constants.WEIGHTED_BINS),
-    )
-
-
-def estimate_slice_entropies(file_path: Path, smoothing: bool) -> list[float]:
-    with BioReader(file_path) as reader:
-        z_end = reader.Z
-
-    # Find a bounding box for each image in the group.
-    slice_histograms = list()
-    with ProcessPoolExecutor(max_workers=constants.NUM_THREADS) as executor:
-        processes = [
-            executor.submit(
-                estimate_slice_entropies_thread,
-                file_path,
-                smoothing,
-                z,
-            )
-            for z in range(z_end)
-        ]
-        for process in processes:
-            slice_histograms.append(process.result())
+            # We use more bins for each tile and merge into the distograms with
+            # fewer bins.
+            for band, histograms, values in (
+                    (y_min, row_histograms, tile[tile_rows]),
+                    (x_min, column_histograms, numpy.transpose(tile)[tile_columns]),
+            ):
+                if len(values) == 0:
+                    continue
+                if band not in histograms:
+                    histograms[band] = array_distogram.ArrayDistogram(
+                        len(values),
+                        constants.MAX_BINS,
+                        constants.WEIGHTED_BINS,
+                    )
+                histograms[band] = array_distogram.merge(histograms[band], array_distogram.from_batch(
+                    values,
+                    constants.MAX_BINS * 2,
+                    constants.WEIGHTED_BINS,
+                ))
 
-    return [
-        scipy.stats.entropy([c for _, c in histogram.bins])
-        for histogram in slice_histograms
-    ]
+            if is_sampled:
+                slice_histogram = array_distogram.merge(slice_histogram, array_distogram.from_batch(
+                    tile.reshape(1, -1),
+                    constants.MAX_BINS * 2,
+                    constants.WEIGHTED_BINS,
+                ))
 
+    row_entropies = numpy.zeros(y_end)
+    for y_min, histograms in row_histograms.items():
+        y_max = min(y_end, y_min + constants.TILE_STRIDE)
+        row_entropies[y_min + numpy.flatnonzero(rows[y_min:y_max])] = array_distogram.entropy(histograms)
 
-def determine_bounding_box_thread(
-        file_path: Path,
-        smoothing: bool,
-        crop_y: bool,
-        crop_x: bool,
-        z_index: int,
-) -> tuple[int, int, int, int]:
-    with BioReader(file_path) as reader:
-        x_end, y_end, z_end = reader.X, reader.Y, reader.Z
+    column_entropies = numpy.zeros(x_end)
+    for x_min, histograms in column_histograms.items():
+        x_max = min(x_end, x_min + constants.TILE_STRIDE)
+        column_entropies[x_min + numpy.flatnonzero(columns[x_min:x_max])] = array_distogram.entropy(histograms)
 
     if crop_y:
-        y1 = find_gradient_spike_xy(file_path, z_index, True, True, smoothing)
-        y2 = find_gradient_spike_xy(file_path, z_index, True, False, smoothing)
+        y1 = find_gradient_spike(row_entropies[:depth_y].tolist(), y_end, True)
+        y2 = find_gradient_spike(row_entropies[::-1][:depth_y].tolist(), y_end, False)
     else:
         y1, y2 = 0, y_end
 
     if crop_x:
-        x1 = find_gradient_spike_xy(file_path, z_index, False, True, smoothing)
-        x2 = find_gradient_spike_xy(file_path, z_index, False, False, smoothing)
+        x1 = find_gradient_spike(column_entropies[:depth_x].tolist(), x_end, True)
+        x2 = find_gradient_spike(column_entropies[::-1][:depth_x].tolist(), x_end, False)
     else:
         x1, x2 = 0, x_end
 
-    return y1, y2, x1, x2
+    logger.debug(f'Found {(y1, y2, x1, x2) = } in the {z_index}-slice of {file_path.name}')
+    slice_entropy = float(array_distogram.entropy(slice_histogram)[0]) if sampled else None
+    return (y1, y2, x1, x2), slice_entropy
 
 
-def determine_bounding_box(
+def bounding_box_from_slices(
         file_path: Path,
-        crop_axes: tuple[bool, bool, bool],
-        smoothing: bool,
+        z_end: int,
+        slices: list[tuple[tuple[int, int, int, int], Optional[float]]],
 ) -> helpers.BoundingBox:
-    """ Using the gradient of entropy values of rows/columns in an image,
-     determine the bounding-box around the region of the image which contains
-     useful information.
-
-    This bounding-box can be used to crop the image.
+    """ Combines the results of `scan_slice` for each z-slice of an image into a
+     single bounding-box.
 
     Args:
         file_path: Path to the image.
-        crop_axes: A 3-tuple indicating whether to crop along the x-axis, y-axis, z-axis.
-        smoothing: Whether to use Gaussian smoothing
+        z_end: The number of z-slices in the image.
+        slices: The result of `scan_slice` for each z-slice, in order.
 
     Returns:
-        A 4-tuple of integers representing a bounding-box.
+        A 6-tuple of integers representing a bounding-box.
     """
-    logger.info(f'Finding bounding_box for {file_path.name}...')
-
-    crop_x, crop_y, crop_z = crop_axes
-    bounding_boxes: list[helpers.BoundingBox] = list()
-    with BioReader(file_path) as reader:
-        x_end, y_end, z_end = reader.X, reader.Y, reader.Z
+    slice_entropies = [slice_entropy for _, slice_entropy in slices]
 
-    if z_end > 1 and crop_z:
+    if z_end > 1 and None not in slice_entropies:
 
         def _find_spike(values: list[float]) -> int:
             gradients = helpers.smoothed_gradients(values, prepend_zeros=True)
@@ -288,7 +231,6 @@ def determine_bounding_box(
                 index_val = helpers.find_spike(gradients, float(threshold))
             return index_val[0]
 
-        slice_entropies = estimate_slice_entropies(file_path, smoothing)
         try:
             z1 = _find_spike(slice_entropies)
             z2 = z_end - _find_spike(list(reversed(slice_entropies)))
@@ -298,31 +240,73 @@ def determine_bounding_box(
     else:
         z1, z2 = 0, z_end
 
-    # Find a bounding box for each z-slice in the image.
-    bounding_boxes_2d = list()
+    bounding_box = helpers.bounding_box_superset([
+        (z1, z2, y1, y2, x1, x2)
+        for (y1, y2, x1, x2), _ in slices
+    ])
+    logger.info(f'Determined {bounding_box = } for {file_path.name}')
+    return bounding_box
+
+
+def determine_bounding_boxes(
+        file_paths: list[Path],
+        crop_axes: tuple[bool, bool, bool],
+        smoothing: bool,
+) -> list[helpers.BoundingBox]:
+    """ Determines the bounding-box of each of the given images.
+
+    Every z-slice of every image is scanned in a single pool of processes, so
+     that each tile is read at most once.
+
+    Args:
+        file_paths: A list of paths to images.
+        crop_axes: A 3-tuple indicating whether to crop along the x-axis, y-axis, z-axis.
+        smoothing: Whether to use Gaussian smoothing
+
+    Returns:
+        A bounding-box for each image, in the same order as the paths.
+    """
+    depths = list()
+    for file_path in file_paths:
+        with BioReader(file_path) as reader:
+            depths.append(reader.Z)
+
     with ProcessPoolExecutor(max_workers=constants.NUM_THREADS) as executor:
         processes = [
-            executor.submit(
-                determine_bounding_box_thread,
-                file_path,
-                smoothing,
-                crop_y,
-                crop_x,
-                z,
-            )
-            for z in range(z_end)
+            [
+                executor.submit(scan_slice, file_path, z, crop_axes, smoothing)
+                for z in range(z_end)
+            ]
+            for file_path, z_end in zip(file_paths, depths)
         ]
-        for process in as_completed(processes):
-            bounding_boxes_2d.append(process.result())
 
-    bounding_boxes.extend([
-        (z1, z2, y1, y2, x1, x2)
-        for y1, y2, x1, x2 in bounding_boxes_2d
-    ])
+        return [
+            bounding_box_from_slices(file_path, z_end, [process.result() for process in slice_processes])
+            for file_path, z_end, slice_processes in zip(file_paths, depths, processes)
+        ]
 
-    bounding_box = helpers.bounding_box_superset(bounding_boxes)
-    logger.info(f'Determined {bounding_box = } for {file_path.name}')
-    return bounding_box
+
+def determine_bounding_box(
+        file_path: Path,
+        crop_axes: tuple[bool, bool, bool],
+        smoothing: bool,
+) -> helpers.BoundingBox:
+    """ Using the gradient of entropy values of rows/columns in an image,
+     determine the bounding-box around the region of the image which contains
+     useful information.
+
+    This bounding-box can be used to crop the image.
+
+    Args:
+        file_path: Path to the image.
+        crop_axes: A 3-tuple indicating whether to crop along the x-axis, y-axis, z-axis.
+        smoothing: Whether to use Gaussian smoothing
+
+    Returns:
+        A 6-tuple of integers representing a bounding-box.
+    """
+    logger.info(f'Finding bounding_box for {file_path.name}...')
+    return determine_bounding_boxes([file_path], crop_axes, smoothing)[0]
 
 
 def verify_group_shape(file_paths: list[Path]):
@@ -365,14 +349,7 @@ def crop_image_group(
     verify_group_shape(file_paths)
 
     # Find a bounding box for each image in the group.
-    bounding_boxes = list()
-    with ProcessPoolExecutor(max_workers=constants.NUM_THREADS) as executor:
-        processes = {
-            executor.submit(determine_bounding_box, file_path, crop_axes, smoothing)
-            for file_path in file_paths
-        }
-        for process in as_completed(processes):
-            bounding_boxes.append(process.result())
+    bounding_boxes = determine_bounding_boxes(file_paths, crop_axes, smoothing)
 
     bounding_box = helpers.bounding_box_superset(bounding_boxes)
     write_cropped_images(file_paths, output_dir, bounding_box)
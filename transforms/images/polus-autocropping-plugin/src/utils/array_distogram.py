@@ -0,0 +1,308 @@
+""" A vectorized variant of `local_distogram` that sketches many distributions
+at once, e.g. one for every row of a tile.
+
+The bins of all distributions are held in arrays of shape
+(num_distributions, capacity), padded with `inf` values and zero counts, so
+that updates, merges and entropies are computed for all distributions
+together. Each update follows the same steps as `local_distogram.update`,
+including how the bin differences are cached, so an ArrayDistogram holds the
+same bins as a list of Distograms fed with the same values.
+
+`local_distogram` remains the reference implementation for accuracy tests.
+"""
+import numpy
+import scipy.stats
+
+from . import local_distogram
+
+EPSILON = local_distogram.EPSILON
+
+
+class ArrayDistogram(object):
+    """ Compressed representation of a batch of distributions.
+    """
+    __slots__ = 'bin_count', 'weighted_diff', 'values', 'counts', 'sizes', 'diffs', 'has_diffs'
+
+    def __init__(
+            self,
+            num_distributions: int,
+            bin_count: int = 100,
+            weighted_diff: bool = False,
+            capacity: int = None,
+    ):
+        """ Creates a new ArrayDistogram object with empty distributions.
+
+        Args:
+            num_distributions: The number of distributions.
+            bin_count: [Optional] the number of bins to use.
+            weighted_diff: [Optional] Whether to use weighted bin sizes.
+            capacity: [Optional] The number of allocated bins, at least bin_count + 1.
+
+        Returns:
+            An ArrayDistogram object.
+        """
+        capacity = bin_count + 1 if capacity is None else max(capacity, bin_count + 1)
+        shape = (num_distributions, capacity)
+
+        self.bin_count: int = bin_count
+        self.weighted_diff: bool = weighted_diff
+        self.values: numpy.ndarray = numpy.full(shape, numpy.inf)
+        self.counts: numpy.ndarray = numpy.zeros(shape)
+        self.sizes: numpy.ndarray = numpy.zeros(num_distributions, dtype=numpy.int64)
+
+        # The cached differences between adjacent bins, like `Distogram.diffs`,
+        # padded with inf. They are only valid for distributions where
+        # `has_diffs` is set.
+        self.diffs: numpy.ndarray = numpy.full(shape, numpy.inf)
+        self.has_diffs: numpy.ndarray = numpy.zeros(num_distributions, dtype=bool)
+
+
+def _weighted_diff(
+        h: ArrayDistogram,
+        left_value: numpy.ndarray,
+        left_count: numpy.ndarray,
+        right_value: numpy.ndarray,
+        right_count: numpy.ndarray,
+) -> numpy.ndarray:
+    diff = left_value - right_value
+    if h.weighted_diff is True:
+        diff = diff * numpy.log(EPSILON + numpy.minimum(left_count, right_count))
+    return diff
+
+
+def _compute_diffs(h: ArrayDistogram) -> numpy.ndarray:
+    valid = numpy.arange(h.values.shape[1] - 1) < (h.sizes[:, None] - 1)
+    with numpy.errstate(invalid='ignore'):
+        diffs = _weighted_diff(h, h.values[:, 1:], h.counts[:, 1:], h.values[:, :-1], h.counts[:, :-1])
+    diffs = numpy.where(valid, diffs, numpy.inf)
+    return numpy.pad(diffs, ((0, 0), (0, 1)), constant_values=numpy.inf)
+
+
+def _refresh_diffs(h: ArrayDistogram, rows: numpy.ndarray, indices: numpy.ndarray) -> None:
+    """ Recompute the cached differences of the given bins with their left and
+     right neighbors, as `local_distogram._update_diffs` does. """
+    for pair in (indices - 1, indices):
+        valid = (pair >= 0) & (pair < h.sizes[rows] - 1)
+        r, p = rows[valid], pair[valid]
+        h.diffs[r, p] = _weighted_diff(
+            h,
+            h.values[r, p + 1], h.counts[r, p + 1],
+            h.values[r, p], h.counts[r, p],
+        )
+    return
+
+
+def _insert(h: ArrayDistogram, rows: numpy.ndarray, indices: numpy.ndarray, value: numpy.ndarray, count: numpy.ndarray):
+    """ Insert a bin at the given index of each of the given distributions. """
+    columns = numpy.arange(h.values.shape[1])
+    shifted = numpy.clip(columns - 1, 0, None)
+    after = columns > indices[:, None]
+    at = columns == indices[:, None]
+
+    for array, new in ((h.values, value), (h.counts, count)):
+        old = array[rows]
+        array[rows] = numpy.where(at, new[:, None], numpy.where(after, old[:, shifted], old))
+
+    # Differences with the new bin are recomputed below, padding stays at inf
+    old = h.diffs[rows]
+    h.diffs[rows] = numpy.where(at, numpy.inf, numpy.where(after, old[:, shifted], old))
+
+    h.sizes[rows] += 1
+    _refresh_diffs(h, rows, indices)
+    return
+
+
+def _trim(h: ArrayDistogram) -> ArrayDistogram:
+    """ Merge the closest pair of adjacent bins of every distribution with more
+     than `bin_count` bins. Updates add at most one bin at a time, so a single
+     merge is enough. """
+    rows = numpy.flatnonzero(h.sizes > h.bin_count)
+    if len(rows) == 0:
+        return h
+
+    diffs = numpy.where(h.has_diffs[rows, None], h.diffs[rows], _compute_diffs(h)[rows])
+    i = numpy.argmin(diffs, axis=1)
+
+    v1, f1 = h.values[rows, i], h.counts[rows, i]
+    v2, f2 = h.values[rows, i + 1], h.counts[rows, i + 1]
+    h.values[rows, i] = (v1 * f1 + v2 * f2) / (f1 + f2)
+    h.counts[rows, i] = f1 + f2
+
+    columns = numpy.arange(h.values.shape[1])
+    shifted = numpy.clip(columns + 1, None, len(columns) - 1)
+    for array, fill in ((h.values, numpy.inf), (h.counts, 0.)):
+        old = array[rows]
+        new = numpy.where(columns > i[:, None], old[:, shifted], old)
+        new[:, -1] = fill
+        array[rows] = new
+
+    # Deleting the bin i + 1 removes the difference i
+    old = h.diffs[rows]
+    new = numpy.where(columns >= i[:, None], old[:, shifted], old)
+    new[:, -1] = numpy.inf
+    h.diffs[rows] = new
+
+    h.sizes[rows] -= 1
+    _refresh_diffs(h, rows, i)
+    return h
+
+
+def update(h: ArrayDistogram, value: numpy.ndarray, count: numpy.ndarray, active: numpy.ndarray = None) -> ArrayDistogram:
+    """ Adds a new element to each of the distributions.
+
+    Args:
+        h: An ArrayDistogram object.
+        value: The value to add to each distribution.
+        count: The number of times that each value must be added.
+        active: [Optional] Mask of the distributions to update.
+
+    Returns:
+        An ArrayDistogram object where the values have been processed.
+    """
+    num_distributions = h.values.shape[0]
+    rows = numpy.arange(num_distributions)
+    if active is None:
+        active = numpy.ones(num_distributions, dtype=bool)
+
+    value = numpy.asarray(value, dtype=numpy.float64)
+    count = numpy.asarray(count, dtype=numpy.float64)
+    sizes = h.sizes
+    last = numpy.clip(sizes - 1, 0, None)
+
+    # Find the bin to compare with, as `bisect_left` on the sorted bins.
+    below = value <= h.values[:, 0]
+    above = ~below & (value >= h.values[rows, last])
+    index = (h.values < value[:, None]).sum(axis=1)
+    index = numpy.where(below, 0, numpy.where(above, last, index))
+
+    # Values that are already a bin only add to its count.
+    equal = active & (sizes > 0) & (h.values[rows, index] == value)
+    h.counts[equal, index[equal]] += count[equal]
+    active = active & ~equal
+
+    # Values inside a full distribution may be merged into their closest bin.
+    interior = active & (sizes > 0) & ~below & ~above & (sizes >= h.bin_count)
+    missing = interior & ~h.has_diffs
+    if missing.any():
+        h.diffs[missing] = _compute_diffs(h)[missing]
+        h.has_diffs[missing] = True
+
+    if interior.any():
+        r, k = rows[interior], index[interior]
+        v = value[interior]
+        ones = numpy.ones(len(r))
+        diff1 = _weighted_diff(h, v, ones, h.values[r, k - 1], h.counts[r, k - 1])
+        diff2 = _weighted_diff(h, h.values[r, k], h.counts[r, k], v, ones)
+        i_bin = numpy.where(diff1 < diff2, k - 1, k)
+        diff = numpy.where(diff1 < diff2, diff1, diff2)
+        in_place = (diff < h.diffs[r].min(axis=1)) & (i_bin > 0)
+
+        r, i = r[in_place], i_bin[in_place]
+        f = h.counts[r, i]
+        h.values[r, i] = (h.values[r, i] * f + value[r] * count[r]) / (f + count[r])
+        h.counts[r, i] = f + count[r]
+        _refresh_diffs(h, r, i)
+        active[r] = False
+
+    # Otherwise insert a new bin, appending values beyond the last bin.
+    r = rows[active]
+    if len(r) > 0:
+        position = numpy.where(above[r], sizes[r], index[r])
+        _insert(h, r, position, value[r], count[r])
+
+    return _trim(h)
+
+
+def from_batch(values: numpy.ndarray, bin_count: int, weighted_diff: bool) -> ArrayDistogram:
+    """ Create a distogram for each row of a 2d array of values.
+
+    This is the vectorized counterpart of `helpers.distogram_from_batch`. The
+     values of each row are sorted and split into chunks of equal size, each
+     of which becomes a bin at the smallest value in the chunk.
+
+    Args:
+        values: 2d array with the values of one distribution in each row.
+        bin_count: number of bins to use in the distogram.
+        weighted_diff: whether the bin widths are weighted by density.
+
+    Returns:
+        An ArrayDistogram with one distribution for each row.
+    """
+    values = numpy.sort(numpy.asarray(values, dtype=numpy.float64), axis=1)
+    num_distributions, num_values = values.shape
+    step = max(1, num_values // bin_count)
+    starts = numpy.arange(0, num_values, step)
+
+    h = ArrayDistogram(num_distributions, bin_count, weighted_diff, capacity=len(starts))
+    h.values[:, :len(starts)] = values[:, starts]
+    h.counts[:, :len(starts)] = numpy.diff(numpy.append(starts, num_values))
+    h.sizes[:] = len(starts)
+    return h
+
+
+def pad(h: ArrayDistogram, num_distributions: int) -> ArrayDistogram:
+    """ Append empty distributions until there are `num_distributions`.
+
+    Args:
+        h: An ArrayDistogram object.
+        num_distributions: The number of distributions after padding.
+
+    Returns:
+        An ArrayDistogram object with the padded distributions.
+    """
+    padding = num_distributions - h.values.shape[0]
+    if padding <= 0:
+        return h
+
+    empty = ArrayDistogram(padding, h.bin_count, h.weighted_diff, capacity=h.values.shape[1])
+    for name in ('values', 'counts', 'sizes', 'diffs', 'has_diffs'):
+        setattr(h, name, numpy.concatenate([getattr(h, name), getattr(empty, name)]))
+    return h
+
+
+def merge(h1: ArrayDistogram, h2: ArrayDistogram) -> ArrayDistogram:
+    """ Merges two ArrayDistogram objects distribution by distribution.
+
+    The bins of h2 are added to h1 one at a time, for all distributions at
+     once.
+
+    Args:
+        h1: First ArrayDistogram.
+        h2: Second ArrayDistogram with the same number of distributions.
+
+    Returns:
+        An ArrayDistogram object being the composition of h1 and h2. The
+        number of bins in this ArrayDistogram is equal to that of h1.
+    """
+    if h1.values.shape[0] != h2.values.shape[0]:
+        raise ValueError(
+            f'Cannot merge {h1.values.shape[0]} distributions with {h2.values.shape[0]} distributions.'
+        )
+
+    for j in range(int(h2.sizes.max(initial=0))):
+        h1 = update(h1, h2.values[:, j], h2.counts[:, j], active=j < h2.sizes)
+    return h1
+
+
+def count(h: ArrayDistogram) -> numpy.ndarray:
+    """ Counts the number of elements in each distribution.
+
+    Args:
+        h: An ArrayDistogram object.
+
+    Returns:
+        The number of elements in each distribution.
+    """
+    return h.counts.sum(axis=1)
+
+
+def entropy(h: ArrayDistogram) -> numpy.ndarray:
+    """ Returns the entropy of the bin counts of each distribution.
+
+    Args:
+        h: An ArrayDistogram object.
+
+    Returns:
+        The entropy of each distribution.
+    """
+    return scipy.stats.entropy(h.counts, axis=1)
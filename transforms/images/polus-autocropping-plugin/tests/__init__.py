@@ -1,10 +1,12 @@
 from unittest import TestSuite
 from .version_test import VersionTest
 from .test_autocrop import CorrectnessTest
+from .test_autocrop import ScanTest
 
 test_cases = (
     VersionTest,
     CorrectnessTest,
+    ScanTest,
 )
 
 
@@ -3,12 +3,56 @@ import unittest
 from pathlib import Path
 
 import numpy
+import scipy.ndimage
+import scipy.stats
 from bfio import BioReader
 from bfio import BioWriter
 
 from src import autocrop
+from src.utils import array_distogram
 from src.utils import helpers
 from src.utils import constants
+from src.utils import local_distogram
+
+
+def reference_bounding_box(image: numpy.ndarray, smoothing: bool) -> tuple[int, int, int, int]:
+    """ Finds the bounding-box of a slice from the whole image in memory. Every
+     row/column gets a distogram that is fed with its part of each tile, in the
+     order of the tiles along the row/column, regardless of its distance from
+     the edges. """
+    tiles = dict()
+    for y_min in range(0, image.shape[0], constants.TILE_STRIDE):
+        for x_min in range(0, image.shape[1], constants.TILE_STRIDE):
+            tile = image[y_min:y_min + constants.TILE_STRIDE, x_min:x_min + constants.TILE_STRIDE]
+            if smoothing:
+                tile = scipy.ndimage.gaussian_filter(tile, sigma=1, mode='constant', cval=numpy.mean(tile))
+            tiles[(y_min, x_min)] = tile
+
+    def entropies(axis: int) -> numpy.ndarray:
+        values = list()
+        for band in range(0, image.shape[axis], constants.TILE_STRIDE):
+            histogram = None
+            for (y_min, x_min), tile in sorted(tiles.items()):
+                if (y_min if axis == 0 else x_min) != band:
+                    continue
+                lines = tile if axis == 0 else numpy.transpose(tile)
+                if histogram is None:
+                    histogram = array_distogram.ArrayDistogram(len(lines), constants.MAX_BINS, constants.WEIGHTED_BINS)
+                histogram = array_distogram.merge(histogram, array_distogram.from_batch(
+                    lines,
+                    constants.MAX_BINS * 2,
+                    constants.WEIGHTED_BINS,
+                ))
+            values.append(array_distogram.entropy(histogram))
+        return numpy.concatenate(values)
+
+    box = list()
+    for axis, end in ((0, image.shape[0]), (1, image.shape[1])):
+        depth = autocrop.scan_depth(end)
+        values = [float(value) for value in entropies(axis)]
+        box.append(autocrop.find_gradient_spike(values[:depth], end, True))
+        box.append(autocrop.find_gradient_spike(values[::-1][:depth], end, False))
+    return tuple(box)
 
 
 class CorrectnessTest(unittest.TestCase):
@@ -62,20 +106,19 @@ class CorrectnessTest(unittest.TestCase):
                         )
         return
 
-    def test_strip_entropy(self):
-        for index in range(self.num_strips):
-            for along_x in (True, False):
-                for smoothing in (True, False):
-                    for direction in (True, False):
-                        strip_entropy = autocrop.calculate_strip_entropy(
-                            file_path=Path(self.infile.name),
-                            z_index=0,
-                            strip_index=index,
-                            along_x=along_x,
-                            direction=direction,
-                            smoothing=smoothing,
-                        )
-                        self.assertTrue(min(strip_entropy) < max(strip_entropy))
+    def test_scan_slice(self):
+        with BioReader(self.infile.name) as reader:
+            image = numpy.asarray(reader[:, :, 0:1, 0, 0], dtype=numpy.float32).reshape(self.image_shape)
+
+        for smoothing in (True, False):
+            bounding_box, slice_entropy = autocrop.scan_slice(
+                Path(self.infile.name),
+                0,
+                (True, True, False),
+                smoothing,
+            )
+            self.assertIsNone(slice_entropy)
+            self.assertEqual(reference_bounding_box(image, smoothing), bounding_box)
         return
 
     def test_determine_bbox(self):
@@ -99,5 +142,111 @@ class CorrectnessTest(unittest.TestCase):
         self.assertEqual((8, 22, 60, 71, 106, 180), bounding_box)
 
 
+class ScanTest(unittest.TestCase):
+    """ Regression tests for the edge cases of the single-read scan. """
+
+    def test_wide_image(self):
+        # A blank border on a random image that is several tiles wide but
+        # shorter than one tile. Rows must span all tiles, and columns must not
+        # be mixed with rows.
+        height, width = 600, 2 * constants.TILE_STRIDE + 400
+        image = numpy.random.default_rng(0).integers(0, 255, size=(height, width), dtype=numpy.uint8)
+        image[:100] = 0
+        image[:, :300] = 0
+        image[:, width - 200:] = 0
+
+        with tempfile.NamedTemporaryFile(suffix='.ome.tif') as infile:
+            with BioWriter(infile.name, X=width, Y=height, dtype=numpy.uint8) as writer:
+                writer[:] = image
+            (y1, y2, x1, x2), _ = autocrop.scan_slice(Path(infile.name), 0, (True, True, False), False)
+
+        self.assertTrue(100 - 2 * constants.WINDOW_SIZE <= y1 <= 100, y1)
+        self.assertTrue(300 - 2 * constants.WINDOW_SIZE <= x1 <= 300, x1)
+        self.assertTrue(width - 200 <= x2 <= width - 200 + 2 * constants.WINDOW_SIZE, x2)
+        self.assertTrue(y1 < y2 <= height, y2)
+
+    def test_spike_after_first_strip(self):
+        # The spike is reported at its absolute index, also when it is found
+        # after the first strip.
+        end = 4 * constants.TILE_STRIDE
+        for step in (100, constants.TILE_STRIDE + 100, 2 * constants.TILE_STRIDE + 500):
+            entropies = [0.0] * step + [5.0] * (end - step)
+            expected, _ = helpers.find_spike(helpers.smoothed_gradients(entropies), constants.GRADIENT_THRESHOLD)
+            self.assertTrue(step - 2 * constants.WINDOW_SIZE <= expected <= step)
+
+            self.assertEqual(expected, autocrop.find_gradient_spike(entropies, end, True))
+            self.assertEqual(end - expected, autocrop.find_gradient_spike(entropies, end, False))
+
+    def test_no_spike(self):
+        # Without a spike above the threshold, a high percentile is used.
+        entropies = numpy.linspace(0, 1e-3, constants.TILE_STRIDE).tolist()
+        index = autocrop.find_gradient_spike(entropies, constants.TILE_STRIDE, True)
+        self.assertTrue(0 <= index < constants.TILE_STRIDE)
+
+
+class DistogramTest(unittest.TestCase):
+    """ Compares the vectorized distograms with the reference implementation. """
+    num_rows = 16
+    num_cols = 1500
+    tile_size = 512
+
+    def reference(self, tiles: list[numpy.ndarray]) -> list[local_distogram.Distogram]:
+        histograms = [
+            local_distogram.Distogram(constants.MAX_BINS, constants.WEIGHTED_BINS)
+            for _ in range(self.num_rows)
+        ]
+        for tile in tiles:
+            for i, row in enumerate(tile):
+                histograms[i] = local_distogram.merge(histograms[i], helpers.distogram_from_batch(
+                    row.astype(numpy.float64).tolist(),
+                    constants.MAX_BINS * 2,
+                    constants.WEIGHTED_BINS,
+                ))
+        return histograms
+
+    def vectorized(self, tiles: list[numpy.ndarray]) -> array_distogram.ArrayDistogram:
+        histograms = array_distogram.ArrayDistogram(self.num_rows, constants.MAX_BINS, constants.WEIGHTED_BINS)
+        for tile in tiles:
+            histograms = array_distogram.merge(histograms, array_distogram.from_batch(
+                tile,
+                constants.MAX_BINS * 2,
+                constants.WEIGHTED_BINS,
+            ))
+        return histograms
+
+    def check(self, image: numpy.ndarray):
+        tiles = [image[:, i:i + self.tile_size] for i in range(0, self.num_cols, self.tile_size)]
+        reference = self.reference(tiles)
+        histograms = self.vectorized(tiles)
+
+        for i, h in enumerate(reference):
+            size = histograms.sizes[i]
+            values, counts = zip(*h.bins)
+            self.assertEqual(len(values), size)
+            numpy.testing.assert_allclose(histograms.values[i, :size], values)
+            numpy.testing.assert_array_equal(histograms.counts[i, :size], counts)
+
+        numpy.testing.assert_allclose(
+            array_distogram.entropy(histograms),
+            [scipy.stats.entropy([c for _, c in h.bins]) for h in reference],
+        )
+
+    def test_uniform(self):
+        self.check(numpy.random.default_rng(0).uniform(size=(self.num_rows, self.num_cols)))
+
+    def test_integers(self):
+        # Repeated values are added to the count of an existing bin
+        self.check(numpy.random.default_rng(1).integers(0, 255, size=(self.num_rows, self.num_cols)))
+
+    def test_skewed(self):
+        self.check(numpy.random.default_rng(2).exponential(size=(self.num_rows, self.num_cols)))
+
+    def test_merge_shape(self):
+        h1 = array_distogram.ArrayDistogram(2, constants.MAX_BINS)
+        h2 = array_distogram.from_batch(numpy.zeros((3, 10)), constants.MAX_BINS, False)
+        with self.assertRaises(ValueError):
+            array_distogram.merge(h1, h2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -46,7 +46,7 @@ fn ftl_rust(c: &mut Criterion) {
                     polygon_set._add_tile(cuboid, (0, y, x));
                 });
             });
-            polygon_set.digest();
+            polygon_set._digest();
             assert!(count == polygon_set.len());
         })
     });
@@ -1,4 +1,6 @@
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import cpu_count
 from pathlib import Path
 
@@ -18,6 +20,17 @@ logging.basicConfig(
 logger = logging.getLogger("PolygonSet")
 logger.setLevel(logging.INFO)
 
+# Number of tiles that are read ahead while the Rust implementation adds the current tile
+PREFETCH_TILES = 2
+
+# Number of labelled tiles that may be held in memory while they wait to be written. A 2d tile of 5120x5120 labels
+# takes 200MB as 8-byte labels from Rust and up to 100MB more in the output dtype, so this bounds the memory used by
+# write_to regardless of the number of cores.
+PENDING_TILES = 4
+
+# Number of threads used to extract labelled tiles
+NUM_WORKERS = max(1, min(cpu_count(), PENDING_TILES))
+
 
 class PolygonSet:
     """ Uses the Rust implementation to build polygons representing objects and to label them.
@@ -69,9 +82,51 @@ class PolygonSet:
 
         return tile_size, num_slices, num_cols, num_rows
     
+    @classmethod
+    def estimate_memory(cls, shape, dtype) -> int:
+        """ Estimates the peak memory, in bytes, used to label an image.
+
+        The prefetched input tiles and the extracted output tiles take a fixed amount of memory. The polygons are
+         run-length encoded, so we use the size of the image as an upper bound on their size.
+
+        Args:
+            shape: The (y, x, z) shape of the image.
+            dtype: The dtype of the image.
+        """
+        y_shape, x_shape, z_shape = shape[:3]
+        itemsize = numpy.dtype(dtype).itemsize
+
+        # Input tiles and their binary copies
+        tile_size = cls._get_iteration_params(z_shape, y_shape, x_shape)[0]
+        read_tile = min(z_shape, tile_size) * min(y_shape, tile_size) * min(x_shape, tile_size)
+        read_bytes = (PREFETCH_TILES + 2) * read_tile * (itemsize + 1)
+
+        # Extracted tiles of 8-byte labels and their copies in the output dtype
+        tile_size = cls._get_iteration_params(1, y_shape, x_shape)[0]
+        write_tile = min(y_shape, tile_size) * min(x_shape, tile_size)
+        write_bytes = PENDING_TILES * write_tile * (8 + 4)
+
+        image_bytes = y_shape * x_shape * z_shape * itemsize
+        return int(image_bytes + read_bytes + write_bytes)
+
+    @staticmethod
+    def _read_tile(reader: BioReader, coordinates):
+        """ Reads a tile and converts it to a binary (z, y, x) array. """
+        z, z_max, y, y_max, x, x_max = coordinates
+        tile = numpy.squeeze(reader[y:y_max, x:x_max, z:z_max, 0, 0])
+        tile = (tile != 0).astype(numpy.uint8)
+        if tile.ndim == 2:
+            tile = tile[numpy.newaxis, :, :]
+        else:
+            tile = tile.transpose(2, 0, 1)
+        return numpy.ascontiguousarray(tile)
+
     def read_from(self, infile: Path):
         """ Reads from a .ome.tif file and finds and labels all objects.
 
+        Tiles are read in a separate thread, a few tiles ahead of the Rust implementation which releases the GIL
+         while it adds a tile, so that decoding the image overlaps with finding polygons.
+
         Args:
             infile: Path to an ome.tif file for which to produce labels.
         """
@@ -80,25 +135,28 @@ class PolygonSet:
             self.metadata = reader.metadata
 
             tile_size, num_slices, num_cols, num_rows = self._get_iteration_params(reader.Z, reader.Y, reader.X)
+            num_tiles = num_slices * num_cols * num_rows
             tile_count = 0
-            for z in range(0, reader.Z, tile_size):
-                z_max = min(reader.Z, z + tile_size)
-                for y in range(0, reader.Y, tile_size):
-                    y_max = min(reader.Y, y + tile_size)
-                    for x in range(0, reader.X, tile_size):
-                        x_max = min(reader.X, x + tile_size)
-
-                        tile = numpy.squeeze(reader[y:y_max, x:x_max, z::z_max, 0, 0])
-                        tile = (tile != 0).astype(numpy.uint8)
-                        if tile.ndim == 2:
-                            tile = tile[numpy.newaxis, :, :]
-                        else:
-                            tile = tile.transpose(2, 0, 1)
-                        self.__polygon_set.add_tile(tile, (z, y, x))
-                        tile_count += 1
-                        logger.debug(f'added tile #{tile_count} ({z}:{z_max}, {y}:{y_max}, {x}:{x_max})')
-                    logger.info(f'Reading Progress {100 * tile_count / (num_slices * num_cols * num_rows):6.3f}%...')
-        
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                pending = deque()
+                for z in range(0, reader.Z, tile_size):
+                    z_max = min(reader.Z, z + tile_size)
+                    for y in range(0, reader.Y, tile_size):
+                        y_max = min(reader.Y, y + tile_size)
+                        for x in range(0, reader.X, tile_size):
+                            x_max = min(reader.X, x + tile_size)
+
+                            coordinates = (z, z_max, y, y_max, x, x_max)
+                            pending.append((coordinates, executor.submit(self._read_tile, reader, coordinates)))
+
+                            # Add the oldest tile once enough tiles are being read ahead
+                            if len(pending) > PREFETCH_TILES:
+                                tile_count = self._add_tile(*pending.popleft(), tile_count, num_tiles)
+
+                while len(pending) > 0:
+                    tile_count = self._add_tile(*pending.popleft(), tile_count, num_tiles)
+
         logger.info('digesting polygons...')
         self.__polygon_set.digest()
 
@@ -106,29 +164,80 @@ class PolygonSet:
         logger.info(f'collected {self.num_polygons} polygons')
         return self
 
-    def write_to(self, outfile: Path):
+    def _add_tile(self, coordinates, future, tile_count: int, num_tiles: int) -> int:
+        z, z_max, y, y_max, x, x_max = coordinates
+        self.__polygon_set.add_tile(future.result(), (z, y, x))
+        tile_count += 1
+        logger.debug(f'added tile #{tile_count} ({z}:{z_max}, {y}:{y_max}, {x}:{x_max})')
+        if tile_count % max(1, num_tiles // 10) == 0 or tile_count == num_tiles:
+            logger.info(f'Reading Progress {100 * tile_count / num_tiles:6.3f}%...')
+        return tile_count
+
+    def statistics(self) -> numpy.ndarray:
+        """ Returns the statistics of every labelled object, computed from the polygons without reading any labels.
+
+        Returns:
+            A 2d array with a row for each object, in the order of their labels, and the columns
+             (label, voxel count, y_min, x_min, z_min, y_max, x_max, z_max, centroid y, centroid x, centroid z).
+             Bounding boxes exclude their maximum values.
+        """
+        statistics = numpy.zeros((self.num_polygons, 11), dtype=numpy.float64)
+        for row, (label, count, bbox, centroid) in enumerate(self.__polygon_set.statistics()):
+            z_min, y_min, x_min, z_max, y_max, x_max = bbox
+            z, y, x = centroid
+            statistics[row] = (label, count, y_min, x_min, z_min, y_max, x_max, z_max, y, x, z)
+        return statistics
+
+    def _extract_tile(self, coordinates, dtype):
+        """ Extracts a labelled tile as a (y, x, z) array of the given dtype. """
+        tile = extract_tile(self.__polygon_set, coordinates)
+        return tile.transpose(1, 2, 0).astype(dtype)
+
+    def write_to(self, outfile: Path, num_workers: int = NUM_WORKERS):
         """ Writes a labelled ome.tif to the given path.
 
         This uses the metadata of the input file and sets the dtype depending on the number of labelled objects.
+         Tiles are extracted by several threads while the finished tiles are written in order.
 
         Args:
             outfile: Path where the labelled image will be written.
+            num_workers: The number of threads used to extract tiles. This is capped at PENDING_TILES.
         """
         with BioWriter(outfile, metadata=self.metadata, max_workers=cpu_count()) as writer:
-            writer.dtype = self.dtype()
-            logger.info(f'writing {outfile.name} with dtype {self.dtype()}...')
+            dtype = self.dtype()
+            writer.dtype = dtype
+            logger.info(f'writing {outfile.name} with dtype {dtype}...')
 
-            tile_size, _, num_cols, num_rows = self._get_iteration_params(writer.Z, writer.Y, writer.X)
+            # Each z-slice is written separately, in tiles aligned with the tiles of the output file
+            tile_size, _, num_cols, num_rows = self._get_iteration_params(1, writer.Y, writer.X)
+            num_tiles = num_cols * num_rows * writer.Z
             tile_count = 0
-            for z in range(writer.Z):
-                for y in range(0, writer.Y, tile_size):
-                    y_max = min(writer.Y, y + tile_size)
-                    for x in range(0, writer.X, tile_size):
-                        x_max = min(writer.X, x + tile_size)
-
-                        tile = extract_tile(self.__polygon_set, (z, z + 1, y, y_max, x, x_max))
-                        writer[y:y_max, x:x_max, z:z + 1, 0, 0] = tile.transpose(1, 2, 0)
-                        tile_count += 1
-                        logger.debug(f'Wrote tile {tile_count}, ({z}, {y}:{y_max}, {x}:{x_max})')
-                logger.info(f'Writing Progress {100 * tile_count / (num_cols * num_rows * writer.Z):6.3f}%...')
+
+            with ThreadPoolExecutor(max_workers=max(1, min(num_workers, PENDING_TILES))) as executor:
+                pending = deque()
+
+                def write_tile():
+                    nonlocal tile_count
+                    (z, y, y_max, x, x_max), future = pending.popleft()
+                    writer[y:y_max, x:x_max, z:z + 1, 0, 0] = future.result()
+                    tile_count += 1
+                    logger.debug(f'Wrote tile {tile_count}, ({z}, {y}:{y_max}, {x}:{x_max})')
+                    if tile_count % (num_cols * num_rows) == 0:
+                        logger.info(f'Writing Progress {100 * tile_count / num_tiles:6.3f}%...')
+
+                for z in range(writer.Z):
+                    for y in range(0, writer.Y, tile_size):
+                        y_max = min(writer.Y, y + tile_size)
+                        for x in range(0, writer.X, tile_size):
+                            x_max = min(writer.X, x + tile_size)
+
+                            # Limit the number of extracted tiles held in memory
+                            if len(pending) >= PENDING_TILES:
+                                write_tile()
+
+                            future = executor.submit(self._extract_tile, (z, z + 1, y, y_max, x, x_max), dtype)
+                            pending.append(((z, y, y_max, x, x_max), future))
+
+                while len(pending) > 0:
+                    write_tile()
         return self
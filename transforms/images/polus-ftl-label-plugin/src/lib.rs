@@ -12,7 +12,8 @@ pub fn extract_tile<'py>(
     polygon_set: &PolygonSet,
     coordinates: (usize, usize, usize, usize, usize, usize),
 ) -> &'py PyArrayDyn<usize> {
-    let tile = polygon_set._extract_tile(coordinates);
+    // Release the GIL so that several tiles can be extracted concurrently from Python threads.
+    let tile = py.allow_threads(|| polygon_set._extract_tile(coordinates));
     tile.into_pyarray(py)
 }
 
@@ -69,8 +70,12 @@ mod tests {
             });
         });
 
-        polygon_set.digest();
+        polygon_set._digest();
 
         assert_eq!(polygon_set.len(), count, "wrong number of polygons");
+
+        let statistics = polygon_set._statistics();
+        let num_voxels: usize = statistics.iter().map(|&(_, voxels, _, _)| voxels).sum();
+        assert_eq!(num_voxels, data.iter().filter(|&&v| v != 0).count(), "wrong number of voxels");
     }
 }
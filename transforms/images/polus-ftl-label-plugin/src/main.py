@@ -1,10 +1,15 @@
 import argparse
 import logging
 import os
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from multiprocessing import cpu_count
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy
+import tifffile
 from bfio import BioReader
 from bfio import BioWriter
 from preadator import ProcessManager
@@ -15,6 +20,9 @@ from ftl_rust import PolygonSet
 POLUS_LOG = getattr(logging, os.environ.get('POLUS_LOG', 'INFO'))
 POLUS_EXT = os.environ.get('POLUS_EXT', '.ome.tif')  # TODO: Figure out how to use this
 
+# Fraction of the physical memory that may be used to label large images concurrently
+MEMORY_FRACTION = 0.5
+
 # Initialize the logger
 logging.basicConfig(
     format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s',
@@ -24,16 +32,107 @@ logger = logging.getLogger("main")
 logger.setLevel(POLUS_LOG)
 
 
+# Columns of the per-object statistics. Bounding boxes exclude their maximum values.
+STATISTICS_COLUMNS = (
+    'label', 'voxel_count',
+    'y_min', 'x_min', 'z_min', 'y_max', 'x_max', 'z_max',
+    'centroid_y', 'centroid_x', 'centroid_z',
+)
+
+
 def get_output_name(filename: str) -> str:
     name = filename.split('.ome')[0]
     return f'{name}{POLUS_EXT}'
 
 
-def filter_by_size(file_paths: List[Path], size_threshold: int) -> Tuple[List[Path], List[Path]]:
+def get_statistics_name(filename: str) -> str:
+    name = filename.split('.ome')[0]
+    return f'{name}_objects.csv'
+
+
+def label_statistics(labels: numpy.ndarray) -> numpy.ndarray:
+    """ Computes the statistics of every object in a labelled image.
+
+    Args:
+        labels: A 2d (y, x) or 3d (y, x, z) labelled image.
+
+    Returns:
+        A 2d array with a row for each object, in the order of their labels, and the columns of STATISTICS_COLUMNS.
+    """
+    # Sort the foreground voxels by label, so that each object is a contiguous run
+    flat_labels = labels.reshape(-1)
+    indices = numpy.flatnonzero(flat_labels)
+    order = numpy.argsort(flat_labels[indices], kind='stable')
+    indices = indices[order]
+    object_labels = flat_labels[indices]
+
+    starts = numpy.flatnonzero(numpy.diff(object_labels, prepend=0))
+    counts = numpy.diff(numpy.append(starts, len(indices)))
+
+    statistics = numpy.zeros((len(starts), len(STATISTICS_COLUMNS)), dtype=numpy.float64)
+    statistics[:, 0] = object_labels[starts]
+    statistics[:, 1] = counts
+    statistics[:, 7] = 1  # 2d images have a single z-slice
+
+    if len(starts) > 0:
+        coordinates = numpy.unravel_index(indices, labels.shape)
+        for axis, axis_coordinates in enumerate(coordinates):
+            statistics[:, 2 + axis] = numpy.minimum.reduceat(axis_coordinates, starts)
+            statistics[:, 5 + axis] = numpy.maximum.reduceat(axis_coordinates, starts) + 1
+            statistics[:, 8 + axis] = numpy.add.reduceat(axis_coordinates.astype(numpy.float64), starts) / counts
+
+    return statistics
+
+
+def write_statistics(output_path: Path, statistics: numpy.ndarray):
+    """ Writes the per-object statistics to a csv file.
+
+    Args:
+        output_path: Path for the csv file.
+        statistics: A 2d array with the columns of STATISTICS_COLUMNS.
+    """
+    integer_columns = len(STATISTICS_COLUMNS) - 3
+    numpy.savetxt(
+        output_path,
+        statistics,
+        fmt=['%d'] * integer_columns + ['%.3f'] * 3,
+        delimiter=',',
+        header=','.join(STATISTICS_COLUMNS),
+        comments='',
+    )
+    return
+
+
+def get_image_shape(file_path: Path) -> Tuple[Tuple[int, ...], numpy.dtype]:
+    """ Reads the shape and dtype of an image from its tiff header, without reading any pixels.
+
+    Args:
+        file_path: Path to an ome.tif file.
+
+    Returns:
+        A 2-tuple of the (y, x, z, c, t) shape and the dtype of the image.
+    """
+    with tifffile.TiffFile(file_path) as tif:
+        series = tif.series[0]
+        axes = dict(zip(series.axes, series.shape))
+        shape = tuple(axes.get(axis, 1) for axis in 'YXZCT')
+        return shape, series.dtype
+
+
+def get_image_shapes(file_paths: List[Path]) -> Dict[Path, Tuple[Tuple[int, ...], numpy.dtype]]:
+    """ Reads the shapes and dtypes of several images in parallel. See `get_image_shape`. """
+    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+        return dict(zip(file_paths, executor.map(get_image_shape, file_paths)))
+
+
+def filter_by_size(
+        image_shapes: Dict[Path, Tuple[Tuple[int, ...], numpy.dtype]],
+        size_threshold: int,
+) -> Tuple[List[Path], List[Path]]:
     """ Partitions the input files by the memory-footprint for the images.
 
     Args:
-        file_paths: The list of files to partition.
+        image_shapes: The shape and dtype of each file to partition.
         size_threshold: The memory-size (in MB) to use as a threshold.
 
     Returns:
@@ -43,10 +142,8 @@ def filter_by_size(file_paths: List[Path], size_threshold: int) -> Tuple[List[Pa
     small_files, large_files = list(), list()
     threshold: int = size_threshold * 1024 * 1024
 
-    for file_path in file_paths:
-        with BioReader(file_path) as reader:
-            num_pixels = numpy.prod(reader.shape)
-            dtype = reader.dtype
+    for file_path, (shape, dtype) in image_shapes.items():
+        num_pixels = numpy.prod(shape)
 
         if dtype in (numpy.uint8, bool):
             pixel_bytes = 8
@@ -63,13 +160,88 @@ def filter_by_size(file_paths: List[Path], size_threshold: int) -> Tuple[List[Pa
     return small_files, large_files
 
 
-def label_cython(input_path: Path, output_path: Path, connectivity: int):
+def get_memory_budget() -> int:
+    """ Returns the memory, in bytes, that may be used to label large images concurrently. """
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+    return int(MEMORY_FRACTION * memory)
+
+
+def label_rust(input_path: Path, output_path: Path, connectivity: int, statistics_path: Optional[Path] = None):
+    """ Label a large input image tile by tile and writes labels back out.
+
+    Args:
+        input_path: Path to input image.
+        output_path: Path for output image.
+        connectivity: Connectivity kind.
+        statistics_path: Optional path for a csv file with the statistics of each object.
+    """
+    polygon_set = PolygonSet(connectivity).read_from(input_path)
+    if statistics_path is not None:
+        write_statistics(statistics_path, polygon_set.statistics())
+    polygon_set.write_to(output_path)
+    return True
+
+
+def label_rust_files(
+        image_shapes: Dict[Path, Tuple[Tuple[int, ...], numpy.dtype]],
+        output_dir: Path,
+        connectivity: int,
+        memory_budget: int,
+        statistics: bool = False,
+):
+    """ Labels several large images concurrently with the Rust implementation.
+
+    Images are started largest first, as long as the estimated memory of all running images fits in the budget.
+     An image is always started when no other image is running, even if it does not fit in the budget.
+
+    Args:
+        image_shapes: The shape and dtype of each image to label.
+        output_dir: Directory for the output images.
+        connectivity: Connectivity kind.
+        memory_budget: The memory, in bytes, that may be used at once.
+        statistics: Whether to write a csv file with the statistics of each object next to each output image.
+    """
+    estimates = {
+        file_path: PolygonSet.estimate_memory(shape, dtype)
+        for file_path, (shape, dtype) in image_shapes.items()
+    }
+    queue = sorted(estimates, key=lambda file_path: estimates[file_path], reverse=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(queue), cpu_count()))) as executor:
+        running = dict()
+        while queue or running:
+
+            # Start images while they fit in the memory budget
+            while queue and (not running or sum(running.values()) + estimates[queue[0]] <= memory_budget):
+                file_path = queue.pop(0)
+                logger.info(f'labeling {file_path.name} with rust...')
+                future = executor.submit(
+                    label_rust,
+                    file_path,
+                    output_dir.joinpath(get_output_name(file_path.name)),
+                    connectivity,
+                    output_dir.joinpath(get_statistics_name(file_path.name)) if statistics else None,
+                )
+                running[future] = estimates[file_path]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                future.result()
+    return
+
+
+def label_cython(input_path: Path, output_path: Path, connectivity: int, statistics_path: Optional[Path] = None):
     """ Label the input image and writes labels back out.
 
     Args:
         input_path: Path to input image.
         output_path: Path for output image.
         connectivity: Connectivity kind.
+        statistics_path: Optional path for a csv file with the statistics of each object.
     """
     with ProcessManager.thread() as active_threads:
         with BioReader(
@@ -88,6 +260,8 @@ def label_cython(input_path: Path, output_path: Path, connectivity: int):
                 if not numpy.any(image):
                     writer.dtype = numpy.uint8
                     writer[:] = numpy.zeros_like(image, dtype=numpy.uint8)
+                    if statistics_path is not None:
+                        write_statistics(statistics_path, label_statistics(image))
                     return
 
                 image = (image > 0)
@@ -101,6 +275,10 @@ def label_cython(input_path: Path, output_path: Path, connectivity: int):
                 # Run the labeling algorithm
                 labels = ftl.label_nd(image, connectivity)
 
+                # Compute the object statistics from the labels in memory
+                if statistics_path is not None:
+                    write_statistics(statistics_path, label_statistics(labels))
+
                 # Save the image
                 writer.dtype = labels.dtype
                 writer[:] = labels
@@ -125,6 +303,11 @@ if __name__ == "__main__":
         help='City block connectivity, must be less than or equal to the number of dimensions',
     )
 
+    parser.add_argument(
+        '--statistics', dest='statistics', type=str, default='false', required=False,
+        help='Whether to write a csv file with the voxel count, bounding box and centroid of each object',
+    )
+
     parser.add_argument(
         '--outDir', dest='outDir', type=str, required=True,
         help='Output collection',
@@ -136,6 +319,9 @@ if __name__ == "__main__":
     _connectivity = int(args.connectivity)
     logger.info(f'connectivity = {_connectivity}')
 
+    _statistics = args.statistics.lower() == 'true'
+    logger.info(f'statistics = {_statistics}')
+
     _input_dir = Path(args.inpDir).resolve()
     assert _input_dir.exists(), f'{_input_dir } does not exist.'
     if _input_dir.joinpath('images').is_dir():
@@ -155,7 +341,8 @@ if __name__ == "__main__":
         lambda _file: _file.is_file() and _file.name.endswith('.ome.tif'),
         _input_dir.iterdir()
     ))
-    _small_files, _large_files = filter_by_size(_files, 500)
+    _image_shapes = get_image_shapes(_files)
+    _small_files, _large_files = filter_by_size(_image_shapes, 500)
 
     logger.info(f'processing {len(_files)} images in total...')
     logger.info(f'processing {len(_small_files)} small images with cython...')
@@ -168,10 +355,15 @@ if __name__ == "__main__":
                 _infile,
                 _output_dir.joinpath(get_output_name(_infile.name)),
                 _connectivity,
+                _output_dir.joinpath(get_statistics_name(_infile.name)) if _statistics else None,
             )
         ProcessManager.join_threads()
 
     if _large_files:
-        for _infile in _large_files:
-            _outfile = _output_dir.joinpath(get_output_name(_infile.name))
-            PolygonSet(_connectivity).read_from(_infile).write_to(_outfile)
+        label_rust_files(
+            {_infile: _image_shapes[_infile] for _infile in _large_files},
+            _output_dir,
+            _connectivity,
+            get_memory_budget(),
+            _statistics,
+        )
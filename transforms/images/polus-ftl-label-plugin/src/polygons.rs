@@ -11,6 +11,8 @@ use rayon::prelude::*;
 
 type Slice = (usize, (usize, (usize, usize))); // (z, (y, (x_min, x_max)))
 type PolyVec = Vec<Arc<Polygon>>;
+type BBox = (usize, usize, usize, usize, usize, usize); // (z_min, y_min, x_min, z_max, y_max, x_max)
+type ObjectStatistics = (usize, usize, BBox, (f64, f64, f64)); // (label, voxel_count, bbox, centroid)
 
 fn do_slices_overlap(left: Slice, right: Slice, connectivity: u8) -> bool {
     let (left_z, (left_y, (left_start, left_stop))) = left;
@@ -123,6 +125,25 @@ impl Polygon {
         self.slices.len()
     }
 
+    /// Returns the number of voxels in this `Polygon` and their centroid as `(z, y, x)`.
+    pub fn moments(&self) -> (usize, (f64, f64, f64)) {
+        let (count, z_sum, y_sum, x_sum) = self.slices.iter().fold(
+            (0, 0., 0., 0.),
+            |(count, z_sum, y_sum, x_sum), &(z, (y, (start, stop)))| {
+                // The x-values in a slice sum to its length times its middle x-value.
+                let length = stop - start;
+                (
+                    count + length,
+                    z_sum + (length * z) as f64,
+                    y_sum + (length * y) as f64,
+                    x_sum + length as f64 * (start + stop - 1) as f64 / 2.,
+                )
+            },
+        );
+        let n = count as f64;
+        (count, (z_sum / n, y_sum / n, x_sum / n))
+    }
+
     /// Returns whether this `Polygon's` bounding-box intersects with that of another `Polygon`.
     ///
     /// This is useful as an early filter for the `boundary_connects` method.
@@ -295,12 +316,31 @@ impl PolygonSet {
         self.polygons.read().unwrap().len()
     }
 
-    pub fn add_tile(&self, tile: PyReadonlyArrayDyn<u8>, top_left_point: (usize, usize, usize)) {
-        self._add_tile(tile.as_array(), top_left_point)
+    /// Detects `Polygons` in a tile and adds them to the set. The GIL is released while the tile is processed so
+    /// that `Python` threads can read the next tile in the meantime.
+    pub fn add_tile(&self, py: Python<'_>, tile: PyReadonlyArrayDyn<u8>, top_left_point: (usize, usize, usize)) {
+        let tile = tile.as_array();
+        py.allow_threads(|| self._add_tile(tile, top_left_point))
     }
 
     /// Restores the invariant that no two `Polygons` in the `PolygonSet` connect with each other.
-    pub fn digest(&self) {
+    pub fn digest(&self, py: Python<'_>) {
+        py.allow_threads(|| self._digest())
+    }
+
+    /// Returns the statistics of every labelled object, in the order of their labels. This must be called after `digest`.
+    ///
+    /// Each object is represented as a nested tuple
+    /// `(label, voxel_count, (z_min, y_min, x_min, z_max, y_max, x_max), (z, y, x))`
+    /// where the bounding-box excludes its maximum values and the last tuple is the centroid.
+    pub fn statistics(&self, py: Python<'_>) -> Vec<ObjectStatistics> {
+        py.allow_threads(|| self._statistics())
+    }
+}
+
+impl PolygonSet {
+    /// Restores the invariant that no two `Polygons` in the `PolygonSet` connect with each other.
+    pub fn _digest(&self) {
         let mut polygons = self
             .polygons
             .write()
@@ -324,9 +364,29 @@ impl PolygonSet {
             .unwrap()
             .extend(polygons.drain(..).map(Arc::new));
     }
-}
 
-impl PolygonSet {
+    /// Computes the statistics of every labelled object. See the `statistics` method.
+    pub fn _statistics(&self) -> Vec<ObjectStatistics> {
+        self.polygons
+            .read()
+            .unwrap()
+            .par_iter()
+            .enumerate()
+            .map(|(i, polygon)| {
+                let (count, centroid) = polygon.moments();
+                let bbox = (
+                    polygon.z_min,
+                    polygon.y_min,
+                    polygon.x_min,
+                    polygon.z_max,
+                    polygon.y_max,
+                    polygon.x_max,
+                );
+                (i + 1, count, bbox, centroid)
+            })
+            .collect()
+    }
+
     /// Detects `Polygons` in a tile and adds them to the set.
     ///
     /// This might break the invariant that no two `Polygons` in the `PolygonSet` connect with each other.
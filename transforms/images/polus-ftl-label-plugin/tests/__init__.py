@@ -0,0 +1,14 @@
+from unittest import TestSuite
+from .polygon_set_test import PolygonSetTest
+
+test_cases = (
+    PolygonSetTest,
+)
+
+
+def load_tests(loader, tests, pattern):
+    suite = TestSuite()
+    for test_class in test_cases:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    return suite
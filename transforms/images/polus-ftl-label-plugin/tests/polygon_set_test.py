@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy
+import scipy.ndimage
+from bfio import BioReader
+from bfio import BioWriter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+import ftl_rust
+from ftl_rust import PolygonSet
+from main import label_statistics
+
+
+def write_image(path: Path, image: numpy.ndarray):
+    """ Writes a (y, x, z) image to an ome.tif file. """
+    with BioWriter(path) as writer:
+        writer.X, writer.Y, writer.Z = image.shape[1], image.shape[0], image.shape[2]
+        writer.dtype = image.dtype
+        writer[:] = image[:, :, :, numpy.newaxis, numpy.newaxis]
+
+
+def read_image(path: Path) -> numpy.ndarray:
+    """ Reads a (y, x, z) image from an ome.tif file. """
+    with BioReader(path) as reader:
+        return reader[:, :, :, 0, 0].reshape(reader.Y, reader.X, reader.Z)
+
+
+class PolygonSetTest(unittest.TestCase):
+    """ Labels a 3d image that spans several tiles (3d tiles are 512 pixels
+     wide) so that objects cross the boundaries between tiles. """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.infile = Path(cls.directory.name).joinpath('image.ome.tif')
+
+        rng = numpy.random.default_rng(0)
+        image = scipy.ndimage.gaussian_filter(rng.random((600, 700, 3)), sigma=(4, 4, 1)) > 0.5
+        cls.image = image.astype(numpy.uint8)
+        write_image(cls.infile, cls.image)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def label(self, connectivity: int, prefetch_tiles: int) -> numpy.ndarray:
+        outfile = Path(self.directory.name).joinpath(f'labels_{connectivity}_{prefetch_tiles}.ome.tif')
+        with mock.patch.object(ftl_rust, 'PREFETCH_TILES', prefetch_tiles):
+            PolygonSet(connectivity).read_from(self.infile).write_to(outfile)
+        return read_image(outfile)
+
+    def test_prefetching(self):
+        for connectivity in (1, 2, 3):
+            with self.subTest(connectivity=connectivity):
+                labels = self.label(connectivity, 0)
+                prefetched = self.label(connectivity, ftl_rust.PREFETCH_TILES)
+                numpy.testing.assert_array_equal(prefetched, labels)
+
+                # The objects are the connected components of the image
+                structure = scipy.ndimage.generate_binary_structure(3, connectivity)
+                expected, num_objects = scipy.ndimage.label(self.image, structure)
+                self.assertEqual(numpy.max(labels), num_objects)
+                numpy.testing.assert_array_equal(labels > 0, self.image > 0)
+                pairs = numpy.unique(numpy.stack([labels[labels > 0], expected[labels > 0]]), axis=1)
+                self.assertEqual(pairs.shape[1], num_objects)
+
+    def test_statistics(self):
+        for connectivity in (1, 2, 3):
+            with self.subTest(connectivity=connectivity):
+                outfile = Path(self.directory.name).joinpath(f'statistics_{connectivity}.ome.tif')
+                polygon_set = PolygonSet(connectivity).read_from(self.infile)
+                statistics = polygon_set.statistics()
+                polygon_set.write_to(outfile)
+
+                # The statistics from the polygons match those from the labels that were written
+                expected = label_statistics(read_image(outfile))
+                self.assertEqual(statistics.shape, expected.shape)
+                numpy.testing.assert_array_equal(statistics[:, :8], expected[:, :8])
+                numpy.testing.assert_allclose(statistics[:, 8:], expected[:, 8:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Benchmark the feature matching and phase correlation registration engines.
+
+Synthetic fluorescence-like images are generated with sparse blurred spots
+(low texture) or dense small spots (high texture). Each image is shifted,
+rotated and scaled by a known transform, and every engine estimates the
+transform back. The accuracy is the largest error in the position of the
+image corners, in pixels.
+
+Run from the plugin root:
+
+    python benches/bench_registration.py --sizes 1024 2048 --repeats 3
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+import image_registration
+
+logging.basicConfig(format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s',
+                    datefmt='%d-%b-%y %H:%M:%S')
+logger = logging.getLogger('bench_registration')
+logger.setLevel(logging.INFO)
+
+# (number of spots per megapixel, blur of the spots)
+TEXTURES = {
+    'low': (100, 6),
+    'high': (5000, 1.5),
+}
+
+# (rotation in degrees, scale, translation as a fraction of the image size)
+TRANSFORMS = {
+    'shift': (0, 1, (0.01, -0.015)),
+    'rotation': (5, 1, (0.005, 0.002)),
+    'similarity': (-12, 1.05, (-0.015, 0.006)),
+}
+
+
+def make_image(size, texture, seed=0):
+    """Create a uint16 image of blurred spots on a smooth background."""
+    rng = np.random.default_rng(seed)
+    density, sigma = TEXTURES[texture]
+    num_spots = int(density * size * size / 1e6)
+
+    image = np.zeros((size, size), dtype=np.float32)
+    image[rng.integers(0, size, num_spots), rng.integers(0, size, num_spots)] = rng.uniform(0.5, 1, num_spots)
+    image = cv2.GaussianBlur(image, (0, 0), sigma)
+    image /= image.max()
+    image += 0.2 * cv2.GaussianBlur(rng.random((size, size)).astype(np.float32), (0, 0), size / 64)
+    image = image / image.max() * 3000 + rng.normal(100, 20, image.shape)
+    return np.clip(image, 0, 65535).astype(np.uint16)
+
+
+def make_pair(image, transform):
+    """Transform an image and crop a margin from both images.
+
+    Returns:
+        moving image, reference image and the true transform that maps the
+        moving image onto the reference image
+    """
+    size = image.shape[0]
+    angle, scale, (tx, ty) = transform
+    matrix = cv2.getRotationMatrix2D((size / 2, size / 2), angle, scale)
+    matrix[:, 2] += (tx * size, ty * size)
+    moving = cv2.warpAffine(image, matrix, (size, size))
+
+    margin = size // 8
+    crop = np.array([[1, 0, margin], [0, 1, margin], [0, 0, 1]], dtype=np.float64)
+    cropped = np.linalg.inv(crop) @ np.vstack([matrix, [0, 0, 1]]) @ crop
+    truth = np.linalg.inv(cropped)
+
+    return moving[margin:-margin, margin:-margin], image[margin:-margin, margin:-margin], truth
+
+
+def corner_error(estimate, truth, shape):
+    """Largest distance between the corners mapped by both transforms."""
+    if estimate is None:
+        return np.inf
+    if estimate.shape[0] == 2:
+        estimate = np.vstack([estimate, [0, 0, 1]])
+
+    height, width = shape
+    corners = np.array([[0, width, 0, width], [0, 0, height, height], [1, 1, 1, 1]], dtype=np.float64)
+    a = estimate @ corners
+    b = truth @ corners
+    return float(np.max(np.abs(a[:2] / a[2] - b[:2] / b[2])))
+
+
+def main_bench():
+    """Time every engine on every image size, texture and transform."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048])
+    parser.add_argument('--textures', type=str, nargs='+', default=list(TEXTURES))
+    parser.add_argument('--transforms', type=str, nargs='+', default=list(TRANSFORMS))
+    parser.add_argument('--engines', type=str, nargs='+', default=image_registration.ENGINES)
+    parser.add_argument('--repeats', type=int, default=1)
+    args = parser.parse_args()
+
+    print('{:>6} {:>8} {:>11} {:>8} {:>12} {:>10}'.format(
+        'size', 'texture', 'transform', 'engine', 'error (px)', 'time (s)'))
+    for size in args.sizes:
+        for texture in args.textures:
+            image = make_image(size, texture)
+            max_val, min_val = int(image.max()), int(image.min())
+
+            for name in args.transforms:
+                moving, reference, truth = make_pair(image, TRANSFORMS[name])
+
+                for engine in args.engines:
+                    times = []
+                    for _ in range(args.repeats):
+                        start = time.perf_counter()
+                        estimate = image_registration.estimate_transform(
+                            moving, reference, max_val, min_val, 'Projective', engine)
+                        times.append(time.perf_counter() - start)
+
+                    error = corner_error(estimate, truth, reference.shape)
+                    print('{:>6} {:>8} {:>11} {:>8} {:>12.2f} {:>10.3f}'.format(
+                        size, texture, name, engine, error, min(times)))
+
+
+if __name__ == '__main__':
+    main_bench()
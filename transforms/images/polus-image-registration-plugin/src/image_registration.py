@@ -1,10 +1,12 @@
-import cv2, argparse, logging
+import cv2, argparse, logging, hashlib, os
 import numpy as np
 from bfio.bfio import BioReader, BioWriter
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import cpu_count
 
+logger = logging.getLogger("image_registration.py")
+
 def corr2(a,b):
     """corr2 Calculate correlation between 2 images
 
@@ -26,35 +28,50 @@ def corr2(a,b):
     
     return r
 
-def get_transform(moving_image,reference_image,max_val,min_val,method):
-    """get_transform Calculate homography matrix transform
+def detect_features(image,max_val,min_val):
+    """detect_features Find ORB keypoints and descriptors in an image
 
-    This function registers the moving image with reference image
-    
     Inputs:
-        moving_image = Image to be transformed
-        reference_image=  reference Image  
+        image = Image in which to find features
+        max_val, min_val = intensity range used to normalize the image
     Outputs:
-        homography= transformation applied to the moving image
+        points= coordinates of the keypoints as a float32 array of shape (n,2)
+        descriptors= ORB descriptors of the keypoints, or None
     """
-    # height, width of the reference image
-    height, width = reference_image.shape
     # max number of features to be calculated using ORB
     max_features=500000
     # initialize orb feature matcher
     orb = cv2.ORB_create(max_features)
     
-    # Normalize images and convert to appropriate type
-    moving_image_norm = cv2.GaussianBlur(moving_image,(3,3),0)
-    reference_image_norm = cv2.GaussianBlur(reference_image,(3,3),0)
-    moving_image_norm = (moving_image_norm-min_val)/(max_val-min_val)
-    moving_image_norm = (moving_image_norm * 255).astype(np.uint8)
-    reference_image_norm = (reference_image_norm-min_val)/(max_val-min_val)
-    reference_image_norm = (reference_image_norm * 255).astype(np.uint8)
+    # Normalize image and convert to appropriate type
+    image_norm = cv2.GaussianBlur(image,(3,3),0)
+    image_norm = (image_norm-min_val)/(max_val-min_val)
+    image_norm = (image_norm * 255).astype(np.uint8)
     
+    # find keypoints and descriptors
+    keypoints, descriptors = orb.detectAndCompute(image_norm, None)
+    points = np.array([keypoint.pt for keypoint in keypoints],dtype=np.float32).reshape(-1,2)
+    
+    return points, descriptors
+
+def get_transform(moving_image,reference_image,max_val,min_val,method,reference_features=None):
+    """get_transform Calculate homography matrix transform
+
+    This function registers the moving image with reference image
+    
+    Inputs:
+        moving_image = Image to be transformed
+        reference_image=  reference Image  
+        reference_features= [Optional] precomputed output of detect_features
+            for the reference image
+    Outputs:
+        homography= transformation applied to the moving image
+    """
     # find keypoints and descriptors in moving and reference image
-    keypoints1, descriptors1 = orb.detectAndCompute(moving_image_norm, None)
-    keypoints2, descriptors2 = orb.detectAndCompute(reference_image_norm, None)
+    keypoints1, descriptors1 = detect_features(moving_image,max_val,min_val)
+    if reference_features is None:
+        reference_features = detect_features(reference_image,max_val,min_val)
+    keypoints2, descriptors2 = reference_features
     
     # Escape if one image does not have descriptors
     if not (isinstance(descriptors1,np.ndarray) and isinstance(descriptors2,np.ndarray)):
@@ -67,7 +84,7 @@ def get_transform(moving_image,reference_image,max_val,min_val,method):
                        multi_probe_level = 1)
     matcher = cv2.FlannBasedMatcher(flann_params, {})
     matches = matcher.match(descriptors1, descriptors2, None)
-    matches.sort(key=lambda x: x.distance, reverse=False)
+    matches = sorted(matches, key=lambda x: x.distance, reverse=False)
     
     # extract top 25% of matches
     good_match_percent=0.25
@@ -75,11 +92,8 @@ def get_transform(moving_image,reference_image,max_val,min_val,method):
     matches = matches[:numGoodMatches]
     
     # extract the point coordinates from the keypoints
-    points1 = np.zeros((len(matches), 2), dtype=np.float32)
-    points2 = np.zeros((len(matches), 2), dtype=np.float32)    
-    for i, match in enumerate(matches):
-        points1[i, :] = keypoints1[match.queryIdx].pt
-        points2[i, :] = keypoints2[match.trainIdx].pt        
+    points1 = keypoints1[[match.queryIdx for match in matches]]
+    points2 = keypoints2[[match.trainIdx for match in matches]]
     
     # If no matching points, return None
     if points1.shape[0]==0 or points2.shape[0]==0:
@@ -95,6 +109,147 @@ def get_transform(moving_image,reference_image,max_val,min_val,method):
     
     return homography
 
+# Registration engines, selectable per run
+ENGINES = ['feature','phase']
+
+# Largest side of the coarsest pyramid level for phase correlation
+PHASE_COARSE_SIZE = 512
+
+# Phase correlation peaks below this response are too weak to be trusted, and
+# feature matching is used instead
+PHASE_MIN_RESPONSE = 0.05
+
+def _normalize(image,max_val,min_val):
+    """ Blur and scale an image to the range [0,1] as float32 """
+    image = cv2.GaussianBlur(image,(3,3),0).astype(np.float32)
+    return (image-min_val)/(max_val-min_val)
+
+def _pad_to_shape(image,shape):
+    """ Pad an image with zeros at the bottom and right to the given shape """
+    return np.pad(image,((0,shape[0]-image.shape[0]),(0,shape[1]-image.shape[1])))
+
+def _highpass(shape):
+    """ High pass filter for centered Fourier spectra (Reddy & Chatterji, 1996) """
+    eta = np.cos(np.pi*np.linspace(-0.5,0.5,shape[0]))
+    xi = np.cos(np.pi*np.linspace(-0.5,0.5,shape[1]))
+    x = np.outer(eta,xi)
+    return (1-x)*(2-x)
+
+def _log_polar_spectrum(image):
+    """ Log-polar transform of the magnitude of the Fourier spectrum
+
+    The magnitude spectrum does not depend on translation. In log-polar
+    coordinates, a rotation of the image is a shift along the rows and a
+    scaling of the image is a shift along the columns.
+    """
+    window = cv2.createHanningWindow(image.shape[::-1],cv2.CV_32F)
+    spectrum = np.abs(np.fft.fftshift(np.fft.fft2(image*window)))
+    spectrum = (spectrum*_highpass(image.shape)).astype(np.float32)
+    
+    center = (image.shape[1]/2,image.shape[0]/2)
+    max_radius = min(center)
+    log_polar = cv2.warpPolar(spectrum,image.shape[::-1],center,max_radius,
+                              cv2.WARP_POLAR_LOG+cv2.INTER_LINEAR)
+    
+    # log-polar column per unit of log radius
+    log_base = image.shape[1]/np.log(max_radius)
+    return log_polar,log_base
+
+def _rotation_scale(moving_image,reference_image):
+    """ Estimate the rotation (degrees) and scale that map the moving image
+    onto the reference image, up to a rotation of 180 degrees """
+    
+    # Square images, so frequencies have the same spacing along both axes
+    size = max(reference_image.shape+moving_image.shape)
+    moving_lp,log_base = _log_polar_spectrum(_pad_to_shape(moving_image,(size,size)))
+    reference_lp,_ = _log_polar_spectrum(_pad_to_shape(reference_image,(size,size)))
+    
+    (shift_radius,shift_angle),_ = cv2.phaseCorrelate(reference_lp,moving_lp)
+    angle = 360*shift_angle/size
+    scale = np.exp(shift_radius/log_base)
+    return angle,scale
+
+def _translation(moving_image,reference_image,transform):
+    """ Phase correlation of the reference with the transformed moving image
+
+    Returns:
+        the translation to add to the transform, and the response of the
+        correlation peak
+    """
+    height, width = reference_image.shape
+    warped = cv2.warpAffine(moving_image,transform,(width,height))
+    window = cv2.createHanningWindow((width,height),cv2.CV_32F)
+    shift,response = cv2.phaseCorrelate(warped,reference_image,window)
+    return np.array(shift),response
+
+def get_transform_phase(moving_image,reference_image,max_val,min_val,method,reference_features=None):
+    """get_transform_phase Calculate a transform using phase correlation
+
+    The rotation and scale are estimated from the log-polar Fourier spectra of
+    the coarsest level of an image pyramid, and the translation is estimated
+    at the coarsest level and refined at every finer level by phase
+    correlation. This takes O(N log N) time and needs no texture for feature
+    points. If the final correlation peak is weak, feature matching is used
+    instead.
+    
+    Inputs:
+        moving_image = Image to be transformed
+        reference_image=  reference Image  
+    Outputs:
+        homography= transformation applied to the moving image
+    """
+    # Normalize images and pad them to the same size
+    shape = tuple(max(a,b) for a,b in zip(moving_image.shape,reference_image.shape))
+    moving = _pad_to_shape(_normalize(moving_image,max_val,min_val),shape)
+    reference = _pad_to_shape(_normalize(reference_image,max_val,min_val),shape)
+    
+    # Build the image pyramid, from fine to coarse
+    levels = [(moving,reference)]
+    while max(levels[-1][0].shape) > PHASE_COARSE_SIZE:
+        levels.append(tuple(cv2.pyrDown(image) for image in levels[-1]))
+    
+    # Rotation and scale at the coarsest level. The spectrum is symmetric, so
+    # both the estimated angle and the opposite angle are tried.
+    moving_coarse,reference_coarse = levels[-1]
+    angle,scale = _rotation_scale(moving_coarse,reference_coarse)
+    center = (moving_coarse.shape[1]/2,moving_coarse.shape[0]/2)
+    candidates = []
+    for candidate_angle in [angle,angle+180]:
+        transform = cv2.getRotationMatrix2D(center,candidate_angle,scale)
+        shift,response = _translation(moving_coarse,reference_coarse,transform)
+        transform[:,2] += shift
+        candidates.append((response,transform))
+    response,transform = max(candidates,key=lambda candidate: candidate[0])
+    
+    # Refine the translation at every finer level
+    for moving_level,reference_level in reversed(levels[:-1]):
+        transform[:,2] *= 2
+        shift,response = _translation(moving_level,reference_level,transform)
+        transform[:,2] += shift
+    
+    if response < PHASE_MIN_RESPONSE:
+        logger.info('Weak phase correlation peak ({:.3f}), using feature matching...'.format(response))
+        return get_transform(moving_image,reference_image,max_val,min_val,method,reference_features)
+    
+    if method=='Projective':
+        transform = np.vstack([transform,[0,0,1]])
+    return transform
+
+def estimate_transform(moving_image,reference_image,max_val,min_val,method,engine='feature',reference_features=None):
+    """estimate_transform Calculate a transform with the selected engine
+
+    Inputs:
+        engine (str): 'feature' for ORB feature matching, 'phase' for phase
+            correlation with a fallback to feature matching
+        reference_features= [Optional] precomputed output of detect_features
+            for the reference image
+    Outputs:
+        homography= transformation applied to the moving image
+    """
+    if engine=='phase':
+        return get_transform_phase(moving_image,reference_image,max_val,min_val,method,reference_features)
+    return get_transform(moving_image,reference_image,max_val,min_val,method,reference_features)
+
 def get_scale_factor(height,width):
     """
     This function returns the appropriate scale factor w.r.t to 
@@ -180,7 +335,79 @@ def get_scaled_down_images(image,scale_factor,get_max=False):
     else:
         return rescaled_image
 
-def register_image(br_ref,br_mov,bw,Xt,Yt,Xm,Ym,x,y,X_crop,Y_crop,max_val,min_val,method):
+def _cache_path(cache_dir,kind,*keys):
+    """ Path of a cache file for the given keys. Input files are identified by
+    their resolved path and modification time. """
+    key = []
+    for k in keys:
+        if Path(str(k)).is_file():
+            key.append('{}:{}'.format(Path(k).resolve(),Path(k).stat().st_mtime_ns))
+        else:
+            key.append(str(k))
+    digest = hashlib.sha1('\n'.join(key).encode()).hexdigest()[:16]
+    return Path(cache_dir).joinpath('{}_{}.npz'.format(kind,digest))
+
+def _save_npz(path,**arrays):
+    """ Write arrays to an npz file atomically, so concurrent registrations
+    never read a partial file """
+    tmp_path = path.with_name('{}.{}.tmp.npz'.format(path.stem,os.getpid()))
+    np.savez(tmp_path,**arrays)
+    os.replace(tmp_path,path)
+
+def load_reference(cache_dir,reference_path,scale_factor):
+    """load_reference Load a cached downscaled reference image
+
+    Outputs:
+        None if the reference is not cached, otherwise a tuple of the
+        downscaled image, max value, min value and ORB features
+    """
+    if cache_dir is None:
+        return None
+    path = _cache_path(cache_dir,'reference',reference_path,scale_factor)
+    if not path.is_file():
+        return None
+    with np.load(path) as data:
+        descriptors = data['descriptors'] if data['descriptors'].size > 0 else None
+        return data['image'],data['max_val'][()],data['min_val'][()],(data['points'],descriptors)
+
+def save_reference(cache_dir,reference_path,scale_factor,image,max_val,min_val,features):
+    """save_reference Cache a downscaled reference image and its ORB features """
+    if cache_dir is None:
+        return
+    points,descriptors = features
+    _save_npz(_cache_path(cache_dir,'reference',reference_path,scale_factor),
+              image=image,max_val=max_val,min_val=min_val,points=points,
+              descriptors=np.zeros((0,32),np.uint8) if descriptors is None else descriptors)
+
+def load_transforms(cache_dir,registration_set,method,engine):
+    """load_transforms Load the cached transforms of a registration set
+
+    Outputs:
+        None if the transforms are not cached, otherwise a tuple of the tile
+        indices, tile shapes and transforms as used by apply_transform
+    """
+    if cache_dir is None:
+        return None
+    path = _cache_path(cache_dir,'transforms',*registration_set,method,engine)
+    if not path.is_file():
+        return None
+    with np.load(path) as data:
+        reg_tiles = [tuple([int(i) for i in t] for t in tile) for tile in data['tiles']]
+        reg_shape = [(int(x),int(y),[int(x0),int(x1)],[int(y0),int(y1)]) for x,y,x0,x1,y0,y1 in data['shapes']]
+        reg_homography = list(data['homographies'])
+    return reg_tiles,reg_shape,reg_homography
+
+def save_transforms(cache_dir,registration_set,method,engine,reg_tiles,reg_shape,reg_homography):
+    """save_transforms Persist the transforms of a registration set, so they
+    can be applied to images again without estimating them """
+    if cache_dir is None:
+        return
+    _save_npz(_cache_path(cache_dir,'transforms',*registration_set,method,engine),
+              tiles=np.array(reg_tiles,dtype=np.int64),
+              shapes=np.array([[x,y,*X_crop,*Y_crop] for x,y,X_crop,Y_crop in reg_shape],dtype=np.int64),
+              homographies=np.array(reg_homography,dtype=np.float64))
+
+def register_image(br_ref,br_mov,bw,Xt,Yt,Xm,Ym,x,y,X_crop,Y_crop,max_val,min_val,method,engine='feature'):
     """register_image Register one section of two images
 
     This method is designed to be used within a thread. It registers
@@ -194,7 +421,7 @@ def register_image(br_ref,br_mov,bw,Xt,Yt,Xm,Ym,x,y,X_crop,Y_crop,max_val,min_va
     mov_tile = br_mov.read_image(X=[Xm[0],Xm[1]],Y=[Ym[0],Ym[1]],Z=[0,1],C=[0],T=[0]).squeeze()
     
     # Get the transformation matrix
-    projective_transform = get_transform(mov_tile,ref_tile,max_val,min_val,method)
+    projective_transform = estimate_transform(mov_tile,ref_tile,max_val,min_val,method,engine)
     
     # Use the rough transformation matrix if no matrix was returned
     is_rough = False
@@ -267,6 +494,8 @@ if __name__=="__main__":
     parser.add_argument('--outDir', dest='outDir', type=str, required=True)
     parser.add_argument('--template', dest='template', type=str,  required=True)
     parser.add_argument('--method', dest='method', type=str,  required=True)
+    parser.add_argument('--engine', dest='engine', type=str, default='feature', choices=ENGINES, required=False)
+    parser.add_argument('--cacheDir', dest='cache_dir', type=str, default=None, required=False)
 
     # parse the arguments 
     args = parser.parse_args()
@@ -275,6 +504,8 @@ if __name__=="__main__":
     outDir = args.outDir   
     template = args.template
     method = args.method
+    engine = args.engine
+    cache_dir = args.cache_dir
     
     # Set up the number of threads for each task
     read_workers = max([cpu_count()//3,1])
@@ -290,7 +521,7 @@ if __name__=="__main__":
     # seperate the filename of the moving image from the complete path
     moving_image_name=registration_set[1][-1*filename_len:]
     
-    # read and downscale reference image
+    # read reference image
     br_ref = BioReader(registration_set[0],max_workers=write_workers)
     scale_factor=get_scale_factor(br_ref.num_y(),br_ref.num_x())
     logger.info('Scale factor: {}'.format(scale_factor))
@@ -301,101 +532,123 @@ if __name__=="__main__":
     else:
         scale_matrix = np.array([[1/scale_factor,1/scale_factor,1],[1/scale_factor,1/scale_factor,1]])
     
-    logger.info('Reading and downscaling reference image: {}'.format(Path(registration_set[0]).name))
-    reference_image_downscaled,max_val,min_val = get_scaled_down_images(br_ref,scale_factor,get_max=True)
-    br_ref.max_workers = read_workers
-    
     # read moving image
-    logger.info('Reading and downscaling moving image: {}'.format(Path(registration_set[1]).name))
     br_mov = BioReader(registration_set[1],max_workers=write_workers)
-    moving_image_downscaled = get_scaled_down_images(br_mov,scale_factor)
-    br_mov.max_workers = read_workers
-    
-    # calculate rough transformation between scaled down reference and moving image
-    logger.info("calculating rough homography...")
-    Rough_Homography_Downscaled = get_transform(moving_image_downscaled,
-                                                reference_image_downscaled,
-                                                max_val,
-                                                min_val,
-                                                method)
-    
-    # upscale the rough homography matrix
-    logger.info("Inverting homography...")
-    if method=='Projective':
-        Rough_Homography_Upscaled=Rough_Homography_Downscaled*scale_matrix
-        homography_inverse=np.linalg.inv(Rough_Homography_Upscaled)
+    
+    # skip the estimation if the transforms of this set were saved by a previous run
+    cached_transforms = load_transforms(cache_dir,registration_set,method,engine)
+    if cached_transforms is not None:
+        logger.info('Using cached transforms for moving image: {}'.format(Path(registration_set[1]).name))
+        reg_tiles,reg_shape,reg_homography = cached_transforms
+        br_ref.max_workers = read_workers
+        similar_transformation_set.insert(0,registration_set[1])
     else:
-        Rough_Homography_Upscaled=Rough_Homography_Downscaled
-        homography_inverse=cv2.invertAffineTransform(Rough_Homography_Downscaled)
-    
-    # Initialize the output file
-    bw = BioWriter(str(Path(outDir).joinpath(Path(registration_set[1]).name)),metadata=br_mov.read_metadata(),max_workers=write_workers)
-    bw.num_x(br_ref.num_x())
-    bw.num_y(br_ref.num_y())
-    bw.num_z(1)
-    bw.num_c(1)
-    bw.num_t(1)
-    
-    # transformation variables
-    reg_shape = []
-    reg_tiles = []
-    reg_homography = []
-    
-    # Loop through image tiles and start threads
-    logger.info("Starting threads...")
-    threads = []
-    first_tile = True
-    with ThreadPoolExecutor(max_workers=loop_workers) as executor:
-        for x in range(0,br_ref.num_x(),2048):
-            for y in range(0,br_ref.num_y(),2048):
+        # the downscaled reference image and its features are shared by all sets with the same reference
+        reference = load_reference(cache_dir,registration_set[0],scale_factor)
+        if reference is None:
+            logger.info('Reading and downscaling reference image: {}'.format(Path(registration_set[0]).name))
+            reference_image_downscaled,max_val,min_val = get_scaled_down_images(br_ref,scale_factor,get_max=True)
+            reference_features = detect_features(reference_image_downscaled,max_val,min_val)
+            save_reference(cache_dir,registration_set[0],scale_factor,reference_image_downscaled,max_val,min_val,reference_features)
+        else:
+            logger.info('Using cached reference image: {}'.format(Path(registration_set[0]).name))
+            reference_image_downscaled,max_val,min_val,reference_features = reference
+        br_ref.max_workers = read_workers
         
-                # Get reference/template image coordinates
-                Xt = [np.max([0,x-1024]),np.min([br_ref.num_x(),x+2048+1024])]
-                Yt = [np.max([0,y-1024]),np.min([br_ref.num_y(),y+2048+1024])]
-                
-                # Use the rough homography to get coordinates in the moving image
-                coords = np.array([[Xt[0],Xt[0],Xt[1],Xt[1]],
-                                [Yt[0],Yt[1],Yt[1],Yt[0]],
-                                [1,1,1,1]],
-                                dtype=np.float64)
-                
-                coords = np.matmul(homography_inverse,coords)
-                
-                mins = np.min(coords,axis=1)
-                maxs = np.max(coords,axis=1)
-                
-                Xm = [int(np.floor(np.max([mins[0],0]))),
-                        int(np.ceil(np.min([maxs[0],br_mov.num_x()])))]
-                Ym = [int(np.floor(np.max([mins[1],0]))),
-                        int(np.ceil(np.min([maxs[1],br_mov.num_y()])))]
-                
-                reg_tiles.append((Xm,Ym,Xt,Yt))
-                
-                # Get cropping dimensions
-                X_crop = [1024 if Xt[0] > 0 else 0]
-                X_crop.append(2048+X_crop[0] if Xt[1]-Xt[0] >= 3072 else Xt[1]-Xt[0]+X_crop[0])
-                Y_crop = [1024 if Yt[0] > 0 else 0]
-                Y_crop.append(2048+Y_crop[0] if Yt[1]-Yt[0] >= 3072 else Yt[1]-Yt[0]+Y_crop[0])
-                reg_shape.append((x,y,X_crop,Y_crop))
-                
-                # Start a thread to register the tiles
-                threads.append(executor.submit(register_image,br_ref,br_mov,bw,Xt,Yt,Xm,Ym,x,y,X_crop,Y_crop,max_val,min_val,method))
-                
-                # Bioformats require the first tile be written before any other tile
-                if first_tile:
-                    logger.info('Waiting for first_tile to finish...')
-                    first_tile = False
-                    threads[0].result()
-    
-        # Wait for threads to finish, track progress
-        for thread_num in range(len(threads)):
-            if thread_num % 10 == 0:
-                logger.info('Registration progress: {:6.2f}%'.format(100*thread_num/len(threads)))
-            reg_homography.append(threads[thread_num].result())
-            
-    # Close the image
-    bw.close_image()
-    logger.info('Registration progress: {:6.2f}%'.format(100.0))
+        logger.info('Reading and downscaling moving image: {}'.format(Path(registration_set[1]).name))
+        moving_image_downscaled = get_scaled_down_images(br_mov,scale_factor)
+        br_mov.max_workers = read_workers
+
+        # calculate rough transformation between scaled down reference and moving image
+        logger.info("calculating rough homography...")
+        Rough_Homography_Downscaled = estimate_transform(moving_image_downscaled,
+                                                         reference_image_downscaled,
+                                                         max_val,
+                                                         min_val,
+                                                         method,
+                                                         engine,
+                                                         reference_features)
+
+        # upscale the rough homography matrix
+        logger.info("Inverting homography...")
+        if method=='Projective':
+            Rough_Homography_Upscaled=Rough_Homography_Downscaled*scale_matrix
+            homography_inverse=np.linalg.inv(Rough_Homography_Upscaled)
+        else:
+            Rough_Homography_Upscaled=Rough_Homography_Downscaled
+            homography_inverse=cv2.invertAffineTransform(Rough_Homography_Downscaled)
+
+        # Initialize the output file
+        bw = BioWriter(str(Path(outDir).joinpath(Path(registration_set[1]).name)),metadata=br_mov.read_metadata(),max_workers=write_workers)
+        bw.num_x(br_ref.num_x())
+        bw.num_y(br_ref.num_y())
+        bw.num_z(1)
+        bw.num_c(1)
+        bw.num_t(1)
+
+        # transformation variables
+        reg_shape = []
+        reg_tiles = []
+        reg_homography = []
+
+        # Loop through image tiles and start threads
+        logger.info("Starting threads...")
+        threads = []
+        first_tile = True
+        with ThreadPoolExecutor(max_workers=loop_workers) as executor:
+            for x in range(0,br_ref.num_x(),2048):
+                for y in range(0,br_ref.num_y(),2048):
+
+                    # Get reference/template image coordinates
+                    Xt = [np.max([0,x-1024]),np.min([br_ref.num_x(),x+2048+1024])]
+                    Yt = [np.max([0,y-1024]),np.min([br_ref.num_y(),y+2048+1024])]
+
+                    # Use the rough homography to get coordinates in the moving image
+                    coords = np.array([[Xt[0],Xt[0],Xt[1],Xt[1]],
+                                    [Yt[0],Yt[1],Yt[1],Yt[0]],
+                                    [1,1,1,1]],
+                                    dtype=np.float64)
+
+                    coords = np.matmul(homography_inverse,coords)
+
+                    mins = np.min(coords,axis=1)
+                    maxs = np.max(coords,axis=1)
+
+                    Xm = [int(np.floor(np.max([mins[0],0]))),
+                            int(np.ceil(np.min([maxs[0],br_mov.num_x()])))]
+                    Ym = [int(np.floor(np.max([mins[1],0]))),
+                            int(np.ceil(np.min([maxs[1],br_mov.num_y()])))]
+
+                    reg_tiles.append((Xm,Ym,Xt,Yt))
+
+                    # Get cropping dimensions
+                    X_crop = [1024 if Xt[0] > 0 else 0]
+                    X_crop.append(2048+X_crop[0] if Xt[1]-Xt[0] >= 3072 else Xt[1]-Xt[0]+X_crop[0])
+                    Y_crop = [1024 if Yt[0] > 0 else 0]
+                    Y_crop.append(2048+Y_crop[0] if Yt[1]-Yt[0] >= 3072 else Yt[1]-Yt[0]+Y_crop[0])
+                    reg_shape.append((x,y,X_crop,Y_crop))
+
+                    # Start a thread to register the tiles
+                    threads.append(executor.submit(register_image,br_ref,br_mov,bw,Xt,Yt,Xm,Ym,x,y,X_crop,Y_crop,max_val,min_val,method,engine))
+
+                    # Bioformats require the first tile be written before any other tile
+                    if first_tile:
+                        logger.info('Waiting for first_tile to finish...')
+                        first_tile = False
+                        threads[0].result()
+
+            # Wait for threads to finish, track progress
+            for thread_num in range(len(threads)):
+                if thread_num % 10 == 0:
+                    logger.info('Registration progress: {:6.2f}%'.format(100*thread_num/len(threads)))
+                reg_homography.append(threads[thread_num].result())
+
+        # Close the image
+        bw.close_image()
+        logger.info('Registration progress: {:6.2f}%'.format(100.0))
+
+        # save the transforms so they can be applied again without estimating them
+        save_transforms(cache_dir,registration_set,method,engine,reg_tiles,reg_shape,reg_homography)
     
     # iterate across all images which have the similar transformation as the moving image above
     for moving_image_path in similar_transformation_set:
@@ -1,15 +1,53 @@
-import argparse, logging, subprocess
+import argparse, logging, subprocess, os, tempfile
 import numpy as np
 from pathlib import Path
 from parser import parse_collection
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import cpu_count
 import shutil
 
+logger = logging.getLogger("main")
+
+# Fraction of the physical memory that concurrent registrations may use
+MEMORY_FRACTION = 0.5
+
+# Upper bound of the pixels in a downscaled image (see get_scale_factor)
+DOWNSCALED_PIXELS = 4*5000000
+
+def set_memory_estimate():
+    """ Estimate of the peak memory used to register one set, in bytes.
+
+    Each registration holds the downscaled reference and moving images and
+    their float copies, plus three 3072x3072 tiles for each tile thread.
+    """
+    loop_workers = max([3*cpu_count()//4,2])
+    return 2*DOWNSCALED_PIXELS*(2+8) + loop_workers*3*3072*3072*(2+8)
+
+def max_concurrent_sets():
+    """ Number of registration sets that fit in the memory budget """
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 1
+    return int(max(1,min(cpu_count(),MEMORY_FRACTION*memory//set_memory_estimate())))
+
+def register_set(registration_set,similar_transformation_set,outDir,template,method,engine,cacheDir):
+    """ Register a set of images in a subprocess """
+    
+    # concatenate lists into a string to pass as an argument to argparse
+    registration_string=' '.join(registration_set)
+    similar_transformation_string=' '.join(similar_transformation_set)
+
+    # open subprocess image_registration.py
+    registration = subprocess.Popen("python3 image_registration.py --registrationString '{}' --similarTransformationString '{}' --outDir '{}' --template '{}' --method '{}' --engine '{}' --cacheDir '{}'".format(registration_string,similar_transformation_string,outDir,template,method,engine,cacheDir), shell=True )
+    if registration.wait() != 0:
+        logger.error('Registration of {} failed'.format(Path(registration_set[1]).name))
+
 
 if __name__=="__main__":
     # Initialize the logger
     logging.basicConfig(format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s',
                         datefmt='%d-%b-%y %H:%M:%S')
-    logger = logging.getLogger("main")
     logger.setLevel(logging.INFO)
 
     # Setup the argument parsing
@@ -22,6 +60,8 @@ if __name__=="__main__":
     parser.add_argument('--TransformationVariable', dest='TransformationVariable', type=str,help='variable to help identify which images have similar transformation', required=True)
     parser.add_argument('--outDir', dest='outDir', type=str, help='Output collection', required=True)
     parser.add_argument('--method', dest='method', type=str, help='projective, affine, or partialaffine', required=True)
+    parser.add_argument('--engine', dest='engine', type=str, default='feature', help='feature or phase', required=False)
+    parser.add_argument('--cacheDir', dest='cacheDir', type=str, help='Directory to cache downscaled references and transforms', required=False)
     
     # Parse the arguments     
     args = parser.parse_args()
@@ -44,6 +84,16 @@ if __name__=="__main__":
     logger.info('outDir = {}'.format(outDir))     
     method = args.method
     logger.info('method = {}'.format(method)) 
+    engine = args.engine
+    logger.info('engine = {}'.format(engine))
+    cacheDir = args.cacheDir
+    logger.info('cacheDir = {}'.format(cacheDir))
+    
+    # without a cache directory, the cache is only shared by the sets of this run
+    remove_cache = cacheDir is None
+    if remove_cache:
+        cacheDir = tempfile.mkdtemp()
+    Path(cacheDir).mkdir(parents=True,exist_ok=True)
     
      # get template image path
     template_image_path=str(Path(inpDir).joinpath(template).absolute())  
@@ -56,6 +106,7 @@ if __name__=="__main__":
     registration_dictionary=parse_collection(inpDir,filePattern,registrationVariable, TransformationVariable, template_image_path)
     
     logger.info('Iterating over registration_dictionary....')
+    groups = {}
     for registration_set,similar_transformation_set in registration_dictionary.items():
         
         # registration_dictionary consists of set of already registered images as well
@@ -68,11 +119,24 @@ if __name__=="__main__":
                 shutil.copy2(image_path,str(Path(outDir).joinpath(image_name).absolute()))            
             continue
         
-        # concatenate lists into a string to pass as an argument to argparse
-        registration_string=' '.join(registration_set)
-        similar_transformation_string=' '.join(similar_transformation_set)        
-
-        # open subprocess image_registration.py
-        registration = subprocess.Popen("python3 image_registration.py --registrationString '{}' --similarTransformationString '{}' --outDir '{}' --template '{}' --method '{}'".format(registration_string,similar_transformation_string,outDir,template,method), shell=True )
-        registration.wait()
-        
\ No newline at end of file
+        # group the sets by reference image, so the reference is downscaled once
+        groups.setdefault(registration_set[0],[]).append((registration_set,similar_transformation_set))
+    
+    # register sets concurrently, as many as fit in the memory budget
+    max_workers = max_concurrent_sets()
+    logger.info('Registering {} sets with {} workers'.format(sum(len(g) for g in groups.values()),max_workers))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            
+            # the first set of each group caches the downscaled reference for the rest of the group
+            pending = {executor.submit(register_set,*group[0],outDir,template,method,engine,cacheDir):group[1:]
+                       for group in groups.values()}
+            while pending:
+                for future in as_completed(list(pending)):
+                    future.result()
+                    for registration_set,similar_transformation_set in pending.pop(future):
+                        pending[executor.submit(register_set,registration_set,similar_transformation_set,
+                                                outDir,template,method,engine,cacheDir)] = []
+    finally:
+        if remove_cache:
+            shutil.rmtree(cacheDir,ignore_errors=True)
@@ -1,8 +1,10 @@
 import argparse, logging, time, sys, os, traceback
 from bfio.bfio import BioReader, BioWriter
+from contextlib import ExitStack
 from pathlib import Path
 import numpy as np
 from preadator import ProcessManager
+from projections import PROJECTIONS, make_projection
 
 # x,y size of the 3d image chunk to be loaded into memory
 tile_size = 1024
@@ -10,89 +12,84 @@ tile_size = 1024
 # depth of the 3d image chunk
 tile_size_z = 128
 
-def max_min_projection(br, bw, x_range, y_range, **kwargs):
-    """ Calculate the max or min intensity
-    projection of a section of the input image.
+def projection(br, bws, x_range, y_range, **kwargs):
+    """ Calculate the intensity projections of a section of the input image.
+
+    The volume is read once in chunks of `tile_size_z` slices, and each chunk
+    is added to the accumulators of all projections.
 
     Args:
         br (BioReader object): input file object
-        bw (BioWriter object): output file object
+        bws (dict): output file object of each projection
         x_range (tuple): x-range of the img to be processed
         y_range (tuple): y-range of the img to be processed
 
     Returns:
-        image array : Max IP of the input volume
+        image array : Projections of the input volume
     """
     with ProcessManager.thread():
         br.max_workers = ProcessManager._active_threads
-        bw.max_workers = ProcessManager._active_threads
+        for bw in bws.values():
+            bw.max_workers = ProcessManager._active_threads
 
-        # set projection method
-        if not 'method' in kwargs:
-            method = np.max
-        else:
-            method = kwargs['method']
+        # percentile for the percentile projection
+        percentile = kwargs.get('percentile', 50.0)
 
         # x,y range of the volume
         x, x_max = x_range
         y, y_max = y_range
 
+        accumulators = {
+            name: make_projection(name, (y_max-y, x_max-x), br.dtype, br.Z, percentile=percentile)
+            for name in bws
+        }
+
         # iterate over depth
-        for ind, z in enumerate(range(0,br.Z,tile_size_z)):
+        for z in range(0,br.Z,tile_size_z):
             z_max = min([br.Z,z+tile_size_z])
-            if ind == 0:
-                out_image = method(br[y:y_max,x:x_max,z:z_max,0,0], axis=2)
-            else:
-                out_image = np.dstack((out_image, method(br[y:y_max,x:x_max,z:z_max,0,0], axis=2)))
-
-        # output image
-        bw[y:y_max,x:x_max,0:1,0,0] = method(out_image, axis=2)
-
-
-
-def mean_projection(br, bw, x_range, y_range, **kwargs):
-    """ Calculate the mean intensity projection
-
-    Args:
-        br (BioReader object): input file object
-        bw (BioWriter object): output file object
-        x_range (tuple): x-range of the img to be processed
-        y_range (tuple): y-range of the img to be processed
-
-    Returns:
-        image array : Mean IP of the input volume
-    """
-    with ProcessManager.thread():
-        br.max_workers = ProcessManager._active_threads
-        bw.max_workers = ProcessManager._active_threads
 
-        # x,y range of the volume
-        x, x_max = x_range
-        y, y_max = y_range
+            chunk = np.reshape(br[y:y_max,x:x_max,z:z_max,0,0], (y_max-y, x_max-x, z_max-z))
+            for accumulator in accumulators.values():
+                accumulator.update(chunk, z)
 
-        # iterate over depth
-        out_image = np.zeros((y_max-y,x_max-x),dtype=np.float64)
-        for ind, z in enumerate(range(0,br.Z,tile_size_z)):
-            z_max = min([br.Z,z+tile_size_z])
+        # output images
+        for name, accumulator in accumulators.items():
+            bws[name][y:y_max,x:x_max,0:1,0,0] = accumulator.result()
 
-            out_image += np.sum(br[y:y_max,x:x_max,z:z_max,...].astype(np.float64),axis=2).squeeze()
 
-        # output image
-        out_image /= br.Z
-        bw[y:y_max,x:x_max,0:1,0,0] = out_image.astype(br.dtype)
+def output_path(outDir, image_name, projection, suffix):
+    """ Path of the output image of a projection. With several projections,
+    the name of the projection is appended to the image name, before its
+    extension. """
+    if suffix:
+        for extension in ('.ome.tif', '.ome.zarr'):
+            if image_name.endswith(extension):
+                break
+        else:
+            extension = os.path.splitext(image_name)[1]
+        stem = image_name[:len(image_name) - len(extension)]
+        image_name = '{}_{}{}'.format(stem, projection, extension)
+    return os.path.join(outDir, image_name)
 
 
-def process_image(input_img_path, output_img_path, projection, method):
+def process_image(input_img_path, outDir, image_name, projections, percentile):
 
     # Grab a free process
     with ProcessManager.process():
 
-        # initalize biowriter and bioreader
-        with BioReader(input_img_path, max_workers=ProcessManager._active_threads) as br, \
-            BioWriter(output_img_path, metadata=br.metadata, max_workers=ProcessManager._active_threads) as bw:
+        # initalize biowriters and bioreader
+        with ExitStack() as stack:
+            br = stack.enter_context(BioReader(input_img_path, max_workers=ProcessManager._active_threads))
 
-            # output image is 2d
-            bw.Z = 1
+            bws = {}
+            for name in projections:
+                output_img_path = output_path(outDir, image_name, name, len(projections) > 1)
+                bw = stack.enter_context(BioWriter(output_img_path, metadata=br.metadata, max_workers=ProcessManager._active_threads))
+
+                # output image is 2d
+                bw.Z = 1
+                bw.dtype = PROJECTIONS[name].output_dtype(br.dtype, br.Z)
+                bws[name] = bw
 
             # iterate along the x,y direction
             for x in range(0,br.X,tile_size):
@@ -101,12 +98,12 @@ def process_image(input_img_path, output_img_path, projection, method):
                 for y in range(0,br.Y,tile_size):
                     y_max = min([br.Y,y+tile_size])
 
-                    ProcessManager.submit_thread(projection,br,bw,(x, x_max),(y, y_max),method=method)
+                    ProcessManager.submit_thread(projection,br,bws,(x, x_max),(y, y_max),percentile=percentile)
 
             ProcessManager.join_threads()
 
 
-def main(inpDir, outDir, projection, method):
+def main(inpDir, outDir, projections, percentile):
 
     # images in the input directory
     inpDir_files = os.listdir(inpDir)
@@ -117,9 +114,8 @@ def main(inpDir, outDir, projection, method):
         for image_name in inpDir_files:
 
             input_img_path = os.path.join(inpDir, image_name)
-            output_img_path = os.path.join(outDir, image_name)
 
-            ProcessManager.submit_process(process_image, input_img_path, output_img_path, projection, method)
+            ProcessManager.submit_process(process_image, input_img_path, outDir, image_name, projections, percentile)
 
         ProcessManager.join_processes()
 
@@ -146,7 +142,9 @@ if __name__=="__main__":
     parser.add_argument('--inpDir', dest='inpDir', type=str,
                         help='Input image collection to be processed by this plugin', required=True)
     parser.add_argument('--projectionType', dest='projectionType', type=str,
-                        help='Type of volumetric intensity projection', required=True)
+                        help='Type of volumetric intensity projection, or a comma separated list of types', required=True)
+    parser.add_argument('--percentile', dest='percentile', type=str, default='50',
+                        help='Percentile for the percentile projection', required=False)
     # Output arguments
     parser.add_argument('--outDir', dest='outDir', type=str,
                         help='Output collection', required=True)
@@ -160,23 +158,22 @@ if __name__=="__main__":
     logger.info('inpDir = {}'.format(inpDir))
     projectionType = args.projectionType
     logger.info('projectionType = {}'.format(projectionType))
+    percentile = float(args.percentile)
+    logger.info('percentile = {}'.format(percentile))
     outDir = args.outDir
     logger.info('outDir = {}'.format(outDir))
 
-    # initialize projection function
-    if projectionType == 'max':
-        projection = max_min_projection
-        method = np.max
-    elif projectionType == 'min':
-        projection = max_min_projection
-        method = np.min
-    elif projectionType == 'mean':
-        projection = mean_projection
-        method = None
-    
+    # several projections are computed in a single pass over each image
+    projections = [name.strip() for name in projectionType.split(',')]
+    for name in projections:
+        if name not in PROJECTIONS:
+            raise ValueError('projectionType must be one of {}, got {}'.format(list(PROJECTIONS), name))
+    if not 0 <= percentile <= 100:
+        raise ValueError('percentile must be between 0 and 100')
+
     ProcessManager.init_processes('main','intensity')
 
-    main(inpDir, outDir, projection, method)
+    main(inpDir, outDir, projections, percentile)
 
 
 
@@ -0,0 +1,291 @@
+""" Streaming accumulators for volumetric intensity projections.
+
+Each projection is computed for one x,y tile at a time. The z-stack of the tile
+is read in chunks, and every chunk is fed to the accumulators of all requested
+projections, so the image is read only once regardless of the number of
+projections. The accumulators have a fixed size that does not depend on the
+depth of the image.
+"""
+import numpy as np
+
+
+class Projection:
+    """ Base class of a projection along the z-axis.
+
+    Args:
+        shape (tuple): x,y shape of the tile
+        dtype (numpy.dtype): data type of the input image
+        depth (int): number of z-slices in the input image
+    """
+
+    def __init__(self, shape, dtype, depth):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.depth = depth
+
+    @classmethod
+    def output_dtype(cls, dtype, depth):
+        """ Data type of the projected image. """
+        return np.dtype(dtype)
+
+    def update(self, chunk, z):
+        """ Add a chunk of consecutive z-slices to the projection.
+
+        Args:
+            chunk (numpy.ndarray): 3d array of shape (y, x, z)
+            z (int): index of the first z-slice in the chunk
+        """
+        raise NotImplementedError
+
+    def result(self):
+        """ Returns the projected 2d image. """
+        raise NotImplementedError
+
+
+class MaxProjection(Projection):
+    """ Maximum intensity along the z-axis. """
+
+    def __init__(self, shape, dtype, depth):
+        super().__init__(shape, dtype, depth)
+        self.out_image = None
+
+    def update(self, chunk, z):
+        chunk_max = np.max(chunk, axis=2)
+        if self.out_image is None:
+            self.out_image = chunk_max
+        else:
+            np.maximum(self.out_image, chunk_max, out=self.out_image)
+
+    def result(self):
+        return self.out_image
+
+
+class MinProjection(Projection):
+    """ Minimum intensity along the z-axis. """
+
+    def __init__(self, shape, dtype, depth):
+        super().__init__(shape, dtype, depth)
+        self.out_image = None
+
+    def update(self, chunk, z):
+        chunk_min = np.min(chunk, axis=2)
+        if self.out_image is None:
+            self.out_image = chunk_min
+        else:
+            np.minimum(self.out_image, chunk_min, out=self.out_image)
+
+    def result(self):
+        return self.out_image
+
+
+class SumProjection(Projection):
+    """ Sum of intensities along the z-axis, as 64-bit floats. """
+
+    def __init__(self, shape, dtype, depth):
+        super().__init__(shape, dtype, depth)
+        self.total = np.zeros(shape, dtype=np.float64)
+        self.count = 0
+
+    @classmethod
+    def output_dtype(cls, dtype, depth):
+        return np.dtype(np.float64)
+
+    def update(self, chunk, z):
+        self.total += np.sum(chunk, axis=2, dtype=np.float64)
+        self.count += chunk.shape[2]
+
+    def result(self):
+        return self.total
+
+
+class MeanProjection(SumProjection):
+    """ Mean intensity along the z-axis, in the data type of the input image. """
+
+    @classmethod
+    def output_dtype(cls, dtype, depth):
+        return np.dtype(dtype)
+
+    def result(self):
+        return (self.total / self.count).astype(self.dtype)
+
+
+class StdProjection(Projection):
+    """ Standard deviation of intensities along the z-axis.
+
+    The mean and sum of squared deviations of each chunk are combined with
+    those of the previous chunks using Welford's update for batches (Chan et
+    al.), which avoids the cancellation of summing squares.
+    """
+
+    def __init__(self, shape, dtype, depth):
+        super().__init__(shape, dtype, depth)
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+        self.count = 0
+
+    @classmethod
+    def output_dtype(cls, dtype, depth):
+        return np.dtype(np.float64)
+
+    def update(self, chunk, z):
+        chunk = chunk.astype(np.float64)
+        chunk_count = chunk.shape[2]
+        chunk_mean = np.mean(chunk, axis=2)
+        chunk_m2 = np.sum((chunk - chunk_mean[..., None]) ** 2, axis=2)
+
+        count = self.count + chunk_count
+        delta = chunk_mean - self.mean
+        self.mean += delta * (chunk_count / count)
+        self.m2 += chunk_m2 + delta ** 2 * (self.count * chunk_count / count)
+        self.count = count
+
+    def result(self):
+        return np.sqrt(self.m2 / self.count)
+
+
+class ArgmaxProjection(Projection):
+    """ Depth map with the index of the z-slice of maximum intensity. Ties are
+    resolved to the first z-slice. """
+
+    def __init__(self, shape, dtype, depth):
+        super().__init__(shape, dtype, depth)
+        self.max = None
+        self.index = np.zeros(shape, dtype=self.output_dtype(dtype, depth))
+
+    @classmethod
+    def output_dtype(cls, dtype, depth):
+        return np.dtype(np.uint16 if depth <= np.iinfo(np.uint16).max + 1 else np.uint32)
+
+    def update(self, chunk, z):
+        chunk_max = np.max(chunk, axis=2)
+        chunk_index = np.argmax(chunk, axis=2) + z
+        if self.max is None:
+            self.max = chunk_max
+            self.index[:] = chunk_index
+        else:
+            better = chunk_max > self.max
+            self.max[better] = chunk_max[better]
+            self.index[better] = chunk_index[better]
+
+    def result(self):
+        return self.index
+
+
+class QuantileProjection(Projection):
+    """ Approximate quantile of intensities along the z-axis.
+
+    Every pixel has a P-square sketch (Jain & Chlamtac, 1985), which tracks
+    the quantile with 5 markers instead of storing all values. The markers of
+    all pixels are updated together, one z-slice at a time. Stacks with fewer
+    than 5 slices get the exact quantile.
+
+    Args:
+        quantile (float): the quantile to estimate, between 0 and 1
+    """
+
+    def __init__(self, shape, dtype, depth, quantile=0.5):
+        super().__init__(shape, dtype, depth)
+        p = quantile
+        self.quantile = p
+        self.count = 0
+
+        # Marker heights and positions of every pixel
+        self.heights = np.zeros((5,) + tuple(shape), dtype=np.float64)
+        self.positions = np.zeros((5,) + tuple(shape), dtype=np.float64)
+        self.positions[:] = np.arange(5).reshape(5, 1, 1)
+
+        # Desired marker positions are the same for all pixels
+        self.desired = np.array([0, 2 * p, 4 * p, 2 + 2 * p, 4])
+        self.increments = np.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    def update(self, chunk, z):
+        for i in range(chunk.shape[2]):
+            self._add(chunk[:, :, i].astype(np.float64))
+
+    def _add(self, x):
+        q, n = self.heights, self.positions
+
+        if self.count < 5:
+            q[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                q.sort(axis=0)
+            return
+        self.count += 1
+
+        # Find the cell of each value and extend the extreme markers
+        cell = (x >= q[1]).astype(np.int8) + (x >= q[2]) + (x >= q[3])
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        n[1:] += np.arange(1, 5).reshape(4, 1, 1) > cell
+        self.desired += self.increments
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            up = (d >= 1) & (n[i + 1] - n[i] > 1)
+            down = (d <= -1) & (n[i - 1] - n[i] < -1)
+            move = up | down
+            if not np.any(move):
+                continue
+
+            s = np.where(up, 1., -1.)
+            parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+            )
+            neighbor = np.where(up, q[i + 1], q[i - 1])
+            distance = np.where(up, n[i + 1], n[i - 1]) - n[i]
+            linear = q[i] + s * (neighbor - q[i]) / distance
+
+            height = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+            q[i] = np.where(move, height, q[i])
+            n[i] += np.where(move, s, 0.)
+
+    def result(self):
+        if self.count < 5:
+            out_image = np.quantile(self.heights[:self.count], self.quantile, axis=0)
+        else:
+            out_image = self.heights[2]
+        if np.issubdtype(self.dtype, np.integer):
+            out_image = np.rint(out_image)
+        return out_image.astype(self.dtype)
+
+
+class MedianProjection(QuantileProjection):
+    """ Approximate median intensity along the z-axis. """
+
+    def __init__(self, shape, dtype, depth):
+        super().__init__(shape, dtype, depth, quantile=0.5)
+
+
+PROJECTIONS = {
+    'max': MaxProjection,
+    'min': MinProjection,
+    'mean': MeanProjection,
+    'sum': SumProjection,
+    'std': StdProjection,
+    'argmax': ArgmaxProjection,
+    'median': MedianProjection,
+    'percentile': QuantileProjection,
+}
+
+
+def make_projection(name, shape, dtype, depth, percentile=50.0):
+    """ Create the accumulator of a projection for a single tile.
+
+    Args:
+        name (str): name of the projection, one of PROJECTIONS
+        shape (tuple): x,y shape of the tile
+        dtype (numpy.dtype): data type of the input image
+        depth (int): number of z-slices in the input image
+        percentile (float): percentile for the 'percentile' projection, between 0 and 100
+
+    Returns:
+        Projection : an empty accumulator
+    """
+    if name not in PROJECTIONS:
+        raise ValueError('Unknown projection {}, must be one of {}'.format(name, list(PROJECTIONS)))
+    if name == 'percentile':
+        return QuantileProjection(shape, dtype, depth, quantile=percentile / 100)
+    return PROJECTIONS[name](shape, dtype, depth)
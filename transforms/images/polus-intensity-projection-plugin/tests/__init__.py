@@ -0,0 +1,16 @@
+from unittest import TestSuite
+from .projections_test import ProjectionsTest
+from .projections_test import OutputPathTest
+
+test_cases = (
+    ProjectionsTest,
+    OutputPathTest,
+)
+
+
+def load_tests(loader, tests, pattern):
+    suite = TestSuite()
+    for test_class in test_cases:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    return suite
@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src'))
+
+from projections import PROJECTIONS, make_projection
+
+
+def project(name, volume, chunk_size, percentile=50.0):
+    """ Feed a y,x,z volume to an accumulator in chunks of z-slices. """
+    accumulator = make_projection(name, volume.shape[:2], volume.dtype, volume.shape[2],
+                                  percentile=percentile)
+    for z in range(0, volume.shape[2], chunk_size):
+        accumulator.update(volume[:, :, z:z + chunk_size], z)
+    return accumulator.result()
+
+
+class ProjectionsTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.volume = rng.integers(0, 4000, (17, 23, 301)).astype(np.uint16)
+        # Ties are resolved to the first z-slice
+        self.volume[0, 0, [5, 9]] = 5000
+
+    def test_exact_projections(self):
+        volume = self.volume
+        expected = {
+            'max': np.max(volume, axis=2),
+            'min': np.min(volume, axis=2),
+            'mean': np.mean(volume, axis=2).astype(volume.dtype),
+            'sum': np.sum(volume, axis=2, dtype=np.float64),
+            'std': np.std(volume.astype(np.float64), axis=2),
+            'argmax': np.argmax(volume, axis=2),
+        }
+        for name, reference in expected.items():
+            for chunk_size in (1, 7, 128, volume.shape[2]):
+                result = project(name, volume, chunk_size)
+                self.assertEqual(result.dtype, PROJECTIONS[name].output_dtype(volume.dtype, volume.shape[2]))
+                np.testing.assert_allclose(result, reference, rtol=1e-12, err_msg=name)
+
+    def test_quantile_projections(self):
+        volume = self.volume[:, :, :200]
+        for name, percentile in [('median', 50.0), ('percentile', 50.0), ('percentile', 10.0), ('percentile', 90.0)]:
+            result = project(name, volume, 32, percentile)
+            self.assertEqual(result.dtype, volume.dtype)
+
+            # The P-square estimate is close to the true percentile of each stack
+            rank = 100 * np.mean(volume < result[:, :, None], axis=2)
+            self.assertLess(np.max(np.abs(rank - percentile)), 6, (name, percentile))
+            self.assertLess(np.mean(np.abs(rank - percentile)), 1.5, (name, percentile))
+
+    def test_quantile_shallow_stack(self):
+        volume = self.volume[:, :, :4]
+        for percentile in (0.0, 25.0, 50.0, 100.0):
+            result = project('percentile', volume, 3, percentile)
+            expected = np.rint(np.quantile(volume, percentile / 100, axis=2)).astype(volume.dtype)
+            np.testing.assert_array_equal(result, expected)
+
+    def test_unknown_projection(self):
+        with self.assertRaises(ValueError):
+            make_projection('mode', (2, 2), np.uint8, 3)
+
+
+class OutputPathTest(unittest.TestCase):
+
+    def test_output_path(self):
+        from main import output_path
+
+        self.assertEqual(output_path('out', 'img.ome.tif', 'max', False), os.path.join('out', 'img.ome.tif'))
+        for name, expected in [('img.ome.tif', 'img_max.ome.tif'),
+                               ('img.ome.zarr', 'img_max.ome.zarr'),
+                               ('img.tif', 'img_max.tif'),
+                               ('img.v2.png', 'img.v2_max.png'),
+                               ('img', 'img_max')]:
+            self.assertEqual(output_path('out', name, 'max', True), os.path.join('out', expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
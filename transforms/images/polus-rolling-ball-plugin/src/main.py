@@ -19,6 +19,7 @@ def main(
         input_dir: Path,
         ball_radius: int,
         light_background: bool,
+        shrink: bool,
         output_dir: Path,
 ) -> None:
     """ Main execution function
@@ -27,6 +28,7 @@ def main(
         input_dir: path to directory containing the input images.
         ball_radius: radius of ball to use for the rolling-ball algorithm.
         light_background: whether the image has a light or dark background.
+        shrink: whether to shrink the image to speed up large balls.
         output_dir: path to directory where to store the output images.
     """
 
@@ -45,6 +47,7 @@ def main(
                     writer=writer,
                     ball_radius=ball_radius,
                     light_background=light_background,
+                    shrink=shrink,
                 )
     return
 
@@ -78,6 +81,14 @@ if __name__ == "__main__":
         help='Whether the image has a light or dark background.',
         required=False,
     )
+    parser.add_argument(
+        '--shrink',
+        dest='shrink',
+        type=str,
+        default='false',
+        help='Whether to shrink the image before rolling the ball. Much faster and slightly less accurate for large balls.',
+        required=False,
+    )
     # Output arguments
     parser.add_argument(
         '--outputDir',
@@ -106,6 +117,13 @@ if __name__ == "__main__":
         raise ValueError(f'lightBackground must be either \'true\' or \'false\'')
     logger.info(f'lightBackground = {_light_background}')
 
+    _shrink = args.shrink
+    if _shrink in {'true', 'false'}:
+        _shrink = (_shrink == 'true')
+    else:
+        raise ValueError(f'shrink must be either \'true\' or \'false\'')
+    logger.info(f'shrink = {_shrink}')
+
     _output_dir = args.output_dir
     logger.info(f'outputDir = {_output_dir}')
 
@@ -113,5 +131,6 @@ if __name__ == "__main__":
         input_dir=_input_dir,
         ball_radius=_ball_radius,
         light_background=_light_background,
+        shrink=_shrink,
         output_dir=_output_dir,
     )
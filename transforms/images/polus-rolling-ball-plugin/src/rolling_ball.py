@@ -1,3 +1,7 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+
 import numpy
 from bfio.bfio import BioReader
 from bfio.bfio import BioWriter
@@ -7,14 +11,86 @@ from skimage import util
 # The number of pixels to be saved at a time must be a multiple of 1024.
 TILE_SIZE = 1024
 
+# The number of processes that apply the rolling-ball algorithm to tiles.
+NUM_WORKERS = max(1, cpu_count() // 2)
+
+
+def shrink_factor(ball_radius: int) -> int:
+    """ The factor by which to shrink tiles before rolling the ball, as chosen
+     by ImageJ's "Subtract Background". Small balls are rolled on the full tile.
+    """
+    if ball_radius <= 10:
+        return 1
+    if ball_radius <= 30:
+        return 2
+    if ball_radius <= 100:
+        return 4
+    return 8
+
+
+def _shrink(tile, factor: int):
+    """ Shrinks a 2-d tile by taking the minimum of each block of factor x factor
+     pixels. The tile is padded with its edge values to a multiple of factor.
+    """
+    height, width = tile.shape
+    padded = numpy.pad(tile, ((0, -height % factor), (0, -width % factor)), mode='edge')
+    blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor)
+    return blocks.min(axis=(1, 3)).astype(numpy.float64)
+
+
+def _enlarge(small, factor: int, shape: tuple[int, int]):
+    """ Enlarges a shrunken tile back to the given shape by bilinear
+     interpolation. Each pixel of the shrunken tile sits at the center of its
+     block.
+    """
+    for axis, size in enumerate(shape):
+        position = (numpy.arange(size) - (factor - 1) / 2) / factor
+        position = numpy.clip(position, 0, small.shape[axis] - 1)
+        low = numpy.floor(position).astype(int)
+        high = numpy.minimum(low + 1, small.shape[axis] - 1)
+        weight = numpy.expand_dims(position - low, axis=1 - axis)
+
+        small = numpy.take(small, low, axis=axis) * (1 - weight) + numpy.take(small, high, axis=axis) * weight
+    return small
+
+
+def _shrunk_kernel(ball_radius: int, factor: int):
+    """ Samples the ball at every factor-th pixel, i.e. the ball as seen from a
+     tile that was shrunk by the factor. It keeps its full height, so it is an
+     ellipsoid in the shrunken tile.
+
+    Unlike restoration.ellipsoid_kernel, the radius of the shrunken ball is not
+     rounded to a whole number of pixels.
+    """
+    offsets = numpy.arange(-(ball_radius // factor), ball_radius // factor + 1) * factor
+    squares = offsets[:, numpy.newaxis] ** 2 + offsets[numpy.newaxis, :] ** 2
+    kernel = numpy.sqrt(numpy.clip(ball_radius ** 2 - squares, 0, None))
+    kernel[squares > ball_radius ** 2] = numpy.inf
+    return kernel
+
 
-def _rolling_ball(tile, ball_radius: int, light_background: bool):
+def _shrunk_background(tile, ball_radius: int, factor: int):
+    """ Approximates the background of a 2-d tile by rolling the ball over a
+     shrunken tile and enlarging the result, as ImageJ does for large balls.
+
+    Shrinking takes the minimum of each block, so on a sloped background the
+     result is lower than the exact background by up to about (factor - 1)
+     times the steepest slope, in intensity levels per pixel. The background is
+     clipped to the tile, so it is never brighter than the image.
+    """
+    background = restoration.rolling_ball(_shrink(tile, factor), kernel=_shrunk_kernel(ball_radius, factor))
+    background = _enlarge(background, factor, tile.shape)
+    return numpy.minimum(background, tile).astype(tile.dtype)
+
+
+def _rolling_ball(tile, ball_radius: int, light_background: bool, factor: int = 1):
     """ Applies the rolling-ball algorithm to a single tile.
 
     Args:
         tile: A tile, usually from an ome.tif file.
         ball_radius: The radius of the ball to use for calculating the background.
         light_background: Whether the image has a light background.
+        factor: The factor by which to shrink the tile for calculating the background.
 
     Returns:
         An image with its background subtracted away.
@@ -30,7 +106,10 @@ def _rolling_ball(tile, ball_radius: int, light_background: bool):
         tile = util.invert(tile)
 
     # use the rolling ball algorithm to calculate the background and subtract it from the image.
-    background = restoration.rolling_ball(tile, radius=ball_radius)
+    if factor > 1:
+        background = _shrunk_background(tile, ball_radius, factor)
+    else:
+        background = restoration.rolling_ball(tile, radius=ball_radius)
     tile = tile - background
 
     # if the image had a light backend, invert the result.
@@ -40,17 +119,17 @@ def _rolling_ball(tile, ball_radius: int, light_background: bool):
     return result
 
 
-def _bounds(x, x_max, ball_radius):
+def _bounds(x, x_max, halo):
     """ Calculates the indices for handling the edges of tiles.
 
-    We pad each tile with 'ball_radius' pixels from the full image along the
+    We pad each tile with 'halo' pixels from the full image along the
      top, bottom, left, and right edges of each tile.
     """
     row_max = min(x_max, x + TILE_SIZE)
-    pad_left = max(0, x - ball_radius)
-    pad_right = min(x_max, row_max + ball_radius)
+    pad_left = max(0, x - halo)
+    pad_right = min(x_max, row_max + halo)
 
-    tile_left = 0 if x == 0 else ball_radius
+    tile_left = 0 if x == 0 else halo
     tile_right = min(x_max, tile_left + TILE_SIZE)
     return row_max, pad_left, pad_right, tile_left, tile_right
 
@@ -60,11 +139,20 @@ def rolling_ball(
         writer: BioWriter,
         ball_radius: int,
         light_background: bool,
+        shrink: bool = False,
+        num_workers: int = NUM_WORKERS,
 ):
     """ Applies the rolling-ball algorithm from skimage to perform background subtraction.
 
     This function processes the image in tiles and, therefore, scales to images of any size.
-    It writes the resulting image to the given BioWriter object.
+    Each tile is padded with a halo of at least 'ball_radius' pixels, so the
+    result does not depend on the tiling. Tiles are processed in parallel by a
+    pool of processes while this process reads the tiles and writes the results,
+    so the BioWriter is only ever used from a single thread.
+
+    With 'shrink', large balls are rolled over shrunken tiles and the background is
+    interpolated back to full size, as ImageJ does. This is much faster for
+    large radii, at the cost of a slightly lower background.
 
     Args:
         reader: BioReader object from which to read the image.
@@ -72,17 +160,44 @@ def rolling_ball(
         ball_radius: The radius of the ball to use for calculating the background.
                      This should be greater than the radii of relevant objects in the image.
         light_background: Whether the image has a light background.
+        shrink: Whether to shrink tiles for calculating the background.
+        num_workers: The number of processes to use.
 
     """
-    for z in range(reader.Z):
+    factor = shrink_factor(ball_radius) if shrink else 1
+
+    # The halo is a multiple of the shrink factor so that all tiles are shrunk
+    # over the same blocks of pixels.
+    halo = factor * -(-ball_radius // factor)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # Limit the number of tiles in flight so that memory use stays bounded.
+        pending = deque()
 
-        for y in range(0, reader.Y, TILE_SIZE):
-            y_max, pad_top, pad_bottom, tile_top, tile_bottom = _bounds(y, reader.Y, ball_radius)
+        for z in range(reader.Z):
+
+            for y in range(0, reader.Y, TILE_SIZE):
+                y_max, pad_top, pad_bottom, tile_top, tile_bottom = _bounds(y, reader.Y, halo)
+
+                for x in range(0, reader.X, TILE_SIZE):
+                    x_max, pad_left, pad_right, tile_left, tile_right = _bounds(x, reader.X, halo)
+
+                    tile = reader[pad_top:pad_bottom, pad_left:pad_right, z:z + 1, 0, 0]
+                    future = executor.submit(_rolling_ball, tile, ball_radius, light_background, factor)
+                    pending.append((future, (y, y_max, x, x_max, z), (tile_top, tile_bottom, tile_left, tile_right)))
+
+                    if len(pending) >= 2 * num_workers:
+                        _write_tile(writer, *pending.popleft())
+
+        while len(pending) > 0:
+            _write_tile(writer, *pending.popleft())
+    return
 
-            for x in range(0, reader.X, TILE_SIZE):
-                x_max, pad_left, pad_right, tile_left, tile_right = _bounds(x, reader.X, ball_radius)
 
-                tile = reader[pad_top:pad_bottom, pad_left:pad_right, z:z + 1, 0, 0]
-                result = _rolling_ball(tile, ball_radius, light_background)
-                writer[y:y_max, x:x_max, z:z + 1, 0, 0] = result[tile_top:tile_bottom, tile_left:tile_right]
+def _write_tile(writer: BioWriter, future, indices, crop):
+    """ Writes the central part of a processed tile once it is ready. """
+    y, y_max, x, x_max, z = indices
+    tile_top, tile_bottom, tile_left, tile_right = crop
+    result = future.result()
+    writer[y:y_max, x:x_max, z:z + 1, 0, 0] = result[tile_top:tile_bottom, tile_left:tile_right]
     return
@@ -7,6 +7,7 @@ from bfio import BioWriter
 from skimage import restoration
 
 from src.rolling_ball import rolling_ball
+from src.rolling_ball import shrink_factor
 
 
 class CorrectnessTest(unittest.TestCase):
@@ -62,3 +63,52 @@ class CorrectnessTest(unittest.TestCase):
         # assert correctness
         self.assertTrue(numpy.all(numpy.equal(true_result, plugin_result)), f'The plugin resulted in a different image')
         return
+
+    def test_shrink(self):
+        # a smooth background, with a sinusoid and a gradient, under small objects and some noise
+        image_size = 1500
+        rng = numpy.random.default_rng(0)
+        y, x = numpy.mgrid[:image_size, :image_size]
+        background = 100 + 60 * numpy.sin(2 * numpy.pi * x / 300) * numpy.sin(2 * numpy.pi * y / 400) + 0.02 * (x + y)
+        image = background + rng.normal(0, 2, background.shape)
+        for center_y, center_x, radius in zip(*rng.integers(0, image_size, (2, 300)), rng.integers(3, 10, 300)):
+            image[(y - center_y) ** 2 + (x - center_x) ** 2 < radius ** 2] += 60
+        image = numpy.clip(image, 0, 255).astype(numpy.uint8)
+
+        # the steepest slope of the background, in intensity levels per pixel
+        gradient_y, gradient_x = numpy.gradient(background)
+        slope = numpy.max(numpy.abs(gradient_y) + numpy.abs(gradient_x))
+
+        with tempfile.NamedTemporaryFile(suffix='.ome.tif') as infile, \
+                tempfile.NamedTemporaryFile(suffix='.ome.tif') as outfile:
+            with BioWriter(infile.name) as writer:
+                writer.X = image_size
+                writer.Y = image_size
+                writer[:] = image[:]
+
+            for ball_radius in (25, 60):
+                # calculate the result with the plugin code on shrunken tiles
+                with BioReader(infile.name) as reader:
+                    with BioWriter(outfile.name, metadata=reader.metadata) as writer:
+                        rolling_ball(
+                            reader=reader,
+                            writer=writer,
+                            ball_radius=ball_radius,
+                            light_background=False,
+                            shrink=True,
+                        )
+
+                # read the image we just wrote into a numpy array
+                with BioReader(outfile.name) as reader:
+                    plugin_result = numpy.asarray(reader[:], dtype=numpy.float64)
+
+                # calculate the true result
+                true_result = image - restoration.rolling_ball(image, radius=ball_radius)
+
+                # the shrunken background is at most (factor - 1) times the slope lower than the true
+                # background, up to the noise and rounding
+                error = numpy.abs(plugin_result - true_result)
+                bound = (shrink_factor(ball_radius) - 1) * slope + 3
+                self.assertLessEqual(numpy.max(error), bound, f'The shrunken background is too far from the true background')
+                self.assertLess(numpy.mean(error), 1, f'The shrunken background is too far from the true background')
+        return